@@ -16,6 +16,8 @@ CREATE TABLE p2p_message (
     "in_consumer_id" TEXT,
     "format" TEXT DEFAULT "xml"
 );
+CREATE INDEX IF NOT EXISTS p2p_message_message_id ON p2p_message (message_id, is_ingoing);
+CREATE INDEX IF NOT EXISTS p2p_message_unhandled ON p2p_message (is_ingoing, in_is_handled);
 
 DROP TABLE IF EXISTS storage;
 CREATE TABLE storage (
@@ -16,8 +16,6 @@ import logging
 import sys
 import time
 import urllib2
-import hashlib
-import hmac
 try:
     import json
 except ImportError:
@@ -40,13 +38,13 @@ class Security(object):
         self.crypto_key_path = crypto_key_path
 
     def _read_crypto_key(self):
-        return binascii.a2b_base64(open(self.crypto_key_path).read().strip())
+        return cryptotool.read_key(self.crypto_key_path)
 
     def sign(self, data, key, timestamp=None):
         date = time.strftime(self.DATE_FORMAT, timestamp or time.gmtime())
         canonical_string = data + date
 
-        digest = hmac.new(key, canonical_string, hashlib.sha1).digest()
+        digest = cryptotool.hmac_sha1(key, canonical_string)
         sign = binascii.b2a_base64(digest)
         if sign.endswith('\n'):
             sign = sign[:-1]
@@ -92,7 +90,7 @@ class WsgiApplication(Security):
                 data = self.decrypt_data(data)
             except:
                 start_response('400 Bad request', [], sys.exc_info())
-                return str(sys.exc_info()[1])
+                return [str(sys.exc_info()[1])]
 
             req = json.loads(data)
             with self.handle_meta_params(req):
@@ -106,20 +104,24 @@ class WsgiApplication(Security):
                             ('Date', date)]
 
             start_response('200 OK', headers)
-            return result
+            # WSGI server writes string response char by char, list of one chunk at once
+            return [result]
         except:
             if sys.exc_info()[0] in (SystemExit, KeyboardInterrupt):
                 raise
             start_response('500 Internal Server Error', [], sys.exc_info())
             LOG.exception('Unhandled exception')
-            return ''
+            return ['']
 
 
     def handle_meta_params(self, req):
-        if 'params' in req and '_platform_access_data' in req['params']:
-            pl = bus.platform
-            pl.set_access_data(req['params']['_platform_access_data'])
-            del req['params']['_platform_access_data']
+        # JSON-RPC batch is a list of requests
+        for r in (req if isinstance(req, list) else [req]):
+            if isinstance(r, dict) and isinstance(r.get('params'), dict) \
+                    and '_platform_access_data' in r['params']:
+                pl = bus.platform
+                pl.set_access_data(r['params']['_platform_access_data'])
+                del r['params']['_platform_access_data']
         return self
 
     def __enter__(self):
@@ -6,7 +6,9 @@ Created on Nov 25, 2011
 '''
 
 from pprint import pformat
+import sys
 import logging
+import threading
 
 from scalarizr import exceptions
 from scalarizr.libs import validate
@@ -16,6 +18,7 @@ from scalarizr import rpc
 from scalarizr import linux
 from scalarizr.handlers import get_role_servers
 from scalarizr.util import Singleton
+from scalarizr.util import DebouncedReload
 from scalarizr import exceptions
 from scalarizr.api import BehaviorAPI
 
@@ -41,6 +44,12 @@ def rename(params):
     ])
 
 
+def _normalize(server):
+    # config returns all values but flags as strings
+    return dict((key, val if isinstance(val, bool) else str(val))
+                for key, val in server.items() if val is not False)
+
+
 _rule_protocol = validate.rule(choises=['tcp', 'http', 'TCP', 'HTTP'])
 _rule_backend = validate.rule(re=r'^role:\d+$')
 _rule_hc_target = validate.rule(re='^[tcp|http]+:\d+$')
@@ -62,6 +71,80 @@ class HAProxyAPI(BehaviorAPI):
         self.path_cfg = path
         self.cfg = haproxy.HAProxyCfg(path)
         self.svc = haproxy.HAProxyInitScript(path)
+        self.stats = haproxy.StatSocket()
+        self._lock = threading.RLock()
+        # (backend, server name) -> server params, for servers removed from config
+        # but still present in the running haproxy in maintenance mode
+        self._disabled = {}
+        self._commits = DebouncedReload(self._commit)
+
+    def _commit(self, reload):
+        with self._lock:
+            self.cfg.save()
+            if reload:
+                if self.svc.status() == 0:
+                    self.svc.reload()
+                self._disabled.clear()
+
+    def _ensure_stats_socket(self):
+        '''
+        Runtime server updates need admin level on the stats socket.
+        Returns True if config was changed
+        '''
+        try:
+            sock = self.cfg.globals['stats']['socket']
+        except:
+            sock = None
+        if isinstance(sock, basestring):
+            sock = sock.split()
+        if sock and sock[0] == haproxy.STATS_SOCKET and 'admin' in sock:
+            return False
+        try:
+            self.cfg.globals['stats']['socket'] = '%s level admin' % haproxy.STATS_SOCKET
+        except:
+            LOG.debug('Cannot configure stats socket: %s', sys.exc_info()[1])
+            return False
+        return True
+
+    def _reload_cfg(self):
+        # don't lose changes waiting for a deferred commit
+        self._commits.flush()
+        self.cfg.reload()
+
+    def _enable_at_runtime(self, backend, name, server):
+        '''
+        Returns True if server is already running with the same params or was enabled in place
+        '''
+        if server.get('disabled'):
+            return False
+        servers = self.cfg.backends[backend]['server']
+        current = self._disabled.get((backend, name))
+        if current is None and name in servers:
+            current = servers[name]
+            if not current.get('disabled'):
+                return _normalize(current) == _normalize(server)
+            current = dict(current)
+            del current['disabled']
+        if current is None or _normalize(current) != _normalize(server):
+            return False
+        try:
+            self.stats.enable_server(backend, name)
+        except haproxy.HAProxyError, e:
+            LOG.debug('Cannot enable server %s/%s in place: %s', backend, name, e)
+            return False
+        self._disabled.pop((backend, name), None)
+        return True
+
+    def _disable_at_runtime(self, backend, name, server):
+        if server.get('disabled'):
+            return True
+        try:
+            self.stats.disable_server(backend, name)
+        except haproxy.HAProxyError, e:
+            LOG.debug('Cannot disable server %s/%s in place: %s', backend, name, e)
+            return False
+        self._disabled[(backend, name)] = server
+        return True
 
     def _server_name(self, server):
         if isinstance(server, basestring):
@@ -252,23 +335,26 @@ class HAProxyAPI(BehaviorAPI):
             backend['server'][self._server_name(server)] = server
 
         # update the cfg
-        self.cfg['listen'][listener_name] = listener
-        if not self.cfg.backend or not backend_name in self.cfg.backend:
-            self.cfg['backend'][backend_name] = backend
+        with self._lock:
+            self.cfg['listen'][listener_name] = listener
+            if not self.cfg.backend or not backend_name in self.cfg.backend:
+                self.cfg['backend'][backend_name] = backend
 
         if iptables.enabled():
             iptables.FIREWALL.ensure(
                 [{"jump": "ACCEPT", "protocol": "tcp", "match": "tcp", "dport": port}]
             )
 
-        self.cfg.save()
-        if self.svc.status() == 0:
-            self.svc.reload()
+        self._ensure_stats_socket()
+        self._commits.flush(reload=True)
 
 
     def recreate_conf(self):
         LOG.debug("Recreating haproxy conf at %s", self.cfg.cnf_path)
+        self._commits.flush()
         with open(self.cfg.cnf_path, 'w') as f:
+            f.write("global\n")
+            f.write("    stats socket %s level admin\n" % haproxy.STATS_SOCKET)
             f.write("defaults\n")
         self.cfg.reload()
 
@@ -281,7 +367,7 @@ class HAProxyAPI(BehaviorAPI):
 
 
     def reset_conf(self):
-        self.cfg.reload()
+        self._reload_cfg()
         # TODO: remove all iptables rules as well?
 
         backends = map(lambda listener: listener["backend"], self.list_listeners())
@@ -295,6 +381,10 @@ class HAProxyAPI(BehaviorAPI):
     def add_server(self, server=None, backend=None):
         """
         Adds server with ipaddr to backend section.
+        Server that is still known to the running haproxy
+        (removed recently or disabled in config) is enabled in place,
+        otherwise config write and service reload are coalesced
+        with other changes made within a few seconds.
 
         :param server: Server configuration.
         :type server: dict
@@ -306,33 +396,32 @@ class HAProxyAPI(BehaviorAPI):
 
             TBD.
         """
-        self.cfg.reload()
-
         if backend:
             backend = backend.strip()
 
         LOG.debug('HAProxyAPI.add_server')
         LOG.debug('     %s' % haproxy.naming('backend', backend=backend))
 
+        with self._lock:
+            bnds = self.cfg.sections(haproxy.naming('backend', backend=backend))
+            if not bnds:
+                if backend:
+                    raise exceptions.NotFound('Backend not found: %s' % (backend, ))
+                else:
+                    raise exceptions.Empty('No listeners to add server to')
 
-        bnds = self.cfg.sections(haproxy.naming('backend', backend=backend))
-        if not bnds:
-            if backend:
-                raise exceptions.NotFound('Backend not found: %s' % (backend, ))
-            else:
-                raise exceptions.Empty('No listeners to add server to')
-
-        #with self.svc.trans(exit='running'):
-            #with self.cfg.trans(exit='working'):
-
-        server.setdefault("check", True)
+            server.setdefault("check", True)
 
-        server = rename(server)
-        for bnd in bnds:
-            self.cfg.backends[bnd]['server'][self._server_name(server)] = server
+            server = rename(server)
+            name = self._server_name(server)
+            reload = False
+            for bnd in bnds:
+                if not self._enable_at_runtime(bnd, name, server):
+                    reload = True
+                # serializer consumes the dict
+                self.cfg.backends[bnd]['server'][name] = dict(server)
 
-        self.cfg.save()
-        self.svc.reload()
+        self._commits.request(reload=reload)
 
 
     @rpc.command_method
@@ -355,32 +444,33 @@ class HAProxyAPI(BehaviorAPI):
             backend = backend.strip()
 
         srv_name = self._server_name(server)
-        for bd in self.cfg.sections(haproxy.naming('backend', backend=backend)):
-            if ':' in srv_name:
-                if srv_name in self.cfg.backends[bd]['server']:
-                    del self.cfg.backends[bd]['server'][srv_name]
-            else:
-                for srv_name_ in list(self.cfg.backends[bd]['server']):
-                    if srv_name_.startswith(srv_name):
-                        del self.cfg.backends[bd]['server'][srv_name_]
+        changed = reload = False
+        with self._lock:
+            for bd in self.cfg.sections(haproxy.naming('backend', backend=backend)):
+                servers = self.cfg.backends[bd]['server']
+                if ':' in srv_name:
+                    names = [srv_name] if srv_name in servers else []
+                else:
+                    names = [srv_name_ for srv_name_ in list(servers)
+                             if srv_name_.startswith(srv_name)]
+                for srv_name_ in names:
+                    # running haproxy stops sending connections to it right now,
+                    # config is written without a reload
+                    if not self._disable_at_runtime(bd, srv_name_, dict(servers[srv_name_])):
+                        reload = True
+                    del servers[srv_name_]
+                    changed = True
 
-        self.cfg.save()
-        if self.svc.status() == 0:
-            self.svc.reload()
+        if changed:
+            self._commits.request(reload=reload)
 
 
     def health(self):
-        try:
-            # if self.cfg.defaults['stats'][''] == 'enable' and \
-            if self.cfg.globals['stats']['socket'] == '/var/run/haproxy-stats.sock':
-                pass
-        except:
-            self.cfg.globals['stats']['socket'] = '/var/run/haproxy-stats.sock'
+        if self._ensure_stats_socket():
             self.cfg.globals['spread-checks'] = 5
-            self.cfg.save()
-            self.svc.reload()
+            self._commits.flush(reload=True)
 
-        stats = haproxy.StatSocket().show_stat()
+        stats = self.stats.show_stat()
 
         # filter the stats
         relevant_keys = [
@@ -464,25 +554,21 @@ class HAProxyAPI(BehaviorAPI):
         backend.update(HEALTHCHECK_DEFAULTS)
 
         # apply changes
-        #with self.svc.trans(exit='running'):
-        #       with self.cfg.trans(enter='reload', exit='working'):
-        #TODO: change save() and reload(),`if True` condition to `with...` enter, exit
-        if True:
+        with self._lock:
             self.cfg['listen'][ln] = listener
             if not self.cfg.backend or not bnd in self.cfg.backend:
                 self.cfg['backend'][bnd] = backend
-            try:
-                if iptables.enabled():
-                    iptables.FIREWALL.ensure(
-                        {"jump": "ACCEPT", "protocol": "tcp", "match": "tcp", "dport": port}
-                    )
-            except Exception, e:
-                raise exceptions.Duplicate(e)
+        try:
+            if iptables.enabled():
+                iptables.FIREWALL.ensure(
+                    {"jump": "ACCEPT", "protocol": "tcp", "match": "tcp", "dport": port}
+                )
+        except Exception, e:
+            raise exceptions.Duplicate(e)
 
-            self.cfg.save()
-            self.svc.reload()
+        self._commits.flush(reload=True)
 
-            return listener
+        return listener
 
 
     @rpc.command_method
@@ -508,29 +594,27 @@ class HAProxyAPI(BehaviorAPI):
             pass
 
         bnds = haproxy.naming('backend', backend=target)
-        if not self.cfg.sections(bnds):
-            raise exceptions.NotFound('Backend `%s` not found' % bnds)
-
-        for bnd in self.cfg.sections(bnds):
-            if timeout:
-                if isinstance(timeout, dict):
-                    self.cfg['backend'][bnd]['timeout'] = timeout
-                else:
-                    self.cfg['backend'][bnd]['timeout'] = {'check': str(timeout)}
-            default_server = {
-                    'inter': interval,
-                    'fall': unhealthy_threshold,
-                    'rise': healthy_threshold
-            }
-            self.cfg['backend'][bnd]['default-server'] = default_server
-            for srv in self.cfg['backend'][bnd]['server']:
-                server = self.cfg['backend'][bnd]['server'][srv]
-                server.update({'check' : True})
-                self.cfg['backend'][bnd]['server'][srv] = server
-        #with self.svc.trans(exit='running'):
-            #       with self.cfg.trans(enter='reload', exit='working'):
-        self.cfg.save()
-        self.svc.reload()
+        with self._lock:
+            if not self.cfg.sections(bnds):
+                raise exceptions.NotFound('Backend `%s` not found' % bnds)
+
+            for bnd in self.cfg.sections(bnds):
+                if timeout:
+                    if isinstance(timeout, dict):
+                        self.cfg['backend'][bnd]['timeout'] = timeout
+                    else:
+                        self.cfg['backend'][bnd]['timeout'] = {'check': str(timeout)}
+                default_server = {
+                        'inter': interval,
+                        'fall': unhealthy_threshold,
+                        'rise': healthy_threshold
+                }
+                self.cfg['backend'][bnd]['default-server'] = default_server
+                for srv in self.cfg['backend'][bnd]['server']:
+                    server = self.cfg['backend'][bnd]['server'][srv]
+                    server.update({'check' : True})
+                    self.cfg['backend'][bnd]['server'][srv] = server
+        self._commits.flush(reload=True)
 
 
     
@@ -542,18 +626,12 @@ class HAProxyAPI(BehaviorAPI):
         """
         APIDOC TBD.
         """
-        try:
-            if self.cfg.defaults['stats'][''] == 'enable' and \
-                            self.cfg.globals['stats']['socket'] == '/var/run/haproxy-stats.sock':
-                pass
-        except:
-            self.cfg.globals['stats']['socket'] = '/var/run/haproxy-stats.sock'
+        if self._ensure_stats_socket():
             self.cfg.defaults['stats'][''] = 'enable'
-            self.cfg.save()
-            self.svc.reload()
+            self._commits.flush(reload=True)
 
         #TODO: select parameters what we need with filter by ipaddr
-        stats = haproxy.StatSocket().show_stat()
+        stats = self.stats.show_stat()
         return stats
 
 
@@ -566,29 +644,30 @@ class HAProxyAPI(BehaviorAPI):
         """
 
         ln = haproxy.naming('listen', protocol, port)
-        if not self.cfg.sections(ln):
-            raise exceptions.NotFound('Listen `%s` not found can`t remove it' % ln)
-        try:
-            default_backend = self.cfg.listener[ln]['default_backend']
-        except:
-            default_backend = None
-
-        for path in self.cfg.sections(ln):
-            del self.cfg['listen'][ln]
-            LOG.debug('HAProxyAPI.delete_listener: removed listener `%s`' % ln)
-
-        if default_backend:
-            has_ref = False
-            for ln in self.cfg.listener:
-                try:
-                    if self.cfg.listener[ln]['default_backend'] == default_backend:
-                        has_ref = True
-                        break
-                except:
-                    pass
-            if not has_ref:
-                #it not used in other section, so will be deleting
-                del self.cfg.backends[default_backend]
+        with self._lock:
+            if not self.cfg.sections(ln):
+                raise exceptions.NotFound('Listen `%s` not found can`t remove it' % ln)
+            try:
+                default_backend = self.cfg.listener[ln]['default_backend']
+            except:
+                default_backend = None
+
+            for path in self.cfg.sections(ln):
+                del self.cfg['listen'][ln]
+                LOG.debug('HAProxyAPI.delete_listener: removed listener `%s`' % ln)
+
+            if default_backend:
+                has_ref = False
+                for ln in self.cfg.listener:
+                    try:
+                        if self.cfg.listener[ln]['default_backend'] == default_backend:
+                            has_ref = True
+                            break
+                    except:
+                        pass
+                if not has_ref:
+                    #it not used in other section, so will be deleting
+                    del self.cfg.backends[default_backend]
 
         try:
             if iptables.enabled():
@@ -598,8 +677,7 @@ class HAProxyAPI(BehaviorAPI):
         except Exception, e:
             raise exceptions.NotFound(e)
 
-        self.cfg.save()
-        self.svc.reload()
+        self._commits.flush(reload=True)
 
 
     @rpc.command_method
@@ -610,18 +688,14 @@ class HAProxyAPI(BehaviorAPI):
         """
         target = target.strip()
         bnds = haproxy.naming('backend', backend=target)
-        if not self.cfg.sections(bnds):
-            raise exceptions.NotFound('Backend `%s` not found' % target)
-        for bnd in self.cfg.sections(bnds):
-            backend = self.cfg['backend'][bnd]
-            backend.update(HEALTHCHECK_DEFAULTS)
-            self.cfg['backend'][bnd] = backend
-
-        #with self.svc.trans(exit='running'):
-            #       with self.cfg.trans(enter='reload', exit='working'):
-            #TODO: with...
-        self.cfg.save()
-        self.svc.reload()
+        with self._lock:
+            if not self.cfg.sections(bnds):
+                raise exceptions.NotFound('Backend `%s` not found' % target)
+            for bnd in self.cfg.sections(bnds):
+                backend = self.cfg['backend'][bnd]
+                backend.update(HEALTHCHECK_DEFAULTS)
+                self.cfg['backend'][bnd] = backend
+        self._commits.flush(reload=True)
 
 
     @rpc.query_method
@@ -642,7 +716,7 @@ class HAProxyAPI(BehaviorAPI):
             }, ...]
 
         """
-        self.cfg.reload()
+        self._reload_cfg()
         res = []
         for ln in self.cfg.sections(haproxy.naming('listen')):
             listener = self.cfg.listener[ln]
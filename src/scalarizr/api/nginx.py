@@ -5,6 +5,7 @@ import glob
 import shutil
 import logging
 import time
+import copy
 import cStringIO
 from telnetlib import Telnet
 from hashlib import sha1
@@ -19,6 +20,7 @@ from scalarizr.util import initdv2
 from scalarizr.util import system2
 from scalarizr.util import PopenError
 from scalarizr.util import Singleton
+from scalarizr.util import DebouncedReload
 from scalarizr.util import firstmatched
 from scalarizr import linux
 from scalarizr.linux import iptables
@@ -191,6 +193,18 @@ def _replace_string_in_file(file_path, s, new_s):
         fp.write(raw)
 
 
+def _write_config_atomic(config, file_path):
+    """
+    Writes metaconf config next to file_path and renames it over, so nginx
+    reloading concurrently never reads a half-written file.
+    """
+    tmp_path = file_path + '.tmp'
+    config.write(tmp_path)
+    if os.path.exists(file_path):
+        shutil.copymode(file_path, tmp_path)
+    os.rename(tmp_path, file_path)
+
+
 def get_all_app_roles():
     _queryenv = bus.queryenv_service
     return _queryenv.list_roles(behaviour=BuiltinBehaviours.APP)
@@ -217,6 +231,11 @@ def _choose_host_ip(host, network=None):
     return host.internal_ip if use_internal_ip else host.external_ip
 
 
+def _server_host(server):
+    """ Destination server entry is IP or dict with 'host' and per-server options """
+    return server['host'] if isinstance(server, dict) else server
+
+
 def get_role_servers(role_id=None, role_name=None, network=None):
     """ Method is used to get role servers from scalr """
     if type(role_id) is int:
@@ -293,7 +312,12 @@ class NginxAPI(BehaviorAPI):
         self._op_api = operation.OperationAPI()
         self.error_pages_inc = None
         self.backend_table = {}
+        # upstream name -> _make_backend_conf() params it was made with
+        self.upstream_params = {}
         self.app_inc_path = None
+        self._app_inc_stat = None
+        self._proxies = None
+        self._reloads = DebouncedReload(self._commit_reload)
         self.proxies_inc_dir = proxies_inc_dir
         self.proxies_inc_path = None
 
@@ -341,7 +365,7 @@ class NginxAPI(BehaviorAPI):
             error_pages_conf.write(self.error_pages_inc)
 
     def _save_proxies_inc(self):
-        self.proxies_inc.write(self.proxies_inc_path)
+        _write_config_atomic(self.proxies_inc, self.proxies_inc_path)
 
     def _load_proxies_inc(self):
         self.proxies_inc = metaconf.Configuration('nginx')
@@ -350,10 +374,25 @@ class NginxAPI(BehaviorAPI):
         else:
             open(self.proxies_inc_path, 'w').close()
 
+    def _stat_app_servers_inc(self):
+        try:
+            st = os.stat(self.app_inc_path)
+        except OSError:
+            return None
+        return (self.app_inc_path, st.st_ino, st.st_size, st.st_mtime)
+
     def _save_app_servers_inc(self):
-        self.app_servers_inc.write(self.app_inc_path)
+        _write_config_atomic(self.app_servers_inc, self.app_inc_path)
+        self._app_inc_stat = self._stat_app_servers_inc()
 
-    def _load_app_servers_inc(self):
+    def _load_app_servers_inc(self, if_changed=False):
+        """
+        :param if_changed: if True keeps parsed app_servers_inc when file
+            wasn't modified since it was last read or written by this API.
+        """
+        if if_changed and self._app_inc_stat and \
+                self._app_inc_stat == self._stat_app_servers_inc():
+            return
         self.app_servers_inc = metaconf.Configuration('nginx')
         if os.path.exists(self.app_inc_path):
             _logger.debug('Reading app-servers.include')
@@ -361,6 +400,7 @@ class NginxAPI(BehaviorAPI):
         else:
             _logger.debug('Creating app-servers.include')
             open(self.app_inc_path, 'w').close()
+        self._app_inc_stat = self._stat_app_servers_inc()
 
     def fix_app_servers_inc(self):
         _logger.debug('Fixing app servers include')
@@ -393,7 +433,19 @@ class NginxAPI(BehaviorAPI):
         self._load_app_servers_inc()
         self._load_proxies_inc()
 
-    def _reload_service(self):
+    def _reload_service(self, deferred=False):
+        """
+        :param deferred: if True reload is coalesced with the ones requested
+            within a few seconds. The first reload after a quiet period
+            happens right away. While the last reload is failing, it is
+            retried right away and its error is raised to the caller.
+        """
+        if deferred and not self._reloads.failed:
+            self._reloads.request()
+        else:
+            self._reloads.flush(reload=True)
+
+    def _commit_reload(self, reload=True):
         if self.service.status() != initdv2.Status.RUNNING:
             self.service.start()
         else:
@@ -491,14 +543,24 @@ class NginxAPI(BehaviorAPI):
             proxy_list = []
 
         _logger.debug('Recreating proxying with %s' % proxy_list)
+        self._proxies = None
+        proxies = copy.deepcopy(proxy_list)
         self._clear_nginx_includes()
         self.backend_table = {}
+        self.upstream_params = {}
 
         try:
             for proxy_parms in proxy_list:
                 if 'hostname' in proxy_parms:
                     proxy_parms['name'] = proxy_parms.pop('hostname')
-                self.add_proxy(reload_service=False, **proxy_parms)
+                # includes are just cleared and loaded, written once below
+                self.add_proxy(reload_service=False,
+                               reread_conf=False,
+                               write_conf=False,
+                               **proxy_parms)
+            self._save_app_servers_inc()
+            self._save_proxies_inc()
+            self._proxies = proxies
 
             if reload_service:
                 self._reload_service()
@@ -506,6 +568,39 @@ class NginxAPI(BehaviorAPI):
             msg = "Can't add proxy %s: %s" % (proxy_parms['name'], e)
             raise Exception(msg)
 
+    def update_proxying(self, proxy_list, host, role_id, up=True, reload_service=True):
+        """
+        Applies server of role going up or down to proxying configuration.
+        If proxy_list is the one proxying was recreated from, only upstreams
+        that proxy given role are rewritten, otherwise proxying is recreated.
+
+        :param proxy_list: List of parameters for each proxy, see recreate_proxying()
+        :type proxy_list: list
+
+        :param host: Server IP or object with internal_ip, external_ip
+            and cloud_location attributes (like queryenv RoleHost)
+
+        :param role_id: Id of the role in which server is up or down.
+        :type role_id: str
+
+        :param up: True if server is up, False if down.
+        :type up: bool
+
+        :param reload_service: If True requests nginx reload, reloads
+            requested within a few seconds are coalesced.
+        :type reload_service: bool
+        """
+        if self._proxies is None or (proxy_list or []) != self._proxies:
+            _logger.debug('Proxying configuration changed')
+            self.recreate_proxying(proxy_list, reload_service=False)
+        else:
+            self._load_app_servers_inc(if_changed=True)
+            if not self._update_role_servers(host, str(role_id), up):
+                return
+            self._save_app_servers_inc()
+        if reload_service:
+            self._reload_service(deferred=True)
+
     def _main_config_contains_server(self):
         config_dir = os.path.dirname(self.app_inc_path)
         nginx_conf_path = os.path.join(config_dir, 'nginx.conf')
@@ -551,6 +646,7 @@ class NginxAPI(BehaviorAPI):
 
         _logger.debug('Clearing backend table')
         self.backend_table = {}
+        self.upstream_params = {}
         
         _logger.debug('backend table is %s' % self.backend_table)
         write_proxies = not self._main_config_contains_server()
@@ -892,36 +988,107 @@ class NginxAPI(BehaviorAPI):
             config.add('upstream/least_conn', '')
 
         for dest in destinations:
-            servers = dest['servers']
-            if len(servers) == 0:
-                # if role destination has no running servers yet, 
-                # adding mock server 127.0.0.1
-                servers = ['127.0.0.1']
-            for server in servers:
-                if 'port' in dest or port:
-                    server = '%s:%s' % (server, dest.get('port', port))
+            for server in self._make_server_lines(dest,
+                                                  port=port,
+                                                  max_fails=max_fails,
+                                                  fail_timeout=fail_timeout,
+                                                  weight=weight):
+                config.add('upstream/server', server)
 
-                if 'backup' in dest and dest['backup']:
-                    server = '%s %s' % (server, 'backup')
+        return config
 
-                _max_fails = dest.get('max_fails', max_fails)
-                if _max_fails:
-                    server = '%s %s' % (server, 'max_fails=%s' % _max_fails)
+    def _make_server_lines(self,
+                           dest,
+                           port=None,
+                           max_fails=None,
+                           fail_timeout=None,
+                           weight=None):
+        """Returns upstream server lines for one destination"""
+        servers = dest['servers']
+        if len(servers) == 0:
+            # if role destination has no running servers yet, 
+            # adding mock server 127.0.0.1
+            servers = ['127.0.0.1']
+        result = []
+        for server in servers:
+            if isinstance(server, dict):
+                # per-server options override destination ones
+                opts = dict(dest)
+                opts.update(server)
+                server = opts['host']
+            else:
+                opts = dest
+            if 'port' in opts or port:
+                server = '%s:%s' % (server, opts.get('port', port))
 
-                _fail_timeout = dest.get('fail_timeout', fail_timeout)
-                if _fail_timeout:
-                    server = '%s %s' % (server, 'fail_timeout=%ss' % _fail_timeout)
+            if 'backup' in opts and opts['backup']:
+                server = '%s %s' % (server, 'backup')
 
-                if 'down' in dest and dest['down']:
-                    server = '%s %s' % (server, 'down')
+            _max_fails = opts.get('max_fails', max_fails)
+            if _max_fails:
+                server = '%s %s' % (server, 'max_fails=%s' % _max_fails)
 
-                _weight = dest.get('weight', weight)
-                if _weight:
-                    server = '%s %s' % (server, 'weight=%s' % _weight)
+            _fail_timeout = opts.get('fail_timeout', fail_timeout)
+            if _fail_timeout:
+                server = '%s %s' % (server, 'fail_timeout=%ss' % _fail_timeout)
 
-                config.add('upstream/server', server)
+            if 'down' in opts and opts['down']:
+                server = '%s %s' % (server, 'down')
 
-        return config
+            _weight = opts.get('weight', weight)
+            if _weight:
+                server = '%s %s' % (server, 'weight=%s' % _weight)
+
+            result.append(server)
+        return result
+
+    def _update_upstream(self, name):
+        """
+        Replaces one upstream in app-servers config with the one made from
+        backend_table, other upstreams are left as is.
+        """
+        backend = self._make_backend_conf(name,
+                                          self.backend_table[name],
+                                          **self.upstream_params.get(name, {}))
+        names = self.app_servers_inc.get_list('upstream')
+        if name not in names:
+            self.app_servers_inc.append_conf(backend)
+            return
+        # metaconf paths like upstream[N] rescan all the upstreams for
+        # each step, so element is swapped in the tree directly
+        old = self.app_servers_inc.etree.findall('upstream')[names.index(name)]
+        root = self.app_servers_inc.etree.getroot()
+        root[list(root).index(old)] = backend.etree.getroot()[0]
+
+    def _update_role_servers(self, host, role_id, up=True):
+        """
+        Adds server to (or removes from, if up is False) role destinations
+        in backend_table and rewrites upstreams that use them.
+        Returns list of updated upstream names.
+        """
+        updated = []
+        for backend_name, backend_destinations in self.backend_table.items():
+            changed = False
+            for dest in backend_destinations:
+                if dest.get('id') != role_id:
+                    continue
+                if isinstance(host, (basestring, dict)):
+                    server = host
+                else:
+                    server = _choose_host_ip(host, dest.get('network'))
+                present = [s for s in dest['servers']
+                           if _server_host(s) == _server_host(server)]
+                if up and not present:
+                    dest['servers'].append(server)
+                    changed = True
+                elif not up and present:
+                    for s in present:
+                        dest['servers'].remove(s)
+                    changed = True
+            if changed:
+                self._update_upstream(backend_name)
+                updated.append(backend_name)
+        return updated
 
     def _backend_nameparts(self, backend_name):
         """ Takes name, location and roles from backend_name """
@@ -991,6 +1158,12 @@ class NginxAPI(BehaviorAPI):
             role_ids.discard(None)
 
             name = self._make_backend_name(hostname, location, role_ids, hash_name)
+            self.upstream_params[name] = dict(port=port,
+                                              ip_hash=ip_hash,
+                                              least_conn=least_conn,
+                                              max_fails=max_fails,
+                                              fail_timeout=fail_timeout,
+                                              weight=weight)
 
             self._add_backend(name,
                               backend_destinations,
@@ -1210,6 +1383,7 @@ class NginxAPI(BehaviorAPI):
                   reload_service=True,
                   hash_backend_name=True,
                   write_proxies=True,
+                  write_conf=True,
                   **kwds):
         """
         Adds proxy.
@@ -1262,6 +1436,9 @@ class NginxAPI(BehaviorAPI):
 
         :param write_proxies: if False changes will not be written in proxies_inc file.
         This can be used if we only need to add backend.
+
+        :param write_conf: if False neither app_servers_inc nor proxies_inc are
+        written, caller saves them after adding several proxies.
         """
         # typecast is needed because scalr sends bool params as strings: '1' for True, '0' for False 
         ssl = _bool_from_scalr_str(ssl)
@@ -1272,8 +1449,11 @@ class NginxAPI(BehaviorAPI):
         reload_service = _bool_from_scalr_str(reload_service)
         hash_backend_name = _bool_from_scalr_str(hash_backend_name)
         write_proxies = _bool_from_scalr_str(write_proxies)
+        write_conf = _bool_from_scalr_str(write_conf)
 
         _logger.debug('Adding proxy with name: %s' % name)
+        # proxying no longer matches the list it was recreated from
+        self._proxies = None
         destinations = self._normalize_destinations(backends)
 
         grouped_destinations = self._group_destinations(destinations)
@@ -1329,9 +1509,10 @@ class NginxAPI(BehaviorAPI):
         if ssl_port:
             _open_port(ssl_port)
 
-        self._save_app_servers_inc()
-        if write_proxies:
-            self._save_proxies_inc()
+        if write_conf:
+            self._save_app_servers_inc()
+            if write_proxies:
+                self._save_proxies_inc()
 
         if reload_service:
             self._reload_service()
@@ -1411,6 +1592,7 @@ class NginxAPI(BehaviorAPI):
         reload_service = _bool_from_scalr_str(reload_service)
 
         _logger.debug('Removing proxy with hostname: %s' % hostname)
+        self._proxies = None
         self._load_proxies_inc()
         self._load_app_servers_inc()
 
@@ -1636,8 +1818,11 @@ class NginxAPI(BehaviorAPI):
             if update_backend_table:
                 empty_destinations = []
                 for destination in self.backend_table[backend]:
-                    if server in destination['servers']:
-                        destination['servers'].remove(server)
+                    present = [s for s in destination['servers']
+                               if _server_host(s) == server]
+                    if present:
+                        for s in present:
+                            destination['servers'].remove(s)
                         if not destination['servers']:
                             empty_destinations.append(destination)
                 for destination in empty_destinations:
@@ -1654,66 +1839,33 @@ class NginxAPI(BehaviorAPI):
         Adds server to each backend that uses given role. If role isn't used in
         any backend, does nothing
 
-        :param server: server configuration. Can be just IP of the server or
-            dict of parameters (such as 'down', 'backup' or 'port')
+        :param server: server IP, dict with 'host' and per-server parameters
+            (such as 'port', 'backup' or 'down') or object with internal_ip,
+            external_ip and cloud_location attributes, then IP is chosen by
+            destination network
         :type server: dict or str
 
         :param role_id: Id of the role in which new server is up.
         :type role_id: str
 
         :param update_conf: if True updates app_servers_inc object from file
-            before performing server addition.
+            (if it was changed) before server addition and writes it after.
         :type update_conf: bool
 
         :param reload_service: if True reloads nginx service after server addition.
         :type reload_service: bool
 
-        Examples:
+        Example:
 
-        Adding server without parameters to backends that are contain role `1234`::
+        Adding server to backends that are contain role `1234`::
 
             api.nginx.add_server_to_role('123.321.111.19', '1234')
 
-        Adding server with non-standard port to backends that are contain
-                role `4321`::
+        Adding server with non-standard port to backends that are contain role `4321`::
 
-            api.nginx.add_server_to_role({'host': '11.22.33.44', 'port': '8089'},
-                                             '4321')
+            api.nginx.add_server_to_role({'host': '11.22.33.44', 'port': '8089'}, '4321')
         """
-        update_conf = _bool_from_scalr_str(update_conf)
-        reload_service = _bool_from_scalr_str(reload_service)
-
-        if update_conf:
-            self._load_app_servers_inc()
-
-        if not server:
-            return
-        if not role_id:
-            return
-        if type(role_id) is not str:
-            role_id = str(role_id)
-
-        config_updated = False
-        for backend_name, backend_destinations in self.backend_table.items():
-            for dest in backend_destinations:
-                if dest.get('id') == role_id and server not in dest['servers']:
-                    srv = {'host': server}
-                    # taking server parameters
-                    srv.update(dest)
-                    srv.pop('servers')
-                    srv.pop('id')
-                    
-                    self.add_server(backend_name, srv, False, False)
-                    if len(dest['servers']) == 0:
-                        self.remove_server(backend_name, '127.0.0.1', False, False)
-                    dest['servers'].append(server)
-                    config_updated = True
-
-        if config_updated:
-            if update_conf:
-                self._save_app_servers_inc()
-            if reload_service:
-                self._reload_service()
+        self._update_role(server, role_id, True, update_conf, reload_service)
 
     @rpc.command_method
     def remove_server_from_role(self,
@@ -1725,14 +1877,17 @@ class NginxAPI(BehaviorAPI):
         Removes server from each backend that uses given role. If role isn't
         used in any backend, does nothing
 
-        :param server: server IP
-        :type server: str
+        :param server: server IP, dict with 'host' and per-server parameters
+            (such as 'port', 'backup' or 'down') or object with internal_ip,
+            external_ip and cloud_location attributes, then IP is chosen by
+            destination network
+        :type server: dict or str
 
         :param role_id: Id of the role in which server is down.
         :type role_id: str
 
         :param update_conf: if True updates app_servers_inc object from file 
-            before performing server removal.
+            (if it was changed) before server removal and writes it after.
         :type update_conf: bool
 
         :param reload_service: if True reloads nginx service after server removal.
@@ -1744,11 +1899,14 @@ class NginxAPI(BehaviorAPI):
 
             api.nginx.remove_server_from_role('123.321.111.19', '1234')
         """
+        self._update_role(server, role_id, False, update_conf, reload_service)
+
+    def _update_role(self, server, role_id, up, update_conf, reload_service):
         update_conf = _bool_from_scalr_str(update_conf)
         reload_service = _bool_from_scalr_str(reload_service)
 
         if update_conf:
-            self._load_app_servers_inc()
+            self._load_app_servers_inc(if_changed=True)
 
         if not server:
             return
@@ -1757,23 +1915,12 @@ class NginxAPI(BehaviorAPI):
         if type(role_id) is not str:
             role_id = str(role_id)
 
-        config_updated = False
-        for backend_name, backend_destinations in self.backend_table.items():
-            for dest in backend_destinations:
-                if dest.get('id') == role_id and server in dest['servers']:
-                    if len(dest['servers']) == 1:
-                        self.add_server(backend_name, '127.0.0.1', False, False)
-                    self.remove_server(backend_name, server, False, False)
-                    dest['servers'].remove(server)
-                    config_updated = True
-
-        if config_updated:
+        if self._update_role_servers(server, role_id, up):
             if update_conf:
                 self._save_app_servers_inc()
             if reload_service:
                 self._reload_service()
 
-
     @rpc.command_method
     def remove_server_from_all_backends(self,
                                         server,
@@ -1811,9 +1958,12 @@ class NginxAPI(BehaviorAPI):
         config_updated = False
         for backend_name, backend_destinations in self.backend_table.items():
             for dest in backend_destinations:
-                if server in dest['servers']:
+                present = [s for s in dest['servers']
+                           if _server_host(s) == server]
+                if present:
                     self.remove_server(backend_name, server, False, False)
-                    dest['servers'].remove(server)
+                    for s in present:
+                        dest['servers'].remove(s)
                     config_updated = True
 
         if config_updated:
@@ -16,10 +16,10 @@ import threading
 import time
 import signal
 import binascii
-import weakref
+import functools
 import subprocess
+import zlib
 
-from multiprocessing import pool
 
 from scalarizr import rpc, linux
 from scalarizr.api import operation as operation_api
@@ -27,8 +27,8 @@ from scalarizr.bus import bus
 from scalarizr.node import __node__
 from scalarizr import util
 from scalarizr.util import system2, dns
-from scalarizr.linux import mount
-from scalarizr.util import kill_childs, Singleton
+from scalarizr.linux import mount, procsampler
+from scalarizr.util import kill_childs, Singleton, PeriodicalExecutor
 from scalarizr.queryenv import ScalingMetric
 from scalarizr.api.binding import jsonrpc_http
 from scalarizr.handlers import script_executor
@@ -43,38 +43,47 @@ max_log_size = 5*1024*1024
 class _ScalingMetricStrategy(object):
     """Strategy class for custom scaling metric"""
 
+    timeout = 3
+
     @staticmethod
     def _get_execute(metric):
         if not os.access(metric.path, os.X_OK):
             raise BaseException("File is not executable: '%s'" % metric.path)
-  
-        exec_timeout = 3
-        close_fds = not linux.os.windows_family
-        proc = subprocess.Popen(metric.path, stdout=subprocess.PIPE, stderr=subprocess.PIPE, close_fds=close_fds)
- 
-        timeout_time = time.time() + exec_timeout
-        while time.time() < timeout_time:
-            if proc.poll() is None:
-                time.sleep(0.2)
-            else:
-                break
+
+        kwds = dict(stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if linux.os.windows_family:
+            kwds['close_fds'] = False
         else:
-            kill_childs(proc.pid)
-            if hasattr(proc, 'terminate'):
-                # python >= 2.6
-                proc.terminate()
-            else:
-                os.kill(proc.pid, signal.SIGTERM)
+            # Own process group: on timeout script is killed with all its children
+            kwds.update(close_fds=True, preexec_fn=os.setsid)
+        proc = subprocess.Popen(metric.path, **kwds)
+
+        killed = []
+        def kill():
+            killed.append(True)
+            try:
+                if linux.os.windows_family:
+                    kill_childs(proc.pid)
+                    proc.terminate()
+                else:
+                    os.killpg(proc.pid, signal.SIGKILL)
+            except OSError:
+                pass
+        timer = threading.Timer(_ScalingMetricStrategy.timeout, kill)
+        timer.start()
+        try:
+            stdout, stderr = proc.communicate()
+        finally:
+            timer.cancel()
+        if killed:
             raise BaseException('Timeouted')
-                                
-        stdout, stderr = proc.communicate()
-        
+
         if proc.returncode > 0:
             raise BaseException(stderr if stderr else 'exitcode: %d' % proc.returncode)
-        
+
         return stdout.strip()
-  
-  
+
+
     @staticmethod
     def _get_read(metric):
         try:
@@ -103,6 +112,95 @@ class _ScalingMetricStrategy(object):
         return {'id':metric.id, 'name':metric.name, 'value':value, 'error':error}
 
 
+class _ScalingMetricCollector(object):
+    """
+    Collects custom scaling metrics in background. Every metric is a task of
+    own PeriodicalExecutor, so a slow script delays only itself and
+    scaling_metrics() returns last values at once
+    """
+
+    interval = 30
+    definitions_interval = 60
+    workers = 10
+
+    def __init__(self):
+        self.values = {}
+        self._metrics = []
+        self._tasks = {}
+        self._cond = threading.Condition()
+        self._executor = PeriodicalExecutor(workers=self.workers)
+
+    def start(self):
+        self.refresh()
+        self._executor.add_task(self._refresh, self.definitions_interval,
+                                'scaling metrics definitions')
+        self._executor.start()
+
+    def stop(self):
+        self._executor.shutdown()
+
+    def _key(self, metric):
+        return (metric.name, metric.path, metric.retrieve_method)
+
+    def refresh(self):
+        """
+        Syncs tasks with metric definitions from QueryEnv (cached there):
+        new and changed metrics are collected at once, removed ones are dropped
+        """
+        metrics = bus.queryenv_service.get_scaling_metrics() or []
+        with self._cond:
+            current = dict((m.id, self._key(m)) for m in metrics)
+            for id, (key, fn) in self._tasks.items():
+                if current.get(id) != key:
+                    self._executor.remove_task(fn)
+                    del self._tasks[id]
+                    self.values.pop(id, None)
+            for m in metrics:
+                if m.id not in self._tasks:
+                    fn = functools.partial(self._collect, m)
+                    self._tasks[m.id] = (self._key(m), fn)
+                    self._executor.add_task(fn, self.interval, 'scaling metric %s' % m.name)
+            self._metrics = metrics
+
+    def _refresh(self):
+        try:
+            self.refresh()
+        except:
+            LOG.warn('Failed to refresh scaling metrics', exc_info=True)
+
+    def _collect(self, metric):
+        result = _ScalingMetricStrategy.get(metric)
+        with self._cond:
+            task = self._tasks.get(metric.id)
+            if task and task[0] == self._key(metric):
+                self.values[metric.id] = (result, time.time())
+                self._cond.notifyAll()
+
+    def get(self, wait=0):
+        """
+        :return: last values with their age in seconds, waits up to `wait`
+            seconds for metrics that were not collected yet
+        """
+        deadline = time.time() + wait
+        with self._cond:
+            while any(m.id not in self.values for m in self._metrics):
+                left = deadline - time.time()
+                if left <= 0:
+                    break
+                self._cond.wait(left)
+            now = time.time()
+            ret = []
+            for m in self._metrics:
+                if m.id in self.values:
+                    result, timestamp = self.values[m.id]
+                    result = dict(result, age=round(now - timestamp, 3))
+                else:
+                    result = {'id': m.id, 'name': m.name, 'value': None,
+                              'error': 'Not collected yet', 'age': None}
+                ret.append(result)
+            return ret
+
+
 class SystemAPI(object):
     """
     Pluggable API to get system information similar to SNMP, Facter(puppet), Ohai(chef).
@@ -124,6 +222,11 @@ class SystemAPI(object):
     _DEBUG_LOG_FILE = '/var/log/scalarizr_debug.log'
     _UPDATE_LOG_FILE = '/var/log/scalarizr_update.log'
 
+    _sampler = None
+    _sampler_lock = threading.Lock()
+    _collector = None
+    _collector_lock = threading.Lock()
+
 
     def __init__(self):
         self._op_api = operation_api.OperationAPI()
@@ -504,7 +607,7 @@ class SystemAPI(object):
             device = params[0]
             for i in range(1, len(params)-1):
                 params[i] = int(params[i])
-            if len(params) == 12:
+            if len(params) >= 12:
                 read = {'num': params[1], 'sectors': params[3], 'bytes': params[3]*512}
                 write = {'num': params[5], 'sectors': params[7], 'bytes': params[7]*512}
             elif len(params) == 5:
@@ -557,6 +660,40 @@ class SystemAPI(object):
         return res
 
 
+    @rpc.query_method
+    def metrics_snapshot(self, since=None):
+        """
+        :param since: Unix time to summarize history from, the whole history
+            (last hour) by default
+        :return: CPU, memory, load average, disk and network I/O summaries
+            from /proc samples taken every 5 seconds in background.
+            Sampler starts on the first call, so rates appear after the next tick.
+
+        Data format::
+
+            {
+                'time': time of the last sample,
+                'since': time of the first sample in summary,
+                'samples': number of samples,
+                'cpu': {<user|nice|system|idle|iowait|irq|softirq|steal>: <summary>},
+                'mem': {<total_real|total_free|buffer|cached|shared|total_swap|avail_swap>: <summary>},
+                'load_average': {<la1|la5|la15>: <summary>},
+                'disk': {<device>: {<read_num|read_bytes|write_num|write_bytes>: <summary>}},
+                'net': {<iface>: {<receive|transmit>_<bytes|packets|errors>: <summary>}}
+            }
+
+        Summary is a dict of 'last', 'avg', 'min', 'p50', 'p95', 'max'.
+        CPU is in percent, memory in kB, disk and net are per second rates
+        with the raw counter in 'last'.
+        """
+        with self._sampler_lock:
+            if not SystemAPI._sampler:
+                sampler = procsampler.ProcSampler()
+                sampler.start()
+                SystemAPI._sampler = sampler
+        return self._sampler.snapshot(since)
+
+
     @rpc.query_method
     def statvfs(self, mpoints=None):
         """
@@ -630,30 +767,28 @@ class SystemAPI(object):
                 'id': 101011,
                 'name': 'jmx.scaling',
                 'value': 1,
-                'error': None
+                'error': None,
+                'age': 12.5
             }, {
                 'id': 202020,
                 'name': 'app.poller',
                 'value': None,
-                'error': 'Couldnt connect to host'
+                'error': 'Couldnt connect to host',
+                'age': 12.5
             }]
+
+        Metrics are collected in background every 30 seconds each, `age` is
+        seconds since the value was taken. The first call waits for values
+        at most the script timeout, metric not collected by then has
+        'Not collected yet' error and None age.
         """
 
-        # Obtain scaling metrics from Scalr.
-        scaling_metrics = bus.queryenv_service.get_scaling_metrics()
-        if not scaling_metrics:
-            return []
-
-        if not hasattr(threading.current_thread(), '_children'):
-            threading.current_thread()._children = weakref.WeakKeyDictionary()
-
-        wrk_pool = pool.ThreadPool(processes=10)
-        
-        try:
-            return wrk_pool.map_async(_ScalingMetricStrategy.get, scaling_metrics).get()
-        finally:
-            wrk_pool.close()
-            wrk_pool.join()
+        with self._collector_lock:
+            if not SystemAPI._collector:
+                collector = _ScalingMetricCollector()
+                collector.start()
+                SystemAPI._collector = collector
+        return self._collector.get(wait=_ScalingMetricStrategy.timeout + 1)
 
 
     @rpc.command_method
@@ -674,10 +809,14 @@ class SystemAPI(object):
 
 
     @rpc.query_method
-    def get_script_logs(self, exec_script_id, maxsize=max_log_size):
+    def get_script_logs(self, exec_script_id, maxsize=max_log_size, offset=None,
+                        length=None, tail=None, cursor=None, gzip=False):
         '''
         :return: stdout and stderr scripting logs
         :rtype: dict(stdout: base64encoded, stderr: base64encoded)
+
+        With any of offset, length, tail or cursor both logs are read as in
+        get_log(), `cursor` then is dict(stdout=cursor, stderr=cursor)
         '''
         stdout_match = glob.glob(os.path.join(script_executor.logs_dir, '*%s-out.log' % exec_script_id))
         stderr_match = glob.glob(os.path.join(script_executor.logs_dir, '*%s-err.log' % exec_script_id))
@@ -686,6 +825,18 @@ class SystemAPI(object):
                     'You can increase "Rotate scripting logs" setting under "Advanced" tab'
                     ' in Farm Designer')
 
+        if _is_ranged(offset, length, tail, cursor):
+            cursor = cursor or {}
+            if not isinstance(cursor, dict):
+                raise rpc.InvalidParamsError('Invalid cursor: %s, '
+                                             'dict(stdout=cursor, stderr=cursor) expected' % cursor)
+            ret = {}
+            for name, match in (('stdout', stdout_match), ('stderr', stderr_match)):
+                if not match:
+                    raise Exception(err_rotated)
+                ret[name] = _read_log(match[0], offset, length, tail, cursor.get(name), gzip)
+            return ret
+
         if not stdout_match:
             stdout = binascii.b2a_base64(err_rotated)
         else:
@@ -700,28 +851,61 @@ class SystemAPI(object):
         return dict(stdout=stdout, stderr=stderr)
 
     @rpc.query_method
-    def get_debug_log(self):
+    def get_debug_log(self, offset=None, length=None, tail=None, cursor=None, gzip=False):
         """
         :return: scalarizr debug log (/var/log/scalarizr.debug.log on Linux)
         :rtype: str
+
+        See get_log() for parameters
         """
+        if _is_ranged(offset, length, tail, cursor):
+            return _read_log(self._DEBUG_LOG_FILE, offset, length, tail, cursor, gzip)
         return binascii.b2a_base64(_get_log(self._DEBUG_LOG_FILE, -1))
 
     @rpc.query_method
-    def get_update_log(self):
+    def get_update_log(self, offset=None, length=None, tail=None, cursor=None, gzip=False):
         """
         :return: scalarizr update log (/var/log/scalarizr.update.log on Linux)
         :rtype: str
+
+        See get_log() for parameters
         """
-        return binascii.b2a_base64(_get_log(self._UPDATE_LOG_FILE, -1))     
+        if _is_ranged(offset, length, tail, cursor):
+            return _read_log(self._UPDATE_LOG_FILE, offset, length, tail, cursor, gzip)
+        return binascii.b2a_base64(_get_log(self._UPDATE_LOG_FILE, -1))
 
     @rpc.query_method
-    def get_log(self):
+    def get_log(self, offset=None, length=None, tail=None, cursor=None, gzip=False):
         """
         :return: scalarizr info log (/var/log/scalarizr.log on Linux)
         :rtype: str
+
+        Without parameters the whole log is returned base64 encoded.
+        With any of them only a part of it is read (at most 5 MB per call):
+
+        :param offset: position in bytes to read from
+        :param length: number of bytes to read
+        :param tail: read last `tail` bytes
+        :param cursor: `cursor` returned by the previous call: read bytes
+            written since then. Rotated or truncated log is read from the start.
+            Only one of offset, tail and cursor can be used
+        :param gzip: gzip data before base64 encoding
+
+        Data format::
+
+            {
+                'data': base64 encoded (and gzipped) bytes,
+                'offset': position of the first byte,
+                'length': number of bytes read,
+                'size': log size,
+                'cursor': opaque position after the last byte,
+                'rotated': True when cursor points to another or truncated file,
+                'gzip': True when data is gzipped
+            }
         """
-        return binascii.b2a_base64(_get_log(self._LOG_FILE, -1))   
+        if _is_ranged(offset, length, tail, cursor):
+            return _read_log(self._LOG_FILE, offset, length, tail, cursor, gzip)
+        return binascii.b2a_base64(_get_log(self._LOG_FILE, -1))
 
 
 def _get_log(logfile, maxsize=max_log_size):
@@ -734,6 +918,61 @@ def _get_log(logfile, maxsize=max_log_size):
         return 'Log file %s is not readable' % logfile
 
 
+def _is_ranged(*params):
+    return any(param is not None for param in params)
+
+
+def _read_log(logfile, offset=None, length=None, tail=None, cursor=None, gzip=False):
+    # Seeks to the requested range and reads only it, see SystemAPI.get_log()
+    starts = [name for name, value in (('offset', offset), ('tail', tail), ('cursor', cursor))
+              if value is not None]
+    if len(starts) > 1:
+        raise rpc.InvalidParamsError('Only one of %s can be used' % ', '.join(starts))
+    for name, value in (('length', length), ('tail', tail)):
+        if value is not None and int(value) < 0:
+            raise rpc.InvalidParamsError('Negative %s: %s' % (name, value))
+    length = max_log_size if length is None else min(int(length), max_log_size)
+    try:
+        fp = open(logfile, 'rb')
+    except IOError:
+        raise Exception('Log file %s is not readable' % logfile)
+    try:
+        st = os.fstat(fp.fileno())
+        rotated = False
+        if cursor is not None:
+            try:
+                ino, offset = map(int, str(cursor).split(':'))
+            except ValueError:
+                raise rpc.InvalidParamsError('Invalid cursor: %s' % cursor)
+            if ino != st.st_ino or offset > st.st_size:
+                rotated = True
+                offset = 0
+        elif tail is not None:
+            offset = max(0, st.st_size - int(tail))
+            length = min(length, int(tail))
+        offset = int(offset or 0)
+        if offset < 0:
+            raise rpc.InvalidParamsError('Negative offset: %s' % offset)
+        fp.seek(offset)
+        data = fp.read(length)
+    finally:
+        fp.close()
+
+    read = len(data)
+    if gzip:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        data = compressor.compress(data) + compressor.flush()
+    return {
+        'data': binascii.b2a_base64(data),
+        'offset': offset,
+        'length': read,
+        'size': st.st_size,
+        'cursor': '%d:%d' % (st.st_ino, offset + read),
+        'rotated': rotated,
+        'gzip': bool(gzip)
+    }
+
+
 if linux.os.windows_family:
     from win32com import client
     from scalarizr.util import coinitialized
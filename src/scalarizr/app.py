@@ -42,6 +42,7 @@ from scalarizr.util.flag import Flag
 
 # Stdlibs
 import cStringIO
+import ConfigParser
 import logging
 import logging.config
 import os, shutil, time, uuid
@@ -213,13 +214,13 @@ def _init():
 DB_NAME = 'db.sqlite'
 DB_SCRIPT = 'db.sql'
 
-def _db_connect(file=None):
+def _db_connect(file=None, **kwds):
     logger = logging.getLogger(__name__)
     cnf = bus.cnf
     file = file or cnf.private_path(DB_NAME)
     logger.debug("Open SQLite database (file: %s)" % (file))    
     
-    conn = sqlite.connect(file, 5.0)
+    conn = sqlite.connect(file, 5.0, **kwds)
     conn.row_factory = sqlite.Row
     conn.text_factory = sqlite.OptimizedUnicode
     #conn.executescript("PRAGMA journal_mode=OFF;")    
@@ -245,6 +246,12 @@ def _init_db(file=None):
         if not any(filter(lambda row: row[1] == 'format', cur.fetchall())):
             cur.execute("alter table p2p_message add column format TEXT default 'xml'")
             conn.commit()
+        # Indexes for message lookups, databases created by older versions don't have them
+        cur.execute('create index if not exists p2p_message_message_id '
+                    'on p2p_message (message_id, is_ingoing)')
+        cur.execute('create index if not exists p2p_message_unhandled '
+                    'on p2p_message (is_ingoing, in_is_handled)')
+        conn.commit()
         cur.close()
         conn.close()
     except sqlite.OperationalError, e:
@@ -259,11 +266,23 @@ def _init_db(file=None):
 
         
     # Configure database connection pool
-    t = sqlite_server.SQLiteServerThread(_db_connect)
-    t.setDaemon(True)
-    t.start()
-    sqlite_server.wait_for_server_thread(t)
-    bus.db = t.connection
+    try:
+        engine = cnf.rawini.get(config.SECT_GENERAL, config.OPT_STORAGE_ENGINE)
+    except ConfigParser.Error:
+        engine = 'pool'
+    if engine == 'pool' and not sqlite_server.wal_supported():
+        logger.debug('SQLite %s has no WAL support, fallback to server storage engine', 
+                     sqlite.sqlite_version)
+        engine = 'server'
+
+    if engine == 'pool':
+        bus.db = sqlite_server.SQLitePool(_db_connect)
+    else:
+        t = sqlite_server.SQLiteServerThread(_db_connect)
+        t.setDaemon(True)
+        t.start()
+        sqlite_server.wait_for_server_thread(t)
+        bus.db = t.connection
     
 
     
@@ -927,6 +946,8 @@ class Service(object):
                 'timestamp': os_time.utcnow().strftime("%a %d %b %Y %H:%M:%S %z")
             })
         producer.on('before_send', msg_meta)
+        # Log and operation progress messages shouldn't block handlers
+        producer.start_async_delivery()
 
         Storage.maintain_volume_table = True
 
@@ -940,7 +961,7 @@ class Service(object):
             except socket.error:
                 pass
             STATE['global.api_port'] = api_port
-            api_app = jsonrpc_http.WsgiApplication(rpc.RequestHandler(api.api_routes),
+            api_app = jsonrpc_http.WsgiApplication(rpc.RequestHandler(api.api_routes, batch_workers=4),
                                                 cnf.key_path(cnf.DEFAULT_KEY))
             class ThreadingWSGIServer(SocketServer.ThreadingMixIn, wsgiref.simple_server.WSGIServer):
                 pass
@@ -1054,7 +1075,10 @@ class Service(object):
         self._logger.debug('Shutdowning external messaging')
         msg_service = bus.messaging_service
         msg_service.get_consumer().shutdown(force=True)
-        msg_service.get_producer().shutdown()
+        producer = msg_service.get_producer()
+        # Undelivered messages stay in database and will be sent after restart
+        producer.flush(timeout=5)
+        producer.shutdown()
         bus.messaging_service = None
 
         # Shutdown API server
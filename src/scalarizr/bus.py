@@ -52,7 +52,7 @@ class _Bus(Observable):
     db = None
     """
     @ivar db: Database connection pool. Single connection per thread
-    @type db: scalarizr.util.sqlite_server.ConnectionProxy
+    @type db: scalarizr.util.sqlite_server.ConnectionProxy or scalarizr.util.sqlite_server.SQLitePool
     """
 
     messaging_service = None
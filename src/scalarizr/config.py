@@ -7,7 +7,7 @@ Created on Aug 11, 2010
 
 from scalarizr.bus import bus
 from scalarizr.libs.bases import Observable
-from scalarizr.util import validators
+from scalarizr.util import validators, cryptotool
 
 from ConfigParser import ConfigParser, RawConfigParser, NoOptionError, NoSectionError
 from getpass import getpass
@@ -24,6 +24,7 @@ OPT_BEHAVIOUR = "behaviour"
 OPT_ROLE_NAME = "role_name"
 OPT_FARMROLE_ID = 'farm_role_id'
 OPT_STORAGE_PATH = "storage_path"
+OPT_STORAGE_ENGINE = "storage_engine"
 OPT_CRYPTO_KEY_PATH = "crypto_key_path"
 OPT_FARM_CRYPTO_KEY_PATH = "farm_crypto_key_path"
 OPT_PLATFORM = "platform"
@@ -895,6 +896,7 @@ class ScalarizrCnf(Observable):
                 file.close()
             if os.path.exists(filename):
                 os.chmod(filename, 0400)
+            cryptotool.invalidate_key(filename)
         return filename
 
     def _get_state(self):
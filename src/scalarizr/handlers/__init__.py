@@ -6,7 +6,7 @@ from scalarizr.node import __node__
 from scalarizr.config import ScalarizrState, STATE
 from scalarizr.messaging import Queues, Message, Messages
 from scalarizr.util import initdv2, software, system2, PopenError
-from scalarizr.linux import iptables, pkgmgr
+from scalarizr.linux import iptables, ipset, pkgmgr
 from scalarizr.service import CnfPresetStore, CnfPreset, PresetType
 
 import os
@@ -42,11 +42,14 @@ class Handler(object):
         return msg
 
     def send_message(self, msg_name, msg_body=None, msg_meta=None, broadcast=False,
-                                    queue=Queues.CONTROL, wait_ack=False, wait_subhandler=False, new_crypto_key=None):
+                                    queue=Queues.CONTROL, wait_ack=False, wait_subhandler=False, new_crypto_key=None,
+                                    sync=None):
         srv = bus.messaging_service
         msg = msg_name if isinstance(msg_name, Message) else \
                         self.new_message(msg_name, msg_body, msg_meta, broadcast)
-        srv.get_producer().send(queue, msg)
+        if wait_ack or wait_subhandler:
+            sync = True
+        srv.get_producer().send(queue, msg, sync=sync)
         cons = srv.get_consumer()
 
         if new_crypto_key:
@@ -211,6 +214,10 @@ class MessageListener:
                 platform_access_data_on_me = True
                 pl.set_access_data(message.platform_access_data)
 
+            if bus.queryenv_service:
+                # Don't let handlers read farm state cached before the message
+                bus.queryenv_service.invalidate_for(message.name)
+
             if message.body.get('global_variables'):    
                 global_variables = message.body.get('global_variables') or []
                 glob_vars = {}
@@ -632,13 +639,22 @@ class DbMsrMessages:
 
 
 class FarmSecurityMixin(object):
+    """
+    Allows farm servers to connect to service ports and denies the rest.
+    When ipset is available farm servers are kept in `farm_ipset` set matched
+    by one rule per port, otherwise each server gets rules of its own.
+    """
+    farm_ipset = 'scalr-farm'
+
     def __init__(self):
         self.__enabled = False
+        self.__use_ipset = False
 
     def init_farm_security(self, ports):
         self._logger = logging.getLogger(__name__)
         self._ports = ports
         self._iptables = iptables
+        self._ipset = ipset
         if self._iptables.enabled():
             bus.on(
                 reload=self.__on_reload
@@ -657,6 +673,10 @@ class FarmSecurityMixin(object):
         if not self.__enabled:
             return
         # Append new server to allowed list
+        if self.__use_ipset:
+            self._ipset.add(self.farm_ipset,
+                            *self.__host_sources(message.local_ip, message.remote_ip))
+            return
         rules = []
         for port in self._ports:
             rules += self.__accept_host(message.local_ip, message.remote_ip, port)
@@ -666,19 +686,16 @@ class FarmSecurityMixin(object):
     def on_HostDown(self, message):
         if not self.__enabled:
             return
-        # Remove terminated server from allowed list
+        # Remove terminated server from allowed list.
+        # Rules of a server that didn't send HostInit are just missing
+        if self.__use_ipset:
+            self._ipset.remove(self.farm_ipset,
+                               *self.__host_sources(message.local_ip, message.remote_ip))
+            return
         rules = []
         for port in self._ports:
             rules += self.__accept_host(message.local_ip, message.remote_ip, port)
-        for rule in rules:
-            try:
-                self._iptables.FIREWALL.remove(rule)
-            except: #?
-                if 'does a matching rule exist in that chain' in str(sys.exc_info()[1]):
-                    # When HostDown comes from a server that didn't send HostInit
-                    pass
-                else:
-                    raise
+        self._iptables.FIREWALL.discard(rules)
 
 
     def __create_rule(self, source, dport, jump):
@@ -699,33 +716,57 @@ class FarmSecurityMixin(object):
         return self.__create_rule(None, dport, 'DROP')
 
 
-    def __accept_host(self, local_ip, public_ip, dport):
+    def __create_ipset_rule(self, dport):
+        return {"jump": "ACCEPT",
+                "protocol": "tcp",
+                "match": "set",
+                "match-set": [self.farm_ipset, "src"],
+                "dport": str(dport)}
+
+
+    def __host_sources(self, local_ip, public_ip):
         ret = []
         if local_ip == self._platform.get_private_ip():
-            ret.append(self.__create_accept_rule('127.0.0.1', dport))
+            ret.append('127.0.0.1')
         if local_ip:
-            ret.append(self.__create_accept_rule(local_ip, dport))
-        ret.append(self.__create_accept_rule(public_ip, dport))
+            ret.append(local_ip)
+        ret.append(public_ip)
         return ret
 
 
+    def __accept_host(self, local_ip, public_ip, dport):
+        return [self.__create_accept_rule(source, dport)
+                for source in self.__host_sources(local_ip, public_ip)]
+
+
     def __insert_iptables_rules(self, *args, **kwds):
         # Collect farm servers IP-s
-        hosts = []
+        hosts = [(self._platform.get_private_ip(), self._platform.get_public_ip())]
         for role in self._queryenv.list_roles(with_init=True):
             for host in role.hosts:
                 hosts.append((host.internal_ip, host.external_ip))
 
         rules = []
+        if self._ipset.enabled():
+            sources = []
+            for local_ip, public_ip in hosts:
+                for source in self.__host_sources(local_ip, public_ip):
+                    if source not in sources:
+                        sources.append(source)
+            try:
+                self._ipset.create(self.farm_ipset, entries=sources)
+                self.__use_ipset = True
+            except linux.LinuxError, e:
+                self._logger.warn('Failed to create ipset %s, falling back '
+                                  'to rule per farm server: %s', self.farm_ipset, e)
         for port in self._ports:
-            # TODO: this will be duplicated, because current host is in the
-            # hosts list too
-            # TODO: this also duplicates the rules, inserted in on_HostInit
-            # for the current host
-            rules += self.__accept_host(self._platform.get_private_ip(),
-                                    self._platform.get_public_ip(), port)
+            if self.__use_ipset:
+                rules.append(self.__create_ipset_rule(port))
+                continue
             for local_ip, public_ip in hosts:
-                rules += self.__accept_host(local_ip, public_ip, port)
+                for rule in self.__accept_host(local_ip, public_ip, port):
+                    if rule not in rules:
+                        rules.append(rule)
 
         # Deny from all
         drop_rules = []
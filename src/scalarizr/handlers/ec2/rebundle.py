@@ -11,7 +11,7 @@ import scalarizr
 from scalarizr.bus import bus
 from scalarizr.node import __node__
 from scalarizr.handlers import HandlerError, build_tags
-from scalarizr.util import system2, wait_until, firstmatched
+from scalarizr.util import system2, wait_until, firstmatched, PopenError
 from scalarizr import linux
 from scalarizr.linux import mount
 
@@ -21,16 +21,20 @@ from scalarizr.messaging import Messages
 from scalarizr.linux import coreutils
 from scalarizr.linux.tar import Tar
 from scalarizr.storage2.volumes import ebs as ebsvolume
-from scalarizr.storage2.cloudfs import FileTransfer
+from scalarizr.storage2.cloudfs import FileTransfer, cloudfs
 from scalarizr.storage2 import volume, filesystem
 from scalarizr.libs.metaconf import Configuration
 
 from binascii import hexlify
 from xml.dom.minidom import Document
 from datetime import datetime
-import time, os, re, shutil, glob
+import time, os, re, shutil, glob, sys
 import string
 import hashlib
+import Queue
+import tempfile
+import threading
+import subprocess
 
 from boto.exception import BotoServerError
 from boto.ec2.blockdevicemapping import EBSBlockDeviceType, BlockDeviceMapping
@@ -54,7 +58,6 @@ BUNDLER_RELEASE = "672"
 
 DIGEST_ALGO = "sha1"
 CRYPTO_ALGO = "aes-128-cbc"
-READ_BUF_SIZE = 1024 * 1024
 
 EPH_STORAGE_MAPPING = {
         'i386': {
@@ -364,7 +367,10 @@ class RebundleInstanceStoreStrategy(RebundleStratery):
         return arch
 
     def _bundle_image(self, name, image_file, user, destination, user_private_key_string,
-                                    user_cert_string, ec2_cert_string, key=None, iv=None):
+                                    user_cert_string, ec2_cert_string, key=None, iv=None, upload=None):
+        '''
+        @param upload: callable(part_path) called as soon as a part is written
+        '''
         try:
             LOG.info("Bundling image...")
 
@@ -382,7 +388,6 @@ class RebundleInstanceStoreStrategy(RebundleStratery):
             # Load and generate necessary keys.
             name = os.path.basename(image_file)
             manifest_file = os.path.join(destination, name + '.manifest.xml')
-            bundled_file_path = os.path.join(destination, name + '.tar.gz.enc')
             user_cert_path = bus.cnf.write_key('aws-cert.pem', user_cert_string)
             user_private_key_path = bus.cnf.write_key('aws-pkey.pem', user_private_key_string)
             ec2_cert_path = bus.cnf.write_key('aws-cloud-cert.pem', ec2_cert_string)
@@ -422,15 +427,39 @@ class RebundleInstanceStoreStrategy(RebundleStratery):
             tar.add(os.path.basename(image_file), os.path.dirname(image_file))
             digest_file = os.path.join('/tmp', 'ec2-bundle-image-digest.sha1')
 
+            # The encrypted stream is split into parts as it comes out of
+            # openssl and every part is hashed while written: no intermediate
+            # bundle file, no re-reading of parts to digest them, and parts
+            # are uploaded while the rest of the image is being bundled.
             LOG.info("Encrypting image")
-            system2(" | ".join([
+            cmd = " | ".join([
                     "%(openssl)s %(digest_algo)s -out %(digest_file)s < %(digest_pipe)s & %(tar)s",
                     "tee %(digest_pipe)s",
                     "gzip",
-                    "%(openssl)s enc -e -%(crypto_algo)s -K %(key)s -iv %(iv)s > %(bundled_file_path)s"]) % dict(
+                    "%(openssl)s enc -e -%(crypto_algo)s -K %(key)s -iv %(iv)s"]) % dict(
                             openssl=openssl, digest_algo=DIGEST_ALGO, digest_file=digest_file, digest_pipe=digest_pipe,
-                            tar=str(tar), crypto_algo=CRYPTO_ALGO, key=key, iv=iv, bundled_file_path=bundled_file_path
-            ), shell=True)
+                            tar=str(tar), crypto_algo=CRYPTO_ALGO, key=key, iv=iv)
+            err = tempfile.TemporaryFile()
+            proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=err, close_fds=True)
+            parts = []
+            bundled_size = 0
+            try:
+                for part_name, size, part_digest in coreutils.split_stream(
+                            proc.stdout, name, self._IMAGE_CHUNK_SIZE, destination, DIGEST_ALGO):
+                    parts.append((part_name, part_digest))
+                    bundled_size += size
+                    if upload:
+                        upload(os.path.join(destination, part_name))
+            finally:
+                proc.stdout.close()
+                proc.wait()
+                err.seek(0)
+                err_text = err.read()
+                err.close()
+            if proc.returncode:
+                raise PopenError('Bundling image failed', '', err_text, proc.returncode, cmd)
+            LOG.debug("Image splitted into %s chunks", len(parts))
+            LOG.debug('Image size: %d bytes', bundled_size)
 
             try:
                 # openssl produce different outputs:
@@ -447,24 +476,6 @@ class RebundleInstanceStoreStrategy(RebundleStratery):
             finally:
                 os.remove(digest_file)
 
-            #digest = "da39a3ee5e6b4b0d3255bfef95601890afd80709"
-
-            # Split the bundled AMI.
-            # Splitting is not done as part of the compress, encrypt digest
-            # stream, so that the filenames of the parts can be easily
-            # tracked. The alternative is to create a dedicated output
-            # directory, but this leaves the user less choice.
-            LOG.info("Splitting image into chunks")
-            part_names = coreutils.split(bundled_file_path, name, self._IMAGE_CHUNK_SIZE, destination)
-            LOG.debug("Image splitted into %s chunks", len(part_names))
-
-            # Sum the parts file sizes to get the encrypted file size.
-            bundled_size = 0
-            for part_name in part_names:
-                bundled_size += os.path.getsize(os.path.join(destination, part_name))
-            LOG.debug('Image size: %d bytes', bundled_size)
-
-
             # Encrypt key and iv.
             LOG.info("Encrypting keys")
 
@@ -484,9 +495,6 @@ class RebundleInstanceStoreStrategy(RebundleStratery):
             ec2_encrypted_iv = public_encrypt(ec2_cert_path, iv)
             LOG.debug("Keys encrypted")
 
-            # Digest parts.
-            parts = self._digest_parts(part_names, destination)
-
             # Create bundle manifest
             bdm = list((name, device) for name, device in self._platform.block_devs_mapping()
                             if not name.startswith('ephemeral'))
@@ -519,54 +527,8 @@ class RebundleInstanceStoreStrategy(RebundleStratery):
             raise
 
 
-    def _digest_parts(self, part_names, destination):
-        LOG.info("Generating digests for each chunk")
-        part_digests = []
-        for part_name in part_names:
-            part_filename = os.path.join(destination, part_name)
-            f = None
-            try:
-                f = open(part_filename)
-                digest = hashlib.sha1()
-                part_digests.append((part_name, hexlify(self._digest_file(digest, f))))
-            except (Exception, BaseException):
-                LOG.error("Cannot generate digest for chunk '%s'", part_name)
-                raise
-            finally:
-                if f is not None:
-                    f.close()
-        return part_digests
-
-
-    def _digest_file(self, digest, fp):
-        while 1:
-            buf = fp.read(READ_BUF_SIZE)
-            if not buf:
-                break;
-            digest.update(buf)
-        return digest.digest()
-
-
-    def _upload_image(self, bucket_name, manifest_path, manifest, region=None, acl="aws-exec-read"):
-        try:
-            LOG.info("Uploading bundle")
-
-            # Files to upload
-            LOG.debug("Enqueue files to upload")
-            manifest_dir = os.path.dirname(manifest_path)
-            upload_files = [manifest_path]
-            for part in manifest.parts:
-                upload_files.append(os.path.join(manifest_dir, part[0]))
-
-            return self._upload_image_files(upload_files, manifest_path)
-
-        except (Exception, BaseException):
-            LOG.error("Cannot upload image")
-            raise
-
-    def _upload_image_files(self, files, manifest_path):
+    def _upload_image_files(self, trn, manifest_path):
         dst = self._platform.scalrfs.images()
-        trn = FileTransfer(src=files, dst=dst)
         res = trn.run()
         #trn = Transfer(pool=4, max_attempts=5, logger=LOG)
         #trn.upload(upload_files, self._platform.scalrfs.images())
@@ -592,6 +554,15 @@ class RebundleInstanceStoreStrategy(RebundleStratery):
         manifest_path = os.path.join(self._platform.scalrfs.images(), os.path.basename(manifest_path))
         return manifest_path.split('s3://')[1]
 
+    def _delete_image_files(self, files):
+        dst = self._platform.scalrfs.images()
+        driver = cloudfs(dst.split('://')[0])
+        for path in files:
+            try:
+                driver.delete(os.path.join(dst, os.path.basename(path)))
+            except (BaseException, Exception), e:
+                LOG.warn("Cannot delete uploaded image file %s. %s", path, e)
+
     def _register_image(self, s3_manifest_path):
         try:
             LOG.info("Registering image '%s'", s3_manifest_path)
@@ -617,15 +588,52 @@ class RebundleInstanceStoreStrategy(RebundleStratery):
         # Clean up
         self._cleanup_image(self._image.mpoint, self._role_name)
 
-        # Bundle image
-        cert, pk = self._platform.get_cert_pk()
-        manifest_path, manifest = self._bundle_image(
-                                self._image_name, image_file, self._platform.get_account_id(),
-                                self._destination, pk, cert, self._platform.get_ec2_cert())
-
-        # Upload image to S3
-        s3_manifest_path = self._upload_image(self._s3_bucket_name, manifest_path,
-                                manifest, region=self._platform.get_region())
+        # Bundle image and upload it to S3: parts are uploaded as soon as
+        # they are written, manifest the last
+        LOG.info("Uploading bundle")
+        files = Queue.Queue()
+        transfer = FileTransfer(src=iter(files.get, None), dst=self._platform.scalrfs.images())
+        uploaded = []
+        transfer.on('transfer_complete', lambda src, dst, retry, chunk_num: uploaded.append(src))
+        manifest_path = os.path.join(self._destination,
+                                os.path.basename(image_file) + '.manifest.xml')
+        upload = {}
+        def uploader():
+            try:
+                upload['s3_manifest_path'] = self._upload_image_files(transfer, manifest_path)
+            except:
+                LOG.error("Cannot upload image")
+                upload['exc_info'] = sys.exc_info()
+        upload_thread = threading.Thread(target=uploader, name='Rebundle upload')
+        upload_thread.start()
+        try:
+            cert, pk = self._platform.get_cert_pk()
+            manifest_path, manifest = self._bundle_image(
+                                    self._image_name, image_file, self._platform.get_account_id(),
+                                    self._destination, pk, cert, self._platform.get_ec2_cert(),
+                                    upload=files.put)
+            files.put(manifest_path)
+        except:
+            # Stop upload: queued parts are dropped, parts in progress
+            # are finished and then deleted with the uploaded ones
+            exc_info = sys.exc_info()
+            transfer.kill_nowait()
+            while True:
+                try:
+                    files.get_nowait()
+                except Queue.Empty:
+                    break
+            files.put(None)
+            upload_thread.join()
+            LOG.info("Deleting %d uploaded image parts", len(uploaded))
+            self._delete_image_files(uploaded)
+            raise exc_info[0], exc_info[1], exc_info[2]
+        finally:
+            files.put(None)
+            upload_thread.join()
+        if 'exc_info' in upload:
+            raise upload['exc_info'][0], upload['exc_info'][1], upload['exc_info'][2]
+        s3_manifest_path = upload['s3_manifest_path']
 
         # Register image on EC2
         return self._register_image(s3_manifest_path)
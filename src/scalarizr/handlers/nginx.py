@@ -15,6 +15,7 @@ from scalarizr.config import Configurator, BuiltinBehaviours, ScalarizrState
 from scalarizr.service import CnfController
 from scalarizr.handlers import HandlerError, ServiceCtlHandler
 from scalarizr.messaging import Messages
+from scalarizr.queryenv import RoleHost
 from scalarizr.api import service as preset_service
 from scalarizr.node import __node__
 from scalarizr.api import nginx as nginx_api
@@ -185,6 +186,16 @@ class NginxHandler(ServiceCtlHandler):
                  service_name=SERVICE_NAME,
                  preset=self.initial_preset)
 
+    def _message_host(self, message):
+        return RoleHost(internal_ip=message.local_ip,
+                        external_ip=message.remote_ip,
+                        cloud_location=message.cloud_location)
+
+    def _role_proxies(self):
+        role_params = self._queryenv.list_farm_role_params(__node__['farm_role_id'])['params']
+        nginx_params = role_params.get(BEHAVIOUR)
+        return nginx_params.get('proxies', []) if nginx_params else []
+
     def on_HostUp(self, message):
         server = ''
         role_id = message.farm_role_id
@@ -226,12 +237,9 @@ class NginxHandler(ServiceCtlHandler):
 
         else:
             self._logger.info('adding new app server %s to role %s backend(s)', server, role_id)
-            # self.api.add_server_to_role(server, role_id)
-            role_params = self._queryenv.list_farm_role_params(__node__['farm_role_id'])['params']
-            nginx_params = role_params.get(BEHAVIOUR)
-            proxies = nginx_params.get('proxies', []) if nginx_params else []
-            self._logger.debug('Recreating proxying with proxies:\n%s' % proxies)
-            self.api.recreate_proxying(proxies)
+            proxies = self._role_proxies()
+            self._logger.debug('Updating proxying with proxies:\n%s' % proxies)
+            self.api.update_proxying(proxies, self._message_host(message), role_id, up=True)
 
         self._logger.info('After %s host up backend table is %s' % (server, self.api.backend_table))
 
@@ -241,7 +249,8 @@ class NginxHandler(ServiceCtlHandler):
                                  role_id,
                                  role_name,
                                  behaviours,
-                                 cache_remove=False):
+                                 cache_remove=False,
+                                 host=None):
         if server in self._terminating_servers:
             self._terminating_servers.remove(server)
             return
@@ -277,15 +286,10 @@ class NginxHandler(ServiceCtlHandler):
             #                                update_backend_table=True)
 
         else:
-            # self._logger.info('removing server %s from role %s backend(s)', server, role_id)
-            # self.api.remove_server_from_role(server, role_id)
-            # self._logger.info('adding new app server %s to role %s backend(s)', server, role_id)
-            # self.api.add_server_to_role(server, role_id)
-            role_params = self._queryenv.list_farm_role_params(__node__['farm_role_id'])['params']
-            nginx_params = role_params.get(BEHAVIOUR)
-            proxies = nginx_params.get('proxies', []) if nginx_params else []
-            self._logger.debug('Recreating proxying with proxies:\n%s' % proxies)
-            self.api.recreate_proxying(proxies)
+            self._logger.info('removing server %s from role %s backend(s)', server, role_id)
+            proxies = self._role_proxies()
+            self._logger.debug('Updating proxying with proxies:\n%s' % proxies)
+            self.api.update_proxying(proxies, host or server, role_id, up=False)
         self._logger.debug('After %s host down backend table is %s' %
                            (server, self.api.backend_table))
 
@@ -302,7 +306,8 @@ class NginxHandler(ServiceCtlHandler):
         else:
             server = message.remote_ip
 
-        self._remove_shut_down_server(server, role_id, role_name, behaviours)
+        self._remove_shut_down_server(server, role_id, role_name, behaviours,
+                                      host=self._message_host(message))
 
     def on_BeforeHostTerminate(self, message):
         server = ''
@@ -314,7 +319,8 @@ class NginxHandler(ServiceCtlHandler):
         else:
             server = message.remote_ip
 
-        self._remove_shut_down_server(server, role_id, role_name, behaviours, True)
+        self._remove_shut_down_server(server, role_id, role_name, behaviours, True,
+                                      host=self._message_host(message))
 
     def on_VhostReconfigure(self, message):
         if not self._get_nginx_v2_mode_flag():
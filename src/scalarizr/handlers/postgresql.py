@@ -253,11 +253,7 @@ class PostgreSqlHander(ServiceCtlHandler):
     
     
     def accept_all_clients(self):
-        farm_hosts = self.farm_hosts
-        for ip in farm_hosts:
-                self.postgresql.register_client(ip, force=False)
-        if farm_hosts:
-            self.postgresql.service.reload('Granting access to all servers within farm.', force=True)
+        self.postgresql.register_clients(self.farm_hosts)
                 
 
     @property
@@ -375,6 +375,7 @@ class Script(object):
 
     logger = None
     proc = None
+    _exited = None
     stdout_path = None
     stderr_path = None
     execution_id = None
@@ -528,19 +529,21 @@ class Script(object):
         self.pid = self.proc.pid
         self.start_time = time.time()
 
+        # Reap the child in a dedicated thread, wait() is woken up on exit
+        self._exited = threading.Event()
+        waiter = threading.Thread(target=self._proc_waiter,
+                                  name='ScriptWaiter-%s' % self.pid)
+        waiter.setDaemon(True)
+        waiter.start()
+
     def wait(self):
         try:
             # Communicate with process
             self.logger.debug('Communicating with %s (pid: %s)', self.interpreter, self.pid)
-            while time.time() - self.start_time < self.exec_timeout:
-                time.sleep(5)
-                if self._proc_poll() is None:
-                    time.sleep(0.5)
-                else:
-                    # Process terminated
-                    self.logger.debug('Process terminated')
-                    self.return_code = self._proc_complete()
-                    break
+            if self._proc_wait(self.start_time + self.exec_timeout - time.time()):
+                # Process terminated
+                self.logger.debug('Process terminated')
+                self.return_code = self._proc_complete()
             else:
                 # Process timed out
                 self.return_code = self._proc_kill()
@@ -608,9 +611,42 @@ class Script(object):
                 'exec_timeout': self.exec_timeout,
                 'run_as': self.run_as}
 
+    def _proc_waiter(self):
+        try:
+            self.proc.wait()
+        finally:
+            self._exited.set()
+
+    def _proc_wait(self, timeout):
+        '''
+        Wait for process exit at most `timeout` seconds.
+        Returns False when timed out
+        '''
+        if self.proc:
+            # Untimed Event.wait() returns on set() immediately,
+            # while timed one polls. Timer only interrupts the wait
+            timer = threading.Timer(max(timeout, 0), self._exited.set)
+            timer.setDaemon(True)
+            timer.start()
+            try:
+                self._exited.wait()
+            finally:
+                timer.cancel()
+            return self.proc.returncode is not None
+        else:
+            # Restored script is not our child, watch /proc
+            deadline = time.time() + timeout
+            while self._proc_poll() is None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                time.sleep(min(remaining, 1))
+            return True
+
     def _proc_poll(self):
         if self.proc:
-            return self.proc.poll()
+            # Child is reaped by _proc_waiter
+            return self.proc.returncode
         else:
             statfile = '/proc/%s/stat' % self.pid
             exefile = '/proc/%s/exe' % self.pid
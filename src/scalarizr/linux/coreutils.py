@@ -9,6 +9,7 @@ import os
 import glob
 import shutil
 import logging
+import hashlib
 from math import ceil
 
 from scalarizr import linux
@@ -223,6 +224,36 @@ def split(filename, part_name_prefix, chunk_size, dest_dir):
             f.close()
 
 
+def split_stream(stream, part_name_prefix, chunk_size, dest_dir, digest_algo=None):
+    '''
+    Splits stream into parts named as split() does, without storing it as a whole.
+    Generates (part_name, size, hex digest or None) as soon as a part is written,
+    digest_algo is hashlib algorithm name to hash every part while writing it
+    '''
+    logger = logging.getLogger(__name__)
+    num = 0
+    while True:
+        buf = stream.read(min(BUFFER_SIZE, chunk_size))
+        if not buf:
+            break
+        part_name = part_name_prefix + PART_SUFFIX + str(num).rjust(2, "0")
+        part_filename = os.path.join(dest_dir, part_name)
+        digest = hashlib.new(digest_algo) if digest_algo else None
+        size = 0
+        logger.debug("Writing chunk '%s'", part_filename)
+        with open(part_filename, "wb") as cf:
+            while buf:
+                cf.write(buf)
+                if digest:
+                    digest.update(buf)
+                size += len(buf)
+                if size == chunk_size:
+                    break
+                buf = stream.read(min(BUFFER_SIZE, chunk_size - size))
+        yield part_name, size, digest.hexdigest() if digest else None
+        num += 1
+
+
 def truncate(filename):
     f = open(filename, "w+")
     f.truncate(0)
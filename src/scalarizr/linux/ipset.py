@@ -0,0 +1,34 @@
+'''
+Sets of addresses that are matched by a single iptables rule, see ipset(8).
+Each call makes one ipset exec whatever the number of entries is.
+'''
+from scalarizr import linux
+
+
+IPSET_BIN = '/usr/sbin/ipset'
+
+
+def enabled():
+    return bool(linux.which('ipset'))
+
+
+def restore(commands):
+    '''
+    Runs ipset commands like ('add', 'myset', '10.0.0.1') with one
+    `ipset restore` call. Existing entries are not an error on add,
+    missing ones on del.
+    '''
+    script = ''.join('%s\n' % ' '.join(command) for command in commands)
+    return linux.system((IPSET_BIN, '-exist', 'restore'), stdin=script)
+
+
+def create(name, type_='hash:ip', entries=()):
+    restore([('create', name, type_)] + [('add', name, entry) for entry in entries])
+
+
+def add(name, *entries):
+    restore([('add', name, entry) for entry in entries])
+
+
+def remove(name, *entries):
+    restore([('del', name, entry) for entry in entries])
@@ -64,15 +64,14 @@ _OPTIONS = {
 }
 
 
-def iptables(**long_kwds):
-
+def _build_args(long_kwds, executable=None):
     ordered_long = OrderedDict()
     for key in ("protocol", "match"):
         if key in long_kwds:
             ordered_long[key] = long_kwds.pop(key)
     ordered_long.update(long_kwds)
     args0 = linux.build_cmd_args(
-            executable=IPTABLES_BIN,
+            executable=executable,
             long=ordered_long)
     args = []
     for arg in args0:
@@ -80,7 +79,11 @@ def iptables(**long_kwds):
             args.extend(('!', arg.replace('not-', '')))
         else:
             args.append(arg)
-    return linux.system(args)
+    return args
+
+
+def iptables(**long_kwds):
+    return linux.system(_build_args(long_kwds, IPTABLES_BIN))
 
 
 def iptables_save(filename=None, *short_args, **long_kwds):
@@ -330,28 +333,10 @@ class _Chain(object):
         return result
 
     def ensure(self, rules, append=False):
-        # Insert or append missing rules.
-        # NOTE: rule comparison is far from ideal, check _to_inner method
-        # NOTE: existing rules don't have table attribute
-
-        tables = [rule.get('table') for rule in rules]
-        filter(None, tables)
-        if not 'filter' in tables:
-            tables.append('filter')
-
-        existing = []
-        for table in tables:
-            existing.extend(self.list(table))
-
-        for rule in reversed(rules):
-            rule_repr = _to_inner(rule)
-            if rule_repr not in existing:
-                if not append:
-                    self.insert(None, rule)
-                    existing.insert(0, rule_repr)
-                else:
-                    self.append(rule)
-                    existing.append(rule_repr)
+        return ensure({self.name: rules}, append)
+
+    def discard(self, rules):
+        return discard({self.name: rules})
 
 
 #? Group this two functions in a Rule class?
@@ -390,6 +375,26 @@ def _to_inner(rule):
     return inner
 
 
+def _canonical(rule):
+    """
+    Inner representation without table and implicit protocol match:
+    '-p tcp -m tcp --dport 22' is the same rule as '-p tcp --dport 22'
+    """
+    inner = _to_inner(rule)
+    inner.pop('table', None)
+    match = inner.get('match')
+    protocol = inner.get('protocol')
+    if match and protocol:
+        if isinstance(match, basestring):
+            match = [match]
+        match = [m for m in match if m != protocol]
+        if not match:
+            del inner['match']
+        else:
+            inner['match'] = match[0] if len(match) == 1 else match
+    return inner
+
+
 def _is_plain_ip(s):
     return [n.isdigit() and 0 <= int(n) <= 255 for n in s.split('.')] == \
                [True] * 4
@@ -445,10 +450,97 @@ def list(chain, table=None):
     return chains[chain].list(table)
 
 
+def _snapshot():
+    """
+    Rules of all tables from one iptables-save call in canonical form:
+    {(table, chain): [rule, ...]}
+    """
+    lines = OrderedDict()
+    table = None
+    for line in iptables_save().splitlines():
+        if line.startswith('*'):
+            table = line[1:].strip()
+        elif line.startswith('-A ') and table:
+            chain = line.split(None, 2)[1]
+            lines.setdefault((table, chain), []).append(line)
+
+    ret = {}
+    for (table, chain), chain_lines in lines.items():
+        rules = _Chain(chain)._parse_list_rules('\n'.join(chain_lines))
+        ret[(table, chain)] = map(_canonical, rules)
+    return ret
+
+
+def _quote(arg):
+    if not arg or re.search(r'[\s"\']', arg):
+        return '"%s"' % arg.replace('"', '\\"')
+    return arg
+
+
+def _restore(commands):
+    """
+    Applies [(table, command, rule), ...] like ('filter', ['--insert', 'INPUT', 1],
+    {...}) with one iptables-restore --noflush, each table is committed atomically.
+    """
+    tables = OrderedDict()
+    for table, command, rule in commands:
+        rule = OrderedDict(rule)
+        rule.pop('table', None)
+        args = map(str, command) + _build_args(rule)
+        line = ' '.join(_quote(arg) for arg in args)
+        tables.setdefault(table, []).append(line)
+    script = ''.join('*%s\n%s\nCOMMIT\n' % (table, '\n'.join(lines))
+                     for table, lines in tables.items())
+    LOG.debug('Applying %d iptables rule changes', len(commands))
+    linux.system(linux.build_cmd_args(executable=IPTABLES_RESTORE,
+            long={'noflush': True}), stdin=script)
+
+
 def ensure(chain_rules, append=False):
     # {chain: [rule, ...]}
+    """
+    Inserts missing rules on top of chains (or appends them) keeping given
+    order. Rules are compared against one iptables-save snapshot and all
+    missing ones are applied with one iptables-restore call.
+    """
+    snapshot = _snapshot()
+    commands = []
+    for chain, rules in chain_rules.iteritems():
+        for rule in (rules if append else reversed(rules)):
+            table = rule.get('table') or 'filter'
+            existing = snapshot.setdefault((table, chain), [])
+            inner = _canonical(rule)
+            if inner in existing:
+                continue
+            if append:
+                command = ['--append', chain]
+                existing.append(inner)
+            else:
+                command = ['--insert', chain, 1]
+                existing.insert(0, inner)
+            commands.append((table, command, rule))
+    if commands:
+        _restore(commands)
+
+
+def discard(chain_rules):
+    # {chain: [rule, ...]}
+    """
+    Deletes rules that exist, all at once like ensure() does.
+    """
+    snapshot = _snapshot()
+    commands = []
     for chain, rules in chain_rules.iteritems():
-        chains[chain].ensure(rules, append)
+        for rule in rules:
+            table = rule.get('table') or 'filter'
+            existing = snapshot.get((table, chain), [])
+            inner = _canonical(rule)
+            if inner not in existing:
+                continue
+            existing.remove(inner)
+            commands.append((table, ['--delete', chain], rule))
+    if commands:
+        _restore(commands)
 
 
 def enabled():
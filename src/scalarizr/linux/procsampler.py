@@ -0,0 +1,273 @@
+from __future__ import with_statement
+'''
+Background sampler of /proc counters.
+
+Every tick /proc/stat, /proc/meminfo, /proc/loadavg, /proc/diskstats and
+/proc/net/dev are read once into fixed size ring buffers, so that
+snapshot() returns rates and percentiles for any window kept in history
+without touching /proc.
+'''
+import array
+import logging
+import threading
+import time
+
+
+LOG = logging.getLogger(__name__)
+
+
+CPU_FIELDS = ('user', 'nice', 'system', 'idle', 'iowait', 'irq', 'softirq', 'steal')
+MEM_FIELDS = (
+    ('total_real', 'MemTotal'),
+    ('total_free', 'MemFree'),
+    ('buffer', 'Buffers'),
+    ('cached', 'Cached'),
+    ('shared', 'Shmem'),
+    ('total_swap', 'SwapTotal'),
+    ('avail_swap', 'SwapFree')
+)
+LA_FIELDS = ('la1', 'la5', 'la15')
+DISK_FIELDS = ('read_num', 'read_bytes', 'write_num', 'write_bytes')
+NET_FIELDS = ('receive_bytes', 'receive_packets', 'receive_errors',
+              'transmit_bytes', 'transmit_packets', 'transmit_errors')
+
+
+class RingBuffer(object):
+    '''
+    Last `capacity` samples of `width` float values each with their timestamps.
+    Values are kept in one flat array, no objects per sample
+    '''
+
+    def __init__(self, capacity, width):
+        self.capacity = capacity
+        self.width = width
+        self.times = array.array('d', [0.0]) * capacity
+        self.values = array.array('d', [0.0]) * (capacity * width)
+        self.count = 0
+
+    def append(self, timestamp, values):
+        pos = self.count % self.capacity
+        self.times[pos] = timestamp
+        self.values[pos * self.width:(pos + 1) * self.width] = array.array('d', values)
+        self.count += 1
+
+    def window(self, since=None):
+        '''
+        @return: (times, rows) of samples taken after `since` preceded by the
+        last sample taken before it, so that rates cover the whole window
+        '''
+        first = max(0, self.count - self.capacity)
+        if since is not None:
+            # binary search over samples ordered by time
+            lo, hi = first, self.count
+            while lo < hi:
+                mid = (lo + hi) / 2
+                if self.times[mid % self.capacity] <= since:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            first = max(first, lo - 1)
+        times, rows = [], []
+        for n in xrange(first, self.count):
+            pos = n % self.capacity
+            times.append(self.times[pos])
+            rows.append(self.values[pos * self.width:(pos + 1) * self.width])
+        return times, rows
+
+
+def percentile(sorted_values, pct):
+    # nearest rank
+    if not sorted_values:
+        return None
+    rank = int(round(pct / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[rank]
+
+
+def summary(values, last=None):
+    '''
+    @return: dict(last, avg, min, p50, p95, max)
+    '''
+    if not values:
+        return None
+    ordered = sorted(values)
+    return {
+        'last': values[-1] if last is None else last,
+        'avg': sum(values) / len(values),
+        'min': ordered[0],
+        'p50': percentile(ordered, 50),
+        'p95': percentile(ordered, 95),
+        'max': ordered[-1]
+    }
+
+
+def gauges(times, rows, fields):
+    if not rows:
+        return None
+    return dict((name, summary([row[i] for row in rows]))
+                for i, name in enumerate(fields))
+
+
+def rates(times, rows, fields):
+    '''
+    Per second rates between consecutive samples. `last` is the current counter
+    '''
+    ret = {}
+    for i, name in enumerate(fields):
+        values = []
+        for n in xrange(1, len(rows)):
+            elapsed = times[n] - times[n - 1]
+            delta = rows[n][i] - rows[n - 1][i]
+            if elapsed > 0 and delta >= 0:
+                # counter reset or wrap shows up as negative delta, skip it
+                values.append(delta / elapsed)
+        stats = summary(values, last=rows[-1][i]) if values else {'last': rows[-1][i]}
+        ret[name] = stats
+    return ret
+
+
+def cpu_percents(times, rows, fields):
+    # Share of every CPU state in jiffies spent between consecutive samples
+    if len(rows) < 2:
+        return None
+    values = dict((name, []) for name in fields)
+    for n in xrange(1, len(rows)):
+        deltas = [max(0.0, rows[n][i] - rows[n - 1][i]) for i in range(len(fields))]
+        total = sum(deltas)
+        if not total:
+            continue
+        for i, name in enumerate(fields):
+            values[name].append(deltas[i] * 100 / total)
+    if not values[fields[0]]:
+        return None
+    return dict((name, summary(values[name])) for name in fields)
+
+
+class ProcSampler(object):
+    '''
+    Samples /proc counters every `interval` seconds into ring buffers that
+    keep `capacity` samples (one hour by default)
+    '''
+
+    proc_path = '/proc'
+
+    def __init__(self, interval=5, capacity=720):
+        self.interval = interval
+        self.capacity = capacity
+        self.cpu = RingBuffer(capacity, len(CPU_FIELDS))
+        self.mem = RingBuffer(capacity, len(MEM_FIELDS))
+        self.load_average = RingBuffer(capacity, len(LA_FIELDS))
+        self.disk = {}
+        self.net = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread:
+                return
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name='/proc sampler')
+            self._thread.setDaemon(True)
+        try:
+            self.sample()
+        except:
+            self._thread = None
+            raise
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        thread, self._thread = self._thread, None
+        if thread:
+            thread.join()
+
+    @property
+    def running(self):
+        return bool(self._thread)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval) and not self._stopped.isSet():
+            try:
+                self.sample()
+            except:
+                LOG.warn('Failed to sample /proc', exc_info=True)
+
+    def _read(self, name):
+        with open('%s/%s' % (self.proc_path, name)) as fp:
+            return fp.read()
+
+    def sample(self, timestamp=None):
+        '''
+        Reads /proc files once and appends values to history
+        '''
+        cpu = self._read('stat').split('\n', 1)[0].split()[1:len(CPU_FIELDS) + 1]
+        cpu += ['0'] * (len(CPU_FIELDS) - len(cpu))
+
+        meminfo = {}
+        for line in self._read('meminfo').splitlines():
+            key, _, value = line.partition(':')
+            meminfo[key] = value.split(None, 1)[0] if value.strip() else '0'
+        mem = [meminfo.get(key, 0) for _, key in MEM_FIELDS]
+
+        la = self._read('loadavg').split()[:3]
+
+        disks = {}
+        for line in self._read('diskstats').splitlines():
+            cols = line.split()
+            if len(cols) >= 14:
+                # reads, sectors read, writes, sectors written
+                disks[cols[2]] = (cols[3], int(cols[5]) * 512, cols[7], int(cols[9]) * 512)
+            elif len(cols) == 7:
+                # partition line of 2.6 kernels
+                disks[cols[2]] = (cols[3], int(cols[4]) * 512, cols[5], int(cols[6]) * 512)
+
+        ifaces = {}
+        for line in self._read('net/dev').splitlines()[2:]:
+            iface, _, counters = line.partition(':')
+            cols = counters.split()
+            ifaces[iface.strip()] = (cols[0], cols[1], cols[2], cols[8], cols[9], cols[10])
+
+        timestamp = timestamp or time.time()
+        with self._lock:
+            self.cpu.append(timestamp, map(float, cpu))
+            self.mem.append(timestamp, map(float, mem))
+            self.load_average.append(timestamp, map(float, la))
+            for history, current, width in ((self.disk, disks, len(DISK_FIELDS)),
+                                            (self.net, ifaces, len(NET_FIELDS))):
+                for name, values in current.iteritems():
+                    if name not in history:
+                        history[name] = RingBuffer(self.capacity, width)
+                    history[name].append(timestamp, map(float, values))
+                for name in history.keys():
+                    if name not in current:
+                        # device is gone
+                        del history[name]
+
+    def snapshot(self, since=None):
+        '''
+        @param since: Unix time, whole history by default
+        @return: dict with `time` of the last sample, `since` time of the first
+        one in the window, number of `samples` and summaries (last, avg, min,
+        p50, p95, max) of: cpu states in percent, load_average, mem in kB,
+        per second disk and net rates (last there is the raw counter)
+        '''
+        with self._lock:
+            times, rows = self.cpu.window(since)
+            if not times:
+                return {'time': None, 'since': None, 'samples': 0}
+            ret = {
+                'time': times[-1],
+                'since': times[0],
+                'samples': len(times),
+                'cpu': cpu_percents(times, rows, CPU_FIELDS),
+                'mem': gauges(*(self.mem.window(since) + ([name for name, _ in MEM_FIELDS], ))),
+                'load_average': gauges(*(self.load_average.window(since) + (LA_FIELDS, ))),
+                'disk': {},
+                'net': {}
+            }
+            for key, history, fields in (('disk', self.disk, DISK_FIELDS),
+                                         ('net', self.net, NET_FIELDS)):
+                for name, ring in history.iteritems():
+                    ret[key][name] = rates(*(ring.window(since) + (fields, )))
+        return ret
@@ -191,7 +191,7 @@ class MessageProducer(Observable):
                 "send_error"
         )
 
-    def send(self, queue, message):
+    def send(self, queue, message, sync=None):
         pass
 
     def shutdown(self):
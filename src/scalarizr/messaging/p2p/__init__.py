@@ -77,14 +77,133 @@ class P2pMessageService(MessageService):
         p.filters['protocol'].append(self._security.out_protocol_filter)
         return p
 
-    def send(self, name, body=None, meta=None, queue=None):
+    def send(self, name, body=None, meta=None, queue=None, sync=None):
         msg = self.new_message(name, meta, body)
-        self.get_producer().send(queue or Queues.CONTROL, msg)
+        self.get_producer().send(queue or Queues.CONTROL, msg, sync=sync)
 
 
 def new_service(**kwargs):
     return P2pMessageService(**kwargs)
 
+class _WriteOp(object):
+    __slots__ = ('statements', 'sync', 'done', 'error')
+
+    def __init__(self, statements, sync):
+        self.statements = statements
+        self.sync = sync
+        self.done = threading.Event()
+        self.error = None
+
+    def wait(self):
+        self.done.wait()
+        if self.error:
+            raise self.error[0], self.error[1], self.error[2]
+
+
+class GroupCommitWriter(object):
+    """
+    Coalesces database mutations and commits them in a single transaction.
+    Asynchronous operations are collected during `window` seconds
+    (or until `batch_size` operations are queued), synchronous operation
+    flushes the queue immediately together with all pending ones.
+    Operations are applied in submission order.
+    """
+
+    window = 0.05
+    batch_size = 200
+
+    def __init__(self, conn_fn, window=None, batch_size=None):
+        self._conn_fn = conn_fn
+        if window is not None:
+            self.window = window
+        if batch_size is not None:
+            self.batch_size = batch_size
+        self._queue = []
+        self._inflight = 0
+        self._cond = threading.Condition()
+        self._thread = None
+        self.commits = 0
+        self.ops = 0
+
+
+    def submit(self, statements, sync=False):
+        """
+        @param statements: [(sql, parameters), ...]
+        @param sync: Block until statements are committed
+        """
+        op = _WriteOp(statements, sync)
+        with self._cond:
+            if not self._thread or not self._thread.isAlive():
+                self._thread = threading.Thread(target=self._run, name='P2pMessageStoreWriter')
+                self._thread.setDaemon(True)
+                self._thread.start()
+            self._queue.append(op)
+            self._cond.notifyAll()
+        if sync:
+            op.wait()
+
+
+    def flush(self):
+        """
+        Block until all submitted operations are committed
+        """
+        with self._cond:
+            if not self._queue and not self._inflight:
+                return
+        op = _WriteOp([], True)
+        with self._cond:
+            self._queue.append(op)
+            self._cond.notifyAll()
+        op.done.wait()
+
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                deadline = time.time() + self.window
+                while len(self._queue) < self.batch_size \
+                        and not any(op.sync for op in self._queue):
+                    timeout = deadline - time.time()
+                    if timeout <= 0:
+                        break
+                    self._cond.wait(timeout)
+                batch = self._queue[:self.batch_size]
+                del self._queue[:self.batch_size]
+                self._inflight = len(batch)
+            try:
+                self._commit(batch)
+            finally:
+                with self._cond:
+                    self._inflight = 0
+
+
+    def _commit(self, batch):
+        statements = []
+        for op in batch:
+            statements.extend(op.statements)
+        try:
+            if statements:
+                self._conn_fn().executebatch(statements)
+                self.commits += 1
+        except:
+            LOG.debug('Batch of %d operations failed, applying them one by one',
+                      len(batch), exc_info=sys.exc_info())
+            for op in batch:
+                try:
+                    if op.statements:
+                        self._conn_fn().executebatch(op.statements)
+                        self.commits += 1
+                except:
+                    op.error = sys.exc_info()
+                    if not op.sync:
+                        LOG.warning('Failed to write messages store', exc_info=op.error)
+        self.ops += len(batch)
+        for op in batch:
+            op.done.set()
+
+
 class _P2pMessageStore:
     _logger = None
 
@@ -93,6 +212,9 @@ class _P2pMessageStore:
     def __init__(self):
         self._logger = logging.getLogger(__name__)
         self._local_storage_lock = threading.Lock()
+        self._ingoing_cond = threading.Condition(self._local_storage_lock)
+        self._ingoing_seq = 0
+        self._writer = GroupCommitWriter(self._conn)
         ex = bus.periodical_executor
         if ex:
             self._logger.debug('Add rotate messages table task for periodical executor')
@@ -109,7 +231,15 @@ class _P2pMessageStore:
         return self._unhandled
 
 
+    def flush(self):
+        """
+        Block until all pending writes are committed
+        """
+        self._writer.flush()
+
+
     def rotate(self):
+        self.flush()
         conn = self._conn()
         cur = conn.cursor()
         cur.execute('SELECT * FROM p2p_message ORDER BY id DESC LIMIT %d, 1' % self.TAIL_LENGTH)
@@ -121,43 +251,72 @@ class _P2pMessageStore:
 
     def put_ingoing(self, message, queue, consumer_id):
         with self._local_storage_lock:
+            # Load pending messages before INSERT, otherwise this one will be loaded twice
+            self._unhandled_messages
+
+        sql = 'INSERT INTO p2p_message (id, message, message_id, ' \
+                'message_name, queue, is_ingoing, in_is_handled, in_consumer_id, format) ' \
+                'VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?)'
+        statements = [(sql, [message.tojson().decode('utf-8'), message.id, message.name,
+                            queue, 1, 0, consumer_id, 'json'])]
+        if message.meta.has_key(MetaOptions.REQUEST_ID):
+            statements.append(("""UPDATE p2p_message
+                            SET response_id = ? WHERE message_id = ?""",
+                    [message.id, message.meta[MetaOptions.REQUEST_ID]]))
+
+        # Message should be durable before we answer to Scalr
+        self._logger.debug("Commiting put_ingoing")
+        self._writer.submit(statements, sync=True)
+        self._logger.debug("Commited put_ingoing")
+
+        with self._local_storage_lock:
+            # Message is persisted, hand it over to the waiting handler.
+            # List is read again: it could be replaced while the lock was released
             self._unhandled_messages.append((queue, message))
+            self._ingoing_seq += 1
+            self._ingoing_cond.notifyAll()
 
-            conn = self._conn()
-            cur = conn.cursor()
-            try:
-                sql = 'INSERT INTO p2p_message (id, message, message_id, ' \
-                        'message_name, queue, is_ingoing, in_is_handled, in_consumer_id, format) ' \
-                        'VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?)'
-
-                #self._logger.debug('Representation mes: %s', repr(str(message)))
-                cur.execute(sql, [message.tojson().decode('utf-8'), message.id, message.name, queue, 1, 0, consumer_id, 'json'])
-                '''
-                cur.execute(sql, [str(message), message.id.decode('utf-8'),
-                                message.name.decode('utf-8'), queue.encode('utf-8'), 1, 0,
-                                consumer_id.encode('utf-8')])
-                '''
-                if message.meta.has_key(MetaOptions.REQUEST_ID):
-                    cur.execute("""UPDATE p2p_message
-                                    SET response_uuid = ? WHERE message_id = ?""",
-                            [message.id, message.meta[MetaOptions.REQUEST_ID]])
-
-                self._logger.debug("Commiting put_ingoing")
-                conn.commit()
-                self._logger.debug("Commited put_ingoing")
-            finally:
-                cur.close()
+
+    @property
+    def ingoing_seq(self):
+        """
+        Counter of ingoing messages events.
+        Read it before scanning get_unhandled() and pass to wait_ingoing()
+        to not miss a message that arrives during the scan
+        """
+        return self._ingoing_seq
 
 
-    def get_unhandled(self, consumer_id):
+    def wait_ingoing(self, seq, timeout=None):
+        """
+        Block until new message is put into store (or wakeup() is called)
+        since ingoing_seq was equal to `seq`
+        @return: current ingoing_seq
+        """
         with self._local_storage_lock:
-            ret = []
-            for queue, message in self._unhandled_messages:
-                msg_copy = P2pMessage()
-                msg_copy.fromjson(message.tojson())
-                ret.append((queue, msg_copy))
+            if self._ingoing_seq == seq:
+                self._ingoing_cond.wait(timeout)
+            return self._ingoing_seq
 
-            return ret
+
+    def wakeup(self):
+        """
+        Wake up threads blocked in wait_ingoing()
+        """
+        with self._local_storage_lock:
+            self._ingoing_seq += 1
+            self._ingoing_cond.notifyAll()
+
+
+    def get_unhandled(self, consumer_id):
+        """
+        Return list of unhandled messages in obtaining order.
+        Messages are not copied: the list is a snapshot, but items are
+        the same objects that were passed to put_ingoing()
+        @return: [(queue, message), ...]
+        """
+        with self._local_storage_lock:
+            return list(self._unhandled_messages)
 
 
     def _get_unhandled_from_db(self):
@@ -165,16 +324,19 @@ class _P2pMessageStore:
         Return list of unhandled messages in obtaining order
         @return: [(queue, message), ...]
         """
+        self.flush()
         cur = self._conn().cursor()
         try:
-            sql = 'SELECT queue, message_id FROM p2p_message ' \
+            sql = 'SELECT queue, message, format FROM p2p_message ' \
                 'WHERE is_ingoing = ? AND in_is_handled = ? ' \
                 'ORDER BY id'
             cur.execute(sql, [1, 0])
 
             ret = []
             for r in cur.fetchall():
-                ret.append((r["queue"], self.load(r["message_id"], True)))
+                message = P2pMessage()
+                self._unmarshall(message, r)
+                ret.append((r["queue"], message))
             return ret
         finally:
             cur.close()
@@ -182,64 +344,63 @@ class _P2pMessageStore:
 
     def mark_as_handled(self, message_id):
         with self._local_storage_lock:
+            msg = None
+            for _, message in self._unhandled_messages:
+                if message.id == message_id:
+                    msg = message
+                    break
             filter_fn = lambda x: x[1].id != message_id
-            self._unhandled = filter(filter_fn, self._unhandled_messages)
+            # In place, so that nobody keeps a reference to a stale list
+            self._unhandled_messages[:] = filter(filter_fn, self._unhandled_messages)
 
-        for _ in xrange(0, 5):
+        if msg is None:
             try:
                 msg = self.load(message_id, True)
-                break
             except:
-                self._logger.debug('Failed to load message %s', message_id, exc_info=sys.exc_info())
-                time.sleep(1)
-        else:
-            self._logger.debug("Cant load message in several attempts, assume it doesn't exists. Leaving")
-            return
-
+                self._logger.debug("Cant load message %s, assume it doesn't exists. Leaving",
+                                   message_id, exc_info=sys.exc_info())
+                return
 
         if 'platform_access_data' in msg.body:
-            del msg.body['platform_access_data']
-        msg_s = msg.tojson().decode('utf-8')
-
-        conn = self._conn()
-        cur = conn.cursor()
-        try:
-            sql = 'UPDATE p2p_message SET in_is_handled = ?, message = ?, out_last_attempt_time = datetime("now")' \
+            # Don't keep cloud credentials on disk
+            body = msg.body.copy()
+            del body['platform_access_data']
+            msg_copy = P2pMessage(msg.name, msg.meta.copy(), body)
+            msg_copy.id = msg.id
+            sql = 'UPDATE p2p_message SET in_is_handled = ?, message = ?, out_last_attempt_time = datetime("now") ' \
                 'WHERE message_id = ? AND is_ingoing = ?'
-            cur.execute(sql, [1, msg_s, message_id, 1])
-            conn.commit()
-        finally:
-            cur.close()
+            params = [1, msg_copy.tojson().decode('utf-8'), message_id, 1]
+        else:
+            sql = 'UPDATE p2p_message SET in_is_handled = ?, out_last_attempt_time = datetime("now") ' \
+                'WHERE message_id = ? AND is_ingoing = ?'
+            params = [1, message_id, 1]
+        self._writer.submit([(sql, params)])
 
 
     def put_outgoing(self, message, queue, sender):
-        conn = self._conn()
-        cur = conn.cursor()
-        try:
-            sql = 'INSERT INTO p2p_message (id, message, message_id, message_name, queue, ' \
-                        'is_ingoing, out_is_delivered, out_delivery_attempts, out_sender, format) ' \
-                    'VALUES ' \
-                    '(NULL, ?, ?, ?, ?, ?, ?, ?, ?, ?)'
-
-            cur.execute(sql, [message.tojson().decode('utf-8'), message.id,
-                                              message.name, queue, 0, 0, 0, sender, 'json'])
-            conn.commit()
-        finally:
-            cur.close()
+        sql = 'INSERT INTO p2p_message (id, message, message_id, message_name, queue, ' \
+                    'is_ingoing, out_is_delivered, out_delivery_attempts, out_sender, format) ' \
+                'VALUES ' \
+                '(NULL, ?, ?, ?, ?, ?, ?, ?, ?, ?)'
+        self._writer.submit([(sql, [message.tojson().decode('utf-8'), message.id,
+                                    message.name, queue, 0, 0, 0, sender, 'json'])])
 
 
     def get_undelivered(self, sender):
         """
         Return list of undelivered messages in outgoing order
         """
+        self.flush()
         cur = self._conn().cursor()
         try:
-            sql = 'SELECT queue, message_id FROM p2p_message ' \
+            sql = 'SELECT queue, message, format FROM p2p_message ' \
                     'WHERE is_ingoing = ? AND out_is_delivered = ? AND out_sender = ? ORDER BY id'
             cur.execute(sql, [0, 0, sender])
             ret = []
             for r in cur.fetchall():
-                ret.append((r[0], self.load(r[1], False)))
+                message = P2pMessage()
+                self._unmarshall(message, r)
+                ret.append((r["queue"], message))
             return ret
         finally:
             cur.close()
@@ -252,18 +413,13 @@ class _P2pMessageStore:
         return self._mark_as_delivered(message_id, 0)
 
     def _mark_as_delivered (self, message_id, delivered):
-        conn = self._conn()
-        cur = conn.cursor()
-        try:
-            sql = 'UPDATE p2p_message SET out_delivery_attempts = out_delivery_attempts + 1, ' \
-                        'out_last_attempt_time = datetime("now"), out_is_delivered = ? ' \
-                    'WHERE message_id = ? AND is_ingoing = ?'
-            cur.execute(sql, [int(bool(delivered)), message_id, 0])
-            conn.commit()
-        finally:
-            cur.close()
+        sql = 'UPDATE p2p_message SET out_delivery_attempts = out_delivery_attempts + 1, ' \
+                    'out_last_attempt_time = datetime("now"), out_is_delivered = ? ' \
+                'WHERE message_id = ? AND is_ingoing = ?'
+        self._writer.submit([(sql, [int(bool(delivered)), message_id, 0])])
 
     def load(self, message_id, is_ingoing):
+        self.flush()
         cur = self._conn().cursor()
         try:
             cur.execute('SELECT * FROM p2p_message ' \
@@ -287,6 +443,7 @@ class _P2pMessageStore:
 
 
     def is_delivered(self, message_id):
+        self.flush()
         cur = self._conn().cursor()
         try:
             cur.execute('SELECT is_delivered FROM p2p_message ' \
@@ -297,6 +454,7 @@ class _P2pMessageStore:
             cur.close()
 
     def is_response_received(self, message_id):
+        self.flush()
         cur = self._conn().cursor()
         try:
             sql = 'SELECT response_id FROM p2p_message ' \
@@ -307,6 +465,7 @@ class _P2pMessageStore:
             cur.close()
 
     def get_response(self, message_id):
+        self.flush()
         cur = self._conn().cursor()
         try:
             cur.execute('SELECT response_id FROM p2p_message ' \
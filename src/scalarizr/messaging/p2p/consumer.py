@@ -38,6 +38,11 @@ class P2pMessageConsumer(MessageConsumer):
     handler_locked = False
     handler_status = 'stopped'
     handing_message_id = None
+    idle_timeout = 1.0
+    '''
+    @cvar idle_timeout: Max seconds message handler sleeps without ingoing messages.
+    Handler is woken up by P2pMessageStore.put_ingoing(), this is only a safety net
+    '''
 
     def __init__(self, endpoint=None, msg_handler_enabled=True):
         MessageConsumer.__init__(self)
@@ -162,7 +167,6 @@ class P2pMessageConsumer(MessageConsumer):
                 try:
                     store = P2pMessageStore()
                     store.put_ingoing(message, queue, self.consumer.endpoint)
-                    #self.consumer._not_empty.set()
                 except (BaseException, Exception), e:
                     logger.exception(e)
                     self.send_response(500, str(e))
@@ -197,15 +201,17 @@ class P2pMessageConsumer(MessageConsumer):
 
         self._logger.debug("Shutdown message handler")
         self.handler_locked = True
+        P2pMessageStore().wakeup()
         if not force:
             t = 120
             self._logger.debug('Waiting for message handler to complete it`s task. Timeout: %d seconds', t)
             wait_until(lambda: self.handler_status in ('idle', 'stopped'),
                             timeout=t, error_text='Message consumer is busy', logger=self._logger)
 
+        store = P2pMessageStore()
         if self.handing_message_id:
-            store = P2pMessageStore()
             store.mark_as_handled(self.handing_message_id)
+        store.flush()
 
         if self._handler_thread:
             self._handler_thread.join()
@@ -235,6 +241,7 @@ class P2pMessageConsumer(MessageConsumer):
         self.message_to_ack = message
         self.return_on_ack = False
         self.ack_event.clear()
+        P2pMessageStore().wakeup()
         self._logger.debug('Waiting message acknowledge event: %s', message.name)
         self.ack_event.wait()
         self._logger.debug('Fired message acknowledge event: %s', message.name)
@@ -270,6 +277,9 @@ class P2pMessageConsumer(MessageConsumer):
         self._logger.debug('Starting message handler')
 
         while self.running:
+            # Remember ingoing counter before the scan,
+            # so message that arrives while we are busy will wake us immediately
+            seq = store.ingoing_seq
             if not self.handler_locked:
                 try:
                     if self.message_to_ack:
@@ -290,7 +300,7 @@ class P2pMessageConsumer(MessageConsumer):
                                 if self.return_on_ack:
                                     return
                                 break
-                        time.sleep(0.1)
+                        store.wait_ingoing(seq, self.idle_timeout)
                         continue
 
                     for queue, message in store.get_unhandled(self.endpoint):
@@ -298,7 +308,7 @@ class P2pMessageConsumer(MessageConsumer):
 
                 except (BaseException, Exception), e:
                     self._logger.exception(e)
-            time.sleep(0.1)
+            store.wait_ingoing(seq, self.idle_timeout)
 
         self.handler_status = 'stopped'
         self._logger.debug('Message handler stopped')
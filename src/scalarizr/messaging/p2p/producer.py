@@ -22,7 +22,22 @@ from scalarizr.node import __node__
 from scalarizr.messaging.p2p import P2pMessage
 
 
+class _SyncDelivery(object):
+    '''
+    Sync message in async queue: sender waits for done, error is set
+    when message wasn't delivered and producer doesn't retry
+    '''
+    def __init__(self):
+        self.done = threading.Event()
+        self.error = None
+
+
 class P2pMessageProducer(messaging.MessageProducer):
+    '''
+    When async delivery is started, sync and async messages are delivered
+    through the same ordered queue, so message is never delivered before
+    the one sent earlier. Sync send() blocks until its message is delivered
+    '''
     endpoint = None
     retries_progression = None
     no_retry = False
@@ -31,6 +46,14 @@ class P2pMessageProducer(messaging.MessageProducer):
     _logger = None
     _stop_delivery = None
 
+    async_messages = ('Log', 'OperationDefinition', 'OperationProgress',
+                      'OperationResult', 'RebundleLog', 'DeployLog')
+    '''
+    @cvar async_messages: Fire-and-forget messages, delivered by background worker
+    when it's started with start_async_delivery()
+    '''
+    async_batch_size = 50
+
     def __init__(self, endpoint=None, retries_progression=None):
         messaging.MessageProducer.__init__(self)
         self.endpoint = endpoint
@@ -45,11 +68,68 @@ class P2pMessageProducer(messaging.MessageProducer):
 
         self._local = threading.local()
         self._local_defaults = dict(interval=None, next_retry_index=0, delivered=False)
+        self.transport = urltool.HTTPConnectionPool()
+        '''
+        @ivar transport: Keep-alive connections to endpoint. See transport.stats for reuse counters
+        '''
+
+        self._async_queue = []
+        self._async_cond = threading.Condition()
+        self._async_worker = None
 
     def shutdown(self):
         self._stop_delivery.set()
-
-    def send(self, queue, message):
+        with self._async_cond:
+            self._async_cond.notifyAll()
+        self.transport.close()
+
+    def start_async_delivery(self):
+        '''
+        Start background worker that delivers async messages in order.
+        Async messages that were not delivered by previous run are queued first
+        '''
+        with self._async_cond:
+            if self._async_worker:
+                return
+            for queue, message in self._store.get_undelivered(self.sender):
+                if message.name in self.async_messages:
+                    self._async_queue.append((queue, message, None))
+            if self._async_queue:
+                self._logger.debug('Queued %d undelivered messages', len(self._async_queue))
+            self._async_worker = threading.Thread(target=self._deliver_async,
+                                                  name='MessageDelivery')
+            self._async_worker.setDaemon(True)
+            self._async_worker.start()
+
+    @property
+    def pending(self):
+        '''
+        Number of messages waiting for delivery
+        '''
+        return len(self._async_queue)
+
+    def flush(self, timeout=None):
+        '''
+        Wait until all queued messages are delivered
+        @return: True if queue is empty
+        '''
+        deadline = timeout and time.time() + timeout
+        with self._async_cond:
+            while self._async_queue and self._async_worker:
+                if deadline:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self._async_cond.wait(remaining)
+                else:
+                    self._async_cond.wait(1)
+            return not self._async_queue
+
+    def send(self, queue, message, sync=None):
+        '''
+        @param sync: Block until message is delivered.
+        By default only async_messages are sent asynchronously (when async delivery is started)
+        '''
         self._logger.debug("Sending message '%s' into queue '%s'", message.name, queue)
 
         if message.id is None:
@@ -57,6 +137,29 @@ class P2pMessageProducer(messaging.MessageProducer):
         self.fire("before_send", queue, message)
         self._store.put_outgoing(message, queue, self.sender)
 
+        if sync is None:
+            sync = message.name not in self.async_messages
+        if self._async_worker and threading.currentThread() is not self._async_worker:
+            waiter = _SyncDelivery() if sync else None
+            with self._async_cond:
+                self._async_queue.append((queue, message, waiter))
+                self._async_cond.notifyAll()
+            if not waiter:
+                return
+            while not waiter.done.isSet() and not self._stop_delivery.isSet():
+                waiter.done.wait(1)
+            if not waiter.done.isSet():
+                # Worker is stopped, deliver message in this thread
+                self._async_worker.join()
+                with self._async_cond:
+                    entry = (queue, message, waiter)
+                    if entry in self._async_queue:
+                        self._async_queue.remove(entry)
+            if waiter.done.isSet():
+                if waiter.error:
+                    raise waiter.error
+                return
+
         if not self.no_retry:
             if not hasattr(self._local, "interval"):
                 for k, v in self._local_defaults.items():
@@ -82,6 +185,50 @@ class P2pMessageProducer(messaging.MessageProducer):
             self._send0(queue, message, self._delivered_cb, self._undelivered_cb_raises)
 
 
+    def _deliver_async(self):
+        next_retry_index = 0
+        while not self._stop_delivery.isSet():
+            with self._async_cond:
+                while not self._async_queue and not self._stop_delivery.isSet():
+                    self._async_cond.wait(1)
+                batch = self._async_queue[:self.async_batch_size]
+
+            # Deliver batch over the same keep-alive connection, stop on first failure
+            # to preserve messages order
+            delivered = []
+            errors = []
+            for queue, message, waiter in batch:
+                if self._stop_delivery.isSet():
+                    break
+                self._send0(queue, message,
+                            lambda queue, message: delivered.append(message),
+                            lambda queue, message, ex: errors.append(ex))
+                if not delivered or delivered[-1] is not message:
+                    break
+                if waiter:
+                    waiter.done.set()
+
+            with self._async_cond:
+                del self._async_queue[:len(delivered)]
+                if len(delivered) < len(batch) and self.no_retry \
+                        and not self._stop_delivery.isSet():
+                    # Async message is left undelivered in store,
+                    # sync one's sender raises error
+                    waiter = self._async_queue.pop(0)[2]
+                    if waiter:
+                        waiter.error = errors[-1]
+                        waiter.done.set()
+                self._async_cond.notifyAll()
+
+            if len(delivered) < len(batch) and not self.no_retry:
+                interval = int(self.retries_progression[next_retry_index]) * 60.0
+                if next_retry_index < len(self.retries_progression) - 1:
+                    next_retry_index += 1
+                self._logger.debug("Sleep %d seconds before next attempt", interval)
+                self._stop_delivery.wait(interval)
+            elif delivered:
+                next_retry_index = 0
+
     def _undelivered_cb_raises(self, queue, message, ex):
         raise ex
 
@@ -123,9 +270,7 @@ class P2pMessageProducer(messaging.MessageProducer):
                 data = f(self, queue, data, headers)
 
             url = self.endpoint + "/" + queue
-            req = urllib2.Request(url, data, headers)
-            opener = urllib2.build_opener(urltool.HTTPRedirectHandler())
-            opener.open(req)
+            self.transport.request('POST', url, data, headers)
 
             self._message_delivered(queue, message, success_callback)
 
@@ -23,6 +23,19 @@ public_dir = base_dir + '/public.d'
 storage_dir = private_dir + '/storage'
 
 
+def _stat(filename):
+    '''
+    Returns (mtime, size, inode) of a file or None when it doesn't exist.
+    Stores compare it with the value they have parsed file at,
+    to reread file only when it was changed or replaced.
+    '''
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size, st.st_ino)
+
+
 class Store(object):
 
     def __repr__(self):
@@ -103,9 +116,11 @@ class Json(Store):
         self.filename = filename
         self.fn = fn
         self._obj = None
+        self._obj_stat = None
 
     def __getitem__(self, key):
-        if not self._obj:
+        stat = _stat(self.filename)
+        if not self._obj or (stat and stat != self._obj_stat):
             try:
                 with open(self.filename, 'r') as fp:
                     kwds = json.load(fp)
@@ -115,6 +130,7 @@ class Json(Store):
                 if isinstance(self.fn, basestring):
                     self.fn = _import(self.fn)
                 self._obj = self.fn(**kwds)
+                self._obj_stat = stat
         return self._obj
 
 
@@ -127,6 +143,7 @@ class Json(Store):
             os.makedirs(dirname)
         with open(self.filename, 'w+') as fp:
             json.dump(value, fp)
+        self._obj_stat = _stat(self.filename)
 
 
 class Ini(Store):
@@ -137,6 +154,7 @@ class Ini(Store):
         self.section = section
         self.ini = None
         self.mapping = mapping or {}
+        self._cache = None
 
 
     def _reload(self, only_last=False):
@@ -149,12 +167,26 @@ class Ini(Store):
                     self.ini.read(filename)
 
 
-    def __getitem__(self, key):
+    def _cached_ini(self):
+        '''
+        Returns parsed files. They are parsed again only when
+        some of them was changed, created or removed since the last time
+        '''
+        stats = [_stat(filename) for filename in self.filenames]
+        cache = self._cache
+        if cache and cache[0] == stats:
+            return cache[1]
         self._reload()
+        self._cache = (stats, self.ini)
+        return self.ini
+
+
+    def __getitem__(self, key):
+        ini = self._cached_ini()
         if key in self.mapping:
             key = self.mapping[key]
         try:
-            return self.ini.get(self.section, key)
+            return ini.get(self.section, key)
         except ConfigParser.Error:
             raise KeyError(key)
 
@@ -174,6 +206,11 @@ class Ini(Store):
         self.ini.set(self.section, key, value)
         with open(self.filenames[0], 'w+') as fp:
             self.ini.write(fp)
+        if len(self.filenames) == 1:
+            # Write-through: written parser is exactly what the file holds
+            self._cache = ([_stat(self.filenames[0])], self.ini)
+        else:
+            self._cache = None
 
 
 class RedisIni(Ini):
@@ -222,19 +259,28 @@ class IniOption(Ini):
 class File(Store):
     def __init__(self, filename):
         self.filename = filename
+        self._cache = None
 
 
     def __getitem__(self, key):
+        stat = _stat(self.filename)
+        cache = self._cache
+        if stat and cache and cache[0] == stat:
+            return cache[1]
         try:
             with open(self.filename) as fp:
-                return fp.read().strip()
+                value = fp.read().strip()
         except:
             raise KeyError(key)
+        self._cache = (stat, value)
+        return value
 
 
     def __setitem__(self, key, value):
+        value = str(value).strip()
         with open(self.filename, 'w+') as fp:
-            fp.write(str(value).strip())
+            fp.write(value)
+        self._cache = (_stat(self.filename), value)
 
 
 class BoolFile(Store):
@@ -4,13 +4,13 @@ Created on Dec 23, 2009
 
 @author: Dmytro Korsakov
 '''
-import binascii
 import logging
 import os
 import sys
 import urllib
 import urllib2
 import time
+import threading
 import HTMLParser
 from copy import deepcopy
 
@@ -31,6 +31,21 @@ class InvalidSignatureError(QueryEnvError):
     pass
 
 
+class _Call(object):
+    # Request in flight that identical concurrent requests wait for
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exc_info = None
+
+    def wait(self):
+        self.done.wait()
+        if self.exc_info:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self.result
+
+
 class QueryEnvService(object):
     _logger = None
 
@@ -39,6 +54,30 @@ class QueryEnvService(object):
     key_path = None
     server_id = None
 
+    cache_ttl = {
+        'list-roles': 10,
+        'list-global-variables': 30,
+        'list-farm-role-params': 30,
+        'get-scaling-metrics': 60
+    }
+    '''
+    Seconds responses of these commands are reused for.
+    Identical requests made while one is in flight wait for its response
+    '''
+
+    invalidate_on = {
+        'HostInit': ('list-roles', ),
+        'BeforeHostUp': ('list-roles', ),
+        'HostUp': ('list-roles', ),
+        'BeforeHostTerminate': ('list-roles', ),
+        'HostDown': ('list-roles', ),
+        'UpdateServiceConfiguration': ()
+    }
+    '''
+    Cached commands to forget when message comes, empty tuple means all of them.
+    See invalidate_for()
+    '''
+
     def _log_parsed_response(self, response):
         self._logger.debug("QueryEnv response (parsed): %s", response)
 
@@ -55,11 +94,80 @@ class QueryEnvService(object):
         self.api_version = api_version
         self.htmlparser = HTMLParser.HTMLParser()
         self.autoretry = autoretry
+        self.transport = urltool.HTTPConnectionPool()
+        '''
+        @ivar transport: Keep-alive connections to QueryEnv (through http_proxy/https_proxy
+        from environment, if set). See transport.stats for reuse counters
+        '''
+        self.stats = dict(hits=0, misses=0, coalesced=0)
+        '''
+        @ivar stats: Response cache counters. Coalesced are requests that waited
+        for identical one in flight
+        '''
+        self._cache = {}
+        self._calls = {}
+        self._generation = 0
+        self._cache_lock = threading.Lock()
+
+    def invalidate(self, *commands):
+        '''
+        Forget cached responses of commands, of all commands when called without arguments.
+        Requests in flight won't store their responses
+        '''
+        with self._cache_lock:
+            self._generation += 1
+            for table in (self._cache, self._calls):
+                for key in table.keys():
+                    if not commands or key[1] in commands:
+                        del table[key]
+
+    def invalidate_for(self, message_name):
+        '''
+        Forget responses message_name makes stale (farm has changed on HostUp,
+        configuration on UpdateServiceConfiguration, etc.)
+        '''
+        if message_name in self.invalidate_on:
+            self.invalidate(*self.invalidate_on[message_name])
 
     def fetch(self, command, params=None, log_response=True):
         """
         @return object
         """
+        ttl = self.cache_ttl.get(command)
+        if not ttl:
+            return self._fetch(command, params, log_response)
+
+        key = (self.api_version, command, tuple(sorted((params or {}).items())))
+        with self._cache_lock:
+            cached = self._cache.get(key)
+            if cached and cached[0] > time.time():
+                self.stats['hits'] += 1
+                return cached[1]
+            call = self._calls.get(key)
+            if call:
+                self.stats['coalesced'] += 1
+                leader = False
+            else:
+                self.stats['misses'] += 1
+                call = self._calls[key] = _Call()
+                generation = self._generation
+                leader = True
+        if not leader:
+            return call.wait()
+
+        try:
+            call.result = self._fetch(command, params, log_response)
+        except:
+            call.exc_info = sys.exc_info()
+        with self._cache_lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+            if not call.exc_info and generation == self._generation:
+                self._cache[key] = (time.time() + ttl, call.result)
+        call.done.set()
+        return call.wait()
+
+    def _fetch(self, command, params=None, log_response=True):
         # Perform HTTP request
         url = "%s/%s/%s" % (self.url, self.api_version, command)
         self._logger.debug('Call QueryEnv: %s', url)
@@ -70,9 +178,7 @@ class QueryEnvService(object):
             for key, value in params.items():
                 request_body[key] = value
 
-        file = open(self.key_path)
-        key = binascii.a2b_base64(file.read())
-        file.close()
+        key = cryptotool.read_key(self.key_path)
 
         signature, timestamp = cryptotool.sign_http_request(request_body, key)
 
@@ -80,7 +186,8 @@ class QueryEnvService(object):
         headers = {
             "Date": timestamp,
             "X-Signature": signature,
-            "X-Server-Id": self.server_id
+            "X-Server-Id": self.server_id,
+            "Content-Type": "application/x-www-form-urlencoded"
         }
         response = None
         wait_seconds = 30
@@ -88,9 +195,7 @@ class QueryEnvService(object):
         while True:
             try:
                 self._logger.debug("QueryEnv request: %s", post_data)
-                opener = urllib2.build_opener(urltool.HTTPRedirectHandler)
-                req = urllib2.Request(url, post_data, headers)
-                response = opener.open(req)
+                response = self.transport.request('POST', url, post_data, headers)
                 break
             except:
                 e = sys.exc_info()[1]
@@ -109,7 +214,7 @@ class QueryEnvService(object):
                 self._logger.warn('Sleep %s seconds before next attempt...', wait_seconds)
                 time.sleep(wait_seconds)
 
-        resp_body = response.read()
+        resp_body = response.data
         resp_body = self.htmlparser.unescape(resp_body)
         resp_body = resp_body.encode('utf-8')
 
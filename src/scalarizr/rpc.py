@@ -18,6 +18,7 @@ import urlparse
 import struct
 import socket
 import traceback
+import threading
 from threading import local
 import logging
 from copy import deepcopy
@@ -90,7 +91,14 @@ class InternalError(ServiceError):
 
 class RequestHandler(object):
 
-    def __init__(self, services):
+    batch_workers = 1
+    '''
+    Threads that run requests of a JSON-RPC batch, one by one by default
+    '''
+
+    def __init__(self, services, batch_workers=None):
+        if batch_workers:
+            self.batch_workers = batch_workers
         svs = None
         if not services:
             import __main__ as svs
@@ -125,47 +133,94 @@ class RequestHandler(object):
         LOG.exception('Caught exception')
 
     def handle_request(self, data, namespace=None):
+        """
+        Handles JSON-RPC request or a batch (list) of them.
+        @param data: JSON string or already parsed request
+        @return: JSON response, list of responses for a batch
+        """
+        try:
+            req = self._parse_request(data) if isinstance(data, basestring) else data
+        except ServiceError:
+            return self._encode_response('', None, self._error(sys.exc_info()))
+        if isinstance(req, list):
+            return self._handle_batch(req, namespace)
+        return self._encode_response(*self._handle(req, namespace))
+
+
+    def _handle(self, req, namespace):
         id, result, error = '', None, None
         log_it = False
         try:
-            req = self._parse_request(data) if isinstance(data, basestring) else data
             id, method, params = self._translate_request(req)
             svs = self._find_service(namespace)
             fn = self._find_method(svs, method)
             if fn._jsonrpc == 'command':
                 log_it = True
-                data_to_log = self._clear_request_data(data)
+                data_to_log = self._clear_request_data(req)
                 LOG.debug('request: %s', json.dumps(data_to_log))
             result = self._invoke_method(fn, params)
-            # important to test json serializarion before serialize the whole result
-            json.dumps(result)
-
-        except ServiceError, e:
-            error = {'code': e.code,
+        except:
+            error = self._error(sys.exc_info())
+        return id, result, error, log_it
+
+
+    def _handle_batch(self, reqs, namespace):
+        if not reqs:
+            return self._encode_response('', None, self._error((InvalidRequestError,
+                    InvalidRequestError('Empty batch'), None)))
+        resps = [None] * len(reqs)
+        indexes = iter(xrange(len(reqs)))
+        lock = threading.Lock()
+
+        def worker():
+            while True:
+                with lock:
+                    i = next(indexes, None)
+                if i is None:
+                    return
+                resps[i] = self._encode_response(*self._handle(reqs[i], namespace))
+
+        threads = [threading.Thread(target=worker, name='JSON-RPC batch %d' % num)
+                   for num in range(min(self.batch_workers, len(reqs)) - 1)]
+        for thread in threads:
+            thread.start()
+        worker()
+        for thread in threads:
+            thread.join()
+        return '[%s]' % ', '.join(resps)
+
+
+    def _error(self, exc_info):
+        E, e = exc_info[:2]
+        if isinstance(e, ServiceError):
+            return {'code': e.code,
                             'message': e.message,
                             'data': e.data}
-        except:
-            E, e = sys.exc_info()[:2]
-            if E in (SystemExit, KeyboardInterrupt):
-                raise
-            code = E.__name__
-            if E in (KeyError, IndexError):
-                # file/line/def where exception occurred formatted like exception stacktrace 
-                where = traceback.format_list([traceback.extract_tb(sys.exc_info()[2])[-1]])[0].strip()  
-                message = '{0}: {1} in {2}'.format(E.__name__, e, where)
-            else:
-                message = '{0}: {1}'.format(E.__name__, e)
-            LOG.warn('Caught API exception. {0}'.format(message), exc_info=sys.exc_info())
-            error = {'code': ServiceError.INTERNAL,
-                            'message': message,
-                            'data': None}
-        finally:
-            if not error:
-                resp = {'result': result}
-            else:
-                resp = {'error': error}
-            resp['id'] = id
-        ret = json.dumps(resp)
+        if E in (SystemExit, KeyboardInterrupt):
+            raise E, e, exc_info[2]
+        code = E.__name__
+        if E in (KeyError, IndexError):
+            # file/line/def where exception occurred formatted like exception stacktrace 
+            where = traceback.format_list([traceback.extract_tb(exc_info[2])[-1]])[0].strip()  
+            message = '{0}: {1} in {2}'.format(E.__name__, e, where)
+        else:
+            message = '{0}: {1}'.format(E.__name__, e)
+        LOG.warn('Caught API exception. {0}'.format(message), exc_info=exc_info)
+        return {'code': ServiceError.INTERNAL,
+                        'message': message,
+                        'data': None}
+
+
+    def _encode_response(self, id, result, error, log_it=False):
+        # Result is serialized once, error response is made only when it fails
+        ret = None
+        if not error:
+            try:
+                ret = json.dumps({'result': result, 'id': id})
+            except:
+                error = self._error(sys.exc_info())
+        if error:
+            ret = json.dumps({'error': error, 'id': id})
         if log_it:
             LOG.debug('response: %s', ret)
         return ret
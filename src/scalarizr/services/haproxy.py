@@ -20,6 +20,7 @@ BEHAVIOUR = SERVICE_NAME = 'haproxy'
 LOG = logging.getLogger(__name__)
 HAPROXY_EXEC = '/usr/sbin/haproxy'
 HAPROXY_CFG_PATH = '/etc/haproxy/haproxy.cfg'
+STATS_SOCKET = '/var/run/haproxy-stats.sock'
 
 class HAProxyError(Exception):
     pass
@@ -596,25 +597,49 @@ class StatSocket(object):
     >> ss.show_stat()
     [{'status': 'UP', 'lastchg': '68', 'weight': '1', 'slim': '', 'pid': '1', 'rate_lim': '',
     'check_duration': '0', 'rate': '0', 'req_rate': '', 'check_status': 'L4OK', 'econ': '0',
-    ...'''
+    ...
 
-    def __init__(self, address='/var/run/haproxy-stats.sock'):
+    Change server state without reloading haproxy
+    (requires `stats socket ... level admin` in global section):
+    >> ss.disable_server('scalr:backend:tcp:80', '10-0-0-1:80')
+    >> ss.enable_server('scalr:backend:tcp:80', '10-0-0-1:80')
+    >> ss.drain_server('scalr:backend:tcp:80', '10-0-0-1:80')
+    '''
+
+    def __init__(self, address=STATS_SOCKET):
+        self.address = address
+
+
+    def execute(self, command):
+        '''
+        Send command and return haproxy response.
+        haproxy closes non-interactive connection after the first command
+        '''
         try:
-            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-            self.sock.connect(address)
-            self.adress = address
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.address)
+            except:
+                raise HAProxyError, "Couldn't connect to socket on address: %s %s" % (
+                        self.address, sys.exc_info()[1]), sys.exc_info()[2]
+            try:
+                sock.sendall(command + '\n')
+                return sock.makefile('r').read()
+            finally:
+                sock.close()
+        except HAProxyError:
+            raise
         except:
-            raise Exception, "Couldn't connect to socket on address: %s%s" % (address, sys.exc_info()[1]), sys.exc_info()[2]
+            raise HAProxyError, "Error working with sockets. Details: %s" % sys.exc_info()[1],\
+                    sys.exc_info()[2]
 
 
     def show_stat(self):
         '''
         @rtype: list[dict]
         '''
+        stat = self.execute('show stat')
         try:
-            self.sock.send('show stat\n')
-            stat = self.sock.makefile('r').read()
-
             fieldnames = filter(None, stat[2:stat.index('\n')].split(','))
             reader = csv.DictReader(cStringIO.StringIO(stat[stat.index('\n'):]), fieldnames)
             res=[]
@@ -622,10 +647,40 @@ class StatSocket(object):
                 res.append(row)
             return res
         except:
-            raise Exception, "Error working with sockets. Details: %s" % sys.exc_info()[1],\
+            raise HAProxyError, "Error parsing stats. Details: %s" % sys.exc_info()[1],\
                     sys.exc_info()[2]
 
 
+    def enable_server(self, backend, server):
+        self._admin('enable server %s/%s' % (backend, server))
+
+
+    def disable_server(self, backend, server):
+        '''
+        Put server into maintenance: no new connections, current ones are served till the end
+        '''
+        self._admin('disable server %s/%s' % (backend, server))
+
+
+    def set_weight(self, backend, server, weight):
+        self._admin('set weight %s/%s %s' % (backend, server, weight))
+
+
+    def drain_server(self, backend, server):
+        '''
+        Stop balancing new connections to server, but keep health checks
+        and persistent (cookie, stick table) sessions
+        '''
+        self.set_weight(backend, server, 0)
+
+
+    def _admin(self, command):
+        # Admin commands respond with an empty line on success
+        out = self.execute(command).strip()
+        if out:
+            raise HAProxyError('%s: %s' % (command, out))
+
+
 def naming(type_, protocol=None, port=None, backend=None):
     ret = 'scalr:%s' % type_
     if type_ == 'backend' and backend:
@@ -218,7 +218,8 @@ class XtrabackupStreamBackup(XtrabackupMixin, backup.Backup):
             self._transfer = cloudfs.LargeTransfer(
                         [self._xbak.stdout],
                         self.cloudfs_target,
-                        compressor=self.compressor)
+                        compressor=self.compressor,
+                        streaming=True)
 
         stderr_thread, stderr = cloudfs.readfp_thread(self._xbak.stderr)
 
@@ -436,7 +437,8 @@ class MySQLDumpBackup(backup.Backup):
             if self._killed:
                 raise Error("Canceled")
             self.transfer = cloudfs.LargeTransfer(self._gen_src, self._dst,
-                                    streamer=None, chunk_size=self.chunk_size)
+                                    streamer=None, chunk_size=self.chunk_size,
+                                    streaming=True)
         result = self.transfer.run()
         if not result:
             raise Error("Error while transfering to cloud storage")
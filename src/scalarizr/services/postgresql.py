@@ -7,11 +7,14 @@ Created on Jul 7, 2011
 
 import os
 import re
+import stat
 import time
 import glob
 import shlex
 import shutil
 import logging
+import threading
+import contextlib
 import subprocess
 
 from scalarizr.util import firstmatched, wait_until
@@ -33,8 +36,6 @@ SSH_KEYGEN = '/usr/bin/ssh-keygen'
 PASSWD_FILE = '/etc/passwd'
 
 PSQL_PATH = '/usr/bin/psql'
-CREATEUSER = '/usr/bin/createuser'
-CREATEDB = '/usr/bin/createdb'
 PG_DUMP = '/usr/bin/pg_dump'
 
 ROOT_USER = "scalr"
@@ -82,9 +83,11 @@ class PgSQLInitScript(initdv2.ParametrizedInitScript):
         return initdv2.Status.RUNNING if p.test_connection() else initdv2.Status.NOT_RUNNING
 
     def stop(self, reason=None):
+        PSQL.close_sessions()
         initdv2.ParametrizedInitScript.stop(self)
     
     def restart(self, reason=None):
+        PSQL.close_sessions()
         initdv2.ParametrizedInitScript.restart(self)
     
     def reload(self, reason=None):
@@ -145,8 +148,9 @@ class PostgreSql(BaseService):
                     
         if slaves:
             LOG.debug('Registering slave hosts: %s' % ' '.join(slaves))
-            for host in slaves:
-                self.register_slave(host, force_restart=False)
+            with self.pg_hba_conf.batch():
+                for host in slaves:
+                    self.register_slave(host, force_restart=False)
         self.service.start()
         
         
@@ -177,8 +181,17 @@ class PostgreSql(BaseService):
             
             
     def register_client(self, ip, force=True):
-        self.pg_hba_conf.add_client(ip)
-        self.service.reload('Allowing access for new app instance: %s' % ip, force=force)
+        self.register_clients([ip], force)
+
+
+    def register_clients(self, ips, force=True):
+        '''
+        Writes pg_hba.conf once and reloads service only if some of ips were not registered yet
+        '''
+        with self.pg_hba_conf.batch():
+            added = [ip for ip in ips if self.pg_hba_conf.add_client(ip)]
+        if added:
+            self.service.reload('Allowing access for new app instances: %s' % ', '.join(added), force=force)
         
         
     def change_primary(self, primary_ip, primary_port, username):
@@ -190,8 +203,8 @@ class PostgreSql(BaseService):
         self.service.reload(reason='Unregistering slave', force=True)
         
     def unregister_client(self, ip):
-        self.pg_hba_conf.delete_client(ip)
-        self.service.reload(reason='Unregistering terminated instance: %s' % ip, force=True)
+        if self.pg_hba_conf.delete_client(ip):
+            self.service.reload(reason='Unregistering terminated instance: %s' % ip, force=True)
 
 
     def stop_replication(self):
@@ -492,8 +505,8 @@ class PgUser(object):
         else:
             LOG.debug('Creating role %s' % self.name)
             try:
-                out = system2([SU_EXEC, '-', self.group, '-c', '%s -s %s' % (CREATEUSER, self.name)])[0]
-                LOG.debug(out or 'Role %s has been successfully created.' % self.name)
+                self.psql.query('CREATE ROLE :"name" WITH SUPERUSER LOGIN;', name=self.name)
+                LOG.debug('Role %s has been successfully created.' % self.name)
             except PopenError, e:
                 LOG.error('Unable to create role %s: %s' % (self.name, e))
                 raise
@@ -516,7 +529,8 @@ class PgUser(object):
             
     def change_role_password(self, password):
         LOG.debug('Changing password for pg role %s' % self.name)
-        self.psql.execute("ALTER USER %s WITH PASSWORD '%s';" % (self.name, password), silent=True)
+        self.psql.query('ALTER USER :"name" WITH PASSWORD :\'password\';', silent=True,
+                        name=self.name, password=password)
         
     def _create_pg_database(self):
         if self._is_pg_database_exist:
@@ -524,8 +538,8 @@ class PgUser(object):
         else:
             LOG.debug('Creating db %s' % self.name)
             try:
-                out = system2([SU_EXEC, '-', self.group, '-c', '%s %s' % (CREATEDB,self.name)])[0]
-                LOG.debug(out or 'DB %s has been successfully created.' % self.name)
+                self.psql.query('CREATE DATABASE :"name";', name=self.name)
+                LOG.debug('DB %s has been successfully created.' % self.name)
             except PopenError, e:
                 LOG.error('Unable to create db %s: %s' % (self.name, e))
                 raise
@@ -553,13 +567,148 @@ class PgUser(object):
             fp.write(key_str)
         
         
+class PSQLSession(object):
+    '''
+    Long-lived psql coprocess, started once through su and fed with
+    statements on stdin. Every statement is followed by \echo of a marker,
+    psql output up to the marker is the statement result.
+    psql stderr goes to the same pipe, so errors come in order
+    '''
+
+    fieldsep = '\x1f'
+    recordsep = '\x1e'
+    error_re = re.compile(r'^(psql:\S*:\d+: )?(ERROR|FATAL|PANIC):\s+')
+
+    def __init__(self, user, path=PSQL_PATH):
+        self.user = user
+        self.path = path
+        self.marker = '--scalarizr-%s--' % os.urandom(8).encode('hex')
+        self.proc = None
+        self.lock = threading.Lock()
+
+
+    def _args(self):
+        return [SU_EXEC, '-', self.user, '-c',
+                'export LANG=en_US; %s -X -q -A -t -v VERBOSITY=terse 2>&1' % self.path]
+
+
+    def _start(self):
+        LOG.debug('Starting psql session for user %s', self.user)
+        self.proc = subprocess.Popen(self._args(), stdin=subprocess.PIPE,
+                        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, close_fds=True)
+        self._communicate([
+            "\\pset fieldsep '\\%03o'" % ord(self.fieldsep),
+            "\\pset recordsep '\\%03o'" % ord(self.recordsep),
+            'SET client_min_messages TO error;'
+        ])
+
+
+    def _communicate(self, lines):
+        try:
+            self.proc.stdin.write('\n'.join(lines + ['\\echo ' + self.marker]) + '\n')
+            self.proc.stdin.flush()
+        except IOError:
+            # psql exited, its output explains why
+            pass
+        out = []
+        while True:
+            line = self.proc.stdout.readline()
+            if not line:
+                out = ''.join(out)
+                self.close()
+                raise EOFError(out.strip() or 'psql exited unexpectedly')
+            if line == self.marker + '\n':
+                break
+            out.append(line)
+        out = ''.join(out)
+        errors = [line for line in out.split('\n') if self.error_re.match(line)]
+        if errors:
+            raise PopenError('\n'.join(errors))
+        return out
+
+
+    def execute(self, sql, params=None):
+        '''
+        Executes one statement and returns rows as tuples of strings.
+        params are passed as psql variables, refer them in sql as
+        :'name' for a literal or :"name" for an identifier
+        '''
+        lines = ["\\set %s '%s'" % (name, _psql_quote(value))
+                 for name, value in (params or {}).items()]
+        sql = sql.strip()
+        if not sql.endswith(';'):
+            sql += ';'
+        lines.append(sql)
+        with self.lock:
+            try:
+                if not self.proc:
+                    self._start()
+                    out = self._communicate(lines)
+                else:
+                    try:
+                        out = self._communicate(lines)
+                    except EOFError, e:
+                        # Connection was lost while session was idle (e.g. server restart)
+                        LOG.debug('psql session for user %s is gone (%s), restarting', self.user, e)
+                        self._start()
+                        out = self._communicate(lines)
+            except EOFError, e:
+                raise PopenError(str(e))
+        if out.endswith('\n'):
+            out = out[:-1]
+        if not out:
+            return []
+        return [tuple(record.split(self.fieldsep)) for record in out.split(self.recordsep)]
+
+
+    def close(self):
+        proc, self.proc = self.proc, None
+        if proc and proc.poll() is None:
+            try:
+                proc.stdin.close()
+                proc.wait()
+            except (IOError, OSError):
+                pass
+
+
+def _psql_quote(value):
+    '''
+    Quotes value for psql \\set argument
+    '''
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    value = str(value)
+    return value.replace('\\', '\\\\').replace("'", "''").replace('\n', '\\n')
+
+
 class PSQL(object):
     path = PSQL_PATH
     user = None
-    
+
+    _sessions = {}
+    _sessions_lock = threading.Lock()
+
     def __init__(self, user=DEFAULT_USER):  
         self.user = user
 
+    @classmethod
+    def close_sessions(cls):
+        '''
+        Closes psql sessions, they hold connections
+        that could delay server shutdown
+        '''
+        with cls._sessions_lock:
+            sessions, cls._sessions = cls._sessions.values(), {}
+        for session in sessions:
+            with session.lock:
+                session.close()
+
+    def _session(self):
+        with self._sessions_lock:
+            if self.user not in self._sessions:
+                self._sessions[self.user] = PSQLSession(self.user, self.path)
+            return self._sessions[self.user]
+
     def test_connection(self):
         LOG.debug('Checking PostgreSQL service status')
         
@@ -572,37 +721,43 @@ class PSQL(object):
                 elif 'the database system is starting up' in str(e):
                     if not attempt:
                         raise BaseException('Postgresql service stuck on starting up database system')
-                    time.sleep(10)
+                    time.sleep(1)
                     return test_recursive(attempt-1)
             return True
-        return test_recursive(12)
-        
-    def execute(self, query, silent=False):
+        return test_recursive(120)
+
+    def query(self, query, silent=False, **params):
+        '''
+        Executes statement in a psql session shared by all PSQL objects
+        of the same user. Returns rows as tuples of strings,
+        see PSQLSession.execute for params
+        '''
         try:
-            out = system2([SU_EXEC, '-', self.user, '-c', 'export LANG=en_US; %s -c "%s"' % (self.path, query)], silent=True)[0]
-            return out  
+            return self._session().execute(query, params)
         except PopenError, e:
             if not silent:
                 LOG.error('Unable to execute query %s from user %s: %s' % (query, self.user, e))
-            raise       
+            raise
+
+    def execute(self, query, silent=False):
+        '''
+        Returns rows as lines of '|' separated values
+        '''
+        rows = self.query(query, silent)
+        return '\n'.join('|'.join(row) for row in rows)
 
     def list_pg_roles(self):
-        out = self.execute('SELECT rolname FROM pg_roles;')
-        roles = out.split()[2:-2]
-        return roles
+        return [row[0] for row in self.query('SELECT rolname FROM pg_roles;')]
     
     def list_pg_databases(self):
-        out = self.execute('SELECT datname FROM pg_database where not datistemplate;')
-        roles = out.split()[2:-2]
-        return roles    
+        return [row[0] for row in
+                self.query('SELECT datname FROM pg_database where not datistemplate;')]
     
     def delete_pg_role(self, name):
-        out = self.execute('DROP ROLE IF EXISTS %s;' % name)
-        LOG.debug(out)
+        self.query('DROP ROLE IF EXISTS :"name";', name=name)
 
     def delete_pg_database(self, name):
-        out = self.execute('DROP DATABASE IF EXISTS %s;' % name)
-        LOG.debug(out)
+        self.query('DROP DATABASE IF EXISTS :"name";', name=name)
         
     def start_backup(self):
         try:
@@ -1054,10 +1209,19 @@ class PgHbaRecord(object):
         self.ip == other.ip and \
         self.mask == other.mask 
     
+    def similarity_key(self):
+        '''
+        Records with the same key are similar to each other
+        '''
+        return (self.host, self.database, self.user, self.address, self.ip, self.mask)
+    
     def __eq__(self, other):
         return self.is_similar_to(other) and \
         self.auth_method == other.auth_method and \
         self.auth_options == other.auth_options 
+    
+    def __ne__(self, other):
+        return not self.__eq__(other)
             
     def __repr__(self):
         line = '%s\t%s\t%s' % (self.host, self.database, self.user)
@@ -1074,6 +1238,17 @@ class PgHbaRecord(object):
     
         
 class PgHbaConf(object):
+    '''
+    pg_hba.conf is parsed once into an in-memory list of lines
+    and reparsed only when the file changes on disk.
+    Records are indexed by PgHbaRecord.similarity_key().
+
+    Group several add/delete calls into one batch() to write the file once:
+
+        with pg_hba_conf.batch():
+            for ip in ips:
+                pg_hba_conf.add_client(ip)
+    '''
     
     config_name = 'pg_hba.conf'
     path = None
@@ -1083,6 +1258,13 @@ class PgHbaConf(object):
     
     def __init__(self, path):
         self.path = path
+        self._lines = None
+        self._index = None
+        self._stat = None
+        self._eol = True
+        self._depth = 0
+        self._appended = None
+        self._removed = None
 
     @classmethod
     def find(cls, config_dir):
@@ -1090,69 +1272,153 @@ class PgHbaConf(object):
     
     @property
     def records(self):
-        l = []
-        text = ''
-        with open(self.path, 'r') as fp:
-            text = fp.read()
-        for line in text.splitlines():
-            if line.strip() and not line.strip().startswith('#'):
-                record = PgHbaRecord.from_string(line)
-                l.append(record)
-        return l
+        self._load()
+        return [line for line in self._lines if isinstance(line, PgHbaRecord)]
+    
+    @contextlib.contextmanager
+    def batch(self):
+        '''
+        Apply add/delete calls made inside the block to the in-memory records
+        and write pg_hba.conf once when the outermost batch exits:
+        append new records, or rewrite the file atomically if any were deleted.
+        Nothing is written if the block raises.
+        '''
+        if not self._depth:
+            self._load()
+            self._appended = []
+            self._removed = set()
+        self._depth += 1
+        try:
+            yield self
+        except:
+            self._depth -= 1
+            if not self._depth:
+                # Discard changes, next call rereads the file
+                self._lines = None
+            raise
+        self._depth -= 1
+        if not self._depth:
+            self._flush()
     
     def add_record(self, record, replace_similar=False):
-        if replace_similar:
-            for old_record in self.records:
-                if old_record != record and old_record.is_similar_to(record):
-                    self.delete_record(old_record)
-        if record not in self.records:
+        '''
+        Returns True if pg_hba.conf was changed
+        '''
+        with self.batch():
+            similar = self._index.get(record.similarity_key(), ())
+            if replace_similar:
+                for old_record in list(similar):
+                    if old_record != record:
+                        self._remove(old_record)
+            if record in similar:
+                LOG.debug('Record "%s" is already in %s. Nothing to add.' % (str(record),self.path))
+                return False
             LOG.debug('Adding record "%s" to %s' % (str(record),self.path))
-            with open(self.path, 'a') as fp:
-                fp.write('\n'+str(record)+'\n')
-        else:
-            LOG.debug('Record "%s" is already in %s. Nothing to add.' % (str(record),self.path))
+            self._lines.append(record)
+            self._index.setdefault(record.similarity_key(), []).append(record)
+            self._appended.append(record)
+            return True
             
     def delete_record(self, record, delete_similar=False):
-        deleted = []
+        '''
+        Returns True if pg_hba.conf was changed
+        '''
+        with self.batch():
+            deleted = [old_record for old_record in self._index.get(record.similarity_key(), ())
+                       if delete_similar or old_record == record]
+            if deleted:
+                LOG.debug('Removing records "%s" from %s' % (map(str, deleted),self.path))
+                for old_record in deleted:
+                    self._remove(old_record)
+            return bool(deleted)
+    
+    def _remove(self, record):
+        key = record.similarity_key()
+        self._index[key] = [r for r in self._index[key] if r is not record]
+        if not self._index[key]:
+            del self._index[key]
+        self._removed.add(id(record))
+    
+    def _file_stat(self):
+        try:
+            st = os.stat(self.path)
+            return (st.st_mtime, st.st_size, st.st_ino)
+        except OSError:
+            return None
+    
+    def _load(self):
+        if self._depth:
+            return
+        st = self._file_stat()
+        if self._lines is not None and st == self._stat:
+            return
+        with open(self.path, 'r') as fp:
+            text = fp.read()
         lines = []
-        changed = False
-        for old_record in self.records:
-            if (old_record == record) or (delete_similar and old_record.is_similar_to(record)):
-                deleted.append(str(old_record))
-                changed = True
-                continue
-            else:
-                lines.append(str(old_record))
-        if changed:
-            LOG.debug('Removing records "%s" from %s' % (deleted,self.path))
-            with open(self.path, 'w') as fp:
-                fp.write('\n'.join(lines))
+        index = {}
+        for line in text.splitlines():
+            if line.strip() and not line.strip().startswith('#'):
+                line = PgHbaRecord.from_string(line)
+                index.setdefault(line.similarity_key(), []).append(line)
+            lines.append(line)
+        self._lines, self._index, self._stat = lines, index, st
+        self._eol = not text or text.endswith('\n')
+    
+    def _flush(self):
+        appended, removed = self._appended, self._removed
+        self._appended = self._removed = None
+        if removed:
+            self._lines = [line for line in self._lines if id(line) not in removed]
+            self._write()
+        elif appended:
+            with open(self.path, 'a') as fp:
+                if not self._eol:
+                    fp.write('\n')
+                fp.write(''.join('%s\n' % record for record in appended))
+        else:
+            return
+        self._eol = True
+        self._stat = self._file_stat()
+    
+    def _write(self):
+        path = os.path.realpath(self.path)
+        st = os.stat(path)
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as fp:
+            fp.write(''.join('%s\n' % line for line in self._lines))
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.chmod(tmp, stat.S_IMODE(st.st_mode))
+        os.chown(tmp, st.st_uid, st.st_gid)
+        os.rename(tmp, path)
     
     def add_standby_host(self, ip, user='postgres'):
         record = self._make_standby_record(ip, user)
-        self.add_record(record)
+        return self.add_record(record)
 
     def delete_standby_host(self, ip, user='postgres'):
         record = self._make_standby_record(ip, user)
-        self.delete_record(record)
+        return self.delete_record(record)
         
     
     def add_client(self, ip):
         record = self._make_farm_server_record(ip)
-        self.add_record(record)
+        return self.add_record(record)
 
     def delete_client(self, ip):
         record = self._make_farm_server_record(ip)
-        self.delete_record(record)      
+        return self.delete_record(record)      
     
     
     def set_trusted_access_mode(self):
-        self.delete_record(self.password_mode)
-        self.add_record(self.trusted_mode)
+        with self.batch():
+            self.delete_record(self.password_mode)
+            self.add_record(self.trusted_mode)
     
     def set_password_access_mode(self):
-        self.delete_record(self.trusted_mode)
-        self.add_record(self.password_mode)
+        with self.batch():
+            self.delete_record(self.trusted_mode)
+            self.add_record(self.password_mode)
 
     def allow_local_connections(self):
         record = PgHbaRecord('host', 'all', 'all', address='127.0.0.1/32', auth_method = 'md5')
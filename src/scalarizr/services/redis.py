@@ -6,9 +6,12 @@ Created on Aug 10, 2011
 '''
 
 import os
+import shlex
 import signal
+import socket
 import logging
 import shutil
+import threading
 
 from scalarizr import storage2, node
 from scalarizr.util import initdv2, system2, PopenError, wait_until, Singleton
@@ -23,7 +26,6 @@ from scalarizr.libs.metaconf import NoPathError
 __redis__ = node.__node__['redis']
 __redis__.update({
     'storage_dir': '/mnt/redisstorage',
-    'redis-cli': '/usr/bin/redis-cli',
     'pid_dir': '/var/run/redis' if os.path.isdir('/var/run/redis') else '/var/run',
     'defaults': {
         'dir': '/var/lib/redis',
@@ -681,11 +683,157 @@ class RedisConf(BaseRedisConfig):
     port_default = __redis__['defaults']['port']
 
 
+class RedisError(PopenError):
+    '''
+    Error reply from redis-server or failure to talk to it
+    '''
+
+
+class RedisConnection(object):
+    '''
+    Connection to a local redis-server, speaks RESP protocol.
+    Error replies are returned as RedisError instances, not raised,
+    so replies of pipelined commands stay in sync
+    '''
+
+    def __init__(self, port, host='127.0.0.1', timeout=60):
+        self.sock = socket.create_connection((host, int(port)), timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._fp = self.sock.makefile('rb')
+
+
+    def close(self):
+        for obj in (self._fp, self.sock):
+            try:
+                obj.close()
+            except:
+                pass
+
+
+    def execute(self, *commands):
+        '''
+        Sends all commands at once and reads their replies
+        '''
+        self.sock.sendall(''.join(self._pack(args) for args in commands))
+        return [self.read_reply() for _ in commands]
+
+
+    def _pack(self, args):
+        ret = ['*%d\r\n' % len(args)]
+        for arg in args:
+            if isinstance(arg, unicode):
+                arg = arg.encode('utf-8')
+            else:
+                arg = str(arg)
+            ret.append('$%d\r\n%s\r\n' % (len(arg), arg))
+        return ''.join(ret)
+
+
+    def read_reply(self):
+        line = self._fp.readline()
+        if not line.endswith('\r\n'):
+            raise socket.error('Connection closed by redis-server')
+        kind, value = line[0], line[1:-2]
+        if kind == '+':
+            return value
+        elif kind == '-':
+            return RedisError(value)
+        elif kind == ':':
+            return int(value)
+        elif kind == '$':
+            length = int(value)
+            if length < 0:
+                return None
+            data = self._fp.read(length + 2)
+            if len(data) != length + 2:
+                raise socket.error('Connection closed by redis-server')
+            return data[:-2]
+        elif kind == '*':
+            length = int(value)
+            if length < 0:
+                return None
+            return [self.read_reply() for _ in range(length)]
+        raise RedisError('Unexpected reply from redis-server: %r' % line)
+
+
+class RedisConnectionPool(object):
+    '''
+    Idle authenticated connections to redis-server on a port.
+    Use find() to share one pool per port and password
+    '''
+
+    _pools = {}
+    _pools_lock = threading.Lock()
+
+
+    def __init__(self, port, password=None, max_idle=4):
+        self.port = int(port)
+        self.password = password
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+
+
+    @classmethod
+    def find(cls, port, password=None):
+        key = (int(port), password)
+        with cls._pools_lock:
+            if key not in cls._pools:
+                cls._pools[key] = cls(port, password)
+            return cls._pools[key]
+
+
+    def _connect(self):
+        conn = RedisConnection(self.port)
+        if self.password:
+            reply = conn.execute(('AUTH', self.password))[0]
+            # redis 2.4 refuses AUTH when no password is set
+            if isinstance(reply, RedisError) and \
+                            'no password is set' not in str(reply):
+                conn.close()
+                raise reply
+        return conn
+
+
+    def execute(self, commands):
+        '''
+        Sends commands in one round trip and returns their replies.
+        Pooled connection could be closed by server restart,
+        in this case command is retried once on a new connection
+        '''
+        while True:
+            with self._lock:
+                conn = self._idle and self._idle.pop() or None
+            pooled = bool(conn)
+            try:
+                conn = conn or self._connect()
+                replies = conn.execute(*commands)
+            except socket.error, e:
+                if conn:
+                    conn.close()
+                if pooled:
+                    continue
+                raise RedisError('Unable to talk to redis-server on port %s: %s' % (self.port, e))
+            with self._lock:
+                if len(self._idle) < self.max_idle:
+                    self._idle.append(conn)
+                    conn = None
+            if conn:
+                conn.close()
+            return replies
+
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
 class RedisCLI(object):
 
     port = None
     password = None
-    path = __redis__['redis-cli']
 
 
     class no_keyerror_dict(dict):
@@ -699,9 +847,7 @@ class RedisCLI(object):
     def __init__(self, password=None, port=__redis__['defaults']['port']):
         self.port = port
         self.password = password
-
-        if not os.path.exists(self.path):
-            raise OSError('redis-cli not found')
+        self.pool = RedisConnectionPool.find(port, password)
 
 
     @classmethod
@@ -709,121 +855,107 @@ class RedisCLI(object):
         return cls(redis_conf.requirepass, port=redis_conf.port)
 
 
-    def execute(self, query, silent=False):
-        if not self.password:
-            full_query = query
-        else:
-            full_query = 'AUTH %s\n%s' % (self.password, query)
+    def pipeline(self, *commands):
+        '''
+        Sends commands (sequences of arguments) to redis-server
+        in one round trip and returns their replies.
+        Raises RedisError for the first error reply
+        '''
+        replies = self.pool.execute(commands)
+        if any(isinstance(reply, RedisError) and str(reply).startswith('LOADING')
+                        for reply in replies):
+            #[SCALARIZR-1604]
+            #test until service becomes available:
+            wait_until(lambda: not self._loading())
+            #run query again:
+            replies = self.pool.execute(commands)
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+        return replies
+
+
+    def _loading(self):
+        reply = self.pool.execute([('PING', )])[0]
+        return isinstance(reply, RedisError) and str(reply).startswith('LOADING')
 
-        execute_query = lambda: system2([self.path, '-p', self.port], stdin=full_query,silent=True, warn_stderr=False)
+
+    def execute(self, query, silent=False):
         try:
-            out = execute_query()[0]
-
-            #fix for redis 2.4 AUTH
-            if 'Client sent AUTH, but no password is set' in out:
-                execute_query = lambda: system2([self.path], stdin=query, silent=True)
-                out = execute_query()[0]
-
-            if "Redis is loading the dataset in memory" in out:
-                #[SCALARIZR-1604]
-                #test until service becomes available:
-                wait_until(lambda: "LOADING" not in system2([self.path], stdin='ping', silent=True)[0])
-                #run query again:
-                out = execute_query()[0]
-
-            elif out.startswith('ERR'):
-                raise PopenError(out)
-
-            elif out.startswith('OK\n'):
-                out = out[3:]
-            if out.endswith('\n'):
-                out = out[:-1]
-            return out
-        except PopenError, e:
+            reply = self.pipeline(shlex.split(query))[0]
+        except RedisError, e:
             if not silent:
-                LOG.error('Unable to execute query %s with redis-cli: %s' % (query, e))
+                LOG.error('Unable to execute query %s on redis port %s: %s' % (query, self.port, e))
             raise
+        if isinstance(reply, list):
+            return '\n'.join(str(item) for item in reply)
+        return '' if reply is None else str(reply)
 
 
     @property
     def info(self):
+        '''
+        INFO snapshot. Query it once and read all the properties
+        you need from it instead of querying per property
+        '''
         info = self.execute('info')
         LOG.debug('Redis INFO: %s' % info)
-        d = self.no_keyerror_dict()
-        if info:
-            for i in info.strip().split('\n'):
-                raw = i[:-1] if i.endswith('\r') else i
-                if raw:
-                    kv = raw.split(':')
-                    if len(kv)==2:
-                        key, val = kv
-                        if key:
-                            d[key] = val
-        return d
+        return RedisInfo.parse(info)
 
 
     @property
     def aof_enabled(self):
-        return True if self.info['aof_enabled']=='1' else False
+        return self.info.aof_enabled
 
 
     @property
     def bgrewriteaof_in_progress(self):
-        return True if self.info['bgrewriteaof_in_progress']=='1' else False
+        return self.info.bgrewriteaof_in_progress
 
 
     @property
     def bgsave_in_progress(self):
-        return True if self.info['bgsave_in_progress']=='1' else False
+        return self.info.bgsave_in_progress
 
 
     @property
     def changes_since_last_save(self):
-        return int(self.info['changes_since_last_save'])
+        return self.info.changes_since_last_save
 
 
     @property
     def connected_slaves(self):
-        return int(self.info['connected_slaves'])
+        return self.info.connected_slaves
 
 
     @property
     def last_save_time(self):
-        return int(self.info['last_save_time'])
+        return self.info.last_save_time
 
 
     @property
     def redis_version(self):
-        return self.info['redis_version']
+        return self.info.redis_version
 
 
     @property
     def role(self):
-        return self.info['role']
+        return self.info.role
 
 
     @property
     def master_host(self):
-        info = self.info
-        if info['role']=='slave':
-            return info['master_host']
-        return None
+        return self.info.master_host
 
 
     @property
     def master_port(self):
-        info = self.info
-        if info['role']=='slave':
-            return int(info['master_port'])
-        return None
+        return self.info.master_port
 
 
     @property
     def master_link_status(self):
-        info = self.info
-        if info['role'] == 'slave':
-            return info['master_link_status']
-        return None
+        return self.info.master_link_status
 
 
     def bgsave(self, wait_until_complete=True):
@@ -847,17 +979,107 @@ class RedisCLI(object):
 
     @property
     def master_last_io_seconds_ago(self):
-        info = self.info
-        if info['role'] == 'slave':
-            return int(info['master_last_io_seconds_ago'])
+        return self.info.master_last_io_seconds_ago
+
+
+    @property
+    def master_sync_in_progress(self):
+        return self.info.master_sync_in_progress
+
+
+class RedisInfo(RedisCLI.no_keyerror_dict):
+    '''
+    Parsed INFO reply, answers RedisCLI properties without
+    querying redis-server again
+    '''
+
+    @classmethod
+    def parse(cls, info):
+        d = cls()
+        if info:
+            for i in info.strip().split('\n'):
+                raw = i[:-1] if i.endswith('\r') else i
+                if raw:
+                    kv = raw.split(':')
+                    if len(kv)==2:
+                        key, val = kv
+                        if key:
+                            d[key] = val
+        return d
+
+
+    @property
+    def aof_enabled(self):
+        return True if self['aof_enabled']=='1' else False
+
+
+    @property
+    def bgrewriteaof_in_progress(self):
+        return True if self['bgrewriteaof_in_progress']=='1' else False
+
+
+    @property
+    def bgsave_in_progress(self):
+        return True if self['bgsave_in_progress']=='1' else False
+
+
+    @property
+    def changes_since_last_save(self):
+        return int(self['changes_since_last_save'])
+
+
+    @property
+    def connected_slaves(self):
+        return int(self['connected_slaves'])
+
+
+    @property
+    def last_save_time(self):
+        return int(self['last_save_time'])
+
+
+    @property
+    def redis_version(self):
+        return self['redis_version']
+
+
+    @property
+    def role(self):
+        return self['role']
+
+
+    @property
+    def master_host(self):
+        if self['role']=='slave':
+            return self['master_host']
+        return None
+
+
+    @property
+    def master_port(self):
+        if self['role']=='slave':
+            return int(self['master_port'])
+        return None
+
+
+    @property
+    def master_link_status(self):
+        if self['role'] == 'slave':
+            return self['master_link_status']
+        return None
+
+
+    @property
+    def master_last_io_seconds_ago(self):
+        if self['role'] == 'slave':
+            return int(self['master_last_io_seconds_ago'])
         return None
 
 
     @property
     def master_sync_in_progress(self):
-        info = self.info
-        if info['role'] == 'slave':
-            return True if info['master_sync_in_progress']=='1' else False
+        if self['role'] == 'slave':
+            return True if self['master_sync_in_progress']=='1' else False
         return False
 
 
@@ -144,6 +144,58 @@ def concurrent_snapshot(volumes, description, tags=None, **kwds):
     return tuple(r[2] for r in results)
 
 
+def concurrent_ensure(volumes, max_workers=8, **kwds):
+    '''
+    Concurrently calls vol.ensure(**kwds), at most max_workers at a time.
+    All or nothing: when some volume fails, the rest are not started,
+    volumes created by this call are destroyed to rollback
+    and the first error is reraised
+    '''
+    volumes = list(volumes)
+    existed = [bool(vol.id) for vol in volumes]
+    indexes = Queue.Queue()
+    for index in range(len(volumes)):
+        indexes.put(index)
+    errors = []
+
+    def ensure():
+        while not errors:
+            try:
+                index = indexes.get_nowait()
+            except Queue.Empty:
+                return
+            vol = volumes[index]
+            try:
+                vol.ensure(**kwds)
+            except:
+                exc_info = sys.exc_info()
+                LOG.warn('Failed to ensure volume %s(%s): %s',
+                                vol.id, vol.type, exc_info[1], exc_info=exc_info)
+                errors.append(exc_info)
+
+    threads = []
+    for num in range(min(max_workers, len(volumes))):
+        thread = threading.Thread(target=ensure, name='Volume ensure %d' % num)
+        thread.start()
+        threads.append(thread)
+
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        for vol, vol_existed in zip(volumes, existed):
+            if vol_existed or not (vol.id or vol.device):
+                continue
+            try:
+                vol.destroy(force=True)
+            except:
+                exc_info = sys.exc_info()
+                LOG.warn('Failed to destroy volume %s(%s): %s',
+                                vol.id, vol.type, exc_info[1], exc_info=exc_info)
+        raise errors[0][0], errors[0][1], errors[0][2]
+    return volumes
+
+
 class StorageError(linux.LinuxError):
     pass
 
@@ -27,7 +27,9 @@ except ImportError:
 
 from scalarizr import storage2
 from scalarizr.libs import bases
+from scalarizr.util import pgzip
 from scalarizr.linux import coreutils, pkgmgr, LinuxError
+from scalarizr.storage2.cloudfs.base import MemoryChunk, source_size
 
 
 LOG = logging.getLogger(__name__)
@@ -270,7 +272,8 @@ class FileTransfer(BaseTransfer):
 
             self.fire('transfer_start', src, dst, retry, chunk_num)
             try:
-                uploading = self._is_remote_path(dst) and os.path.isfile(src)
+                uploading = self._is_remote_path(dst) and \
+                                (isinstance(src, MemoryChunk) or os.path.isfile(src))
                 downloading = self._is_remote_path(src) and not self._is_remote_path(dst)
                 assert not (uploading and downloading)
                 assert uploading or downloading
@@ -280,7 +283,7 @@ class FileTransfer(BaseTransfer):
                     driver = cloudfs(urlparse.urlparse(rem).scheme)
                 with self._worker_lock:
                     if self.multipart and not self._upload_id:
-                        chunk_size = os.path.getsize(loc)
+                        chunk_size = source_size(loc)
                         self._upload_id = driver.multipart_init(rem, chunk_size)
 
                 zero = int(time.time())
@@ -294,7 +297,7 @@ class FileTransfer(BaseTransfer):
                                     'src': src,
                                     'dst': dst,
                                     'chunk_num': chunk_num,
-                                    'size': os.path.getsize(src)})
+                                    'size': source_size(src)})
                 else:
                     driver.get(src, dst, report_to=progress_report_cb)
                     LOG.debug("*** BENCH %s %s downloaded", int(time.time() - zero), os.path.basename(src))
@@ -402,18 +405,22 @@ class LargeTransfer(bases.Task):
 
     # python 2.7.2 @ ubuntu 11.10 subprocess hangs sometimes
 
-    pigz_bin = '/usr/bin/pigz'
-    gzip_bin = '/bin/gzip'
+    # Restorer reads downloaded chunks in buffers of this size
+    restore_buf_size = 1024 * 1024
+    # and keeps up to restore_read_ahead buffers ahead of the pipe writer
+    restore_read_ahead = 32
+    # Check md5 sums of downloaded chunks against the manifest
+    verify_chunks = True
 
     def __init__(self, src, dst,
                             transfer_id=None,
                             streamer="tar",
                             compressor="gzip",
                             chunk_size=100,
-                            try_pigz=True,
                             manifest='manifest.json',
                             description='',
                             tags=None,
+                            streaming=False,
                             **kwds):
         '''
         :param src: DL: manifest url. UL: str file or directory path,
@@ -424,13 +431,19 @@ class LargeTransfer(bases.Task):
         :param streamer: "gzip" or :class:`.Exec<scalarizr.services.mysql2.Exec>`
                                          instance. Else - no streaming. Ignored when uploading
                                          files or streams
-        :param compressor: "gzip" or :class:`.Exec<scalarizr.services.mysql2.Exec>`
-                                           instance. Else - no compression
+        :param compressor: "gzip", :class:`.ParallelGzip<scalarizr.util.pgzip.ParallelGzip>`
+                                           or :class:`.Exec<scalarizr.services.mysql2.Exec>`
+                                           instance. Else - no compression.
+                                           "gzip" is compressed in-process with default
+                                           ParallelGzip settings
         :param chunk_size: chunk size in megabytes
-        :param try_pigz: if compressor is "gzip", try pigz first
         :param manifest: manifest file basename
         :param description: description to save in manifest
         :param tags: tags to save in manifest
+        :param streaming: UL: pass chunks to the cloudfs driver from memory
+                                          instead of a tmpfs transit volume. At most
+                                          num_workers chunks are kept in memory, reading
+                                          from the source blocks until one is uploaded
         :param **kwds: additional kwargs for :class:`FileTransfer`
         '''
 
@@ -466,9 +479,14 @@ class LargeTransfer(bases.Task):
         self.src = src
         self.dst = dst
         self.streamer = streamer
+        if isinstance(compressor, pgzip.ParallelGzip):
+            self._gzip = compressor
+            compressor = "gzip"
+        else:
+            self._gzip = pgzip.ParallelGzip()
         self.compressor = compressor
         self.chunk_size = chunk_size
-        self.try_pigz = try_pigz
+        self.streaming = streaming and self._up
         self._upload_res = None
         self._restorer = None
         self._killed = False
@@ -485,29 +503,14 @@ class LargeTransfer(bases.Task):
                 dst=self._dst_generator, **kwds)
         self._tranzit_vol = storage2.volume(type='tmpfs',
                 mpoint=tempfile.mkdtemp())
+        # Chunks being uploaded in streaming mode
+        self._buffers = Queue.Queue(self._transfer.num_workers)
 
         events = self._transfer.list_events()
         self.define_events(*events)
         for ev in events:
             self._transfer.on(ev, self._proxy_event(ev))
 
-    def _gzip_bin(self):
-        if self.try_pigz:
-            mgr = pkgmgr.package_mgr()
-            if not mgr.info('pigz')['installed']:
-                try:
-                    pkgmgr.epel_repository()
-                    mgr.installed("pigz")
-                except:
-                    LOG.debug("PIGZ install with epel failed, using gzip."\
-                                      " Caught %s", repr(sys.exc_info()[1]))
-                else:
-                    return self.pigz_bin
-            else:
-                return self.pigz_bin
-        return self.gzip_bin
-
-
     def _proxy_event(self, event):
         def proxy(*args, **kwds):
             self.fire(event, *args, **kwds)
@@ -532,9 +535,17 @@ class LargeTransfer(bases.Task):
                 self.manifest["tags"] = self.tags
 
             def delete_uploaded_chunk(src, dst, retry, chunk_num):
-                os.remove(src)
+                if isinstance(src, MemoryChunk):
+                    self._release_buffer(src)
+                else:
+                    os.remove(src)
             self._transfer.on(transfer_complete=delete_uploaded_chunk)
 
+            def release_failed_chunk(src, dst, retry, chunk_num, exc_info):
+                if isinstance(src, MemoryChunk):
+                    self._release_buffer(src)
+            self._transfer.on(transfer_error=release_failed_chunk)
+
             for src in self.src:
                 LOG.debug('src: %s, type: %s', src, type(src))
                 fileinfo = {
@@ -601,12 +612,7 @@ class LargeTransfer(bases.Task):
                     fileinfo["compressor"] = "gzip"
                     prefix += 'gz.'
                     LOG.debug("LargeTransfer src_generator GZIP POPEN")
-                    gzip = cmd = subprocess.Popen(
-                                            [self._gzip_bin(), '-5'],
-                                            stdin=stream,
-                                            stdout=subprocess.PIPE,
-                                            stderr=subprocess.PIPE,
-                                            close_fds=True)
+                    gzip = cmd = self._gzip.popen(stdin=stream)
                     LOG.debug("LargeTransfer src_generator AFTER GZIP")
                     if tar:
                         # Allow tar to receive SIGPIPE if gzip exits.
@@ -622,7 +628,8 @@ class LargeTransfer(bases.Task):
                         tar.stdout.close()
                     stream = cmd.stdout
 
-                for filename, md5sum, size in self._split(stream, prefix):
+                split = self._split_to_memory if self.streaming else self._split
+                for filename, md5sum, size in split(stream, prefix):
                     fileinfo["chunks"].append((os.path.basename(filename), md5sum, size))
                     LOG.debug("LargeTransfer src_generator yield %s", filename)
                     yield filename
@@ -689,15 +696,7 @@ class LargeTransfer(bases.Task):
                 self._restorer = threading.Thread(target=self._dl_restorer)
                 self._restorer.start()
 
-            def wait_chunk(src, dst, retry, chunk_num):
-                chunk_name = os.path.basename(src)
-                for file_ in self.files:
-                    if chunk_name in file_["chunks"]:
-                        chunk = file_["chunks"][chunk_name]
-                chunk["downloaded"].set()
-                chunk["processed"].wait()
-                os.remove(os.path.join(dst, chunk_name))
-            self._transfer.on(transfer_complete=wait_chunk)
+            self._transfer.on(transfer_complete=self._chunk_downloaded)
 
             for file_ in self.files:
                 for chunk in file_["chunks"]:
@@ -729,19 +728,7 @@ class LargeTransfer(bases.Task):
                 with open(chunk_name, 'w') as chunk:
                     while chunk_capacity:
 
-                        while True:
-                            try:
-                                bytes_ = stream.read(min(buf_size, chunk_capacity))
-                            except IOError, e:
-                                if e.errno == errno.EINTR:
-                                    LOG.debug("EINTR while reading data for %s",
-                                            chunk_name)
-                                    continue
-                                else:
-                                    raise
-                            else:
-                                break
-
+                        bytes_ = self._read(stream, min(buf_size, chunk_capacity), chunk_name)
                         if not bytes_:
                             break
                         chunk.write(bytes_)
@@ -762,9 +749,72 @@ class LargeTransfer(bases.Task):
             self.kill()
 
 
-    def _dl_restorer(self):
-        buf_size = 4096
+    def _read(self, stream, size, chunk_name):
+        while True:
+            try:
+                return stream.read(size)
+            except IOError, e:
+                if e.errno == errno.EINTR:
+                    LOG.debug("EINTR while reading data for %s", chunk_name)
+                    continue
+                raise
+
+
+    def _split_to_memory(self, stream, prefix):
+        '''
+        Same as :meth:`_split`, but yields :class:`MemoryChunk` objects.
+        Blocks while all buffers are in use
+        '''
+        try:
+            buf_size = 1024 * 1024
+            chunk_size = self.chunk_size * 1024 * 1024
+
+            for chunk_n in itertools.count():
+                chunk_name = prefix + '%03d' % chunk_n
+                if not self._acquire_buffer():
+                    break
+                chunk_capacity = chunk_size
+                chunk_md5 = hashlib.md5()
+                pieces = []
+
+                while chunk_capacity:
+                    bytes_ = self._read(stream, min(buf_size, chunk_capacity), chunk_name)
+                    if not bytes_:
+                        break
+                    pieces.append(bytes_)
+                    chunk_capacity -= len(bytes_)
+                    chunk_md5.update(bytes_)
+
+                if pieces:
+                    chunk = MemoryChunk(chunk_name, ''.join(pieces))
+                    del pieces
+                    yield chunk, chunk_md5.hexdigest(), chunk.size
+                else:
+                    self._buffers.get_nowait()
+                if chunk_capacity:
+                    break
+        except:
+            LOG.debug(" ", exc_info=sys.exc_info())
+            self.kill()
+
+
+    def _acquire_buffer(self):
+        while not self._killed:
+            try:
+                self._buffers.put(None, timeout=1)
+                return True
+            except Queue.Full:
+                continue
+        return False
+
 
+    def _release_buffer(self, chunk):
+        if chunk.data is not None:
+            chunk.release()
+            self._buffers.get_nowait()
+
+
+    def _dl_restorer(self):
         for file_ in self.files:
             dst = self.dst
 
@@ -789,11 +839,7 @@ class LargeTransfer(bases.Task):
 
                     if file_["compressor"] == "gzip":
                         LOG.debug("RESTORER unzip popen")
-                        cmd = subprocess.Popen([self._gzip_bin(), "-d"],
-                                stdin=subprocess.PIPE,
-                                stdout=compressor_out,
-                                stderr=subprocess.PIPE,
-                                close_fds=True)
+                        cmd = self._gzip.popen(stdout=compressor_out, decompress=True)
                         LOG.debug("RESTORER after unzip")
                     else:  # custom compressor
                         LOG.debug("RESTORER custom decompressor popen")
@@ -827,31 +873,7 @@ class LargeTransfer(bases.Task):
                         stream = cmd.stdin
 
             try:
-                for chunk, info in file_["chunks"].iteritems():
-
-                    LOG.debug("RESTORER before wait %s", chunk)
-                    info["downloaded"].wait()
-                    zero = int(time.time())
-
-                    location = os.path.join(self._tranzit_vol.mpoint, chunk)
-                    with open(location, 'rb') as fd:
-                        while True:
-                            try:
-                                bytes_ = fd.read(buf_size)
-                                if not bytes_:
-                                    LOG.debug("RESTORER break %s", chunk)
-                                    LOG.debug("*** BENCH %s %s restored", int(time.time() - zero),
-                                                    chunk)
-                                    break
-
-                                stream.write(bytes_)
-                            except Exception:
-                                LOG.exception("Caught error in restore loop\ncmd.stderr: %s",
-                                                cmd.stderr.read())
-                                self.kill()
-                                raise
-
-                    info["processed"].set()  # this leads to chunk removal
+                self._restore_chunks(file_, stream, cmd)
             finally:
                 stream.close()
 
@@ -863,12 +885,113 @@ class LargeTransfer(bases.Task):
                     LOG.debug("LargeTransfer download: finished restoring")
 
 
+    def _chunk_downloaded(self, src, dst, retry, chunk_num):
+        '''
+        transfer_complete listener, runs in download worker: verifies chunk's
+        md5 sum (in parallel with other workers), hands chunk to the restorer
+        and waits until it's processed
+        '''
+        chunk_name = os.path.basename(src)
+        for file_ in self.files:
+            if chunk_name in file_["chunks"]:
+                chunk = file_["chunks"][chunk_name]
+        location = os.path.join(dst, chunk_name)
+        if self.verify_chunks and chunk["md5sum"]:
+            md5 = hashlib.md5()
+            with open(location, 'rb') as fd:
+                while True:
+                    bytes_ = fd.read(self.restore_buf_size)
+                    if not bytes_:
+                        break
+                    md5.update(bytes_)
+            if md5.hexdigest() != chunk["md5sum"]:
+                os.remove(location)
+                chunk["downloaded"].interrupt(
+                        Exception("Chunk %s is corrupted: md5 sum mismatch" % chunk_name))
+                return
+        chunk["downloaded"].set()
+        chunk["processed"].wait()
+        os.remove(location)
+
+
+    def _restore_chunks(self, file_, stream, cmd):
+        '''
+        Write file's chunks into the restore pipe in order.
+        Chunks are read by :meth:`_read_chunks` thread, so
+        reading the next chunk overlaps with writing the current one
+        '''
+        pieces = Queue.Queue(self.restore_read_ahead)
+        stop = threading.Event()
+        reader = threading.Thread(target=self._read_chunks, args=(file_, pieces, stop),
+                                  name='restore-reader')
+        reader.setDaemon(True)
+        reader.start()
+        try:
+            while True:
+                piece = pieces.get()
+                if piece is None:
+                    break
+                if isinstance(piece, tuple):
+                    raise piece[0], piece[1], piece[2]
+                stream.write(piece)
+        except EventInterrupt:
+            raise
+        except Exception:
+            LOG.exception("Caught error in restore loop\ncmd.stderr: %s",
+                            cmd.stderr.read() if cmd and cmd.stderr else '')
+            self.kill()
+            raise
+        finally:
+            stop.set()
+            # Unblock reader if it waits for a free slot
+            while reader.isAlive():
+                try:
+                    pieces.get_nowait()
+                except Queue.Empty:
+                    reader.join(0.1)
+
+
+    def _read_chunks(self, file_, pieces, stop):
+        '''
+        Read downloaded chunks in order.
+        Data is passed to *pieces* queue, followed by None or exc_info on error.
+        Chunks are verified by :meth:`_chunk_downloaded` before they are
+        marked downloaded, so corrupted data never reaches the restore pipe
+        '''
+        def put(item):
+            # Blocking put: timed waits poll in python 2
+            if not stop.isSet():
+                pieces.put(item)
+            return not stop.isSet()
+
+        try:
+            for chunk, info in file_["chunks"].iteritems():
+                LOG.debug("RESTORER before wait %s", chunk)
+                info["downloaded"].wait()
+                zero = int(time.time())
+
+                location = os.path.join(self._tranzit_vol.mpoint, chunk)
+                with open(location, 'rb') as fd:
+                    while True:
+                        bytes_ = fd.read(self.restore_buf_size)
+                        if not bytes_:
+                            break
+                        if not put(bytes_):
+                            return
+                LOG.debug("*** BENCH %s %s restored", int(time.time() - zero), chunk)
+
+                info["processed"].set()  # this leads to chunk removal
+            put(None)
+        except:
+            put(sys.exc_info())
+
+
     def _run(self):
         # ..
-        LOG.debug("Creating tmpfs...")
-        self._tranzit_vol.size = int(self.chunk_size * self._transfer.num_workers * 1.2)
-        self._tranzit_vol.ensure(mkfs=True)
-        LOG.debug("Creating tmpfs...")
+        if not self.streaming:
+            LOG.debug("Creating tmpfs...")
+            self._tranzit_vol.size = int(self.chunk_size * self._transfer.num_workers * 1.2)
+            self._tranzit_vol.ensure(mkfs=True)
         try:
             res = self._transfer.run()
             LOG.debug("self._transfer finished")
@@ -890,8 +1013,9 @@ class LargeTransfer(bases.Task):
                 else:
                     return self.manifest
         finally:
-            LOG.debug("Destroying tmpfs")
-            self._tranzit_vol.destroy()
+            if not self.streaming:
+                LOG.debug("Destroying tmpfs")
+                self._tranzit_vol.destroy()
             coreutils.remove(self._tranzit_vol.mpoint)
 
 
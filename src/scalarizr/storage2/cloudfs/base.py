@@ -1,6 +1,7 @@
 import sys
 import urlparse
 import os
+import cStringIO
 
 
 class DriverError(Exception):
@@ -80,6 +81,43 @@ def decorate_public_methods(decorator):
     return DecoratePublicMethods
 
 
+class MemoryChunk(str):
+    """
+    Chunk of a stream kept in memory instead of a file.
+
+    Behaves like a chunk file path (drivers use it to name remote objects),
+    while data is read with :func:`open_source`. Call :meth:`release` when
+    chunk is uploaded to free it's buffer.
+    """
+
+    def __new__(cls, name, data):
+        obj = str.__new__(cls, name)
+        obj.data = data
+        obj.size = len(data)
+        return obj
+
+    def open(self):
+        return cStringIO.StringIO(self.data)
+
+    def release(self):
+        self.data = None
+
+
+def open_source(src):
+    """
+    Open upload source: local file path or :class:`MemoryChunk`
+    """
+    if isinstance(src, MemoryChunk):
+        return src.open()
+    return open(src, 'rb')
+
+
+def source_size(src):
+    if isinstance(src, MemoryChunk):
+        return src.size
+    return os.path.getsize(src)
+
+
 class CloudFileSystem(object):
 
     __metaclass__ = decorate_public_methods(raises(DriverError))
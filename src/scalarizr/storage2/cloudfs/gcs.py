@@ -11,7 +11,7 @@ import random
 from apiclient.http import MediaIoBaseUpload, MediaIoBaseDownload
 from apiclient.errors import HttpError
 
-from scalarizr.storage2.cloudfs.base import CloudFileSystem
+from scalarizr.storage2.cloudfs.base import CloudFileSystem, open_source
 from scalarizr.storage2.cloudfs import cloudfs_types
 from scalarizr.bus import bus
 from scalarizr.node import __node__
@@ -93,7 +93,7 @@ class GCSFileSystem(CloudFileSystem):
         if bucket not in buckets:
             self._create_bucket(bucket)
 
-        fd = open(local_path, 'rb')
+        fd = open_source(local_path)
         try:
             media = MediaIoBaseUpload(fd,
                     'application/octet-stream',
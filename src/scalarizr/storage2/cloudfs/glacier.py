@@ -6,7 +6,7 @@ import hashlib
 from urlparse import urlparse
 from scalarizr.node import __node__
 from boto.glacier.writer import chunk_hashes, tree_hash, bytes_to_hex
-from scalarizr.storage2.cloudfs.base import CloudFileSystem
+from scalarizr.storage2.cloudfs.base import CloudFileSystem, open_source, source_size
 
 
 class GlacierFilesystem(CloudFileSystem):
@@ -41,9 +41,9 @@ class GlacierFilesystem(CloudFileSystem):
         return response['UploadId']
 
     def multipart_put(self, upload_id, part_num, part):
-        fileobj = open(part, 'rb')
+        fileobj = open_source(part)
         bytes_to_upload = fileobj.read(self._part_size)
-        part_size = os.fstat(fileobj.fileno()).st_size
+        part_size = source_size(part)
 
         start_byte = part_num * self._part_size
         content_range = (start_byte, start_byte + part_size - 1)
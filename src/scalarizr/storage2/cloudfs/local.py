@@ -1,9 +1,11 @@
+from __future__ import with_statement
+
 import logging
 import os
 import shutil
 import errno
 
-from scalarizr.storage2.cloudfs.base import CloudFileSystem
+from scalarizr.storage2.cloudfs.base import CloudFileSystem, MemoryChunk
 from scalarizr.storage2.cloudfs import cloudfs_types
 
 
@@ -55,7 +57,13 @@ class LocalFileSystem(CloudFileSystem):
             if e.errno != 17:  # 17: already exists
                 raise
 
-        shutil.copy(src, path)
+        if isinstance(src, MemoryChunk):
+            if path.endswith("/"):
+                path = os.path.join(path, os.path.basename(src))
+            with open(path, 'wb') as fp:
+                fp.write(src.data)
+        else:
+            shutil.copy(src, path)
 
         res = path
         if res.endswith("/"):
@@ -6,7 +6,7 @@ import os
 import sys
 
 from scalarizr.node import __node__
-from scalarizr.storage2.cloudfs.base import CloudFileSystem
+from scalarizr.storage2.cloudfs.base import CloudFileSystem, open_source
 from scalarizr.storage2.cloudfs import cloudfs_types
 
 from boto.s3.key import Key
@@ -79,7 +79,7 @@ class S3FileSystem(CloudFileSystem):
             try:
                 key = Key(self._bucket)
                 key.name = key_name
-                file_ = open(local_path, "rb")
+                file_ = open_source(local_path)
                 LOG.debug("Actually uploading %s", os.path.basename(local_path))
                 key.set_contents_from_file(file_, policy=self.acl,
                         cb=report_to, num_cb=self.report_frequency)
@@ -5,7 +5,7 @@ import logging
 
 from swiftclient.client import ClientException
 
-from scalarizr.storage2.cloudfs.base import CloudFileSystem
+from scalarizr.storage2.cloudfs.base import CloudFileSystem, open_source
 from scalarizr.storage2.cloudfs import cloudfs_types
 from scalarizr.node import __node__
 
@@ -41,7 +41,7 @@ class SwiftFileSystem(CloudFileSystem):
         if object_.endswith("/"):
             object_ = os.path.join(object_, os.path.basename(local_path))
 
-        fd = open(local_path, 'rb')
+        fd = open_source(local_path)
         try:
             conn = self._get_connection()
             try:
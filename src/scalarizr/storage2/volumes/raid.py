@@ -100,7 +100,6 @@ class RaidVolume(base.Volume):
             disks = []
             snaps = []
             try:
-                # @todo: create disks concurrently
                 for disk_snap in self.snap['disks']:
                     if self._v1_compat:
                         disk_snap = disk_snap['snapshot']
@@ -146,12 +145,8 @@ class RaidVolume(base.Volume):
         # Making sure autoassembly is disabled before attaching disks
         self._disable_autoassembly()
 
-        disks = []
-        for disk in self.disks:
-            disk = storage2.volume(disk)
-            disk.ensure()
-            disks.append(disk)
-        self.disks = disks
+        self.disks = [storage2.volume(disk) for disk in self.disks]
+        storage2.concurrent_ensure(self.disks)
 
         disks_devices = [disk.device for disk in self.disks]
 
@@ -455,7 +450,7 @@ class RaidVolume(base.Volume):
                             new_disk = disk.clone()
                             new_disk.snap = snap
                             new_vol.disks.append(new_disk)
-                            new_disk.ensure()
+                        storage2.concurrent_ensure(new_vol.disks)
                     finally:
                         for s in snaps:
                             try:
@@ -468,10 +463,9 @@ class RaidVolume(base.Volume):
 
                 existing_raid_disk = new_vol.disks[0]
                 add_disks_count = new_len - current_len
-                for _ in range(add_disks_count):
-                    disk_to_add = existing_raid_disk.clone()
-                    added_disks.append(disk_to_add)
-                    disk_to_add.ensure()
+                disks_to_add = [existing_raid_disk.clone() for _ in range(add_disks_count)]
+                # Failed ensure destroys disks it has created itself
+                added_disks = storage2.concurrent_ensure(disks_to_add)
 
                 added_disks_devices = [d.device for d in added_disks]
                 mdadm.mdadm('manage', new_vol.raid_pv, add=True,
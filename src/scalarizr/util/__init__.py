@@ -15,6 +15,12 @@ import pkgutil
 import traceback
 import platform
 import functools
+import itertools
+import heapq
+import random
+import select
+import errno
+import Queue
 
 
 from scalarizr.bus import bus
@@ -514,73 +520,292 @@ def port_in_use(port):
         s.close()
 
         
-class PeriodicalExecutor:
+class _Alarm(object):
+    '''
+    Sleep that other threads can interrupt with wake().
+    Python 2 Condition.wait(timeout) naps in 50 ms steps until timeout,
+    select() on a pipe sleeps in kernel instead.
+    '''
+
+    def __init__(self):
+        self._event = None
+        if os.name == 'nt':
+            # select() accepts only sockets on Windows
+            self._event = threading.Event()
+            return
+        import fcntl
+        self._rfd, self._wfd = os.pipe()
+        for fd in (self._rfd, self._wfd):
+            fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+    def sleep(self, timeout=None):
+        if self._event:
+            self._event.wait(timeout)
+            self._event.clear()
+            return
+        try:
+            select.select([self._rfd], [], [], timeout)
+        except select.error, e:
+            if e.args[0] != errno.EINTR:
+                raise
+        try:
+            os.read(self._rfd, 4096)
+        except OSError, e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def wake(self):
+        if self._event:
+            self._event.set()
+            return
+        try:
+            os.write(self._wfd, '.')
+        except OSError, e:
+            # Pipe is full: sleeper is woken up anyway
+            if e.errno != errno.EAGAIN:
+                raise
+
+
+class PeriodicalExecutor(object):
+    '''
+    Runs registered tasks every `interval` seconds.
+
+    Scheduler thread keeps tasks in a heap ordered by deadline and sleeps
+    until the nearest one, due tasks are run by a pool of `workers` threads,
+    so a slow task doesn't hold back the others. A task never overlaps itself:
+    run that comes due while the previous one is still in progress is skipped.
+    Each run is delayed by a random part of `jitter` * interval to spread
+    tasks with equal intervals, run started later than `tolerance` seconds
+    after its deadline is counted as missed (see stats()).
+    '''
     _logger = None
     _tasks = None
     _lock = None
     _ex_thread = None
     _shutdown = None
-    
-    def __init__(self):
+
+    def __init__(self, workers=4, jitter=0.05, tolerance=1):
         self._logger = logging.getLogger(__name__ + '.PeriodicalExecutor')
         self._tasks = dict()
+        self._heap = []
+        self._seq = itertools.count()
+        self._due = Queue.Queue()
+        self._alarm = _Alarm()
+        self.jitter = jitter
+        self.tolerance = tolerance
         self._ex_thread = threading.Thread(target=self._executor, name='PeriodicalExecutor')
         self._ex_thread.setDaemon(True)
+        self._workers = []
+        for num in range(workers):
+            worker = threading.Thread(target=self._worker,
+                                      name='PeriodicalExecutor worker %d' % num)
+            worker.setDaemon(True)
+            self._workers.append(worker)
         self._lock = threading.Lock()
 
     def start(self):
-        self._shutdown = False          
+        self._shutdown = False
         self._ex_thread.start()
-        
+        for worker in self._workers:
+            worker.start()
+
     def shutdown(self):
         self._shutdown = True
-        self._ex_thread.join(1)
+        self._alarm.wake()
+        for _ in self._workers:
+            self._due.put(None)
+        deadline = time.time() + 1
+        for thread in [self._ex_thread] + self._workers:
+            thread.join(max(deadline - time.time(), 0))
 
     def add_task(self, fn, interval, title=None):
-        self._lock.acquire()
-        try:
+        with self._lock:
             if fn in self._tasks:
-                raise BaseException('Task %s already registered in executor with an interval %s minutes', 
-                        fn, self._tasks[fn])
+                raise BaseException('Task %s already registered in executor with an interval %s minutes',
+                        fn, self._tasks[fn]['interval'])
             if interval <= 0:
                 raise ValueError('interval should be > 0')
-            self._tasks[fn] = dict(fn=fn, interval=interval, title=title, last_exec_time=0)
-        finally:
-            self._lock.release()
+            task = dict(fn=fn, interval=interval, title=title, last_exec_time=0,
+                        running=False, runs=0, skipped=0, missed=0,
+                        max_delay=0, last_duration=None)
+            self._tasks[fn] = task
+            self._schedule(task, time.time())
+        self._alarm.wake()
 
     def remove_task(self, fn):
-        self._lock.acquire()
-        try:
-            if fn in self._tasks:
-                del self._tasks[fn]
-        finally:
-            self._lock.release()
-    
-    def _tasks_to_execute(self):
-        self._lock.acquire()            
-        try:
-            now = time.time()                       
-            return list(task for task in self._tasks.values()
-                            if now - task['last_exec_time'] > task['interval'])
-        finally:
-            self._lock.release()
-    
+        with self._lock:
+            # Heap entry is dropped when it comes due
+            self._tasks.pop(fn, None)
+
+    def stats(self):
+        '''
+        Returns per task counters, keyed by task title:
+        runs, skipped (overlapping runs), missed (started later than tolerance),
+        max_delay and last_duration in seconds
+        '''
+        with self._lock:
+            return dict((task['title'] or repr(task['fn']),
+                        dict((name, task[name]) for name in
+                             ('interval', 'runs', 'skipped', 'missed', 'max_delay', 'last_duration')))
+                        for task in self._tasks.values())
+
+    def _schedule(self, task, deadline):
+        task['deadline'] = deadline
+        run_at = deadline
+        if task['runs'] or task['running']:
+            run_at += random.uniform(0, self.jitter) * task['interval']
+        heapq.heappush(self._heap, (run_at, self._seq.next(), task))
+
+    def _dispatch(self, task, run_at, now):
+        if task['running']:
+            task['skipped'] += 1
+            self._logger.warn('Task %s is still running, skipping its next run',
+                              task['title'] or task['fn'])
+        else:
+            task['running'] = True
+            self._due.put((task, run_at))
+        deadline = task['deadline'] + task['interval']
+        if deadline <= now:
+            # Fell behind: don't try to catch up with a burst of runs
+            deadline = now + task['interval']
+        self._schedule(task, deadline)
+
     def _executor(self):
         while not self._shutdown:
-            for task in self._tasks_to_execute():
-                self._logger.debug('Executing task %s', task['title'] or task['fn'])
+            with self._lock:
+                now = time.time()
+                while self._heap and self._heap[0][0] <= now:
+                    run_at, _, task = heapq.heappop(self._heap)
+                    if self._tasks.get(task['fn']) is task:
+                        self._dispatch(task, run_at, now)
+                timeout = self._heap[0][0] - now if self._heap else None
+            self._alarm.sleep(timeout)
+
+    def _worker(self):
+        while True:
+            item = self._due.get()
+            if not item:
+                break
+            task, run_at = item
+            start = time.time()
+            delay = start - run_at
+            if delay > self.tolerance:
+                self._logger.debug('Task %s started %.1f seconds after its deadline',
+                                   task['title'] or task['fn'], delay)
+            self._logger.debug('Executing task %s', task['title'] or task['fn'])
+            try:
                 try:
-                    task['last_exec_time'] = time.time()
                     task['fn']()
                 except (BaseException, Exception), e:
                     self._logger.exception(e)
-                if self._shutdown:
-                    break
-            if not self._shutdown:
-                time.sleep(1)
-        
-                
-                
+            finally:
+                with self._lock:
+                    task['running'] = False
+                    task['last_exec_time'] = start
+                    task['last_duration'] = time.time() - start
+                    task['runs'] += 1
+                    task['max_delay'] = max(task['max_delay'], delay)
+                    if delay > self.tolerance:
+                        task['missed'] += 1
+
+
+class DebouncedReload(object):
+    '''
+    Coalesces config writes and service reloads.
+    The first request after a quiet period is committed in the calling thread,
+    requests arriving within `window` seconds after a commit are deferred
+    and committed together in one write and at most one reload.
+
+    A failed commit stays pending: deferred commits are retried every `window`
+    seconds, and the next flush() retries it in the caller's thread and raises
+    on failure. `error` holds the exception of the last failed commit.
+
+    commit -- callable(reload), writes config and reloads service when reload is True
+    '''
+
+    def __init__(self, commit, window=3):
+        self.commit = commit
+        self.window = window
+        self.error = None
+        self._lock = threading.Lock()
+        self._timer = None
+        self._pending = None
+        self._last = 0
+
+
+    def request(self, reload=True):
+        with self._lock:
+            self._pending = bool(self._pending) or reload
+            if self._timer:
+                return
+            delay = self._last + self.window - time.time()
+            if delay > 0:
+                self._schedule(delay)
+                return
+        self.flush()
+
+
+    def _schedule(self, delay):
+        self._timer = threading.Timer(delay, self._deferred)
+        self._timer.setDaemon(True)
+        self._timer.start()
+
+
+    def flush(self, reload=False):
+        '''
+        Commit pending changes right now, reload service if any of them
+        or the caller needs it
+        '''
+        with self._lock:
+            timer, self._timer = self._timer, None
+            if timer:
+                timer.cancel()
+            pending, self._pending = self._pending, None
+            commit = pending is not None or reload
+            if commit:
+                self._last = time.time()
+        if timer:
+            # don't leave cancelled timer thread behind
+            timer.join()
+        if commit:
+            reload = bool(pending) or reload
+            try:
+                self.commit(reload)
+            except:
+                exc_info = sys.exc_info()
+                with self._lock:
+                    self._pending = bool(self._pending) or reload
+                    self.error = exc_info[1]
+                raise exc_info[0], exc_info[1], exc_info[2]
+            self.error = None
+
+
+    @property
+    def pending(self):
+        return self._pending is not None
+
+
+    @property
+    def failed(self):
+        return self.error is not None
+
+
+    def _deferred(self):
+        with self._lock:
+            if self._timer is not threading.currentThread():
+                return
+            self._timer = None
+        try:
+            self.flush()
+        except:
+            LOG.error('Deferred config commit failed: %s, retrying in %s seconds',
+                    sys.exc_info()[1], self.window, exc_info=sys.exc_info())
+            with self._lock:
+                if not self._timer:
+                    self._schedule(self.window)
+
+
 def run_detached(binary, args=[], env=None):
     if not os.path.exists(binary):
         from . import software
@@ -11,6 +11,7 @@ import hashlib
 import re
 import os
 import time
+import threading
 
 try:
     with_m2crypto = True
@@ -24,10 +25,76 @@ except ImportError:
 
 crypto_algo = dict(name="des_ede3_cbc", key_size=24, iv_size=8)
 
+_key_cache = {}
+_key_cache_lock = threading.Lock()
+
 
 def keygen(length=40):
     return binascii.b2a_base64(os.urandom(length))
 
+
+def read_key(filename):
+    '''
+    Read base64 encoded key file and return decoded key.
+    Key is cached until file's mtime, size or inode changes
+    '''
+    st = os.stat(filename)
+    stamp = (st.st_mtime, st.st_size, st.st_ino)
+    with _key_cache_lock:
+        cached = _key_cache.get(filename)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    with open(filename) as fp:
+        key = binascii.a2b_base64(fp.read().strip())
+    with _key_cache_lock:
+        _key_cache[filename] = (stamp, key)
+    return key
+
+
+def invalidate_key(filename=None):
+    '''
+    Forget cached key. Call it after key file was rewritten
+    '''
+    with _key_cache_lock:
+        if filename:
+            _key_cache.pop(filename, None)
+        else:
+            _key_cache.clear()
+
+
+class _BoundedCache(dict):
+    '''
+    Small cache for per-key crypto objects.
+    When `size` keys are cached it is cleared before adding a new one,
+    so lookups stay lock-free
+    '''
+    def __init__(self, size=8):
+        self.size = size
+        self._lock = threading.Lock()
+
+    def get_or_create(self, key, fn):
+        try:
+            return self[key]
+        except KeyError:
+            value = fn(key)
+            with self._lock:
+                if len(self) >= self.size:
+                    self.clear()
+                self[key] = value
+            return value
+
+_hmac_cache = _BoundedCache()
+
+
+def hmac_sha1(key, msg):
+    '''
+    HMAC-SHA1 digest. Key setup is computed once per key and copied for each message
+    '''
+    base = _hmac_cache.get_or_create(key, lambda key: hmac.new(key, digestmod=hashlib.sha1))
+    h = base.copy()
+    h.update(msg)
+    return h.digest()
+
 if with_m2crypto:
     def _init_cipher(key, op_enc=1):
         skey = key[0:crypto_algo["key_size"]]   # Use first n bytes as crypto key
@@ -49,13 +116,20 @@ if with_m2crypto:
         return ret
 
 else:
-    def _new_cipher(key):
+    _cipher_cache = _BoundedCache()
+    _padding = padding.PKCS7(64)
+
+    def _create_cipher(key):
         skey = key[0:crypto_algo["key_size"]]   # Use first n bytes as crypto key
         iv = key[-crypto_algo["iv_size"]:]      # Use last m bytes as IV
         return Cipher(algorithms.TripleDES(skey), modes.CBC(iv), backend=default_backend())
 
+    def _new_cipher(key):
+        # Cipher is a reusable factory of encryption/decryption contexts
+        return _cipher_cache.get_or_create(key, _create_cipher)
+
     def _new_padding():
-        return padding.PKCS7(64)
+        return _padding
 
     def encrypt(s, key):
         enc = _new_cipher(key).encryptor()
@@ -74,17 +148,14 @@ else:
 
 def _get_canonical_string (params=None):
     params = params or {}
-    s = ""
-    for key, value in sorted(params.items()):
-        s = s + str(key) + str(value)
-    return s
+    return "".join(str(key) + str(value) for key, value in sorted(params.items()))
 
 def sign_http_request(data, key, timestamp=None):
     date = time.strftime("%a %d %b %Y %H:%M:%S %Z", timestamp or time.gmtime())
     canonical_string = _get_canonical_string(data) if hasattr(data, "__iter__") else data
     canonical_string += date
 
-    digest = hmac.new(key, canonical_string, hashlib.sha1).digest()
+    digest = hmac_sha1(key, canonical_string)
     sign = binascii.b2a_base64(digest)
     if sign.endswith('\n'):
         sign = sign[:-1]
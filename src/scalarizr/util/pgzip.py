@@ -0,0 +1,312 @@
+from __future__ import with_statement
+'''
+Parallel gzip compression in a thread pool (zlib releases GIL while
+deflating, so threads use all cores).
+
+Input is split into blocks, each block is compressed into a separate gzip
+member. Concatenated members are a standard gzip stream, readable by
+gzip/pigz. Every member stores it's size in the FEXTRA header field,
+so such streams are decompressed in parallel too. Streams made by other
+tools are decompressed sequentially.
+'''
+
+import os
+import sys
+import zlib
+import fcntl
+import Queue
+import struct
+import logging
+import threading
+import subprocess
+import collections
+import multiprocessing
+import cStringIO
+
+
+LOG = logging.getLogger(__name__)
+
+FTEXT, FHCRC, FEXTRA, FNAME, FCOMMENT = 1, 2, 4, 8, 16
+# Extra subfield with member size: 'S', 'Z', LEN=4, total member size
+SUBFIELD_ID = 'SZ'
+_HEADER = struct.Struct('<2sBBIBBH2sHI')
+_TRAILER = struct.Struct('<II')
+
+
+class GzipError(Exception):
+    pass
+
+
+def compress_block(data, level=5):
+    '''
+    Compress data into a single gzip member with member size in extra field
+    '''
+    c = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    deflated = c.compress(data) + c.flush()
+    size = _HEADER.size + len(deflated) + _TRAILER.size
+    header = _HEADER.pack('\x1f\x8b', 8, FEXTRA, 0, 0, 255, 8, SUBFIELD_ID, 4, size)
+    trailer = _TRAILER.pack(zlib.crc32(data) & 0xffffffff, len(data) & 0xffffffff)
+    return header + deflated + trailer
+
+
+def decompress_member(member):
+    '''
+    Decompress gzip member produced by :func:`compress_block`
+    '''
+    d = zlib.decompressobj(-zlib.MAX_WBITS)
+    data = d.decompress(member[_HEADER.size:-_TRAILER.size]) + d.flush()
+    crc, size = _TRAILER.unpack(member[-_TRAILER.size:])
+    if crc != zlib.crc32(data) & 0xffffffff or size != len(data) & 0xffffffff:
+        raise GzipError('CRC check failed')
+    return data
+
+
+class _Job(object):
+
+    def __init__(self, fn, arg):
+        self.fn = fn
+        self.arg = arg
+        self.done = threading.Event()
+        self.result = None
+        self.exc_info = None
+
+    def __call__(self):
+        try:
+            self.result = self.fn(self.arg)
+        except:
+            self.exc_info = sys.exc_info()
+        self.done.set()
+
+    def get(self):
+        self.done.wait()
+        if self.exc_info:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self.result
+
+
+def pmap(fn, iterable, threads):
+    '''
+    Ordered parallel map over (possibly endless) iterable.
+    At most 2 * threads items are in flight, so input is not read ahead of output
+    '''
+    jobs = Queue.Queue()
+
+    def worker():
+        while True:
+            job = jobs.get()
+            if job is None:
+                return
+            job()
+
+    pool = [threading.Thread(target=worker, name='pgzip-%d' % n) for n in range(threads)]
+    for t in pool:
+        t.setDaemon(True)
+        t.start()
+    try:
+        pending = collections.deque()
+        for item in iterable:
+            job = _Job(fn, item)
+            jobs.put(job)
+            pending.append(job)
+            if len(pending) >= threads * 2:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        for t in pool:
+            jobs.put(None)
+        for t in pool:
+            t.join()
+
+
+def read_blocks(fp, block_size):
+    while True:
+        data = fp.read(block_size)
+        if not data:
+            return
+        yield data
+
+
+def read_members(fp):
+    '''
+    Split gzip stream into items for decompression:
+    ('member', bytes) for members with size in extra field and
+    ('stream', header_bytes) for a foreign member, the rest of fp should be
+    decompressed sequentially then
+    '''
+    while True:
+        header = fp.read(_HEADER.size)
+        if not header:
+            return
+        if len(header) == _HEADER.size and header[:2] == '\x1f\x8b':
+            magic, cm, flg, mtime, xfl, os_, xlen, si, sublen, size = _HEADER.unpack(header)
+            if flg == FEXTRA and xlen == 8 and si == SUBFIELD_ID and sublen == 4:
+                member = header + fp.read(size - _HEADER.size)
+                if len(member) != size:
+                    raise GzipError('Unexpected end of gzip stream')
+                yield 'member', member
+                continue
+        yield 'stream', header
+        return
+
+
+def _inflate_stream(data, fp, write, buf_size=1024 * 1024):
+    # Sequential decompression of (possibly multi-member) gzip stream
+    d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    while True:
+        while data:
+            write(d.decompress(data))
+            data = d.unused_data
+            if data:
+                # Next member
+                d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        data = fp.read(buf_size)
+        if not data:
+            break
+    write(d.flush())
+
+
+def _cloexec_pipe():
+    r, w = os.pipe()
+    for fd in (r, w):
+        fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+    return r, w
+
+
+def _own_fp(fp, mode):
+    # Duplicate fd, so caller may close it's copy as with a child process
+    if hasattr(fp, 'fileno'):
+        fd = os.dup(fp.fileno())
+        fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+        return os.fdopen(fd, mode)
+    return fp
+
+
+class ParallelGzip(object):
+    '''
+    In-process replacement for `gzip`/`pigz` pipes.
+
+    Usage::
+
+        gz = ParallelGzip(level=6)
+        proc = gz.popen(stdin=open('dump.sql'))
+        upload(proc.stdout)
+        proc.wait()
+
+        proc = gz.popen(stdout=open('dump.sql', 'w'), decompress=True)
+        proc.stdin.write(data)
+        proc.stdin.close()
+        proc.wait()
+    '''
+
+    def __init__(self, level=5, block_size=1024 * 1024, threads=None):
+        '''
+        :param level: compression level 1-9
+        :param block_size: input block size in bytes, compressed in one thread
+        :param threads: number of compression threads, defaults to number of CPUs
+        '''
+        self.level = level
+        self.block_size = block_size
+        self.threads = threads or multiprocessing.cpu_count()
+
+    def __str__(self):
+        # Output is a regular gzip stream
+        return 'gzip'
+
+    def compress(self, fp):
+        '''
+        Generator of gzip members for data read from fp
+        '''
+        compress = lambda data: compress_block(data, self.level)
+        empty = True
+        for member in pmap(compress, read_blocks(fp, self.block_size), self.threads):
+            empty = False
+            yield member
+        if empty:
+            yield compress_block('', self.level)
+
+    def decompress(self, fp, write):
+        '''
+        Decompress gzip stream from fp, pass decompressed data to write()
+        '''
+        foreign = []
+
+        def decompress(item):
+            kind, data = item
+            if kind == 'member':
+                return decompress_member(data)
+            foreign.append(data)
+            return ''
+
+        for data in pmap(decompress, read_members(fp), self.threads):
+            write(data)
+        if foreign:
+            _inflate_stream(foreign[0], fp, write)
+
+    def popen(self, stdin=subprocess.PIPE, stdout=subprocess.PIPE, decompress=False, **kwds):
+        '''
+        Start (de)compression in a thread. Returns Popen-like object
+        '''
+        return _Process(self, stdin, stdout, decompress)
+
+
+class _Process(object):
+    '''
+    Popen-like handle of (de)compression thread
+    '''
+
+    def __init__(self, gzip, stdin, stdout, decompress):
+        self.stdin = self.stdout = None
+        self.returncode = None
+        self.error = None
+        if stdin == subprocess.PIPE:
+            r, w = _cloexec_pipe()
+            self.stdin = os.fdopen(w, 'wb')
+            self._input = os.fdopen(r, 'rb')
+        else:
+            self._input = _own_fp(stdin, 'rb')
+        if stdout == subprocess.PIPE:
+            r, w = _cloexec_pipe()
+            self.stdout = os.fdopen(r, 'rb')
+            self._output = os.fdopen(w, 'wb')
+        else:
+            self._output = _own_fp(stdout, 'wb')
+        self._thread = threading.Thread(target=self._run, args=(gzip, decompress),
+                                        name='pgzip')
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def _run(self, gzip, decompress):
+        try:
+            try:
+                if decompress:
+                    gzip.decompress(self._input, self._output.write)
+                else:
+                    for member in gzip.compress(self._input):
+                        self._output.write(member)
+                self.returncode = 0
+            except:
+                LOG.debug('pgzip failed', exc_info=sys.exc_info())
+                self.error = str(sys.exc_info()[1]) or repr(sys.exc_info()[1])
+                self.returncode = 1
+        finally:
+            for fp in (self._input, self._output):
+                try:
+                    fp.close()
+                except (IOError, OSError):
+                    pass
+
+    @property
+    def stderr(self):
+        return cStringIO.StringIO(self.error or '')
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self):
+        self._thread.join()
+        return self.returncode
+
+    def communicate(self):
+        self.wait()
+        return None, self.error
@@ -19,6 +19,33 @@ import sqlite3
 LOG = logging.getLogger(__name__)
 GLOBAL_TIMEOUT = 30
 
+def executebatch(conn, statements):
+    '''
+    Execute statements in a single transaction on autocommit connection
+    @param statements: [(sql, parameters), ...]
+    @return: list of rowcounts
+    '''
+    cur = conn.cursor()
+    try:
+        cur.execute('BEGIN IMMEDIATE')
+        try:
+            rowcounts = []
+            for sql, parameters in statements:
+                cur.execute(sql, parameters or [])
+                rowcounts.append(cur.rowcount)
+            cur.execute('COMMIT')
+            return rowcounts
+        except:
+            exc_info = sys.exc_info()
+            try:
+                cur.execute('ROLLBACK')
+            except sqlite3.Error:
+                pass
+            raise exc_info[0], exc_info[1], exc_info[2]
+    finally:
+        cur.close()
+
+
 class Proxy(object):
 
 
@@ -115,6 +142,17 @@ class ConnectionProxy(Proxy):
     def executescript(self, sql):
         return self._call('conn_executescript', [sql])
 
+    def executebatch(self, statements):
+        for _ in range(0, GLOBAL_TIMEOUT):
+            try:
+                return self._call('conn_executebatch', [statements])
+            except sqlite3.OperationalError, e:
+                if 'database is locked' in str(e):
+                    LOG.debug('Caught %s, retrying', e)
+                    time.sleep(1)
+                else:
+                    raise
+
     def _get_row_factory(self):
         return self._call('conn_get_row_factory')
 
@@ -255,6 +293,10 @@ class SqliteServer(object):
         return self._master_conn.executescript(sql)
 
 
+    def _conn_executebatch(self, hash, statements):
+        return executebatch(self._master_conn, statements)
+
+
     def _conn_execute(self, hash, *args, **kwds):
         cur = self._cursor_create(hash, self._single_conn_proxy)
         try:
@@ -281,6 +323,220 @@ class SqliteServer(object):
             self._cursor_delete(hash)
 
 
+WAL_MIN_SQLITE_VERSION = (3, 7, 0)
+
+
+def wal_supported():
+    return sqlite3.sqlite_version_info >= WAL_MIN_SQLITE_VERSION
+
+
+class PooledCursorProxy(object):
+    '''
+    CursorProxy compatible cursor over SQLitePool connections.
+    SELECT statements are executed on a calling thread's reader connection
+    and rows are fetched lazily, all other statements are serialized on
+    a single writer connection.
+    '''
+
+    def __init__(self, pool):
+        self._pool = pool
+        self._cursor = None
+        self._data = None
+        self._rowcount = -1
+
+
+    def execute(self, sql, parameters=None):
+        self.close()
+        args = [sql]
+        if parameters:
+            args += [parameters]
+        if self._pool.is_read(sql):
+            self._cursor = self._pool.reader().cursor()
+            self._pool.retry_locked(self._cursor.execute, *args)
+            self._rowcount = self._cursor.rowcount
+        else:
+            self._data, self._rowcount = self._pool.write(*args)
+        return self
+
+
+    def fetchone(self):
+        if self._cursor:
+            row = self._cursor.fetchone()
+            if row is None:
+                self.close()
+            return row
+        if self._data:
+            return self._data.pop(0)
+        return None
+
+
+    def fetchall(self):
+        if self._cursor:
+            try:
+                return self._cursor.fetchall()
+            finally:
+                self.close()
+                self._data = None
+        try:
+            return self._data
+        finally:
+            self._data = None
+
+
+    @property
+    def rowcount(self):
+        return self._rowcount
+
+
+    def close(self):
+        # Finalize statement, so reader connection doesn't hold an old WAL snapshot
+        if self._cursor:
+            try:
+                self._cursor.close()
+            except sqlite3.Error:
+                pass
+            self._cursor = None
+
+    __del__ = close
+
+
+class SQLitePool(object):
+    '''
+    ConnectionProxy compatible SQLite access in WAL mode:
+    per-thread reader connections (readers don't block each other and the writer)
+    plus a single writer connection guarded by a lock.
+
+    @param conn_creator: callable(**kwds) that returns sqlite3.Connection.
+    It's called with check_same_thread=False for the writer connection
+    '''
+
+    READ_STATEMENTS = ('SELECT', 'EXPLAIN')
+
+    def __init__(self, conn_creator):
+        self._conn_creator = conn_creator
+        self._local = threading.local()
+        self._readers = {}
+        self._readers_lock = threading.Lock()
+        self._write_lock = threading.RLock()
+        self._row_factory = _NULL
+        self._text_factory = _NULL
+
+        self._writer = conn_creator(check_same_thread=False)
+        self._writer.isolation_level = None
+        self.journal_mode = self._writer.execute('PRAGMA journal_mode=WAL').fetchone()[0]
+        # WAL is fsynced on every commit: message committed before it's acknowledged
+        # (P2pMessageStore.put_ingoing) must survive a power loss
+        self._writer.execute('PRAGMA synchronous=FULL')
+        if self.journal_mode.lower() != 'wal':
+            LOG.debug('SQLite (%s) failed to switch to WAL mode, readers may be blocked by writer',
+                      sqlite3.sqlite_version)
+
+
+    def connect(self):
+        return self
+
+
+    def cursor(self):
+        return PooledCursorProxy(self)
+
+
+    def commit(self):
+        # no worries, autocommit is set
+        pass
+
+
+    def executescript(self, sql):
+        with self._write_lock:
+            return self.retry_locked(self._writer.executescript, sql)
+
+
+    def executebatch(self, statements):
+        with self._write_lock:
+            return self.retry_locked(executebatch, self._writer, statements)
+
+
+    def is_read(self, sql):
+        words = sql.lstrip().split(None, 1)
+        return bool(words) and words[0].upper() in self.READ_STATEMENTS
+
+
+    def reader(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._conn_creator()
+            conn.isolation_level = None
+            self._apply_factories(conn)
+            self._local.conn = conn
+            with self._readers_lock:
+                # Forget connections of finished threads
+                alive = set(t.ident for t in threading.enumerate())
+                for ident in self._readers.keys():
+                    if ident not in alive:
+                        del self._readers[ident]
+                self._readers[threading.currentThread().ident] = conn
+        return conn
+
+
+    def write(self, *args):
+        with self._write_lock:
+            cur = self._writer.cursor()
+            try:
+                self.retry_locked(cur.execute, *args)
+                return cur.fetchall(), cur.rowcount
+            finally:
+                cur.close()
+
+
+    def retry_locked(self, fn, *args):
+        # Other processes (ScalrUpdClient) may lock database for a while.
+        # Busy timeout is handled by sqlite itself, here we only stretch it
+        delay = 0.05
+        deadline = time.time() + GLOBAL_TIMEOUT
+        while True:
+            try:
+                return fn(*args)
+            except sqlite3.OperationalError, e:
+                if 'database is locked' in str(e) and time.time() < deadline:
+                    LOG.debug('Caught %s, retrying', e)
+                    time.sleep(delay)
+                    delay = min(delay * 2, 1)
+                else:
+                    raise
+
+
+    def _apply_factories(self, conn):
+        if self._row_factory is not _NULL:
+            conn.row_factory = self._row_factory
+        if self._text_factory is not _NULL:
+            conn.text_factory = self._text_factory
+
+
+    def _connections(self):
+        with self._readers_lock:
+            return [self._writer] + self._readers.values()
+
+
+    def _get_row_factory(self):
+        return self._writer.row_factory
+
+    def _set_row_factory(self, f):
+        self._row_factory = f
+        for conn in self._connections():
+            conn.row_factory = f
+
+    row_factory = property(_get_row_factory, _set_row_factory)
+
+    def _get_text_factory(self):
+        return self._writer.text_factory
+
+    def _set_text_factory(self, f):
+        self._text_factory = f
+        for conn in self._connections():
+            conn.text_factory = f
+
+    text_factory = property(_get_text_factory, _set_text_factory)
+
+
 class _NULL(object):
     pass
 
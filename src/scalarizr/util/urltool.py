@@ -5,7 +5,16 @@ Created on May 23, 2011
 @author: marat
 '''
 
+import time
+import errno
+import base64
+import socket
+import httplib
+import urllib
 import urllib2
+import urlparse
+import threading
+import cStringIO
 
 class HTTPRedirectHandler(urllib2.HTTPRedirectHandler):
 
@@ -40,3 +49,190 @@ class HTTPRedirectHandler(urllib2.HTTPRedirectHandler):
             raise urllib2.HTTPError(req.get_full_url(), code, msg, headers, fp)
 
     http_error_305 = urllib2.HTTPRedirectHandler.http_error_302
+
+
+class HTTPConnectionPool(object):
+    '''
+    Persistent (keep-alive) HTTP/HTTPS connections.
+    Idle connections are kept per (scheme, host, port) and reused by subsequent requests.
+    Redirects are followed the same way HTTPRedirectHandler does.
+    Errors are raised as urllib2.HTTPError/URLError, so callers can switch from urllib2 openers.
+    Proxies are taken from environment (http_proxy, https_proxy, no_proxy) as urllib2 does:
+    plain HTTP requests are sent to proxy, HTTPS ones are tunneled with CONNECT.
+
+    Counters in `stats`:
+        requests - requests sent (redirects included)
+        connections - new connections established
+        reused - requests sent over already established connection
+        handshake_time - total seconds spent in TCP (and TLS) connection setup
+    '''
+
+    max_redirects = 10
+
+    def __init__(self, maxsize=4, timeout=None):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+        self.stats = dict(requests=0, connections=0, reused=0, handshake_time=0.0)
+
+
+    def request(self, method, url, body=None, headers=None):
+        '''
+        @return: httplib.HTTPResponse with already read body in `data` attribute
+        '''
+        headers = dict(headers or {})
+        for _ in range(self.max_redirects + 1):
+            resp = self._request(method, url, body, headers)
+            if 300 <= resp.status < 400 and resp.getheader('location') \
+                    and self._redirect_allowed(method, resp.status):
+                url = urlparse.urljoin(url, resp.getheader('location').replace(' ', '%20'))
+                # urllib2 repeats redirected POST as GET without body
+                method, body = 'GET', None
+                headers = dict((k, v) for k, v in headers.items()
+                               if k.lower() not in ('content-length', 'content-type'))
+                continue
+            if not 200 <= resp.status < 300:
+                raise urllib2.HTTPError(url, resp.status, resp.reason, resp.msg,
+                                        cStringIO.StringIO(resp.data))
+            return resp
+        raise urllib2.HTTPError(url, resp.status, 'Too many redirects', resp.msg,
+                                cStringIO.StringIO(resp.data))
+
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+
+    def _redirect_allowed(self, method, code):
+        return code in (301, 302, 303, 307) and method in ('GET', 'HEAD') \
+                or code in (301, 302, 303, 305) and method == 'POST'
+
+
+    def _request(self, method, url, body, headers):
+        r = urlparse.urlparse(url)
+        proxy = self._proxy_for(r.scheme, r.hostname)
+        key = (r.scheme, r.hostname, r.port, proxy)
+        path = r.path or '/'
+        if r.query:
+            path += '?' + r.query
+        if proxy and r.scheme != 'https':
+            path = '%s://%s%s' % (r.scheme, r.netloc, path)
+            auth = self._proxy_auth(proxy)
+            if auth:
+                headers = dict(headers, **{'Proxy-Authorization': auth})
+
+        conn = self._checkout(key)
+        reused = conn is not None
+        while True:
+            if conn is None:
+                conn = self._connect(key)
+            try:
+                conn.request(method, path, body, headers)
+                resp = conn.getresponse()
+            except (httplib.HTTPException, socket.error), e:
+                conn.close()
+                if reused and self._stale_connection(e):
+                    # Server has closed idle keep-alive connection, retry on a new one
+                    reused = False
+                    conn = None
+                    continue
+                if isinstance(e, socket.error):
+                    raise urllib2.URLError(e)
+                raise
+            try:
+                resp.data = resp.read()
+            except (httplib.HTTPException, socket.error), e:
+                # Request was processed, never retry it
+                conn.close()
+                if isinstance(e, socket.error):
+                    raise urllib2.URLError(e)
+                raise
+            break
+
+        with self._lock:
+            self.stats['requests'] += 1
+            if reused:
+                self.stats['reused'] += 1
+        if resp.will_close:
+            conn.close()
+        else:
+            self._checkin(key, conn)
+        return resp
+
+
+    def _stale_connection(self, exc):
+        # Only errors that mean the server had closed idle connection before
+        # it read the request: reset or broken pipe while sending, or before
+        # any response byte. Timeouts are never retried, since the request
+        # may have been processed already
+        if isinstance(exc, socket.timeout):
+            return False
+        if isinstance(exc, socket.error):
+            return bool(exc.args) and exc.args[0] in (errno.ECONNRESET, errno.EPIPE)
+        # Empty status line: connection was closed without a response
+        return isinstance(exc, httplib.BadStatusLine) and exc.line in ('', "''")
+
+
+    def _proxy_for(self, scheme, host):
+        # Read on every request, as urllib2.ProxyHandler reads it for every opener
+        proxy = urllib.getproxies().get(scheme)
+        if not proxy or urllib.proxy_bypass(host):
+            return None
+        if '://' not in proxy:
+            proxy = 'http://' + proxy
+        return proxy
+
+
+    def _proxy_auth(self, proxy):
+        r = urlparse.urlparse(proxy)
+        if r.username:
+            userpass = '%s:%s' % (urllib.unquote(r.username), urllib.unquote(r.password or ''))
+            return 'Basic ' + base64.b64encode(userpass)
+
+
+    def _connect(self, key):
+        scheme, host, port, proxy = key
+        cls = httplib.HTTPSConnection if scheme == 'https' else httplib.HTTPConnection
+        kwds = {}
+        if self.timeout:
+            kwds['timeout'] = self.timeout
+        if proxy:
+            r = urlparse.urlparse(proxy)
+            conn = cls(r.hostname, r.port, **kwds)
+            if scheme == 'https':
+                auth = self._proxy_auth(proxy)
+                conn.set_tunnel(host, port, auth and {'Proxy-Authorization': auth} or None)
+        else:
+            conn = cls(host, port, **kwds)
+        start = time.time()
+        try:
+            conn.connect()
+            # Small requests on a long-living connection shouldn't wait for delayed ACKs
+            conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except socket.error, e:
+            raise urllib2.URLError(e)
+        with self._lock:
+            self.stats['connections'] += 1
+            self.stats['handshake_time'] += time.time() - start
+        return conn
+
+
+    def _checkout(self, key):
+        with self._lock:
+            conns = self._idle.get(key)
+            if conns:
+                return conns.pop()
+
+
+    def _checkin(self, key, conn):
+        with self._lock:
+            conns = self._idle.setdefault(key, [])
+            if len(conns) < self.maxsize:
+                conns.append(conn)
+                return
+        conn.close()
@@ -0,0 +1,108 @@
+'''
+Helpers shared by scalarizr micro-benchmarks.
+
+Benchmarks are standalone scripts, run them from the source tree:
+
+    PYTHONPATH=src python tests/benchmarks/<name>.py [options]
+'''
+from __future__ import with_statement
+
+import os
+import sys
+import time
+import sqlite3
+import tempfile
+import contextlib
+
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+SRC_PATH = os.path.join(ROOT, 'src')
+DB_SCRIPT = os.path.join(ROOT, 'share', 'db.sql')
+
+if SRC_PATH not in sys.path:
+    sys.path.insert(0, SRC_PATH)
+
+
+def create_db(filename=None):
+    '''
+    Create scalarizr database from share/db.sql
+    @return: database file name
+    '''
+    if not filename:
+        fd, filename = tempfile.mkstemp(prefix='szr-bench-', suffix='.sqlite')
+        os.close(fd)
+    conn = sqlite3.connect(filename)
+    try:
+        conn.executescript(open(DB_SCRIPT).read())
+        conn.commit()
+    finally:
+        conn.close()
+    return filename
+
+
+def conn_creator(filename):
+    def creator(**kwds):
+        conn = sqlite3.connect(filename, 5.0, **kwds)
+        conn.row_factory = sqlite3.Row
+        conn.text_factory = sqlite3.OptimizedUnicode
+        return conn
+    return creator
+
+
+def start_sqlite_server(filename):
+    '''
+    Start SQLiteServerThread the same way as scalarizr.app._init_db does
+    @return: ConnectionProxy
+    '''
+    from scalarizr.util import sqlite_server
+    t = sqlite_server.SQLiteServerThread(conn_creator(filename))
+    t.setDaemon(True)
+    t.start()
+    sqlite_server.wait_for_server_thread(t)
+    return t.connection
+
+
+def start_sqlite_pool(filename):
+    '''
+    @return: SQLitePool
+    '''
+    from scalarizr.util import sqlite_server
+    return sqlite_server.SQLitePool(conn_creator(filename))
+
+
+@contextlib.contextmanager
+def timer(result, key):
+    start = time.time()
+    try:
+        yield
+    finally:
+        result[key] = time.time() - start
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    idx = int(round((len(values) - 1) * pct / 100.0))
+    return values[idx]
+
+
+def report(title, rows, columns):
+    '''
+    Print benchmark results as a plain text table
+    @param rows: list of dicts
+    @param columns: list of (key, header, format) tuples
+    '''
+    print title
+    print '-' * len(title)
+    table = [[header for _, header, _ in columns]]
+    for row in rows:
+        cells = []
+        for key, _, fmt in columns:
+            value = row.get(key, '')
+            cells.append(fmt % value if value != '' else '')
+        table.append(cells)
+    widths = [max(len(line[i]) for line in table) for i in range(len(columns))]
+    for line in table:
+        print '  '.join(cell.rjust(w) for cell, w in zip(line, widths))
+    print
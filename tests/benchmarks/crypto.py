@@ -0,0 +1,83 @@
+'''
+Message security filter cost: key file read + decode, cipher and HMAC setup
+per message (former P2pMessageSecurity) vs cached key, cipher and HMAC state.
+
+    PYTHONPATH=src python tests/benchmarks/crypto.py -n 5000
+'''
+from __future__ import with_statement
+
+import os
+import sys
+import time
+import hmac
+import hashlib
+import logging
+import binascii
+import optparse
+import tempfile
+
+import benchutil
+
+from scalarizr.util import cryptotool
+
+
+def legacy_roundtrip(key_path, data):
+    with open(key_path) as fp:
+        key = binascii.a2b_base64(fp.read().strip())
+    enc = cryptotool.encrypt(data, key)
+    hmac.new(key, enc, hashlib.sha1).digest()
+    with open(key_path) as fp:
+        key = binascii.a2b_base64(fp.read().strip())
+    cryptotool.decrypt(enc, key)
+
+
+def cached_roundtrip(key_path, data):
+    key = cryptotool.read_key(key_path)
+    enc = cryptotool.encrypt(data, key)
+    cryptotool.hmac_sha1(key, enc)
+    key = cryptotool.read_key(key_path)
+    cryptotool.decrypt(enc, key)
+
+
+def run(name, roundtrip, key_path, num_messages, size):
+    data = 'x' * size
+    start = time.time()
+    for _ in xrange(num_messages):
+        roundtrip(key_path, data)
+    elapsed = time.time() - start
+    return {
+        'mode': name,
+        'size': size,
+        'msg_per_sec': num_messages / elapsed,
+        'usec_per_msg': elapsed / num_messages * 1000000
+    }
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-n', '--num-messages', type='int', default=5000)
+    parser.add_option('-s', '--sizes', default='256,4096,65536', help='Comma separated message sizes')
+    opts, _ = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    fd, key_path = tempfile.mkstemp()
+    try:
+        os.write(fd, cryptotool.keygen(40))
+        os.close(fd)
+        rows = []
+        for size in map(int, opts.sizes.split(',')):
+            rows.append(run('per message setup', legacy_roundtrip, key_path, opts.num_messages, size))
+            rows.append(run('cached', cached_roundtrip, key_path, opts.num_messages, size))
+    finally:
+        os.remove(key_path)
+
+    benchutil.report('encrypt + sign + decrypt, %d messages' % opts.num_messages, rows, [
+        ('mode', 'mode', '%s'),
+        ('size', 'bytes', '%d'),
+        ('msg_per_sec', 'msg/s', '%.1f'),
+        ('usec_per_msg', 'usec/msg', '%.1f')
+    ])
+
+
+if __name__ == '__main__':
+    sys.exit(main())
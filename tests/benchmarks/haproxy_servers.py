@@ -0,0 +1,164 @@
+'''
+Autoscaling burst through HAProxyAPI.add_server/remove_server:
+config reparse + write + reload per server (former add_server/remove_server)
+vs runtime updates over the stats socket and coalesced reloads.
+
+haproxy is not started: reload is a sleep of --reload-cost seconds
+and the stats socket is a stand-in that accepts enable/disable server.
+
+    PYTHONPATH=src python tests/benchmarks/haproxy_servers.py -n 50
+'''
+from __future__ import with_statement
+
+import os
+import sys
+import time
+import shutil
+import logging
+import optparse
+import tempfile
+import threading
+import SocketServer
+
+import benchutil
+
+from scalarizr.api import haproxy as haproxy_api
+from scalarizr.services import haproxy
+
+
+HAPROXY_CFG = '''global
+    stats socket /var/run/haproxy-stats.sock level admin
+
+defaults
+    timeout connect 5000ms
+
+listen scalr:listen:tcp:80
+    mode tcp
+    bind *:80
+    default_backend scalr:backend:tcp:80
+
+backend scalr:backend:tcp:80
+    mode tcp
+'''
+
+
+class StatsHandler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        self.rfile.readline()
+        self.wfile.write('\n')
+
+
+class StatsServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+class Service(object):
+
+    def __init__(self, cost):
+        self.cost = cost
+        self.reloads = 0
+
+    def status(self):
+        return 0
+
+    def reload(self):
+        time.sleep(self.cost)
+        self.reloads += 1
+
+
+class LegacyHAProxyAPI(haproxy_api.HAProxyAPI):
+
+    def add_server(self, server=None, backend=None):
+        self.cfg.reload()
+        bnds = self.cfg.sections(haproxy.naming('backend', backend=backend))
+        server.setdefault("check", True)
+        server = haproxy_api.rename(server)
+        for bnd in bnds:
+            self.cfg.backends[bnd]['server'][self._server_name(server)] = server
+        self.cfg.save()
+        self.svc.reload()
+
+    def remove_server(self, server, backend=None):
+        srv_name = self._server_name(server)
+        for bd in self.cfg.sections(haproxy.naming('backend', backend=backend)):
+            if srv_name in self.cfg.backends[bd]['server']:
+                del self.cfg.backends[bd]['server'][srv_name]
+        self.cfg.save()
+        if self.svc.status() == 0:
+            self.svc.reload()
+
+
+def make_api(cls, tmp_dir, reload_cost):
+    path = os.path.join(tmp_dir, 'haproxy.cfg')
+    with open(path, 'w') as fp:
+        fp.write(HAPROXY_CFG)
+    api = cls.__new__(cls)
+    haproxy_api.HAProxyAPI.__init__(api, path)
+    api.stats = haproxy.StatSocket(os.path.join(tmp_dir, 'stats.sock'))
+    api.svc = Service(reload_cost)
+    return api
+
+
+def run(name, cls, tmp_dir, num_servers, reload_cost):
+    api = make_api(cls, tmp_dir, reload_cost)
+    ips = ['10.0.0.%d' % (n + 1) for n in range(num_servers)]
+    start = time.time()
+    # scale out, scale in half of the servers, scale out again
+    for ip in ips:
+        api.add_server({'host': ip, 'port': 80}, backend='tcp:80')
+    for ip in ips[::2]:
+        api.remove_server({'host': ip, 'port': 80}, backend='tcp:80')
+    for ip in ips[::2]:
+        api.add_server({'host': ip, 'port': 80}, backend='tcp:80')
+    api._commits.flush()
+    elapsed = time.time() - start
+    servers = haproxy.HAProxyCfg(api.cfg.cnf_path).backends['scalr:backend:tcp:80']['server']
+    assert len(list(servers)) == num_servers
+    calls = num_servers * 2
+    return {
+        'mode': name,
+        'calls': calls,
+        'reloads': api.svc.reloads,
+        'elapsed': elapsed,
+        'per_sec': calls / elapsed
+    }
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-n', '--num-servers', type='int', default=50)
+    parser.add_option('-c', '--reload-cost', type='float', default=0.1,
+                      help='Seconds spent in one haproxy reload')
+    opts, _ = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    tmp_dir = tempfile.mkdtemp()
+    stats = StatsServer(os.path.join(tmp_dir, 'stats.sock'), StatsHandler)
+    thread = threading.Thread(target=stats.serve_forever, args=(0.05, ))
+    thread.setDaemon(True)
+    thread.start()
+    try:
+        rows = [
+            run('write + reload per call', LegacyHAProxyAPI, tmp_dir,
+                opts.num_servers, opts.reload_cost),
+            run('runtime + coalesced', haproxy_api.HAProxyAPI, tmp_dir,
+                opts.num_servers, opts.reload_cost)
+        ]
+    finally:
+        stats.shutdown()
+        stats.server_close()
+        shutil.rmtree(tmp_dir)
+
+    benchutil.report('%d servers up, half down and up again, reload %.2fs' % (
+                     opts.num_servers, opts.reload_cost), rows, [
+        ('mode', 'mode', '%s'),
+        ('calls', 'api calls', '%d'),
+        ('reloads', 'reloads', '%d'),
+        ('elapsed', 'seconds', '%.2f'),
+        ('per_sec', 'calls/s', '%.1f')
+    ])
+
+
+if __name__ == '__main__':
+    sys.exit(main())
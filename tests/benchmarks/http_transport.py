@@ -0,0 +1,125 @@
+'''
+Message POST cost: new urllib2 opener per message (former P2pMessageProducer._send0)
+vs keep-alive urltool.HTTPConnectionPool.
+
+Plain HTTP by default, pass --cert/--key to measure over TLS.
+
+    PYTHONPATH=src python tests/benchmarks/http_transport.py -n 2000
+'''
+from __future__ import with_statement
+
+import ssl
+import sys
+import time
+import urllib2
+import logging
+import optparse
+import threading
+import SocketServer
+import BaseHTTPServer
+
+import benchutil
+
+from scalarizr.util import urltool
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send response in one segment, otherwise Nagle delays keep-alive responses
+    wbufsize = -1
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(201, 'Created')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def start_server(certfile=None, keyfile=None):
+    server = Server(('127.0.0.1', 0), Handler)
+    scheme = 'http'
+    if certfile:
+        server.socket = ssl.wrap_socket(server.socket, certfile=certfile,
+                                        keyfile=keyfile, server_side=True)
+        scheme = 'https'
+    t = threading.Thread(target=server.serve_forever)
+    t.setDaemon(True)
+    t.start()
+    return server, '%s://127.0.0.1:%d' % (scheme, server.server_port)
+
+
+def send_urllib2(url, data, headers):
+    req = urllib2.Request(url, data, headers)
+    opener = urllib2.build_opener(urltool.HTTPRedirectHandler())
+    try:
+        opener.open(req).read()
+    except urllib2.HTTPError, e:
+        if e.code != 201:
+            raise
+
+
+def run(name, send, endpoint, num_messages, size):
+    data = '{"name": "OperationProgress", "body": {"progress": "%s"}}' % ('x' * size)
+    headers = {'Content-Type': 'application/json'}
+    latencies = []
+    start = time.time()
+    for _ in xrange(num_messages):
+        t = time.time()
+        send(endpoint + '/control', data, headers)
+        latencies.append((time.time() - t) * 1000)
+    elapsed = time.time() - start
+    return {
+        'transport': name,
+        'msg_per_sec': num_messages / elapsed,
+        'lat_p50': benchutil.percentile(latencies, 50),
+        'lat_p99': benchutil.percentile(latencies, 99)
+    }
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-n', '--num-messages', type='int', default=1000)
+    parser.add_option('-s', '--size', type='int', default=512, help='Payload size')
+    parser.add_option('--cert', help='Server certificate to benchmark HTTPS')
+    parser.add_option('--key', help='Server private key')
+    opts, _ = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    if opts.cert:
+        # self-signed certificate
+        ssl._create_default_https_context = ssl._create_unverified_context
+    server, endpoint = start_server(opts.cert, opts.key)
+    try:
+        pool = urltool.HTTPConnectionPool()
+
+        def send_pool(url, data, headers):
+            pool.request('POST', url, data, headers)
+
+        rows = [
+            run('urllib2 opener', send_urllib2, endpoint, opts.num_messages, opts.size),
+            run('connection pool', send_pool, endpoint, opts.num_messages, opts.size)
+        ]
+        rows[1].update(pool.stats)
+    finally:
+        server.shutdown()
+
+    benchutil.report('POST %s, %d messages' % (endpoint, opts.num_messages), rows, [
+        ('transport', 'transport', '%s'),
+        ('msg_per_sec', 'msg/s', '%.1f'),
+        ('lat_p50', 'p50 ms', '%.2f'),
+        ('lat_p99', 'p99 ms', '%.2f'),
+        ('connections', 'connections', '%d'),
+        ('reused', 'reused', '%d'),
+        ('handshake_time', 'handshake s', '%.3f')
+    ])
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,212 @@
+'''
+FarmSecurityMixin on a farm of many servers: initial rules and a burst of
+HostInit/HostDown. Former rule engine (--list-rules, then iptables exec per
+missing rule, per-rule delete on HostDown) vs one iptables-save snapshot and
+one iptables-restore per call vs ipset farm set matched by a rule per port.
+
+iptables and ipset are replaced with tests/unit/fixtures/linux/fake_iptables.py
+(a python script keeping rules in a JSON file, so an exec costs more than
+a real iptables one, but real ones also lock and reload the kernel table).
+
+    PYTHONPATH=src python tests/benchmarks/iptables_rules.py -n 200 -e 20
+'''
+from __future__ import with_statement
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import optparse
+import tempfile
+
+import benchutil
+
+from scalarizr import linux
+from scalarizr.handlers import FarmSecurityMixin
+from scalarizr.linux import iptables, ipset
+
+
+FAKE_IPTABLES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '../unit/fixtures/linux/fake_iptables.py')
+PORTS = [8008, 8010, 8012, 8013, 8014]
+
+
+class LegacyChain(iptables._Chain):
+
+    def ensure(self, rules, append=False):
+        existing = self.list()
+        for rule in reversed(rules):
+            rule_repr = iptables._to_inner(rule)
+            if rule_repr not in existing:
+                if not append:
+                    self.insert(None, rule)
+                    existing.insert(0, rule_repr)
+                else:
+                    self.append(rule)
+                    existing.append(rule_repr)
+
+
+class LegacyIptables(object):
+    FIREWALL = LegacyChain('INPUT')
+
+
+class NoIpset(object):
+
+    @staticmethod
+    def enabled():
+        return False
+
+
+class Platform(object):
+
+    def get_private_ip(self):
+        return '10.0.0.1'
+
+    def get_public_ip(self):
+        return '54.0.0.1'
+
+
+class Host(object):
+
+    def __init__(self, n):
+        self.internal_ip = '10.0.%d.%d' % (n / 250, n % 250 + 2)
+        self.external_ip = '54.0.%d.%d' % (n / 250, n % 250 + 2)
+
+
+class Role(object):
+
+    def __init__(self, hosts):
+        self.hosts = hosts
+
+
+class QueryEnv(object):
+
+    def __init__(self, num_hosts):
+        self.num_hosts = num_hosts
+
+    def list_roles(self, with_init=None):
+        return [Role([Host(n) for n in range(self.num_hosts)])]
+
+
+class FarmSecurity(FarmSecurityMixin):
+
+    def __init__(self, ports, num_hosts, iptables_mod, ipset_mod):
+        FarmSecurityMixin.__init__(self)
+        self._logger = logging.getLogger(__name__)
+        self._ports = ports
+        self._iptables = iptables_mod
+        self._ipset = ipset_mod
+        self._platform = Platform()
+        self._queryenv = QueryEnv(num_hosts)
+        self._FarmSecurityMixin__insert_iptables_rules()
+        self._FarmSecurityMixin__enabled = True
+
+
+class LegacyFarmSecurity(FarmSecurity):
+
+    def on_HostDown(self, message):
+        rules = []
+        for port in self._ports:
+            rules += self._FarmSecurityMixin__accept_host(message.local_ip,
+                                                          message.remote_ip, port)
+        for rule in rules:
+            try:
+                self._iptables.FIREWALL.remove(rule)
+            except linux.LinuxError, e:
+                if 'does a matching rule exist in that chain' not in str(e):
+                    raise
+
+
+class Message(object):
+
+    def __init__(self, host):
+        self.local_ip = host.internal_ip
+        self.remote_ip = host.external_ip
+
+
+def make_tools(tmp_dir):
+    paths = {}
+    for tool in ('iptables', 'iptables-save', 'iptables-restore', 'ipset'):
+        path = paths[tool] = os.path.join(tmp_dir, tool)
+        with open(path, 'w') as fp:
+            fp.write('#!/bin/sh\nexec %s %s %s "$@"\n' % (sys.executable, FAKE_IPTABLES, tool))
+        os.chmod(path, 0755)
+    iptables.IPTABLES_BIN = paths['iptables']
+    iptables.IPTABLES_SAVE = paths['iptables-save']
+    iptables.IPTABLES_RESTORE = paths['iptables-restore']
+    ipset.IPSET_BIN = paths['ipset']
+    os.environ['PATH'] = '%s:%s' % (tmp_dir, os.environ.get('PATH', ''))
+
+
+def read_state():
+    with open(os.environ['FAKE_IPTABLES_STATE']) as fp:
+        return json.load(fp)
+
+
+def run(name, cls, iptables_mod, ipset_mod, tmp_dir, opts):
+    os.environ['FAKE_IPTABLES_STATE'] = os.path.join(tmp_dir, name + '.json')
+    start = time.time()
+    mixin = cls(PORTS, opts.num_hosts, iptables_mod, ipset_mod)
+    init_elapsed = time.time() - start
+    init_execs = read_state()['execs']
+
+    hosts = [Host(opts.num_hosts + n) for n in range(opts.num_events)]
+    start = time.time()
+    for host in hosts:
+        mixin.on_HostInit(Message(host))
+    for host in hosts[::2]:
+        mixin.on_HostDown(Message(host))
+    elapsed = time.time() - start
+
+    state = read_state()
+    events = len(hosts) + len(hosts[::2])
+    rules = state['tables']['filter']['INPUT']
+    entries = state['sets'].get(FarmSecurityMixin.farm_ipset, [])
+    # every farm server is let in on every port one way or another
+    assert len(rules) + len(entries) * len(PORTS) >= \
+            (opts.num_hosts + len(hosts) / 2) * 2 * len(PORTS)
+    return {
+        'mode': name,
+        'init_execs': init_execs,
+        'init_elapsed': init_elapsed,
+        'rules': len(rules),
+        'execs_per_event': float(state['execs'] - init_execs) / events,
+        'ms_per_event': elapsed * 1000 / events
+    }
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-n', '--num-hosts', type='int', default=200)
+    parser.add_option('-e', '--num-events', type='int', default=20,
+                      help='HostInit events, half of the servers go down then')
+    opts, _ = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        make_tools(tmp_dir)
+        rows = [
+            run('exec per rule (former)', LegacyFarmSecurity, LegacyIptables,
+                NoIpset, tmp_dir, opts),
+            run('save + restore', FarmSecurity, iptables, NoIpset, tmp_dir, opts),
+            run('ipset', FarmSecurity, iptables, ipset, tmp_dir, opts)
+        ]
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    benchutil.report('%d farm servers, %d ports, %d HostInit' % (
+                     opts.num_hosts, len(PORTS), opts.num_events), rows, [
+        ('mode', 'mode', '%s'),
+        ('init_execs', 'init execs', '%d'),
+        ('init_elapsed', 'init seconds', '%.2f'),
+        ('rules', 'rules', '%d'),
+        ('execs_per_event', 'execs/event', '%.1f'),
+        ('ms_per_event', 'ms/event', '%.1f')
+    ])
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,174 @@
+'''
+Scalarizr API over JSON-RPC: a large result validated by json.dumps and
+then serialized again (former RequestHandler.handle_request) vs encoded
+once, and N single metric calls vs one JSON-RPC batch of them.
+
+Calls go through WsgiApplication (signature, encryption) served by the same
+threading wsgiref server scalarizr uses, the API method spends --method-cost
+ms in sleep.
+
+    PYTHONPATH=src python tests/benchmarks/jsonrpc_batch.py -n 20
+'''
+from __future__ import with_statement
+
+import os
+import sys
+import time
+import shutil
+import logging
+import optparse
+import tempfile
+import threading
+import SocketServer
+import wsgiref.simple_server
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+import benchutil
+
+from scalarizr import rpc
+from scalarizr.api.binding import jsonrpc_http
+from scalarizr.util import cryptotool
+
+
+class SystemService(object):
+    method_cost = 0
+
+    @rpc.query_method
+    def mounts(self, num=0):
+        return dict(('/mnt/vol%d' % n, {'device': '/dev/xvd%d' % n, 'fstype': 'ext3',
+                     'options': 'rw,noatime', 'mpoint': '/mnt/vol%d' % n}) for n in range(num))
+
+    @rpc.query_method
+    def disk_stats(self):
+        time.sleep(self.method_cost)
+        return dict(('xvda%d' % n, {'read': {'num': 1000 + n, 'sectors': 8000, 'bytes': 4096000},
+                     'write': {'num': 500, 'sectors': 4000, 'bytes': 2048000}}) for n in range(4))
+
+
+class LegacyRequestHandler(rpc.RequestHandler):
+
+    def _encode_response(self, id, result, error, log_it=False):
+        if not error:
+            try:
+                json.dumps(result)
+            except:
+                error = self._error(sys.exc_info())
+        resp = {'error': error} if error else {'result': result}
+        resp['id'] = id
+        return json.dumps(resp)
+
+
+class WSGIServer(SocketServer.ThreadingMixIn, wsgiref.simple_server.WSGIServer):
+    daemon_threads = True
+
+
+class QuietHandler(wsgiref.simple_server.WSGIRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+
+def bench_encoding(opts):
+    rows = []
+    for name, cls in (('validate + encode (former)', LegacyRequestHandler),
+                      ('encode once', rpc.RequestHandler)):
+        handler = cls({None: SystemService()})
+        req = {'id': 1, 'method': 'mounts', 'params': {'num': opts.num_mounts}}
+        start = time.time()
+        for _ in range(opts.repeat):
+            resp = handler.handle_request(req)
+        elapsed = time.time() - start
+        rows.append({
+            'mode': name,
+            'size': len(resp) / 1024.0,
+            'ms_per_call': elapsed * 1000 / opts.repeat
+        })
+    benchutil.report('mounts() result with %d entries' % opts.num_mounts, rows, [
+        ('mode', 'mode', '%s'),
+        ('size', 'response KB', '%.0f'),
+        ('ms_per_call', 'ms/call', '%.1f')
+    ])
+
+
+def bench_batch(opts, key_path):
+    SystemService.method_cost = opts.method_cost / 1000.0
+    handler = rpc.RequestHandler({'system': SystemService()}, batch_workers=opts.workers)
+    app = jsonrpc_http.WsgiApplication(handler, key_path)
+    server = wsgiref.simple_server.make_server('127.0.0.1', 0, app,
+                    server_class=WSGIServer, handler_class=QuietHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+    endpoint = 'http://127.0.0.1:%d' % server.server_port
+    client = jsonrpc_http.HttpServiceProxy(endpoint, key_path)
+
+    def single():
+        for _ in range(opts.num_calls):
+            client.system.disk_stats()
+
+    def batch(workers):
+        def call():
+            handler.batch_workers = workers
+            req = json.dumps([{'id': n, 'method': 'disk_stats', 'params': {}}
+                              for n in range(opts.num_calls)])
+            client.local.method = ['system', 'disk_stats']
+            try:
+                resp = json.loads(client.exchange(req))
+            finally:
+                client.local.method = []
+            assert len(resp) == opts.num_calls and all('result' in r for r in resp)
+        return call
+
+    rows = []
+    try:
+        for name, fn, round_trips in (
+                ('single calls', single, opts.num_calls),
+                ('batch, sequential', batch(1), 1),
+                ('batch, %d workers' % opts.workers, batch(opts.workers), 1)):
+            start = time.time()
+            for _ in range(opts.repeat):
+                fn()
+            elapsed = time.time() - start
+            rows.append({
+                'mode': name,
+                'round_trips': round_trips,
+                'ms': elapsed * 1000 / opts.repeat
+            })
+    finally:
+        server.shutdown()
+    benchutil.report('%d disk_stats() calls, %.0fms each' % (
+                     opts.num_calls, opts.method_cost), rows, [
+        ('mode', 'mode', '%s'),
+        ('round_trips', 'HTTP requests', '%d'),
+        ('ms', 'ms total', '%.1f')
+    ])
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-n', '--num-calls', type='int', default=20)
+    parser.add_option('-c', '--method-cost', type='float', default=5.0,
+                      help='Milliseconds spent in API method')
+    parser.add_option('-w', '--workers', type='int', default=4,
+                      help='RequestHandler.batch_workers')
+    parser.add_option('-m', '--num-mounts', type='int', default=20000)
+    parser.add_option('-r', '--repeat', type='int', default=10)
+    opts, _ = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        key_path = os.path.join(tmp_dir, 'default')
+        with open(key_path, 'w') as fp:
+            fp.write(cryptotool.keygen())
+        bench_encoding(opts)
+        bench_batch(opts, key_path)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,90 @@
+'''
+LargeTransfer upload of a piped stream to the file:// driver:
+chunks written to a tmpfs transit volume vs streaming from memory.
+
+Legacy mode mounts tmpfs, so run it as root.
+
+    PYTHONPATH=src python tests/benchmarks/largetransfer.py -s 1024 -c 100
+'''
+from __future__ import with_statement
+
+import os
+import sys
+import time
+import shutil
+import logging
+import optparse
+import tempfile
+import subprocess
+
+import benchutil
+
+from scalarizr.storage2 import cloudfs
+from scalarizr.storage2.cloudfs import local  # registers file://
+
+
+def run(name, streaming, source_file, size, chunk_size, num_workers, compressor):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        source = subprocess.Popen(['cat', source_file], stdout=subprocess.PIPE, close_fds=True)
+        transfer = cloudfs.LargeTransfer(source.stdout, 'file://%s/' % tmp_dir,
+                                         compressor=compressor,
+                                         chunk_size=chunk_size,
+                                         streaming=streaming,
+                                         num_workers=num_workers)
+        start = time.time()
+        manifest = transfer.run()
+        elapsed = time.time() - start
+        source.wait()
+        assert manifest, 'Upload failed'
+        if streaming:
+            transit = chunk_size * num_workers
+        else:
+            transit = int(chunk_size * num_workers * 1.2)
+        return {
+            'mode': name,
+            'elapsed': elapsed,
+            'mb_per_sec': size / elapsed,
+            'chunks': len(manifest['files'][0]['chunks']),
+            'transit': transit
+        }
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-s', '--size', type='int', default=1024, help='Stream size in megabytes')
+    parser.add_option('-c', '--chunk-size', type='int', default=100, help='Chunk size in megabytes')
+    parser.add_option('-w', '--workers', type='int', default=4)
+    parser.add_option('--gzip', action='store_true', default=False)
+    opts, _ = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    compressor = 'gzip' if opts.gzip else None
+    # Incompressible data, like an already compressed xtrabackup stream
+    fd, source_file = tempfile.mkstemp()
+    try:
+        with os.fdopen(fd, 'w') as fp:
+            for _ in xrange(opts.size):
+                fp.write(os.urandom(1024 * 1024))
+        rows = [
+            run('tmpfs transit', False, source_file, opts.size,
+                opts.chunk_size, opts.workers, compressor),
+            run('streaming', True, source_file, opts.size,
+                opts.chunk_size, opts.workers, compressor)
+        ]
+    finally:
+        os.remove(source_file)
+    benchutil.report('LargeTransfer %d MB, %d MB chunks, %d workers' % (
+                     opts.size, opts.chunk_size, opts.workers), rows, [
+        ('mode', 'mode', '%s'),
+        ('elapsed', 'seconds', '%.2f'),
+        ('mb_per_sec', 'MB/s', '%.1f'),
+        ('chunks', 'chunks', '%d'),
+        ('transit', 'max transit MB', '%d')
+    ])
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,104 @@
+'''
+Scalr fetching scalarizr debug log: whole file read, base64 encoded and
+encrypted on every get_debug_log() call (former) vs following it with
+a cursor, tail and gzip.
+
+Calls go through rpc.RequestHandler and cryptotool.encrypt as in
+WsgiApplication, the log is --size MB of scalarizr-like lines and
+--append KB are appended between follow polls.
+
+    PYTHONPATH=src python tests/benchmarks/log_retrieval.py -s 20
+'''
+from __future__ import with_statement
+
+import os
+import sys
+import time
+import shutil
+import logging
+import optparse
+import tempfile
+
+import benchutil
+
+from scalarizr import rpc
+from scalarizr.api import system
+from scalarizr.util import cryptotool
+
+
+LINE = '2014-05-12 10:01:02,345 - DEBUG - scalarizr.handlers.script_executor - ' \
+       'Executing script "App deploy %d" in async mode\n'
+
+
+def write_lines(path, size, mode='a'):
+    chunk = ''.join(LINE % n for n in range(1000))
+    with open(path, mode) as fp:
+        for _ in range(size / len(chunk)):
+            fp.write(chunk)
+        fp.write(chunk[:size % len(chunk)])
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-s', '--size', type='float', default=20.0,
+                      help='Log size in MB')
+    parser.add_option('-a', '--append', type='int', default=64,
+                      help='KB appended between follow polls')
+    parser.add_option('-r', '--repeat', type='int', default=5)
+    opts, _ = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        api = system.SystemAPI.__new__(system.SystemAPI)
+        api._DEBUG_LOG_FILE = os.path.join(tmp_dir, 'scalarizr_debug.log')
+        write_lines(api._DEBUG_LOG_FILE, int(opts.size * 1024 * 1024), 'w')
+        handler = rpc.RequestHandler({None: api})
+        key = cryptotool.keygen()
+
+        def call(params):
+            resp = handler.handle_request({'id': 1, 'method': 'get_debug_log', 'params': params})
+            assert '"error"' not in resp[:20], resp[:200]
+            return cryptotool.encrypt(resp, key)
+
+        def follow(gzip):
+            cursor = handler._handle({'id': 1, 'method': 'get_debug_log',
+                                      'params': {'tail': 0}}, None)[1]['cursor']
+            def poll():
+                write_lines(api._DEBUG_LOG_FILE, opts.append * 1024)
+                result = handler._handle({'id': 1, 'method': 'get_debug_log',
+                                          'params': {'cursor': state[0], 'gzip': gzip}}, None)[1]
+                state[0] = result['cursor']
+                resp = handler._encode_response(1, result, None)
+                return cryptotool.encrypt(resp, key)
+            state = [cursor]
+            return poll
+
+        rows = []
+        for name, poll in (
+                ('whole log (former)', lambda: call({})),
+                ('tail=64KB', lambda: call({'tail': 64 * 1024})),
+                ('follow cursor', follow(False)),
+                ('follow cursor, gzip', follow(True))):
+            start = time.time()
+            for _ in range(opts.repeat):
+                resp = poll()
+            elapsed = time.time() - start
+            rows.append({
+                'mode': name,
+                'size': len(resp) / 1024.0,
+                'ms_per_call': elapsed * 1000 / opts.repeat
+            })
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    benchutil.report('%.0f MB debug log, %d KB appended per follow poll' % (
+                     opts.size, opts.append), rows, [
+        ('mode', 'mode', '%s'),
+        ('size', 'response KB', '%.0f'),
+        ('ms_per_call', 'ms/call', '%.1f')
+    ])
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,92 @@
+'''
+Scalr polling system metrics of a server: cpu_stat, mem_info, disk_stats,
+net_stats and load_average RPCs parsing /proc on every call (deltas left
+to the poller) vs one metrics_snapshot RPC summarizing sampler history.
+
+Calls go through rpc.RequestHandler (JSON encoding included, no HTTP),
+sampler history is filled with an hour of real /proc samples up front.
+
+    PYTHONPATH=src python tests/benchmarks/metrics_snapshot.py -n 200
+'''
+import sys
+import time
+import logging
+import optparse
+
+import benchutil
+
+from scalarizr import rpc
+from scalarizr.api import system
+from scalarizr.linux import procsampler
+
+
+RAW_METHODS = ('cpu_stat', 'mem_info', 'disk_stats', 'net_stats', 'load_average')
+
+
+def make_api(sampler):
+    api = system.SystemAPI.__new__(system.SystemAPI)
+    system.SystemAPI._sampler = sampler
+    return api
+
+
+def call(handler, method, params=None):
+    resp = handler.handle_request({'id': 1, 'method': method, 'params': params or {}})
+    assert '"error"' not in resp[:20], resp
+    return resp
+
+
+def run(name, poll, num_polls):
+    sizes = 0
+    calls = 0
+    start = time.time()
+    for n in range(num_polls):
+        resps = poll(n)
+        calls += len(resps)
+        sizes += sum(len(r) for r in resps)
+    elapsed = time.time() - start
+    return {
+        'mode': name,
+        'calls': float(calls) / num_polls,
+        'bytes': float(sizes) / num_polls,
+        'ms_per_poll': elapsed * 1000 / num_polls
+    }
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-n', '--num-polls', type='int', default=200)
+    parser.add_option('-i', '--poll-interval', type='int', default=60,
+                      help='Seconds between Scalr polls, window of metrics_snapshot(since)')
+    opts, _ = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    sampler = procsampler.ProcSampler()
+    now = time.time()
+    start = time.time()
+    for n in range(sampler.capacity):
+        sampler.sample(now - (sampler.capacity - n) * sampler.interval)
+    tick_ms = (time.time() - start) * 1000 / sampler.capacity
+    sampler._thread = True  # history is filled by hand, don't start sampling thread
+
+    handler = rpc.RequestHandler({None: make_api(sampler)})
+    rows = [
+        run('5 raw RPCs (former)', lambda n: [call(handler, m) for m in RAW_METHODS],
+            opts.num_polls),
+        run('metrics_snapshot(since)', lambda n: [call(handler, 'metrics_snapshot',
+            {'since': now - opts.poll_interval})], opts.num_polls),
+        run('metrics_snapshot(), hour', lambda n: [call(handler, 'metrics_snapshot')],
+            opts.num_polls)
+    ]
+
+    benchutil.report('%d polls, sampler tick %.2fms every %ds, %d disks, %d ifaces' % (
+                     opts.num_polls, tick_ms, sampler.interval, len(sampler.disk),
+                     len(sampler.net)), rows, [
+        ('mode', 'mode', '%s'),
+        ('calls', 'RPCs/poll', '%d'),
+        ('bytes', 'bytes/poll', '%d'),
+        ('ms_per_poll', 'ms/poll', '%.2f')
+    ])
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,172 @@
+'''
+Autoscaling burst on a www role proxying many backends: proxying recreated
+from scratch on every HostUp/HostDown, each proxy rereading and writing
+includes (former NginxHandler), recreated with a single write, and only
+upstreams of the scaled role patched with coalesced reloads.
+
+nginx is not started: reload is a sleep of --reload-cost seconds,
+role servers come from a dict instead of queryenv. Former mode takes
+minutes per event with 500 backends, run it with --legacy and few events.
+
+    PYTHONPATH=src python tests/benchmarks/nginx_upstreams.py -n 500 -e 20
+    PYTHONPATH=src python tests/benchmarks/nginx_upstreams.py -n 500 -e 2 --legacy
+'''
+from __future__ import with_statement
+
+import os
+import sys
+import time
+import shutil
+import random
+import logging
+import optparse
+import tempfile
+
+import mock
+
+import benchutil
+
+from scalarizr.api import nginx
+
+
+class Service(object):
+
+    def __init__(self, cost):
+        self.cost = cost
+        self.reloads = 0
+
+    def status(self):
+        return 0
+
+    def reload(self):
+        time.sleep(self.cost)
+        self.reloads += 1
+
+    def set_port_to_check(self, port):
+        pass
+
+
+class RecreatingNginxAPI(nginx.NginxAPI):
+
+    def update_proxying(self, proxy_list, host, role_id, up=True, reload_service=True):
+        self.recreate_proxying(proxy_list, reload_service)
+
+
+class LegacyNginxAPI(RecreatingNginxAPI):
+
+    def recreate_proxying(self, proxy_list, reload_service=True):
+        self._clear_nginx_includes()
+        self.backend_table = {}
+        for proxy_parms in proxy_list:
+            if 'hostname' in proxy_parms:
+                proxy_parms['name'] = proxy_parms.pop('hostname')
+            self.add_proxy(reload_service=False, **proxy_parms)
+        if reload_service:
+            self._reload_service()
+
+
+def make_api(cls, tmp_dir, reload_cost):
+    api = cls.__new__(cls)
+    nginx.NginxAPI.__init__(api, tmp_dir, tmp_dir)
+    api.error_pages_inc = os.path.join(tmp_dir, 'error-pages.include')
+    api.service = Service(reload_cost)
+    api._load_app_servers_inc()
+    api._load_proxies_inc()
+    return api
+
+
+def make_proxies(num_backends, num_roles):
+    return [{'hostname': 'app%d.example.com' % n,
+             'port': '80',
+             'backend_max_fails': '3',
+             'backends': [{'farm_role_id': str(n % num_roles + 1), 'port': '8080'}]}
+            for n in range(num_backends)]
+
+
+def make_events(num_roles, num_events):
+    rnd = random.Random(0)
+    ups = [(str(rnd.randint(1, num_roles)), '10.1.%d.%d' % (n / 250, n % 250 + 1))
+           for n in range(num_events)]
+    return [(role_id, ip, True) for role_id, ip in ups] + \
+           [(role_id, ip, False) for role_id, ip in ups[::2]]
+
+
+def run(name, cls, tmp_dir, opts):
+    work_dir = tempfile.mkdtemp(dir=tmp_dir)
+    api = make_api(cls, work_dir, opts.reload_cost)
+    roles = dict((str(r), ['10.0.%d.%d' % (r / 250, r % 250 + 1)])
+                 for r in range(1, opts.num_roles + 1))
+
+    def get_role_servers(role_id=None, role_name=None, network=None):
+        return list(roles[str(role_id)])
+
+    with mock.patch.object(nginx, 'get_role_servers', get_role_servers):
+        with mock.patch.object(nginx, '_open_port'):
+            with mock.patch.object(api, '_old_style_ssl_on', return_value=False):
+                api.recreate_proxying(make_proxies(opts.num_backends, opts.num_roles))
+                api._reloads.flush()
+                api.service.reloads = 0
+
+                events = make_events(opts.num_roles, opts.num_events)
+                start = time.time()
+                for role_id, ip, up in events:
+                    if up:
+                        roles[role_id].append(ip)
+                    else:
+                        roles[role_id].remove(ip)
+                    # handler fetches proxies from queryenv on every event
+                    proxies = make_proxies(opts.num_backends, opts.num_roles)
+                    api.update_proxying(proxies, ip, role_id, up=up)
+                api._reloads.flush()
+                elapsed = time.time() - start
+
+    with open(api.app_inc_path) as fp:
+        app_servers_inc = fp.read()
+    return {
+        'mode': name,
+        'events': len(events),
+        'reloads': api.service.reloads,
+        'elapsed': elapsed,
+        'ms_per_event': elapsed * 1000 / len(events),
+        'conf': app_servers_inc
+    }
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-n', '--num-backends', type='int', default=500)
+    parser.add_option('-r', '--num-roles', type='int', default=50)
+    parser.add_option('-e', '--num-events', type='int', default=20,
+                      help='HostUp events, half of the servers go down then')
+    parser.add_option('-c', '--reload-cost', type='float', default=0.1,
+                      help='Seconds spent in one nginx reload')
+    parser.add_option('--legacy', action='store_true', default=False)
+    opts, _ = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        modes = [
+            ('recreate per event, single write', RecreatingNginxAPI),
+            ('patch upstreams + coalesced', nginx.NginxAPI)
+        ]
+        if opts.legacy:
+            modes.insert(0, ('recreate per event (former)', LegacyNginxAPI))
+        rows = [run(name, cls, tmp_dir, opts) for name, cls in modes]
+    finally:
+        shutil.rmtree(tmp_dir)
+    # all modes end up with the same upstreams
+    assert len(set(row['conf'] for row in rows)) == 1
+
+    benchutil.report('%d backends of %d roles, reload %.2fs' % (
+                     opts.num_backends, opts.num_roles, opts.reload_cost), rows, [
+        ('mode', 'mode', '%s'),
+        ('events', 'events', '%d'),
+        ('reloads', 'reloads', '%d'),
+        ('elapsed', 'seconds', '%.2f'),
+        ('ms_per_event', 'ms/event', '%.1f')
+    ])
+
+
+if __name__ == '__main__':
+    sys.exit(main())
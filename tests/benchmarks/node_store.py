@@ -0,0 +1,99 @@
+'''
+__node__ lookups per second: stores that read and parse their files
+on every lookup (former Ini/File) vs parsing once and checking mtime.
+
+    PYTHONPATH=src python tests/benchmarks/node_store.py -n 20000
+'''
+from __future__ import with_statement
+
+import os
+import sys
+import time
+import shutil
+import logging
+import optparse
+import tempfile
+
+import benchutil
+
+from scalarizr import node
+
+
+class UncachedIni(node.Ini):
+
+    def _cached_ini(self):
+        self._reload()
+        return self.ini
+
+
+class UncachedStateFile(node.StateFile):
+
+    def __getitem__(self, key):
+        try:
+            with open(self.filename) as fp:
+                return fp.read().strip()
+        except:
+            return 'unknown'
+
+
+def make_node(tmp_dir, ini_class, state_class):
+    private = os.path.join(tmp_dir, 'private.ini')
+    public = os.path.join(tmp_dir, 'public.ini')
+    with open(private, 'w') as fp:
+        fp.write('[general]\n')
+        for key in ('server_id', 'role_id', 'farm_id', 'farm_role_id', 'env_id'):
+            fp.write('%s = %s\n' % (key, os.urandom(8).encode('hex')))
+        fp.write('\n[messaging_p2p]\nmessage_format = json\n'
+                 'producer_url = http://scalr.example.com/messaging\n')
+    with open(public, 'w') as fp:
+        fp.write('[general]\nplatform_name = ec2\n'
+                 'crypto_key_path = private.d/keys/default\n')
+    with open(os.path.join(tmp_dir, '.state'), 'w') as fp:
+        fp.write('running')
+    return node.Compound({
+        'server_id,role_id,farm_id,farm_role_id,env_id': ini_class(private, 'general'),
+        'message_format,producer_url': ini_class(private, 'messaging_p2p'),
+        'platform_name,crypto_key_path': ini_class(public, 'general'),
+        'state': state_class(os.path.join(tmp_dir, '.state'))
+    })
+
+
+def run(name, ini_class, state_class, num_lookups):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        store = make_node(tmp_dir, ini_class, state_class)
+        keys = ['server_id', 'message_format', 'platform_name', 'state']
+        start = time.time()
+        for n in xrange(num_lookups):
+            store[keys[n % len(keys)]]
+        elapsed = time.time() - start
+    finally:
+        shutil.rmtree(tmp_dir)
+    return {
+        'mode': name,
+        'lookups': num_lookups,
+        'elapsed': elapsed,
+        'lookups_per_sec': num_lookups / elapsed
+    }
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-n', '--num-lookups', type='int', default=20000)
+    opts, _ = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    rows = [
+        run('parse every lookup', UncachedIni, UncachedStateFile, opts.num_lookups),
+        run('cached, mtime check', node.Ini, node.StateFile, opts.num_lookups)
+    ]
+    benchutil.report('__node__ lookups: ini keys and state file', rows, [
+        ('mode', 'mode', '%s'),
+        ('lookups', 'lookups', '%d'),
+        ('elapsed', 'seconds', '%.2f'),
+        ('lookups_per_sec', 'lookups/s', '%.0f')
+    ])
+
+
+if __name__ == '__main__':
+    sys.exit(main())
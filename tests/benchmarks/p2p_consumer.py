@@ -0,0 +1,137 @@
+'''
+POST -> handler latency and throughput of P2pMessageConsumer.
+
+Compares event-driven delivery (P2pMessageStore.wait_ingoing) with
+the former 100 ms polling loop that copied every pending message.
+
+    PYTHONPATH=src python tests/benchmarks/p2p_consumer.py -n 500
+'''
+from __future__ import with_statement
+
+import os
+import sys
+import time
+import socket
+import httplib
+import logging
+import optparse
+import threading
+
+import benchutil
+
+from scalarizr.bus import bus
+from scalarizr.messaging import p2p
+from scalarizr.messaging.p2p import P2pMessage, P2pMessageStore
+from scalarizr.messaging.p2p import consumer as p2p_consumer
+
+
+class PollingMessageConsumer(p2p_consumer.P2pMessageConsumer):
+    '''
+    Message handler loop as it was before event-driven delivery
+    '''
+
+    def message_handler(self):
+        store = P2pMessageStore()
+        self.handler_status = 'idle'
+        while self.running:
+            if not self.handler_locked:
+                try:
+                    for queue, message in store.get_unhandled(self.endpoint):
+                        msg_copy = P2pMessage()
+                        msg_copy.fromjson(message.tojson())
+                        self._handle_one_message(msg_copy, queue, store)
+                except (BaseException, Exception), e:
+                    self._logger.exception(e)
+            time.sleep(0.1)
+        self.handler_status = 'stopped'
+
+
+def free_port():
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+    finally:
+        s.close()
+
+
+def run(consumer_cls, num_messages, interval):
+    port = free_port()
+    consumer = consumer_cls('http://127.0.0.1:%d' % port)
+    consumer.filters['protocol'] = []
+
+    sent = {}
+    received = {}
+    all_received = threading.Event()
+
+    def listener(message, queue):
+        received[message.id] = time.time()
+        if len(received) == num_messages:
+            all_received.set()
+    consumer.listeners.append(listener)
+
+    t = threading.Thread(target=consumer.start)
+    t.setDaemon(True)
+    t.start()
+    while not consumer.running:
+        time.sleep(0.01)
+    time.sleep(0.2)
+
+    conn = httplib.HTTPConnection('127.0.0.1', port)
+    headers = {'Content-Type': 'application/json'}
+    start = time.time()
+    for i in xrange(num_messages):
+        msg = P2pMessage('BenchMessage', body={'seq': i})
+        msg.id = 'bench-%s-%d' % (consumer_cls.__name__, i)
+        sent[msg.id] = time.time()
+        conn.request('POST', '/control', msg.tojson(), headers)
+        conn.getresponse().read()
+        conn.close()
+        if interval:
+            time.sleep(interval)
+    all_received.wait(60 + num_messages * 0.2)
+    elapsed = time.time() - start
+    consumer.shutdown(force=True)
+
+    latencies = [(received[k] - sent[k]) * 1000 for k in received]
+    return {
+        'path': consumer_cls.__name__,
+        'messages': len(received),
+        'msg_per_sec': len(received) / elapsed,
+        'lat_avg': sum(latencies) / max(len(latencies), 1),
+        'lat_p50': benchutil.percentile(latencies, 50),
+        'lat_p99': benchutil.percentile(latencies, 99)
+    }
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-n', '--num-messages', type='int', default=300)
+    parser.add_option('-i', '--interval', type='float', default=0.0,
+                    help='Pause between POSTs in seconds')
+    opts, _ = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    rows = []
+    for consumer_cls in (PollingMessageConsumer, p2p_consumer.P2pMessageConsumer):
+        db_file = benchutil.create_db()
+        try:
+            bus.db = benchutil.start_sqlite_server(db_file)
+            rows.append(run(consumer_cls, opts.num_messages, opts.interval))
+        finally:
+            # Store caches unhandled messages, so start each run from scratch
+            p2p._message_store = None
+            os.remove(db_file)
+
+    benchutil.report('P2pMessageConsumer: POST -> handler', rows, [
+        ('path', 'path', '%s'),
+        ('messages', 'messages', '%d'),
+        ('msg_per_sec', 'msg/s', '%.1f'),
+        ('lat_avg', 'avg ms', '%.2f'),
+        ('lat_p50', 'p50 ms', '%.2f'),
+        ('lat_p99', 'p99 ms', '%.2f')
+    ])
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,105 @@
+'''
+p2p_message write path: commit per mutation vs group commit.
+
+Each message goes through put_ingoing -> mark_as_handled and
+put_outgoing -> mark_as_delivered, like a HostUp/HostDown burst.
+
+    PYTHONPATH=src python tests/benchmarks/p2p_store.py -n 10000 -t 4
+'''
+from __future__ import with_statement
+
+import os
+import sys
+import time
+import logging
+import optparse
+import threading
+
+import benchutil
+
+from scalarizr.bus import bus
+from scalarizr.messaging import p2p
+from scalarizr.messaging.p2p import P2pMessage
+
+
+ENGINES = {
+    'server': benchutil.start_sqlite_server,
+    'pool': benchutil.start_sqlite_pool
+}
+
+
+def run(name, engine, writer_kwds, num_messages, num_threads):
+    db_file = benchutil.create_db()
+    try:
+        bus.db = engine(db_file)
+        p2p._message_store = None
+        store = p2p.P2pMessageStore()
+        store._writer = p2p.GroupCommitWriter(store._conn, **writer_kwds)
+        errors = []
+
+        def work(offset):
+            try:
+                for i in xrange(offset, num_messages, num_threads):
+                    msg = P2pMessage('HostUp', body={
+                        'local_ip': '10.0.0.%d' % (i % 255),
+                        'platform_access_data': {'key': 'x' * 64}})
+                    msg.id = 'in-%d' % i
+                    store.put_ingoing(msg, 'control', 'bench')
+                    store.mark_as_handled(msg.id)
+
+                    msg = P2pMessage('HostUpAck', body={'seq': i})
+                    msg.id = 'out-%d' % i
+                    store.put_outgoing(msg, 'control', 'daemon')
+                    store.mark_as_delivered(msg.id)
+            except:
+                errors.append(sys.exc_info()[1])
+
+        threads = [threading.Thread(target=work, args=(n, )) for n in range(num_threads)]
+        start = time.time()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        store.flush()
+        elapsed = time.time() - start
+        if errors:
+            raise errors[0]
+
+        return {
+            'mode': name,
+            'elapsed': elapsed,
+            'msg_per_sec': num_messages / elapsed,
+            'ops': store._writer.ops,
+            'commits': store._writer.commits
+        }
+    finally:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(db_file + suffix):
+                os.remove(db_file + suffix)
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-n', '--num-messages', type='int', default=10000)
+    parser.add_option('-t', '--threads', type='int', default=4)
+    parser.add_option('-e', '--engine', choices=ENGINES.keys(), default='pool')
+    opts, _ = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    engine = ENGINES[opts.engine]
+    rows = [
+        run('commit per op', engine, dict(window=0, batch_size=1), opts.num_messages, opts.threads),
+        run('group commit', engine, {}, opts.num_messages, opts.threads)
+    ]
+    benchutil.report('p2p_message store: %d messages, %d threads, %s engine' % (
+                     opts.num_messages, opts.threads, opts.engine), rows, [
+        ('mode', 'mode', '%s'),
+        ('elapsed', 'seconds', '%.2f'),
+        ('msg_per_sec', 'msg/s', '%.1f'),
+        ('ops', 'operations', '%d'),
+        ('commits', 'commits', '%d')
+    ])
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,88 @@
+'''
+PeriodicalExecutor with one slow task among fast ones: single thread
+scanning tasks every second (former executor) vs deadline heap with
+a worker pool. Reports how far fast tasks drift from their interval.
+
+    PYTHONPATH=src python tests/benchmarks/periodical_executor.py -d 12
+'''
+import sys
+import time
+import logging
+import optparse
+
+import benchutil
+
+from scalarizr import util
+
+
+class ScanningExecutor(util.PeriodicalExecutor):
+
+    def __init__(self):
+        super(ScanningExecutor, self).__init__(workers=0)
+
+    def _executor(self):
+        while not self._shutdown:
+            with self._lock:
+                now = time.time()
+                tasks = [task for task in self._tasks.values()
+                         if now - task['last_exec_time'] > task['interval']]
+            for task in tasks:
+                try:
+                    task['last_exec_time'] = time.time()
+                    task['fn']()
+                except (BaseException, Exception), e:
+                    self._logger.exception(e)
+                if self._shutdown:
+                    break
+            if not self._shutdown:
+                time.sleep(1)
+
+
+def run(name, executor, opts):
+    calls = dict((num, []) for num in range(opts.num_tasks))
+    for num in range(opts.num_tasks):
+        executor.add_task(lambda num=num: calls[num].append(time.time()),
+                          opts.interval, 'fast %d' % num)
+    executor.add_task(lambda: time.sleep(opts.slow_duration), opts.interval, 'slow')
+    executor.start()
+    time.sleep(opts.duration)
+    executor.shutdown()
+
+    gaps = []
+    for times in calls.values():
+        gaps.extend(b - a for a, b in zip(times, times[1:]))
+    return {
+        'mode': name,
+        'runs': sum(len(times) for times in calls.values()),
+        'expected': int(opts.duration / opts.interval) * opts.num_tasks,
+        'mean_gap': sum(gaps) / len(gaps),
+        'max_gap': max(gaps)
+    }
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-d', '--duration', type='float', default=12)
+    parser.add_option('-n', '--num-tasks', type='int', default=5)
+    parser.add_option('-i', '--interval', type='float', default=1)
+    parser.add_option('-s', '--slow-duration', type='float', default=2.5,
+                      help='Duration of a slow task run, seconds')
+    opts, _ = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    rows = [
+        run('1s scan, one thread', ScanningExecutor(), opts),
+        run('heap + 4 workers', util.PeriodicalExecutor(jitter=0), opts)
+    ]
+    benchutil.report('%d tasks every %.1fs + one taking %.1fs, %.0f seconds' % (
+                     opts.num_tasks, opts.interval, opts.slow_duration, opts.duration), rows, [
+        ('mode', 'mode', '%s'),
+        ('runs', 'runs', '%d'),
+        ('expected', 'expected', '%d'),
+        ('mean_gap', 'mean gap, s', '%.2f'),
+        ('max_gap', 'max gap, s', '%.2f')
+    ])
+
+
+if __name__ == '__main__':
+    sys.exit(main())
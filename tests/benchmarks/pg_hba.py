@@ -0,0 +1,103 @@
+'''
+Registering farm servers in pg_hba.conf: former PgHbaConf (reparse the
+file on every records access) vs in-memory indexed records, one HostUp
+at a time and in one batch (accept_all_clients).
+
+    PYTHONPATH=src python tests/benchmarks/pg_hba.py -n 200
+'''
+from __future__ import with_statement
+
+import os
+import sys
+import time
+import logging
+import optparse
+import tempfile
+
+import benchutil
+
+from scalarizr.services import postgresql
+
+
+PG_HBA = '''local   all   postgres   trust
+host    all   all   127.0.0.1/32   md5
+'''
+
+
+class LegacyPgHbaConf(postgresql.PgHbaConf):
+
+    @property
+    def records(self):
+        l = []
+        with open(self.path, 'r') as fp:
+            text = fp.read()
+        for line in text.splitlines():
+            if line.strip() and not line.strip().startswith('#'):
+                l.append(postgresql.PgHbaRecord.from_string(line))
+        return l
+
+    def add_record(self, record, replace_similar=False):
+        if replace_similar:
+            for old_record in self.records:
+                if old_record != record and old_record.is_similar_to(record):
+                    self.delete_record(old_record)
+        if record not in self.records:
+            with open(self.path, 'a') as fp:
+                fp.write('\n'+str(record)+'\n')
+            return True
+        return False
+
+
+def run(name, conf_class, ips, batch, tmp_dir):
+    path = os.path.join(tmp_dir, 'pg_hba.conf')
+    with open(path, 'w') as fp:
+        fp.write(PG_HBA)
+    conf = conf_class(path)
+    start = time.time()
+    if batch:
+        with conf.batch():
+            for ip in ips:
+                conf.add_client(ip)
+    else:
+        for ip in ips:
+            # HostUp from every server, some of them twice
+            conf.add_client(ip)
+            conf.add_client(ips[0])
+    elapsed = time.time() - start
+    assert len(postgresql.PgHbaConf(path).records) == len(ips) + 2
+    os.remove(path)
+    return {
+        'mode': name,
+        'clients': len(ips),
+        'elapsed': elapsed,
+        'per_sec': len(ips) / elapsed
+    }
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-n', '--num-clients', type='int', default=200)
+    opts, _ = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    ips = ['10.0.%d.%d' % (n / 250, n % 250 + 1) for n in range(opts.num_clients)]
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        rows = [
+            run('reparse per call', LegacyPgHbaConf, ips, False, tmp_dir),
+            run('indexed, per HostUp', postgresql.PgHbaConf, ips, False, tmp_dir),
+            run('indexed, one batch', postgresql.PgHbaConf, ips, True, tmp_dir)
+        ]
+    finally:
+        os.rmdir(tmp_dir)
+
+    benchutil.report('add_client for %d servers' % opts.num_clients, rows, [
+        ('mode', 'mode', '%s'),
+        ('clients', 'clients', '%d'),
+        ('elapsed', 'seconds', '%.3f'),
+        ('per_sec', 'clients/s', '%.0f')
+    ])
+
+
+if __name__ == '__main__':
+    sys.exit(main())
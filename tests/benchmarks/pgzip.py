@@ -0,0 +1,125 @@
+'''
+Compression stage of LargeTransfer: gzip/pigz subprocess vs in-process
+ParallelGzip on synthetic mysqldump-like input.
+
+    PYTHONPATH=src python tests/benchmarks/pgzip.py -s 1024
+'''
+from __future__ import with_statement
+
+import os
+import sys
+import time
+import random
+import logging
+import optparse
+import tempfile
+import subprocess
+
+import benchutil
+
+from scalarizr.linux import which
+from scalarizr.util import pgzip
+
+
+def make_input(filename, size):
+    # 16 Mb of dump-like lines, repeated: farther apart than deflate window
+    rnd = random.Random(0)
+    lines = []
+    length = 0
+    while length < 16 * 1024 * 1024:
+        line = 'INSERT INTO `events` VALUES (%d,\'%s\',%d,\'%s\');\n' % (
+                rnd.randint(0, 1 << 30), rnd.choice(('login', 'logout', 'purchase', 'view')),
+                rnd.randint(0, 100000), '%032x' % rnd.getrandbits(128))
+        lines.append(line)
+        length += len(line)
+    block = ''.join(lines)
+    with open(filename, 'w') as fp:
+        written = 0
+        while written < size:
+            fp.write(block[:size - written])
+            written += len(block[:size - written])
+
+
+def run_subprocess(args, src, dst):
+    with open(src) as stdin:
+        with open(dst, 'w') as stdout:
+            subprocess.check_call(args, stdin=stdin, stdout=stdout, close_fds=True)
+
+
+def run_pgzip(gz, src, dst, decompress=False):
+    with open(src) as stdin:
+        with open(dst, 'w') as stdout:
+            proc = gz.popen(stdin=stdin, stdout=stdout, decompress=decompress)
+            assert proc.wait() == 0, proc.error
+
+
+def measure(name, fn, src, dst, size):
+    start = time.time()
+    fn(src, dst)
+    elapsed = time.time() - start
+    return {
+        'tool': name,
+        'elapsed': elapsed,
+        'mb_per_sec': size / 1048576.0 / elapsed,
+        'out_size': os.path.getsize(dst) / 1048576.0
+    }
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-s', '--size', type='int', default=1024, help='Input size in megabytes')
+    parser.add_option('-l', '--level', type='int', default=5)
+    parser.add_option('-b', '--block-size', type='int', default=1024, help='Block size in kilobytes')
+    parser.add_option('-t', '--threads', type='int', default=None)
+    opts, _ = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    gz = pgzip.ParallelGzip(level=opts.level, block_size=opts.block_size * 1024,
+                            threads=opts.threads)
+    tools = [('gzip', which('gzip'))]
+    if which('pigz'):
+        tools.append(('pigz', which('pigz')))
+
+    tmp_dir = tempfile.mkdtemp()
+    src = os.path.join(tmp_dir, 'input')
+    out = os.path.join(tmp_dir, 'output')
+    restored = os.path.join(tmp_dir, 'restored')
+    size = opts.size * 1048576
+    try:
+        make_input(src, size)
+        compress, decompress = [], []
+        for name, path in tools:
+            level = '-%d' % opts.level
+            compress.append(measure(name, lambda s, d: run_subprocess([path, level], s, d),
+                                    src, out, size))
+            decompress.append(measure(name, lambda s, d: run_subprocess([path, '-d'], s, d),
+                                      out, restored, size))
+            decompress.append(measure('ParallelGzip (%s stream)' % name,
+                                      lambda s, d: run_pgzip(gz, s, d, True), out, restored, size))
+        name = 'ParallelGzip x%d' % gz.threads
+        compress.append(measure(name, lambda s, d: run_pgzip(gz, s, d), src, out, size))
+        for tool_name, path in tools:
+            decompress.append(measure('%s (ParallelGzip stream)' % tool_name,
+                                      lambda s, d: run_subprocess([path, '-d'], s, d),
+                                      out, restored, size))
+        decompress.append(measure(name, lambda s, d: run_pgzip(gz, s, d, True), out, restored, size))
+        assert os.path.getsize(restored) == size
+    finally:
+        for filename in (src, out, restored):
+            if os.path.exists(filename):
+                os.remove(filename)
+        os.rmdir(tmp_dir)
+
+    columns = [
+        ('tool', 'tool', '%s'),
+        ('elapsed', 'seconds', '%.2f'),
+        ('mb_per_sec', 'MB/s', '%.1f'),
+        ('out_size', 'output MB', '%.1f')
+    ]
+    benchutil.report('compress %d MB, level %d' % (opts.size, opts.level), compress, columns)
+    print
+    benchutil.report('decompress %d MB' % opts.size, decompress, columns)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,109 @@
+'''
+Role setup statements through services.postgresql.PSQL: su + psql per
+statement (former PSQL.execute) vs one long-lived psql session.
+
+psql is replaced with tests/unit/fixtures/services/postgresql/fake_psql.py
+(a python script, its start-up is slower than psql's, but psql also has
+to connect and authenticate); su runs for real as root.
+
+    PYTHONPATH=src python tests/benchmarks/psql.py -n 5
+'''
+import os
+import sys
+import time
+import logging
+import optparse
+import tempfile
+
+import benchutil
+
+from scalarizr.util import system2
+from scalarizr.services import postgresql
+
+
+FAKE_PSQL = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         '../unit/fixtures/services/postgresql/fake_psql.py')
+
+
+def fake_psql_command(log):
+    return '%s %s %s' % (sys.executable, FAKE_PSQL, log)
+
+
+class SessionPSQL(postgresql.PSQLSession):
+    log = None
+
+    def _args(self):
+        return [postgresql.SU_EXEC, '-', 'root', '-c', fake_psql_command(self.log)]
+
+
+class SpawningPSQL(postgresql.PSQL):
+    log = None
+
+    def query(self, query, silent=False, **params):
+        lines = ["\\set %s '%s'" % (name, postgresql._psql_quote(value))
+                 for name, value in params.items()]
+        out = system2([postgresql.SU_EXEC, '-', 'root', '-c', fake_psql_command(self.log)],
+                      stdin='\n'.join(lines + [query]) + '\n', silent=True)[0]
+        return [tuple(line.split('|')) for line in out.splitlines()]
+
+
+def setup_roles(psql, num_roles):
+    for num in range(num_roles):
+        name = 'user%d' % num
+        name in psql.list_pg_databases()
+        psql.query('CREATE DATABASE :"name";', name=name)
+        name in psql.list_pg_roles()
+        psql.query('CREATE ROLE :"name" WITH SUPERUSER LOGIN;', name=name)
+        psql.query('ALTER USER :"name" WITH PASSWORD :\'password\';',
+                   name=name, password='secret')
+
+
+def run(name, psql, log, num_roles):
+    start = time.time()
+    setup_roles(psql, num_roles)
+    elapsed = time.time() - start
+    postgresql.PSQL.close_sessions()
+    with open(log) as fp:
+        spawns = fp.read().count('start')
+    return {
+        'mode': name,
+        'statements': num_roles * 5,
+        'spawns': spawns,
+        'elapsed': elapsed,
+        'per_sec': num_roles * 5 / elapsed
+    }
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-n', '--num-roles', type='int', default=5)
+    opts, _ = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    logs = [tempfile.mkstemp()[1] for _ in range(2)]
+    try:
+        SpawningPSQL.log = logs[0]
+        SessionPSQL.log = logs[1]
+        postgresql.PSQLSession, session_class = SessionPSQL, postgresql.PSQLSession
+        try:
+            rows = [
+                run('su + psql per statement', SpawningPSQL(), logs[0], opts.num_roles),
+                run('psql session', postgresql.PSQL(), logs[1], opts.num_roles)
+            ]
+        finally:
+            postgresql.PSQLSession = session_class
+    finally:
+        for log in logs:
+            os.remove(log)
+
+    benchutil.report('create %d databases and roles' % opts.num_roles, rows, [
+        ('mode', 'mode', '%s'),
+        ('statements', 'statements', '%d'),
+        ('spawns', 'psql starts', '%d'),
+        ('elapsed', 'seconds', '%.2f'),
+        ('per_sec', 'statements/s', '%.1f')
+    ])
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,172 @@
+'''
+QueryEnv calls made by handlers on a burst of HostUp messages: new urllib2
+opener and POST per call (former QueryEnvService.fetch) vs cached responses,
+coalesced concurrent requests and keep-alive connections.
+
+QueryEnv is a local HTTP server answering after --latency milliseconds.
+Every event MessageListener drops list-roles responses, then --handlers
+threads each call list_roles, list_global_variables, get_scaling_metrics
+and list_farm_role_params.
+
+    PYTHONPATH=src python tests/benchmarks/queryenv_cache.py -e 50
+'''
+from __future__ import with_statement
+
+import os
+import sys
+import time
+import shutil
+import urllib
+import urllib2
+import logging
+import optparse
+import tempfile
+import threading
+import SocketServer
+import BaseHTTPServer
+
+import benchutil
+
+from scalarizr import queryenv
+from scalarizr.util import cryptotool, urltool
+
+
+RESPONSES = {
+    'list-roles': '<?xml version="1.0" encoding="UTF-8"?><response><roles>%s</roles></response>' % ''.join(
+        '<role id="%d" behaviour="app" name="app%d"><hosts>%s</hosts></role>' % (r, r, ''.join(
+            '<host index="%d" internal-ip="10.0.%d.%d" external-ip="54.0.%d.%d" cloud-location="us-east-1"/>'
+            % (h, r, h, r, h) for h in range(1, 11))) for r in range(1, 6)),
+    'list-global-variables': '<?xml version="1.0" encoding="UTF-8"?><response><variables>%s</variables></response>' % ''.join(
+        '<variable name="VAR_%d">value %d</variable>' % (n, n) for n in range(50)),
+    'get-scaling-metrics': '<?xml version="1.0" encoding="UTF-8"?><response><metrics>'
+        '<metric id="1" name="custom"><path>/usr/local/bin/metric</path>'
+        '<retrieve-method>execute</retrieve-method></metric></metrics></response>',
+    'list-farm-role-params': '<?xml version="1.0" encoding="UTF-8"?><response><app>'
+        '<port>8080</port></app></response>'
+}
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1
+    latency = 0
+    requests = 0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        time.sleep(self.latency)
+        Handler.requests += 1
+        body = RESPONSES[self.path.rsplit('/', 1)[-1]]
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class LegacyQueryEnvService(queryenv.QueryEnvService):
+
+    def fetch(self, command, params=None, log_response=True):
+        url = "%s/%s/%s" % (self.url, self.api_version, command)
+        request_body = {"operation": command, "version": self.api_version}
+        request_body.update(params or {})
+        key = cryptotool.read_key(self.key_path)
+        signature, timestamp = cryptotool.sign_http_request(request_body, key)
+        post_data = urllib.urlencode(request_body)
+        headers = {
+            "Date": timestamp,
+            "X-Signature": signature,
+            "X-Server-Id": self.server_id
+        }
+        opener = urllib2.build_opener(urltool.HTTPRedirectHandler)
+        response = opener.open(urllib2.Request(url, post_data, headers))
+        resp_body = response.read()
+        return self.htmlparser.unescape(resp_body).encode('utf-8')
+
+
+def handle_event(qe, num_handlers):
+    def handler():
+        qe.list_roles(with_init=True)
+        qe.list_global_variables()
+        qe.get_scaling_metrics()
+        qe.list_farm_role_params(1)
+
+    qe.invalidate_for('HostUp')
+    threads = [threading.Thread(target=handler) for _ in range(num_handlers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def run(name, cls, url, key_path, opts):
+    qe = cls(url, '1', key_path)
+    Handler.requests = 0
+    start = time.time()
+    for _ in range(opts.num_events):
+        handle_event(qe, opts.num_handlers)
+    elapsed = time.time() - start
+    calls = opts.num_events * opts.num_handlers * 4
+    row = {
+        'mode': name,
+        'calls': calls,
+        'requests': Handler.requests,
+        'connections': qe.transport.stats['connections'],
+        'ms_per_event': elapsed * 1000 / opts.num_events
+    }
+    row.update(qe.stats)
+    if cls is LegacyQueryEnvService:
+        row['connections'] = Handler.requests
+    return row
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-e', '--num-events', type='int', default=50)
+    parser.add_option('-t', '--num-handlers', type='int', default=4,
+                      help='Handlers calling QueryEnv on every event')
+    parser.add_option('-l', '--latency', type='float', default=20.0,
+                      help='QueryEnv response time, ms')
+    opts, _ = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    Handler.latency = opts.latency / 1000.0
+    server = Server(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+    url = 'http://127.0.0.1:%d/query-env' % server.server_port
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        key_path = os.path.join(tmp_dir, 'default')
+        with open(key_path, 'w') as fp:
+            fp.write(cryptotool.keygen())
+        rows = [
+            run('opener per call (former)', LegacyQueryEnvService, url, key_path, opts),
+            run('cache + keep-alive', queryenv.QueryEnvService, url, key_path, opts)
+        ]
+    finally:
+        server.shutdown()
+        shutil.rmtree(tmp_dir)
+
+    benchutil.report('%d HostUp, %d handlers, QueryEnv latency %.0fms' % (
+                     opts.num_events, opts.num_handlers, opts.latency), rows, [
+        ('mode', 'mode', '%s'),
+        ('calls', 'calls', '%d'),
+        ('requests', 'requests', '%d'),
+        ('connections', 'connections', '%d'),
+        ('hits', 'hits', '%d'),
+        ('coalesced', 'coalesced', '%d'),
+        ('ms_per_event', 'ms/event', '%.1f')
+    ])
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,89 @@
+'''
+RaidVolume members restore: ensure() of each disk one after another
+(former RaidVolume._ensure) vs storage2.concurrent_ensure.
+
+Disks are loop volumes restored from a loop snapshot; cloud volumes
+spend most of ensure() waiting for create and attach, simulated with
+a sleep of --latency seconds. Needs root for losetup.
+
+    PYTHONPATH=src python tests/benchmarks/raid_ensure.py -n 8 -l 2
+'''
+import os
+import sys
+import time
+import shutil
+import logging
+import optparse
+import tempfile
+
+import benchutil
+
+from scalarizr import storage2
+from scalarizr.linux import coreutils
+from scalarizr.storage2.volumes import loop
+
+
+class SlowLoopVolume(loop.LoopVolume):
+    latency = 0
+
+    def _ensure(self):
+        time.sleep(self.latency)
+        super(SlowLoopVolume, self)._ensure()
+
+
+def sequential_ensure(disks):
+    for disk in disks:
+        disk.ensure()
+
+
+def run(name, ensure, snap, num_disks):
+    disks = [SlowLoopVolume(type='loop', snap=snap) for _ in range(num_disks)]
+    start = time.time()
+    try:
+        ensure(disks)
+        elapsed = time.time() - start
+        assert len(set(disk.device for disk in disks)) == num_disks
+    finally:
+        for disk in disks:
+            if disk.device or disk.file:
+                disk.destroy(force=True)
+    return {
+        'mode': name,
+        'disks': num_disks,
+        'elapsed': elapsed
+    }
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-n', '--num-disks', type='int', default=8)
+    parser.add_option('-l', '--latency', type='float', default=2,
+                      help='Simulated create + attach time of a disk, seconds')
+    opts, _ = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    SlowLoopVolume.latency = opts.latency
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        # 'file' is split by the first dot to name restored copies
+        snap_file = os.path.join(tmp_dir, 'disk')
+        coreutils.dd(**{'if': '/dev/zero', 'of': snap_file, 'bs': '1M', 'count': 16})
+        snap = {'type': 'loop', 'file': snap_file}
+        rows = [
+            run('one by one', sequential_ensure, snap, 1),
+            run('one by one', sequential_ensure, snap, opts.num_disks),
+            run('concurrent_ensure', storage2.concurrent_ensure, snap, opts.num_disks)
+        ]
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    benchutil.report('restore RAID members from loop snapshots, %.1fs attach latency' % (
+                     opts.latency), rows, [
+        ('mode', 'mode', '%s'),
+        ('disks', 'disks', '%d'),
+        ('elapsed', 'seconds', '%.2f')
+    ])
+
+
+if __name__ == '__main__':
+    sys.exit(main())
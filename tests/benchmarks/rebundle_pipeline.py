@@ -0,0 +1,142 @@
+'''
+EC2 instance-store rebundle: former tar | gzip | openssl into one bundle
+file, then split, then a read pass to digest parts, then upload vs one
+pass that splits the openssl stream, hashes parts while writing them and
+uploads them while bundling goes on.
+
+The image is --size MB of random data (worst case for gzip), uploads go
+to a local cloudfs driver throttled to --upload-rate MB/s per connection.
+
+    PYTHONPATH=src python tests/benchmarks/rebundle_pipeline.py -s 128
+'''
+from __future__ import with_statement
+
+import os
+import sys
+import time
+import Queue
+import shutil
+import hashlib
+import logging
+import optparse
+import tempfile
+import threading
+import subprocess
+
+import benchutil
+
+from scalarizr.linux import coreutils
+from scalarizr.storage2 import cloudfs
+from scalarizr.storage2.cloudfs import local
+
+
+PART_SIZE = 10 * 1024 * 1024
+
+
+class ThrottledFileSystem(local.LocalFileSystem):
+    schema = 'bench'
+    rate = None
+
+    def put(self, src, url, report_to=None):
+        time.sleep(os.path.getsize(src) / self.rate)
+        return local.LocalFileSystem.put(self, src, url)
+
+cloudfs.cloudfs_types['bench'] = ThrottledFileSystem
+
+
+def pipeline(image):
+    return ('tar -c -S -f - -C %s %s | gzip | openssl enc -e -aes-128-cbc -K %s -iv %s' % (
+            os.path.dirname(image), os.path.basename(image), '0' * 32, '0' * 32))
+
+
+def upload(files, dst):
+    res = cloudfs.FileTransfer(src=files, dst=dst).run()
+    assert not res['failed'], res['failed']
+    return len(res['completed'])
+
+
+def former(image, work_dir, dst):
+    bundle = os.path.join(work_dir, 'image.tar.gz.enc')
+    subprocess.check_call(pipeline(image) + ' > ' + bundle, shell=True)
+    part_names = coreutils.split(bundle, 'image', PART_SIZE, work_dir)
+    for name in part_names:
+        digest = hashlib.sha1()
+        with open(os.path.join(work_dir, name)) as fp:
+            while True:
+                buf = fp.read(coreutils.BUFFER_SIZE)
+                if not buf:
+                    break
+                digest.update(buf)
+    extra_io = os.path.getsize(bundle) * 3  # bundle write, split read, digest read
+    return upload([os.path.join(work_dir, name) for name in part_names], dst), extra_io
+
+
+def single_pass(image, work_dir, dst):
+    files = Queue.Queue()
+    ret = {}
+    def uploader():
+        ret['uploaded'] = upload(iter(files.get, None), dst)
+    thread = threading.Thread(target=uploader)
+    thread.start()
+    proc = subprocess.Popen(pipeline(image), shell=True, stdout=subprocess.PIPE)
+    try:
+        for name, size, digest in coreutils.split_stream(proc.stdout, 'image', PART_SIZE,
+                                                         work_dir, 'sha1'):
+            files.put(os.path.join(work_dir, name))
+    finally:
+        proc.stdout.close()
+        proc.wait()
+        files.put(None)
+        thread.join()
+    return ret['uploaded'], 0
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-s', '--size', type='int', default=128, help='Image size in MB')
+    parser.add_option('-u', '--upload-rate', type='float', default=10.0,
+                      help='Upload MB/s per connection')
+    opts, _ = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    ThrottledFileSystem.rate = opts.upload_rate * 1024 * 1024
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        image = os.path.join(tmp_dir, 'image')
+        with open(image, 'wb') as fp:
+            for _ in range(opts.size):
+                fp.write(os.urandom(1024 * 1024))
+
+        rows = []
+        for name, fn in (('bundle, split, digest, upload (former)', former),
+                         ('single pass, overlapped upload', single_pass)):
+            work_dir = os.path.join(tmp_dir, 'work')
+            dst_dir = os.path.join(tmp_dir, 'dst')
+            os.mkdir(work_dir)
+            try:
+                start = time.time()
+                parts, extra_io = fn(image, work_dir, 'bench://%s/' % dst_dir)
+                elapsed = time.time() - start
+            finally:
+                shutil.rmtree(work_dir)
+                shutil.rmtree(dst_dir, ignore_errors=True)
+            rows.append({
+                'mode': name,
+                'parts': parts,
+                'extra_io': extra_io / 1024.0 / 1024,
+                'seconds': elapsed
+            })
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    benchutil.report('%d MB image, %.0f MB/s per upload connection' % (
+                     opts.size, opts.upload_rate), rows, [
+        ('mode', 'mode', '%s'),
+        ('parts', 'parts', '%d'),
+        ('extra_io', 'extra disk I/O MB', '%.0f'),
+        ('seconds', 'seconds', '%.1f')
+    ])
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,142 @@
+'''
+Redis monitoring cost: RedisCLI forking redis-cli per query (former
+RedisCLI.execute) vs pooled RESP connections, against N redis ports.
+
+Without -r, ports are served by an in-process fake RESP server and
+redis-cli is replaced with a script printing a canned INFO, so forking
+numbers show only the fork/exec cost, a lower bound of the real one.
+
+    PYTHONPATH=src python tests/benchmarks/redis_cli.py -n 10 -p 20
+'''
+from __future__ import with_statement
+
+import os
+import sys
+import time
+import shutil
+import logging
+import optparse
+import tempfile
+import threading
+import SocketServer
+
+import benchutil
+
+from scalarizr.util import system2
+from scalarizr.services import redis
+
+
+INFO = '\r\n'.join(['# Replication', 'role:slave', 'master_host:10.0.0.1',
+                    'master_port:6379', 'master_link_status:up',
+                    'master_sync_in_progress:0', 'aof_enabled:0',
+                    'bgsave_in_progress:0', 'connected_slaves:0', ''] +
+                   ['filler_%d:%d' % (n, n) for n in range(80)])
+
+
+class FakeRedisHandler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            for _ in range(int(line[1:])):
+                self.rfile.read(int(self.rfile.readline()[1:]) + 2)
+            self.wfile.write('$%d\r\n%s\r\n' % (len(INFO), INFO))
+
+
+class ForkingRedisCLI(redis.RedisCLI):
+    path = '/usr/bin/redis-cli'
+
+    def execute(self, query, silent=False):
+        return system2([self.path, '-p', str(self.port)], stdin=query,
+                       silent=True, warn_stderr=False)[0]
+
+
+def monitor(cli_class, ports, polls):
+    # What wait_for_sync and replication status do: poll link status,
+    # sync progress and role of every instance
+    clis = [cli_class(port=port) for port in ports]
+    for _ in range(polls):
+        for cli in clis:
+            assert cli.master_link_status == 'up'
+            assert not cli.master_sync_in_progress
+            assert cli.role == 'slave'
+
+
+def monitor_snapshot(cli_class, ports, polls):
+    clis = [cli_class(port=port) for port in ports]
+    for _ in range(polls):
+        for cli in clis:
+            info = cli.info
+            assert info.master_link_status == 'up'
+            assert not info.master_sync_in_progress
+            assert info.role == 'slave'
+
+
+def run(name, fn, cli_class, ports, polls):
+    start = time.time()
+    fn(cli_class, ports, polls)
+    elapsed = time.time() - start
+    queries = len(ports) * polls * (3 if fn is monitor else 1)
+    return {
+        'mode': name,
+        'queries': queries,
+        'elapsed': elapsed,
+        'polls_per_sec': len(ports) * polls / elapsed
+    }
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-n', '--num-instances', type='int', default=10)
+    parser.add_option('-p', '--polls', type='int', default=20)
+    parser.add_option('-r', '--real-ports', default=None,
+                      help='Comma separated ports of running redis-servers, uses real redis-cli')
+    opts, _ = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    tmp_dir = tempfile.mkdtemp()
+    servers = []
+    try:
+        if opts.real_ports:
+            ports = [int(port) for port in opts.real_ports.split(',')]
+        else:
+            ports = []
+            for _ in range(opts.num_instances):
+                server = SocketServer.ThreadingTCPServer(('127.0.0.1', 0), FakeRedisHandler)
+                server.daemon_threads = True
+                thread = threading.Thread(target=server.serve_forever)
+                thread.setDaemon(True)
+                thread.start()
+                servers.append(server)
+                ports.append(server.server_address[1])
+            with open(os.path.join(tmp_dir, 'info'), 'w') as fp:
+                fp.write(INFO)
+            ForkingRedisCLI.path = os.path.join(tmp_dir, 'redis-cli')
+            with open(ForkingRedisCLI.path, 'w') as fp:
+                fp.write('#!/bin/sh\ncat %s\n' % os.path.join(tmp_dir, 'info'))
+            os.chmod(ForkingRedisCLI.path, 0755)
+
+        rows = [
+            run('fork per property', monitor, ForkingRedisCLI, ports, opts.polls),
+            run('RESP pool per property', monitor, redis.RedisCLI, ports, opts.polls),
+            run('RESP pool, INFO snapshot', monitor_snapshot, redis.RedisCLI, ports, opts.polls)
+        ]
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+        shutil.rmtree(tmp_dir)
+
+    benchutil.report('%d redis instances, %d polls of link/sync/role' % (
+                     len(ports), opts.polls), rows, [
+        ('mode', 'mode', '%s'),
+        ('queries', 'INFO queries', '%d'),
+        ('elapsed', 'seconds', '%.2f'),
+        ('polls_per_sec', 'instance polls/s', '%.1f')
+    ])
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,108 @@
+'''
+LargeTransfer download + restore from a local file:// manifest:
+chunk by chunk copy in 4 Kb buffers (former _dl_restorer) vs pipelined
+read-ahead with md5 verification in download workers.
+
+Download mounts tmpfs, so run it as root.
+
+    PYTHONPATH=src python tests/benchmarks/restore.py -n 64 -c 4
+'''
+from __future__ import with_statement
+
+import os
+import sys
+import time
+import shutil
+import logging
+import optparse
+import tempfile
+
+import benchutil
+
+from scalarizr.storage2 import cloudfs
+from scalarizr.storage2.cloudfs import local  # registers file://
+
+
+class LegacyRestoreTransfer(cloudfs.LargeTransfer):
+    # former restorer didn't check md5 sums
+    verify_chunks = False
+
+    def _restore_chunks(self, file_, stream, cmd):
+        for chunk, info in file_["chunks"].iteritems():
+            info["downloaded"].wait()
+            location = os.path.join(self._tranzit_vol.mpoint, chunk)
+            with open(location, 'rb') as fd:
+                while True:
+                    bytes_ = fd.read(4096)
+                    if not bytes_:
+                        break
+                    stream.write(bytes_)
+            info["processed"].set()
+
+
+class UnverifiedRestoreTransfer(cloudfs.LargeTransfer):
+    verify_chunks = False
+
+
+def upload(tmp_dir, num_chunks, chunk_size, compressor):
+    src = os.path.join(tmp_dir, 'dump.sql')
+    with open(src, 'w') as fp:
+        for _ in xrange(num_chunks * chunk_size):
+            # Half random to make gzip work a bit
+            data = os.urandom(512 * 1024)
+            fp.write(data + data.encode('hex')[:512 * 1024])
+    transfer = cloudfs.LargeTransfer(src, 'file://%s/bucket/' % tmp_dir,
+                                     compressor=compressor, chunk_size=chunk_size)
+    manifest = transfer.run()
+    os.remove(src)
+    return manifest
+
+
+def run(name, cls, manifest, tmp_dir, size):
+    dst = tempfile.mkdtemp(dir=tmp_dir)
+    try:
+        start = time.time()
+        cls(manifest.cloudfs_path, dst + '/').run()
+        elapsed = time.time() - start
+        assert os.path.getsize(os.path.join(dst, 'dump.sql')) == size
+        return {
+            'mode': name,
+            'elapsed': elapsed,
+            'mb_per_sec': size / 1048576.0 / elapsed
+        }
+    finally:
+        shutil.rmtree(dst)
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-n', '--num-chunks', type='int', default=64)
+    parser.add_option('-c', '--chunk-size', type='int', default=4, help='Chunk size in megabytes')
+    parser.add_option('--gzip', action='store_true', default=False)
+    opts, _ = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        compressor = 'gzip' if opts.gzip else None
+        manifest = upload(tmp_dir, opts.num_chunks, opts.chunk_size, compressor)
+        size = opts.num_chunks * opts.chunk_size * 1048576
+        rows = [
+            run('4 Kb copy', LegacyRestoreTransfer, manifest, tmp_dir, size),
+            run('pipelined, no md5', UnverifiedRestoreTransfer, manifest, tmp_dir, size),
+            run('pipelined', cloudfs.LargeTransfer, manifest, tmp_dir, size)
+        ]
+        chunks = len(manifest['files'][0]['chunks'])
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    benchutil.report('restore %d MB in %d chunks, compressor: %s' % (
+                     size / 1048576, chunks, compressor), rows, [
+        ('mode', 'mode', '%s'),
+        ('elapsed', 'seconds', '%.2f'),
+        ('mb_per_sec', 'MB/s', '%.1f')
+    ])
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,141 @@
+'''
+Scalr polling custom scaling metrics: former scaling_metrics() (new
+10-thread ThreadPool per call, every script forked and polled with 0.2s
+sleeps, timeout waited in full) vs background collector serving last values.
+
+Metrics are --num-metrics scripts taking --script-cost ms each plus
+--num-slow ones hanging past the 3s timeout.
+
+    PYTHONPATH=src python tests/benchmarks/scaling_metrics.py -n 10
+'''
+from __future__ import with_statement
+
+import os
+import sys
+import time
+import signal
+import shutil
+import logging
+import optparse
+import tempfile
+import threading
+import subprocess
+from multiprocessing import pool
+
+import mock
+
+import benchutil
+
+from scalarizr.api import system
+from scalarizr.queryenv import ScalingMetric
+
+
+def legacy_execute(metric):
+    proc = subprocess.Popen(metric.path, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            close_fds=True)
+    timeout_time = time.time() + system._ScalingMetricStrategy.timeout
+    while time.time() < timeout_time:
+        if proc.poll() is None:
+            time.sleep(0.2)
+        else:
+            break
+    else:
+        os.kill(proc.pid, signal.SIGTERM)
+        raise BaseException('Timeouted')
+    return proc.communicate()[0].strip()
+
+
+def legacy_scaling_metrics(metrics):
+    wrk_pool = pool.ThreadPool(processes=10)
+    try:
+        return wrk_pool.map_async(system._ScalingMetricStrategy.get, metrics).get()
+    finally:
+        wrk_pool.close()
+        wrk_pool.join()
+
+
+def make_metrics(tmp_dir, opts):
+    metrics = []
+    for n in range(opts.num_metrics + opts.num_slow):
+        m = ScalingMetric()
+        m.id = n
+        m.name = 'metric%d' % n
+        m.path = os.path.join(tmp_dir, m.name)
+        m.retrieve_method = 'execute'
+        cost = 10 if n >= opts.num_metrics else opts.script_cost / 1000.0
+        with open(m.path, 'w') as fp:
+            fp.write('#!/bin/sh\nsleep %.3f\necho %d\n' % (cost, n))
+        os.chmod(m.path, 0755)
+        metrics.append(m)
+    return metrics
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-n', '--num-metrics', type='int', default=10)
+    parser.add_option('-s', '--num-slow', type='int', default=1)
+    parser.add_option('-c', '--script-cost', type='float', default=50.0,
+                      help='Milliseconds a metric script takes')
+    parser.add_option('-r', '--repeat', type='int', default=5)
+    opts, _ = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        metrics = make_metrics(tmp_dir, opts)
+        rows = []
+
+        with mock.patch.object(system._ScalingMetricStrategy, '_get_execute',
+                               staticmethod(legacy_execute)):
+            start = time.time()
+            for _ in range(opts.repeat):
+                ret = legacy_scaling_metrics(metrics)
+            rows.append({
+                'mode': 'per call pool (former)',
+                'first': (time.time() - start) * 1000 / opts.repeat,
+                'ms_per_call': (time.time() - start) * 1000 / opts.repeat,
+                'forks': len(metrics) * opts.repeat,
+                'errors': sum(1 for m in ret if m['error'])
+            })
+
+        with mock.patch('scalarizr.api.system.bus') as bus:
+            bus.queryenv_service.get_scaling_metrics.return_value = metrics
+            collector = system._ScalingMetricCollector()
+            runs = []
+            orig_get = system._ScalingMetricStrategy.get
+            def counting_get(metric):
+                runs.append(metric.id)
+                return orig_get(metric)
+            with mock.patch.object(system._ScalingMetricStrategy, 'get',
+                                   staticmethod(counting_get)):
+                start = time.time()
+                collector.start()
+                ret = collector.get(wait=system._ScalingMetricStrategy.timeout + 1)
+                first = time.time() - start
+                start = time.time()
+                for _ in range(opts.repeat):
+                    ret = collector.get(wait=system._ScalingMetricStrategy.timeout + 1)
+                elapsed = time.time() - start
+                collector.stop()
+            rows.append({
+                'mode': 'background collector',
+                'first': first * 1000,
+                'ms_per_call': elapsed * 1000 / opts.repeat,
+                'forks': len(runs),
+                'errors': sum(1 for m in ret if m['error'])
+            })
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    benchutil.report('%d scaling_metrics() calls, %d metrics of %.0fms, %d hanging' % (
+                     opts.repeat, opts.num_metrics, opts.script_cost, opts.num_slow), rows, [
+        ('mode', 'mode', '%s'),
+        ('first', 'first call ms', '%.1f'),
+        ('ms_per_call', 'ms/call', '%.1f'),
+        ('forks', 'scripts run', '%d'),
+        ('errors', 'errors', '%d')
+    ])
+
+
+if __name__ == '__main__':
+    sys.exit(main())
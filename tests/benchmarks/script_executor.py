@@ -0,0 +1,91 @@
+'''
+Synchronous scripts throughput of ScriptExecutor.execute_scripts:
+polling wait (former Script.wait, poll every 5 seconds) vs reaping
+the child in a waiter thread.
+
+    PYTHONPATH=src python tests/benchmarks/script_executor.py -n 20
+'''
+from __future__ import with_statement
+
+import os
+import sys
+import time
+import shutil
+import logging
+import optparse
+import tempfile
+import ConfigParser
+
+import benchutil
+
+from scalarizr.bus import bus
+from scalarizr.handlers import script_executor
+
+
+class PollingScript(script_executor.Script):
+
+    def _proc_wait(self, timeout):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            time.sleep(5)
+            if self.proc.poll() is not None:
+                return True
+        return False
+
+
+class Cnf(object):
+    rawini = ConfigParser.RawConfigParser()
+
+
+def run(name, script_class, num_scripts):
+    executor = script_executor.ScriptExecutor.__new__(script_executor.ScriptExecutor)
+    executor._logger = logging.getLogger('bench')
+    executor.in_progress = []
+    results = []
+    executor.send_message = lambda name, body, **kwds: results.append(body)
+
+    scripts = (script_class(name='echo-%d' % n, body='#!/bin/sh\necho %d' % n,
+                            exec_timeout=60, event_name='HostInit')
+               for n in range(num_scripts))
+    start = time.time()
+    executor.execute_scripts(scripts, 'HostInit', num_scripts)
+    elapsed = time.time() - start
+    assert [r['return_code'] for r in results] == [0] * num_scripts
+    return {
+        'mode': name,
+        'scripts': num_scripts,
+        'elapsed': elapsed,
+        'scripts_per_sec': num_scripts / elapsed
+    }
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-n', '--num-scripts', type='int', default=20)
+    parser.add_option('-p', '--num-polling', type='int', default=3,
+                      help='Scripts to run with polling wait, 5 seconds each')
+    opts, _ = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    tmp_dir = tempfile.mkdtemp()
+    script_executor.exec_dir_prefix = os.path.join(tmp_dir, 'scalr-scripting.')
+    script_executor.logs_dir = tmp_dir
+    bus.cnf = Cnf()
+    try:
+        rows = [
+            run('poll every 5s', PollingScript, opts.num_polling),
+            run('waiter thread', script_executor.Script, opts.num_scripts)
+        ]
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    benchutil.report('ScriptExecutor.execute_scripts, sync echo scripts', rows, [
+        ('mode', 'mode', '%s'),
+        ('scripts', 'scripts', '%d'),
+        ('elapsed', 'seconds', '%.2f'),
+        ('scripts_per_sec', 'scripts/s', '%.2f')
+    ])
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,101 @@
+'''
+Concurrent p2p_message inserts/lookups through bus.db:
+SQLiteServerThread (single server thread) vs SQLitePool (WAL mode).
+
+    PYTHONPATH=src python tests/benchmarks/sqlite_engine.py -t 8 -n 500
+'''
+from __future__ import with_statement
+
+import os
+import sys
+import time
+import uuid
+import logging
+import optparse
+import threading
+
+import benchutil
+
+from scalarizr.bus import bus
+from scalarizr.messaging import p2p
+from scalarizr.messaging.p2p import P2pMessage
+
+
+def run(name, engine, num_threads, num_messages, lookups):
+    db_file = benchutil.create_db()
+    try:
+        bus.db = engine(db_file)
+        p2p._message_store = None
+        store = p2p.P2pMessageStore()
+        timings = {'insert': [], 'lookup': []}
+        errors = []
+
+        def work():
+            try:
+                ids = []
+                for i in xrange(num_messages):
+                    msg = P2pMessage('BenchMessage', body={'seq': i, 'payload': 'x' * 512})
+                    msg.id = str(uuid.uuid4())
+                    start = time.time()
+                    store.put_outgoing(msg, 'control', 'daemon')
+                    timings['insert'].append(time.time() - start)
+                    ids.append(msg.id)
+                    for _ in xrange(lookups):
+                        start = time.time()
+                        store.load(ids[-1], False)
+                        timings['lookup'].append(time.time() - start)
+            except:
+                errors.append(sys.exc_info()[1])
+
+        threads = [threading.Thread(target=work) for _ in range(num_threads)]
+        start = time.time()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.time() - start
+        if errors:
+            raise errors[0]
+
+        ops = len(timings['insert']) + len(timings['lookup'])
+        return {
+            'engine': name,
+            'ops_per_sec': ops / elapsed,
+            'insert_p50': benchutil.percentile(timings['insert'], 50) * 1000,
+            'insert_p99': benchutil.percentile(timings['insert'], 99) * 1000,
+            'lookup_p50': benchutil.percentile(timings['lookup'], 50) * 1000,
+            'lookup_p99': benchutil.percentile(timings['lookup'], 99) * 1000
+        }
+    finally:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(db_file + suffix):
+                os.remove(db_file + suffix)
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-t', '--threads', type='int', default=8)
+    parser.add_option('-n', '--num-messages', type='int', default=300,
+                    help='Messages inserted by each thread')
+    parser.add_option('-l', '--lookups', type='int', default=3,
+                    help='Lookups per inserted message')
+    opts, _ = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    rows = [
+        run('server', benchutil.start_sqlite_server, opts.threads, opts.num_messages, opts.lookups),
+        run('pool', benchutil.start_sqlite_pool, opts.threads, opts.num_messages, opts.lookups)
+    ]
+    benchutil.report('p2p_message: %d threads x %d messages' % (opts.threads, opts.num_messages),
+                     rows, [
+        ('engine', 'engine', '%s'),
+        ('ops_per_sec', 'ops/s', '%.1f'),
+        ('insert_p50', 'insert p50 ms', '%.2f'),
+        ('insert_p99', 'insert p99 ms', '%.2f'),
+        ('lookup_p50', 'lookup p50 ms', '%.2f'),
+        ('lookup_p99', 'lookup p99 ms', '%.2f')
+    ])
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,138 @@
+'''
+Stands in for iptables, iptables-save, iptables-restore and ipset.
+Usage: fake_iptables.py <tool> <args>, rules and sets are kept in a JSON file
+named by FAKE_IPTABLES_STATE environment variable, every start is counted there.
+'''
+import os
+import sys
+import json
+import shlex
+
+
+SHORT = {
+    '-A': '--append',
+    '-D': '--delete',
+    '-I': '--insert',
+    '-S': '--list-rules',
+    '-N': '--new-chain',
+    '-t': '--table',
+    '-p': '--protocol',
+    '-s': '--source',
+    '-d': '--destination',
+    '-j': '--jump',
+    '-m': '--match'
+}
+COMMANDS = ('--append', '--delete', '--insert', '--list-rules', '--new-chain')
+
+
+class Error(Exception):
+    pass
+
+
+def parse(args):
+    pairs = []
+    for arg in args:
+        if arg.startswith('-') and not arg[1:].isdigit():
+            pairs.append([SHORT.get(arg, arg), []])
+        else:
+            pairs[-1][1].append(arg)
+    return pairs
+
+
+def rule_key(pairs):
+    ret = []
+    for opt, values in pairs:
+        if opt in ('--source', '--destination') and '/' not in values[0]:
+            values = [values[0] + '/32']
+        ret.append(' '.join([opt] + values))
+    # iptables-save prints options in its own order
+    return ' '.join(sorted(ret))
+
+
+def iptables(state, args):
+    table = 'filter'
+    command = chain = None
+    rule = []
+    for opt, values in parse(args):
+        if opt == '--table':
+            table = values[0]
+        elif opt in COMMANDS:
+            command, chain = opt, values[0]
+            index = int(values[1]) - 1 if len(values) > 1 else 0
+        else:
+            rule.append((opt, values))
+    rules = state['tables'].setdefault(table, {}).setdefault(chain, [])
+    key = rule_key(rule)
+    if command == '--list-rules':
+        return '-P %s ACCEPT\n' % chain + \
+               ''.join('-A %s %s\n' % (chain, r) for r in rules)
+    elif command == '--insert':
+        rules.insert(index, key)
+    elif command == '--append':
+        rules.append(key)
+    elif command == '--delete':
+        if key not in rules:
+            raise Error('iptables: Bad rule (does a matching rule exist in that chain?).')
+        rules.remove(key)
+    return ''
+
+
+def iptables_save(state, args):
+    out = []
+    for table, chains in sorted(state['tables'].items()):
+        out.append('*%s' % table)
+        out += [':%s ACCEPT [0:0]' % chain for chain in sorted(chains)]
+        for chain, rules in sorted(chains.items()):
+            out += ['-A %s %s' % (chain, rule) for rule in rules]
+        out.append('COMMIT')
+    return '\n'.join(out) + '\n'
+
+
+def iptables_restore(state, args):
+    table = None
+    for line in sys.stdin:
+        line = line.strip()
+        if line.startswith('*'):
+            table = line[1:]
+        elif line and line != 'COMMIT' and not line.startswith('#'):
+            iptables(state, ['--table', table] + shlex.split(line))
+    return ''
+
+
+def ipset(state, args):
+    if args[-1:] != ['restore']:
+        raise Error('ipset: only restore is supported')
+    for line in sys.stdin:
+        command, name = line.split()[:2]
+        entry = line.split()[2]
+        if command == 'create':
+            state['sets'].setdefault(name, [])
+        elif command == 'add' and entry not in state['sets'][name]:
+            state['sets'][name].append(entry)
+        elif command == 'del' and entry in state['sets'][name]:
+            state['sets'][name].remove(entry)
+    return ''
+
+
+def main():
+    path = os.environ['FAKE_IPTABLES_STATE']
+    if os.path.exists(path):
+        with open(path) as fp:
+            state = json.load(fp)
+    else:
+        state = {'tables': {}, 'sets': {}, 'execs': 0}
+    state['execs'] += 1
+    tool = sys.argv[1].replace('-', '_')
+    try:
+        out = globals()[tool](state, sys.argv[2:])
+    except Error, e:
+        sys.stderr.write('%s\n' % e)
+        return 1
+    finally:
+        with open(path, 'w') as fp:
+            json.dump(state, fp)
+    sys.stdout.write(out)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,55 @@
+'''
+Stands in for `psql -X -q -A -t` reading statements from stdin.
+Usage: fake_psql.py <log file>, every start is logged to it
+'''
+import re
+import sys
+
+
+def unquote(arg):
+    arg = arg[1:-1].replace("''", "'")
+    return re.sub(r'\\(\\|n|\d{3})', lambda m: {'\\': '\\', 'n': '\n'}.get(
+                  m.group(1)) or chr(int(m.group(1), 8)), arg)
+
+
+def main():
+    with open(sys.argv[1], 'a') as fp:
+        fp.write('start\n')
+    variables = {'fieldsep': '|', 'recordsep': '\n'}
+    statement = []
+    lineno = 0
+    while True:
+        line = sys.stdin.readline()
+        if not line:
+            break
+        lineno += 1
+        line = line.rstrip('\n')
+        if line.startswith('\\echo '):
+            sys.stdout.write(line[6:] + '\n')
+        elif line.startswith('\\pset ') or line.startswith('\\set '):
+            _, name, value = line.split(' ', 2)
+            variables[name] = unquote(value)
+        else:
+            statement.append(line)
+            if not line.endswith(';'):
+                continue
+            sql = '\n'.join(statement)
+            statement = []
+            sql = re.sub(r":'(\w+)'", lambda m: "'%s'" % variables[m.group(1)].replace("'", "''"), sql)
+            sql = re.sub(r':"(\w+)"', lambda m: '"%s"' % variables[m.group(1)], sql)
+            if 'CRASH' in sql:
+                sys.stdout.write('server closed the connection unexpectedly\n')
+                sys.exit(2)
+            elif 'BOGUS' in sql:
+                sys.stdout.write('psql:<stdin>:%d: ERROR:  syntax error at or near "BOGUS"\n' % lineno)
+            elif sql.startswith('SET ') or sql.startswith('ALTER '):
+                pass
+            elif sql == 'SELECT rolname FROM pg_roles;':
+                sys.stdout.write(variables['recordsep'].join(['postgres', 'scalr']) + '\n')
+            else:
+                sys.stdout.write(variables['fieldsep'].join([sql, 'multi\nline']) + '\n')
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
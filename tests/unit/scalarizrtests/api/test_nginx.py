@@ -4,10 +4,16 @@ Created on Nov 2, 2012
 @author: uty
 '''
 import os
+import time
 import mock
+import shutil
+import tempfile
 import StringIO
 
+from nose.tools import eq_, assert_raises
+
 from scalarizr.api import nginx
+from scalarizr.util import initdv2
 
 
 ###############################################################################
@@ -108,3 +114,136 @@ class TestNginxAPI(object):
         conf.write_fp(str_fp, close=False)
         assert desired_config == str_fp, '%s' % str_fp.getvalue()
         
+
+
+class TestNginxAPIUpstreams(object):
+
+    def setup(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        # bypass Singleton
+        self.api = nginx.NginxAPI.__new__(nginx.NginxAPI)
+        self.api.__init__(self.tmp_dir, self.tmp_dir)
+        self.api.error_pages_inc = os.path.join(self.tmp_dir, 'error-pages.include')
+        self.api.service = mock.Mock(**{'status.return_value': initdv2.Status.RUNNING})
+        self.api._reloads.window = 60
+        self.api._load_app_servers_inc()
+        self.api._load_proxies_inc()
+
+        self.roles = {'1': ['10.0.0.1'], '2': ['10.0.0.2', '10.0.0.3']}
+        self.patchers = [
+            mock.patch.object(nginx, 'get_role_servers', side_effect=self._role_servers),
+            mock.patch.object(nginx, '_open_port'),
+            mock.patch.object(nginx, '__node__', {'cloud_location': 'us-east-1'}),
+            mock.patch.object(self.api, '_old_style_ssl_on', return_value=False)
+        ]
+        self.get_role_servers = self.patchers[0].start()
+        for patcher in self.patchers[1:]:
+            patcher.start()
+        self.api.recreate_proxying(self._proxies())
+
+    def teardown(self):
+        self.api._reloads.flush()
+        for patcher in self.patchers:
+            patcher.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def _role_servers(self, role_id=None, role_name=None, network=None):
+        return list(self.roles[str(role_id)])
+
+    def _proxies(self):
+        return [{'hostname': 'one.example.com',
+                 'backends': [{'farm_role_id': '1', 'port': '8080'}]},
+                {'hostname': 'two.example.com',
+                 'backend_max_fails': '3',
+                 'backends': [{'farm_role_id': '2', 'port': '8080'},
+                              {'farm_role_id': '1', 'location': '/admin'}]}]
+
+    def _app_servers_inc(self):
+        with open(self.api.app_inc_path) as fp:
+            return fp.read()
+
+    def _recreated_app_servers_inc(self):
+        self.api.recreate_proxying(self._proxies(), reload_service=False)
+        return self._app_servers_inc()
+
+    def test_server_up(self):
+        self.get_role_servers.reset_mock()
+        self.roles['2'].append('10.0.0.4')
+        self.api.update_proxying(self._proxies(), '10.0.0.4', '2')
+
+        assert not self.get_role_servers.called
+        conf = self._app_servers_inc()
+        assert '10.0.0.4:8080 max_fails=3;' in conf
+        assert conf == self._recreated_app_servers_inc()
+
+    def test_server_down_to_mock(self):
+        host = mock.Mock(internal_ip='10.0.0.1',
+                         external_ip='54.0.0.1',
+                         cloud_location='us-east-1')
+        self.roles['1'] = []
+        self.api.update_proxying(self._proxies(), host, 2, up=False)
+        assert '10.0.0.1' in self._app_servers_inc()
+
+        self.api.update_proxying(self._proxies(), host, 1, up=False)
+        conf = self._app_servers_inc()
+        assert '10.0.0.1' not in conf
+        assert '127.0.0.1:8080;' in conf
+        assert conf == self._recreated_app_servers_inc()
+
+    def test_dict_server_to_role(self):
+        server = {'host': '10.0.0.7', 'port': '8089', 'backup': True}
+        self.api.add_server_to_role(server, '2')
+        assert '10.0.0.7:8089 backup max_fails=3;' in self._app_servers_inc()
+
+        self.api.remove_server_from_role({'host': '10.0.0.7'}, '2')
+        assert '10.0.0.7' not in self._app_servers_inc()
+
+    def test_proxies_changed(self):
+        proxies = self._proxies()
+        proxies[0]['backends'][0]['port'] = '8081'
+        self.roles['1'].append('10.0.0.5')
+        self.api.update_proxying(proxies, '10.0.0.5', '1')
+        assert '10.0.0.5:8081;' in self._app_servers_inc()
+
+        # proxying was changed through API
+        self.api.remove_proxy('one.example.com')
+        self.roles['2'].append('10.0.0.6')
+        self.get_role_servers.reset_mock()
+        self.api.update_proxying(proxies, '10.0.0.6', '2')
+        assert self.get_role_servers.called
+        assert 'one.example.com' in open(self.api.proxies_inc_path).read()
+
+    def test_reloads_coalesced(self):
+        eq_(self.api.service.reload.call_count, 1)
+        for n in range(4, 8):
+            self.api.update_proxying(self._proxies(), '10.0.0.%d' % n, '2')
+        self.api.update_proxying(self._proxies(), '10.0.0.1', '1')
+        eq_(self.api.service.reload.call_count, 1)
+        assert self.api._reloads.pending
+
+        self.api._reload_service()
+        eq_(self.api.service.reload.call_count, 2)
+        assert not self.api._reloads.pending
+
+    def test_app_servers_inc_replaced(self):
+        inode = os.stat(self.api.app_inc_path).st_ino
+        self.api.update_proxying(self._proxies(), '10.0.0.4', '2')
+        assert os.stat(self.api.app_inc_path).st_ino != inode
+        assert not os.path.exists(self.api.app_inc_path + '.tmp')
+
+    def test_failed_reload_raised(self):
+        self.api._reloads.window = 0.1
+        self.api.service.reload.side_effect = initdv2.InitdError('reload failed')
+        self.api.update_proxying(self._proxies(), '10.0.0.4', '2')
+        time.sleep(0.5)
+        assert self.api._reloads.failed
+        assert self.api.service.reload.call_count > 2
+
+        assert_raises(initdv2.InitdError,
+                      self.api.update_proxying, self._proxies(), '10.0.0.5', '2')
+        assert self.api._reloads.pending
+
+        self.api.service.reload.side_effect = None
+        self.api.update_proxying(self._proxies(), '10.0.0.6', '2')
+        assert not self.api._reloads.failed
+        assert not self.api._reloads.pending
@@ -0,0 +1,89 @@
+from __future__ import with_statement
+
+import os
+import time
+import shutil
+import tempfile
+
+import mock
+from nose.tools import eq_
+
+from scalarizr.api import system
+from scalarizr.queryenv import ScalingMetric
+
+
+class TestScalingMetricCollector(object):
+
+    def setup(self):
+        self.tmp = tempfile.mkdtemp()
+        self.bus = mock.patch('scalarizr.api.system.bus').start()
+        self.collector = system._ScalingMetricCollector()
+
+    def teardown(self):
+        self.collector.stop()
+        mock.patch.stopall()
+        shutil.rmtree(self.tmp)
+
+    def metric(self, id, script, method='execute'):
+        m = ScalingMetric()
+        m.id = id
+        m.name = 'metric%s' % id
+        m.path = os.path.join(self.tmp, m.name)
+        m.retrieve_method = method
+        with open(m.path, 'w') as fp:
+            fp.write(script)
+        os.chmod(m.path, 0755)
+        return m
+
+    def test_slow_metric(self):
+        pid_file = os.path.join(self.tmp, 'child.pid')
+        self.bus.queryenv_service.get_scaling_metrics.return_value = [
+            self.metric(1, '#!/bin/sh\necho 10\n'),
+            self.metric(2, '#!/bin/sh\nsleep 30 &\necho $! > %s\nwait\n' % pid_file),
+            self.metric(3, '5', 'read')
+        ]
+        self.collector.start()
+
+        start = time.time()
+        ret = self.collector.get(wait=0.5)
+        assert time.time() - start < 1
+        eq_([(m['id'], m['value'], m['error']) for m in ret],
+            [(1, 10.0, ''), (2, None, 'Not collected yet'), (3, 5.0, '')])
+        eq_(ret[1]['age'], None)
+
+        ret = self.collector.get(wait=system._ScalingMetricStrategy.timeout + 1)
+        eq_((ret[1]['value'], ret[1]['error']), (0.0, 'Timeouted'))
+        # script children are killed with their process group
+        time.sleep(0.1)
+        pid = int(open(pid_file).read())
+        assert not os.path.exists('/proc/%d' % pid) or \
+               open('/proc/%d/stat' % pid).read().split()[2] == 'Z'
+
+    def test_cached_values(self):
+        m = self.metric(1, '#!/bin/sh\necho 10\n')
+        self.bus.queryenv_service.get_scaling_metrics.return_value = [m]
+        self.collector.start()
+        self.collector.get(wait=1)
+
+        with open(m.path, 'w') as fp:
+            fp.write('#!/bin/sh\necho 20\n')
+        ret = self.collector.get()
+        eq_(ret[0]['value'], 10.0)
+        assert ret[0]['age'] >= 0
+
+    def test_refresh(self):
+        metrics = [self.metric(1, '1', 'read'), self.metric(2, '2', 'read')]
+        self.bus.queryenv_service.get_scaling_metrics.return_value = metrics
+        self.collector.start()
+        eq_([m['value'] for m in self.collector.get(wait=1)], [1.0, 2.0])
+
+        changed = self.metric(2, '3', 'read')
+        changed.path += '.new'
+        with open(changed.path, 'w') as fp:
+            fp.write('3')
+        self.bus.queryenv_service.get_scaling_metrics.return_value = [changed]
+        self.collector.refresh()
+
+        ret = self.collector.get(wait=1)
+        eq_([(m['id'], m['value']) for m in ret], [(2, 3.0)])
+        eq_(self.collector.values.keys(), [2])
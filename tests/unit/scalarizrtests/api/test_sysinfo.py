@@ -160,6 +160,19 @@ class TestSysInfoAPI(unittest.TestCase):
         self.info._NETSTATS = NETSTATS
 
 
+    def tearDown(self):
+        if system.SystemAPI._collector:
+            system.SystemAPI._collector.stop()
+            system.SystemAPI._collector = None
+
+
+    def _scaling_metrics(self):
+        ret = self.info.scaling_metrics()
+        for metric in ret:
+            assert metric.pop('age') is not None
+        return ret
+
+
     def test_fqdn(self):
         (out, err, rc) = system2(('hostname'))
         self.assertEqual(out.strip(), self.info.fqdn())
@@ -263,7 +276,7 @@ class TestSysInfoAPI(unittest.TestCase):
         m.path = '/tmp/test_custom_scaling_metric_read'
         m.retrieve_method = 'read'
         system.bus.queryenv_service.get_scaling_metrics.return_value = [m]
-        assert self.info.scaling_metrics() == [{'error': '', 'id': '777', 'value': 555.0, 'name': 'test_name'}]
+        assert self._scaling_metrics() == [{'error': '', 'id': '777', 'value': 555.0, 'name': 'test_name'}]
         os.remove('/tmp/test_custom_scaling_metric_read')
 
 
@@ -277,7 +290,7 @@ class TestSysInfoAPI(unittest.TestCase):
         m.path = '/tmp/this_file_dosnt_exist'
         m.retrieve_method = 'read'
         system.bus.queryenv_service.get_scaling_metrics.return_value = [m]
-        assert self.info.scaling_metrics() == [{'error': "File is not readable: '/tmp/this_file_dosnt_exist'", 'id': '777', 'value': 0.0, 'name': 'test_name'}]
+        assert self._scaling_metrics() == [{'error': "File is not readable: '/tmp/this_file_dosnt_exist'", 'id': '777', 'value': 0.0, 'name': 'test_name'}]
 
 
     @mock.patch('scalarizr.api.system.bus')
@@ -293,7 +306,7 @@ class TestSysInfoAPI(unittest.TestCase):
         m.path = '/tmp/test_custom_scaling_metric_execute.sh'
         m.retrieve_method = 'execute'
         system.bus.queryenv_service.get_scaling_metrics.return_value = [m]
-        assert self.info.scaling_metrics() == [{'error': '', 'id': '777', 'value': 555.0, 'name': 'test_name'}]
+        assert self._scaling_metrics() == [{'error': '', 'id': '777', 'value': 555.0, 'name': 'test_name'}]
         os.remove('/tmp/test_custom_scaling_metric_execute.sh')
 
 
@@ -310,7 +323,7 @@ class TestSysInfoAPI(unittest.TestCase):
         m.path = '/tmp/test_custom_scaling_metric_execute.sh'
         m.retrieve_method = 'execute'
         system.bus.queryenv_service.get_scaling_metrics.return_value = [m]
-        assert self.info.scaling_metrics() == [{'error': 'exitcode: 1', 'id': '777', 'value': 0.0, 'name': 'test_name'}]
+        assert self._scaling_metrics() == [{'error': 'exitcode: 1', 'id': '777', 'value': 0.0, 'name': 'test_name'}]
         os.remove('/tmp/test_custom_scaling_metric_execute.sh')
 
 
@@ -327,7 +340,7 @@ class TestSysInfoAPI(unittest.TestCase):
         m.path = '/tmp/test_custom_scaling_metric_execute.sh'
         m.retrieve_method = 'execute'
         system.bus.queryenv_service.get_scaling_metrics.return_value = [m]
-        assert self.info.scaling_metrics() == [{'error': 'Timeouted', 'id': '777', 'value': 0.0, 'name': 'test_name'}]
+        assert self._scaling_metrics() == [{'error': 'Timeouted', 'id': '777', 'value': 0.0, 'name': 'test_name'}]
 
         ps = subps.Popen(['ps -ef'], shell=True, stdout=subps.PIPE)
         output = ps.stdout.read()
@@ -350,7 +363,7 @@ class TestSysInfoAPI(unittest.TestCase):
         m.path = '/tmp/test_custom_scaling_metric_read'
         m.retrieve_method = 'read'
         system.bus.queryenv_service.get_scaling_metrics.return_value = [m for _ in range(27)]
-        assert self.info.scaling_metrics() == [{'error': '', 'id': '777', 'value': 555.0, 'name': 'test_name'} for _ in range(27)]
+        assert self._scaling_metrics() == [{'error': '', 'id': '777', 'value': 555.0, 'name': 'test_name'} for _ in range(27)]
         os.remove('/tmp/test_custom_scaling_metric_read')
 
 
@@ -0,0 +1,118 @@
+from __future__ import with_statement
+
+import os
+import gzip
+import shutil
+import binascii
+import tempfile
+import cStringIO
+
+import mock
+from nose.tools import eq_, raises
+
+from scalarizr import rpc
+from scalarizr.api import system
+
+
+class TestLogs(object):
+
+    def setup(self):
+        self.tmp = tempfile.mkdtemp()
+        self.api = system.SystemAPI.__new__(system.SystemAPI)
+        self.api._LOG_FILE = os.path.join(self.tmp, 'scalarizr.log')
+        self.write('0123456789')
+
+    def teardown(self):
+        shutil.rmtree(self.tmp)
+
+    def write(self, data, mode='w', path=None):
+        with open(path or self.api._LOG_FILE, mode) as fp:
+            fp.write(data)
+
+    def data(self, ret):
+        return binascii.a2b_base64(ret['data'])
+
+    def test_whole_log(self):
+        eq_(binascii.a2b_base64(self.api.get_log()), '0123456789')
+
+    def test_range(self):
+        ret = self.api.get_log(offset=2, length=3)
+        eq_(self.data(ret), '234')
+        eq_((ret['offset'], ret['length'], ret['size']), (2, 3, 10))
+
+        eq_(self.data(self.api.get_log(tail=4)), '6789')
+        eq_(self.data(self.api.get_log(tail=20)), '0123456789')
+        eq_(self.api.get_log(offset=20)['length'], 0)
+
+    def test_max_length(self):
+        with mock.patch.object(system, 'max_log_size', 4):
+            ret = self.api.get_log(offset=0)
+            eq_(self.data(ret), '0123')
+            eq_(self.data(self.api.get_log(cursor=ret['cursor'])), '4567')
+
+    def test_follow(self):
+        ret = self.api.get_log(tail=0)
+        eq_((self.data(ret), ret['rotated']), ('', False))
+
+        self.write('abc', 'a')
+        ret = self.api.get_log(cursor=ret['cursor'])
+        eq_((self.data(ret), ret['offset'], ret['rotated']), ('abc', 10, False))
+
+        ret = self.api.get_log(cursor=ret['cursor'])
+        eq_(self.data(ret), '')
+
+        # logrotate moves file away and a new one is created
+        os.rename(self.api._LOG_FILE, self.api._LOG_FILE + '.1')
+        self.write('new')
+        ret = self.api.get_log(cursor=ret['cursor'])
+        eq_((self.data(ret), ret['offset'], ret['rotated']), ('new', 0, True))
+
+        # copytruncate
+        self.write('x')
+        ret = self.api.get_log(cursor=ret['cursor'])
+        eq_((self.data(ret), ret['rotated']), ('x', True))
+
+    def test_gzip(self):
+        ret = self.api.get_log(offset=0, gzip=True)
+        eq_(ret['gzip'], True)
+        eq_(gzip.GzipFile(fileobj=cStringIO.StringIO(self.data(ret))).read(), '0123456789')
+        eq_(ret['length'], 10)
+
+    @raises(rpc.InvalidParamsError)
+    def test_invalid_cursor(self):
+        self.api.get_log(cursor='garbage')
+
+    @raises(rpc.InvalidParamsError)
+    def check_invalid_params(self, params):
+        self.api.get_log(**params)
+
+    def test_negative_range(self):
+        for params in ({'offset': -1}, {'length': -1}, {'tail': -1}):
+            yield self.check_invalid_params, params
+
+    def test_mixed_start(self):
+        for params in ({'offset': 1, 'tail': 2}, {'tail': 2, 'cursor': '1:0'},
+                       {'offset': 1, 'cursor': '1:0'}):
+            yield self.check_invalid_params, params
+
+    def test_zero_length(self):
+        ret = self.api.get_log(offset=2, length=0)
+        eq_((self.data(ret), ret['length'], ret['cursor'].split(':')[1]), ('', 0, '2'))
+
+    @raises(rpc.InvalidParamsError)
+    def test_script_logs_invalid_cursor(self):
+        self.write('stdout', path=os.path.join(self.tmp, 'script.1-out.log'))
+        with mock.patch.object(system.script_executor, 'logs_dir', self.tmp):
+            self.api.get_script_logs(1, cursor='1:0')
+
+    def test_script_logs(self):
+        for suffix, data in (('out', 'stdout'), ('err', 'stderr')):
+            self.write(data, path=os.path.join(self.tmp, 'script.1-%s.log' % suffix))
+        with mock.patch.object(system.script_executor, 'logs_dir', self.tmp):
+            ret = self.api.get_script_logs(1, tail=3)
+            eq_((self.data(ret['stdout']), self.data(ret['stderr'])), ('out', 'err'))
+
+            self.write('!', 'a', path=os.path.join(self.tmp, 'script.1-out.log'))
+            ret = self.api.get_script_logs(1, cursor=dict(
+                    (name, ret[name]['cursor']) for name in ret))
+            eq_((self.data(ret['stdout']), self.data(ret['stderr'])), ('!', ''))
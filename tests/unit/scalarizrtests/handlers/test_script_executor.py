@@ -15,6 +15,8 @@ import platform
 import binascii
 import threading
 import ConfigParser
+import shutil
+import tempfile
 
 
 
@@ -115,3 +117,36 @@ class TestScript(object):
 
     def test_interrupted_and_timeouted(self):
         pass
+
+
+class TestScriptWait(object):
+
+    def setup(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.patcher = mock.patch.multiple(script_executor,
+                        exec_dir_prefix=os.path.join(self.tmp_dir, 'scalr-scripting.'),
+                        logs_dir=self.tmp_dir)
+        self.patcher.start()
+
+    def teardown(self):
+        self.patcher.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def _script(self, body, exec_timeout=30):
+        return script_executor.Script(name='test', body='#!/bin/sh\n' + body,
+                        exec_timeout=exec_timeout, event_name='HostInit')
+
+    def test_returns_on_exit(self):
+        script = self._script('echo hello; exit 3')
+        script.start()
+        script.wait()
+        assert script.return_code == 3
+        assert script.elapsed_time < 1
+        assert open(script.stdout_path).read() == 'hello\n'
+
+    def test_timeout(self):
+        script = self._script('sleep 30', exec_timeout=1)
+        script.start()
+        script.wait()
+        assert script.return_code == script.TIMEOUT_RETURN_CODE
+        assert 1 <= script.elapsed_time < 3
@@ -1,5 +1,9 @@
 
 import os
+import shutil
+import hashlib
+import tempfile
+import cStringIO
 
 from scalarizr.linux import coreutils
 
@@ -20,3 +24,22 @@ def test_lsscsi():
         sda = ret['/dev/sda']
         assert sda['target'] == '1'
         assert sda['host'] == '0'
+
+
+def test_split_stream():
+    tmp = tempfile.mkdtemp()
+    try:
+        data = os.urandom(coreutils.BUFFER_SIZE * 2 + 100)
+        chunk_size = coreutils.BUFFER_SIZE + 50
+        parts = list(coreutils.split_stream(cStringIO.StringIO(data), 'image', chunk_size, tmp, 'sha1'))
+
+        assert [part[0] for part in parts] == ['image.part.00', 'image.part.01']
+        assert [part[1] for part in parts] == [chunk_size, len(data) - chunk_size]
+        for n, (name, size, digest) in enumerate(parts):
+            chunk = data[n * chunk_size:(n + 1) * chunk_size]
+            assert open(os.path.join(tmp, name), 'rb').read() == chunk
+            assert digest == hashlib.sha1(chunk).hexdigest()
+
+        assert list(coreutils.split_stream(cStringIO.StringIO(''), 'empty', 10, tmp)) == []
+    finally:
+        shutil.rmtree(tmp)
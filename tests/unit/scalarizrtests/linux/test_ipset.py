@@ -0,0 +1,26 @@
+import mock
+
+from scalarizr.linux import ipset
+
+
+@mock.patch('scalarizr.linux.ipset.linux.system')
+def test_create(system):
+    ipset.create('scalr-farm', entries=['10.0.0.1', '10.0.0.2'])
+
+    system.assert_called_once_with(('/usr/sbin/ipset', '-exist', 'restore'), stdin=
+            'create scalr-farm hash:ip\n'
+            'add scalr-farm 10.0.0.1\n'
+            'add scalr-farm 10.0.0.2\n')
+
+
+@mock.patch('scalarizr.linux.ipset.linux.system')
+def test_add_remove(system):
+    ipset.add('scalr-farm', '10.0.0.1', '10.0.0.2')
+    system.assert_called_once_with(('/usr/sbin/ipset', '-exist', 'restore'), stdin=
+            'add scalr-farm 10.0.0.1\n'
+            'add scalr-farm 10.0.0.2\n')
+
+    system.reset_mock()
+    ipset.remove('scalr-farm', '10.0.0.1')
+    system.assert_called_once_with(('/usr/sbin/ipset', '-exist', 'restore'), stdin=
+            'del scalr-farm 10.0.0.1\n')
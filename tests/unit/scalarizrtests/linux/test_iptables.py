@@ -151,45 +151,117 @@ class TestIptables(object):
                 "comment": "my local LAN",
         }]
 
-    @mock.patch('scalarizr.linux.iptables.INPUT.list')
-    @mock.patch('scalarizr.linux.iptables.INPUT.insert')
-    @mock.patch('scalarizr.linux.iptables.INPUT.append')
-    def test_ensure(self, append_w, insert_w, list_w):
-        two_rules = [{
-                "source": "192.168.0.1/32",
-                "destination": "192.168.0.2/32",
+    @mock.patch('scalarizr.linux.iptables.iptables_save')
+    def test_snapshot(self, iptables_save):
+        iptables_save.return_value = IPTABLES_SAVE_OUT
+
+        res = iptables._snapshot()
+
+        assert res == {
+                ('nat', 'PREROUTING'): [{
+                        'protocol': 'tcp',
+                        'dport': '8080',
+                        'jump': 'REDIRECT',
+                        'to-ports': '80'}],
+                ('filter', 'INPUT'): [{
+                        'source': '192.168.0.1/32',
+                        'protocol': 'tcp',
+                        'dport': '22',
+                        'jump': 'ACCEPT'},
+                {
+                        'protocol': 'tcp',
+                        'match': 'set',
+                        'match-set': ['scalr-farm', 'src'],
+                        'dport': '80',
+                        'jump': 'ACCEPT'}]}
+
+    @mock.patch('scalarizr.linux.iptables._restore')
+    @mock.patch('scalarizr.linux.iptables.iptables_save')
+    def test_ensure(self, iptables_save, restore):
+        iptables_save.return_value = IPTABLES_SAVE_OUT
+        rules = [{
+                "source": "192.168.0.%d" % i,
                 "protocol": "tcp",
                 "match": "tcp",
-                "dport": "22",
+                "dport": 22,
                 "jump": "ACCEPT",
-        },
-        {
-                "in-interface": "eth1",
-                "match": "comment",
-                "comment": "my local LAN",
-        }]
+        } for i in (1, 2, 3)]
 
-        # 1
-        iptables.chains["INPUT"].list.return_value = two_rules
+        # 1 all rules exist
+        iptables.ensure({"INPUT": rules[:1]})
 
-        iptables.ensure({"INPUT": [two_rules[0]]})
+        iptables_save.assert_called_once_with()
+        assert not restore.called
 
-        iptables.chains["INPUT"].list.assert_called_once_with()
-        assert not iptables.chains["INPUT"].insert.called
-        assert not iptables.chains["INPUT"].append.called
+        # 2 missing rules are inserted in given order with a single call
+        iptables.ensure({"INPUT": rules})
 
-        #
+        restore.assert_called_once_with([
+                ('filter', ['--insert', 'INPUT', 1], rules[2]),
+                ('filter', ['--insert', 'INPUT', 1], rules[1])])
 
-        iptables.chains["INPUT"].list.reset_mock()
-        iptables.chains["INPUT"].insert.reset_mock()
-        iptables.chains["INPUT"].append.reset_mock()
+        # 3
+        restore.reset_mock()
+        nat_rule = dict(rules[1], table='nat')
 
-        # 2
+        iptables.INPUT.ensure([nat_rule, nat_rule], append=True)
 
-        iptables.chains["INPUT"].list.return_value = [two_rules[1]]
+        restore.assert_called_once_with([
+                ('nat', ['--append', 'INPUT'], nat_rule)])
 
-        iptables.ensure({"INPUT": [two_rules[0]]})
+    @mock.patch('scalarizr.linux.iptables._restore')
+    @mock.patch('scalarizr.linux.iptables.iptables_save')
+    def test_discard(self, iptables_save, restore):
+        iptables_save.return_value = IPTABLES_SAVE_OUT
+        rule = {
+                "protocol": "tcp",
+                "match": "set",
+                "match-set": ["scalr-farm", "src"],
+                "dport": "80",
+                "jump": "ACCEPT"
+        }
 
-        iptables.chains["INPUT"].list.assert_called_once_with()
-        iptables.chains["INPUT"].insert.assert_called_once_with(None, two_rules[0])
-        assert not iptables.chains["INPUT"].append.called
+        iptables.INPUT.discard([rule, dict(rule, dport="443")])
+
+        restore.assert_called_once_with([
+                ('filter', ['--delete', 'INPUT'], rule)])
+
+    def test_restore(self):
+        iptables.linux.build_cmd_args = IPTABLES_LINUX.build_cmd_args
+        rule = iptables.OrderedDict((
+                ("protocol", "tcp"),
+                ("match", "set"),
+                ("match-set", ["scalr-farm", "src"]),
+                ("dport", "80"),
+                ("jump", "ACCEPT")))
+        comment = iptables.OrderedDict((
+                ("table", "nat"),
+                ("match", "comment"),
+                ("comment", "my local LAN")))
+
+        iptables._restore([
+                ('filter', ['--insert', 'INPUT', 1], rule),
+                ('nat', ['--append', 'PREROUTING'], comment),
+                ('filter', ['--delete', 'INPUT'], rule)])
+
+        iptables.linux.system.assert_called_once_with(
+                ['/sbin/iptables-restore', '--noflush'], stdin=
+                '*filter\n'
+                '--insert INPUT 1 --protocol tcp --match set --match-set scalr-farm src --dport 80 --jump ACCEPT\n'
+                '--delete INPUT --protocol tcp --match set --match-set scalr-farm src --dport 80 --jump ACCEPT\n'
+                'COMMIT\n'
+                '*nat\n'
+                '--append PREROUTING --match comment --comment "my local LAN"\n'
+                'COMMIT\n')
+
+IPTABLES_SAVE_OUT = \
+        '# Generated by iptables-save v1.4.12\n' \
+        '*nat\n' \
+        ':PREROUTING ACCEPT [0:0]\n' \
+        '-A PREROUTING -p tcp -m tcp --dport 8080 -j REDIRECT --to-ports 80\n' \
+        'COMMIT\n' \
+        '*filter\n' \
+        ':INPUT ACCEPT [0:0]\n' \
+        '-A INPUT -s 192.168.0.1/32 -p tcp -m tcp --dport 22 -j ACCEPT\n' \
+        '-A INPUT -p tcp -m set --match-set scalr-farm src -m tcp --dport 80 -j ACCEPT\n' \
+        'COMMIT\n'
@@ -0,0 +1,121 @@
+from __future__ import with_statement
+
+import os
+import shutil
+import tempfile
+
+from nose.tools import eq_, raises
+
+from scalarizr.linux import procsampler
+
+
+STAT = 'cpu  %d 0 %d %d 0 0 0 0 0 0\ncpu0 1 0 1 1 0 0 0 0 0 0\n'
+MEMINFO = 'MemTotal:        1000 kB\nMemFree:          %d kB\nBuffers:          10 kB\n' \
+          'Cached:           100 kB\nSwapTotal:          0 kB\nSwapFree:           0 kB\n'
+LOADAVG = '%.2f 0.50 0.25 1/100 1234\n'
+DISKSTATS = '   8       0 sda %d 0 %d 0 %d 0 %d 0 0 0 0\n'
+NETDEV = 'Inter-|   Receive  |  Transmit\n face |bytes    packets errs|bytes\n' \
+         '  eth0: %d 10 0 0 0 0 0 0 %d 20 0 0 0 0 0 0\n'
+
+
+class TestRingBuffer(object):
+
+    def test_window(self):
+        ring = procsampler.RingBuffer(4, 2)
+        for n in range(6):
+            ring.append(10.0 * n, [n, n * 2])
+
+        times, rows = ring.window()
+        eq_(times, [20.0, 30.0, 40.0, 50.0])
+        eq_([list(row) for row in rows], [[2, 4], [3, 6], [4, 8], [5, 10]])
+
+        # sample before `since` is kept as a base for rates
+        eq_(ring.window(since=35)[0], [30.0, 40.0, 50.0])
+        eq_(ring.window(since=50)[0], [50.0])
+        eq_(ring.window(since=0)[0], [20.0, 30.0, 40.0, 50.0])
+
+
+class TestProcSampler(object):
+
+    def setup(self):
+        self.proc = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.proc, 'net'))
+        self.sampler = procsampler.ProcSampler(capacity=10)
+        self.sampler.proc_path = self.proc
+
+    def teardown(self):
+        shutil.rmtree(self.proc)
+
+    def write(self, user, system, idle, free, la, reads, writes, rx, tx):
+        for name, content in (('stat', STAT % (user, system, idle)),
+                              ('meminfo', MEMINFO % free),
+                              ('loadavg', LOADAVG % la),
+                              ('diskstats', DISKSTATS % (reads, reads * 8, writes, writes * 8)),
+                              ('net/dev', NETDEV % (rx, tx))):
+            with open(os.path.join(self.proc, name), 'w') as fp:
+                fp.write(content)
+
+    def test_snapshot(self):
+        self.write(0, 0, 0, 500, 1.0, 0, 0, 0, 0)
+        self.sampler.sample(100)
+        snap = self.sampler.snapshot()
+        eq_(snap['samples'], 1)
+        eq_(snap['cpu'], None)
+        eq_(snap['disk']['sda']['read_num'], {'last': 0})
+
+        self.write(50, 25, 25, 400, 2.0, 100, 10, 1000, 2000)
+        self.sampler.sample(110)
+        self.write(100, 50, 150, 300, 3.0, 300, 10, 1000, 4000)
+        self.sampler.sample(120)
+
+        snap = self.sampler.snapshot()
+        eq_((snap['time'], snap['since'], snap['samples']), (120, 100, 3))
+        eq_(snap['cpu']['user']['max'], 50.0)
+        eq_(snap['cpu']['user']['min'], 25.0)
+        eq_(snap['cpu']['idle']['last'], 62.5)
+        eq_(snap['mem']['total_free']['last'], 300)
+        eq_(snap['mem']['total_free']['max'], 500)
+        eq_(snap['mem']['total_real']['avg'], 1000)
+        eq_(snap['load_average']['la1']['p50'], 2.0)
+        eq_(snap['disk']['sda']['read_num'],
+            {'last': 300, 'avg': 15, 'min': 10, 'p50': 20, 'p95': 20, 'max': 20})
+        eq_(snap['disk']['sda']['read_bytes']['max'], 20 * 8 * 512)
+        eq_(snap['net']['eth0']['transmit_bytes']['avg'], 200)
+        eq_(snap['net']['eth0']['receive_packets']['max'], 0)
+
+        snap = self.sampler.snapshot(since=115)
+        eq_((snap['since'], snap['samples']), (110, 2))
+        eq_(snap['disk']['sda']['read_num']['avg'], 20)
+
+    def test_counter_reset(self):
+        self.write(0, 0, 0, 500, 1.0, 100, 0, 0, 0)
+        self.sampler.sample(100)
+        self.write(0, 0, 0, 500, 1.0, 10, 0, 0, 0)
+        self.sampler.sample(110)
+        self.write(0, 0, 0, 500, 1.0, 20, 0, 0, 0)
+        self.sampler.sample(120)
+
+        eq_(self.sampler.snapshot()['disk']['sda']['read_num']['max'], 1)
+
+    def test_device_gone(self):
+        self.write(0, 0, 0, 500, 1.0, 0, 0, 0, 0)
+        self.sampler.sample(100)
+        with open(os.path.join(self.proc, 'diskstats'), 'w') as fp:
+            fp.write('')
+        self.sampler.sample(110)
+
+        eq_(self.sampler.snapshot()['disk'], {})
+
+    def test_start_failed(self):
+        @raises(IOError)
+        def start():
+            self.sampler.start()
+        start()
+        assert not self.sampler.running
+
+        self.write(0, 0, 0, 500, 1.0, 0, 0, 0, 0)
+        self.sampler.start()
+        try:
+            assert self.sampler.running
+        finally:
+            self.sampler.stop()
@@ -0,0 +1,123 @@
+import threading
+
+import mock
+
+from scalarizr.messaging import p2p
+from scalarizr.messaging.p2p import producer as p2p_producer
+
+
+class TestAsyncDelivery(object):
+
+    def setup(self):
+        self.store = mock.Mock()
+        self.store.get_undelivered.return_value = []
+        patcher = mock.patch.object(p2p, 'P2pMessageStore', return_value=self.store)
+        patcher.start()
+        self.patchers = [patcher]
+        self.producer = p2p_producer.P2pMessageProducer('http://localhost:8013', '0')
+        self.sent = []
+        self.fail_times = 0
+        self.release = threading.Event()
+        self.release.set()
+
+        def send0(queue, message, success_callback=None, fail_callback=None):
+            self.release.wait()
+            if self.fail_times:
+                self.fail_times -= 1
+                if fail_callback:
+                    fail_callback(queue, message, Exception('Endpoint unreachable'))
+                return
+            self.sent.append(message.name)
+            if success_callback:
+                success_callback(queue, message)
+        self.producer._send0 = send0
+
+
+    def teardown(self):
+        self.release.set()
+        self.producer.shutdown()
+        for patcher in self.patchers:
+            patcher.stop()
+
+
+    def _new_message(self, name):
+        msg = p2p.P2pMessage.__new__(p2p.P2pMessage)
+        msg.__dict__.update(id=None, name=name, meta={}, body={})
+        return msg
+
+
+    def test_async_messages_dont_block(self):
+        self.producer.start_async_delivery()
+        self.release.clear()
+        for i in range(3):
+            self.producer.send('log', self._new_message('Log'))
+        assert self.producer.pending == 3
+        self.release.set()
+        assert self.producer.flush(5)
+        assert self.sent == ['Log'] * 3
+        assert self.store.put_outgoing.call_count == 3
+
+
+    def test_sync_flag(self):
+        self.producer.start_async_delivery()
+        self.producer.send('log', self._new_message('Log'), sync=True)
+        self.producer.send('control', self._new_message('HostUp'))
+        assert self.producer.pending == 0
+        assert self.sent == ['Log', 'HostUp']
+
+
+    def test_sync_after_async_keeps_order(self):
+        self.producer.start_async_delivery()
+        self.release.clear()
+        self.producer.send('log', self._new_message('Log'))
+        self.producer.send('log', self._new_message('OperationResult'))
+        sender = threading.Thread(target=self.producer.send,
+                                  args=('control', self._new_message('HostUp')))
+        sender.start()
+        sender.join(0.2)
+        assert sender.isAlive()
+        assert self.producer.pending == 3
+        self.release.set()
+        sender.join(5)
+        assert self.sent == ['Log', 'OperationResult', 'HostUp']
+
+
+    def test_sync_error_without_retries(self):
+        self.producer.shutdown()
+        self.producer = p2p_producer.P2pMessageProducer('http://localhost:8013')
+        self.producer._send0 = send0 = mock.Mock(
+                side_effect=lambda queue, message, success, fail: fail(queue, message, KeyError()))
+        self.producer.start_async_delivery()
+        try:
+            self.producer.send('control', self._new_message('HostUp'))
+            assert False, 'Exception expected'
+        except KeyError:
+            pass
+        assert send0.call_count == 1
+
+
+    def test_without_async_delivery(self):
+        self.producer.send('log', self._new_message('OperationProgress'))
+        assert self.sent == ['OperationProgress']
+
+
+    def test_retry_keeps_order(self):
+        self.producer.start_async_delivery()
+        self.release.clear()
+        self.fail_times = 2
+        self.producer.send('log', self._new_message('OperationDefinition'))
+        self.producer.send('log', self._new_message('OperationProgress'))
+        self.producer.send('log', self._new_message('OperationResult'))
+        self.release.set()
+        assert self.producer.flush(5)
+        assert self.sent == ['OperationDefinition', 'OperationProgress', 'OperationResult']
+
+
+    def test_undelivered_from_previous_run(self):
+        self.store.get_undelivered.return_value = [
+            ('control', self._new_message('HostUp')),
+            ('log', self._new_message('Log'))
+        ]
+        self.producer.start_async_delivery()
+        assert self.producer.flush(5)
+        assert self.sent == ['Log']
@@ -0,0 +1,154 @@
+import os
+import time
+import sqlite3
+import tempfile
+import threading
+
+import mock
+
+from scalarizr.bus import bus
+from scalarizr.util import sqlite_server
+from scalarizr.messaging import p2p
+from scalarizr.messaging.p2p import P2pMessage
+
+
+DB_SCRIPT = os.path.join(os.path.dirname(__file__), '../../../../../share/db.sql')
+
+
+class TestP2pMessageStore(object):
+
+    def setup(self):
+        fd, self.db_file = tempfile.mkstemp()
+        os.close(fd)
+        conn = sqlite3.connect(self.db_file)
+        conn.executescript(open(DB_SCRIPT).read())
+        conn.close()
+
+        def creator():
+            conn = sqlite3.connect(self.db_file)
+            conn.row_factory = sqlite3.Row
+            return conn
+        t = sqlite_server.SQLiteServerThread(creator)
+        t.setDaemon(True)
+        t.start()
+        sqlite_server.wait_for_server_thread(t)
+        self.patcher = mock.patch.multiple(bus, db=t.connection, cnf=None, periodical_executor=None)
+        self.patcher.start()
+        self.store = p2p._P2pMessageStore()
+
+
+    def teardown(self):
+        self.patcher.stop()
+        os.remove(self.db_file)
+
+
+    def _message(self, id):
+        msg = P2pMessage('TestMessage', body={'a': 1})
+        msg.id = id
+        return msg
+
+
+    def test_put_ingoing_wakes_waiter(self):
+        seq = self.store.ingoing_seq
+        result = {}
+
+        def waiter():
+            start = time.time()
+            result['seq'] = self.store.wait_ingoing(seq, 5)
+            result['elapsed'] = time.time() - start
+
+        t = threading.Thread(target=waiter)
+        t.start()
+        time.sleep(0.1)
+        self.store.put_ingoing(self._message('msg-1'), 'control', 'test')
+        t.join()
+
+        assert result['seq'] == seq + 1
+        assert result['elapsed'] < 1
+
+
+    def test_wait_ingoing_returns_if_seq_changed(self):
+        seq = self.store.ingoing_seq
+        self.store.put_ingoing(self._message('msg-1'), 'control', 'test')
+        start = time.time()
+        assert self.store.wait_ingoing(seq, 5) == seq + 1
+        assert time.time() - start < 1
+
+
+    def test_get_unhandled_without_copies(self):
+        msg = self._message('msg-1')
+        self.store.put_ingoing(msg, 'control', 'test')
+        unhandled = self.store.get_unhandled('test')
+        assert unhandled == [('control', msg)]
+        assert unhandled[0][1] is msg
+
+        self.store.mark_as_handled('msg-1')
+        assert self.store.get_unhandled('test') == []
+        assert self.store.is_handled('msg-1')
+
+
+    def test_put_ingoing_concurrent_with_mark_as_handled(self):
+        for n in range(20):
+            self.store.put_ingoing(self._message('old-%d' % n), 'control', 'test')
+        start = threading.Event()
+
+        def put():
+            start.wait()
+            for n in range(20):
+                self.store.put_ingoing(self._message('new-%d' % n), 'control', 'test')
+
+        def handle():
+            start.wait()
+            for n in range(20):
+                self.store.mark_as_handled('old-%d' % n)
+
+        threads = [threading.Thread(target=put), threading.Thread(target=handle)]
+        for t in threads:
+            t.start()
+        start.set()
+        for t in threads:
+            t.join()
+
+        ids = [msg.id for _, msg in self.store.get_unhandled('test')]
+        assert ids == ['new-%d' % n for n in range(20)], ids
+
+
+    def test_mark_as_handled_strips_platform_access_data(self):
+        msg = self._message('msg-2')
+        msg.body['platform_access_data'] = {'key': 'secret'}
+        self.store.put_ingoing(msg, 'control', 'test')
+        self.store.mark_as_handled('msg-2')
+
+        stored = self.store.load('msg-2', True)
+        assert 'platform_access_data' not in stored.body
+        assert stored.body['a'] == 1
+        # in-memory message is left untouched for the handler
+        assert msg.body['platform_access_data'] == {'key': 'secret'}
+
+
+    def test_group_commit(self):
+        conn = mock.Mock(wraps=bus.db)
+        writer = p2p.GroupCommitWriter(lambda: conn, window=0.5)
+        for i in range(10):
+            writer.submit([('INSERT INTO state VALUES (?, ?)', ['key%d' % i, str(i)])])
+        writer.submit([('INSERT INTO state VALUES (?, ?)', ['sync', 'value'])], sync=True)
+
+        assert conn.executebatch.call_count == 1
+        assert len(conn.executebatch.call_args[0][0]) == 11
+        cur = bus.db.cursor()
+        cur.execute('SELECT COUNT(*) FROM state')
+        assert cur.fetchone()[0] == 11
+
+
+    def test_group_commit_isolates_failed_operation(self):
+        writer = p2p.GroupCommitWriter(lambda: bus.db, window=0.5)
+        writer.submit([('INSERT INTO state VALUES (?, ?)', ['good', '1'])])
+        writer.submit([('INSERT INTO unknown_table VALUES (?)', ['bad'])])
+        try:
+            writer.submit([('INSERT INTO unknown_table VALUES (?)', ['bad'])], sync=True)
+            assert False, 'Exception expected'
+        except sqlite3.OperationalError:
+            pass
+        cur = bus.db.cursor()
+        cur.execute('SELECT value FROM state WHERE name = ?', ['good'])
+        assert cur.fetchone()[0] == '1'
@@ -0,0 +1,206 @@
+from __future__ import with_statement
+
+import os
+import shutil
+import tempfile
+import threading
+import SocketServer
+
+import mock
+from nose.tools import eq_, assert_raises
+
+from scalarizr.api import haproxy as haproxy_api
+from scalarizr.services import haproxy
+
+
+BACKEND = 'scalr:backend:tcp:80'
+
+HAPROXY_CFG = '''global
+    stats socket /var/run/haproxy-stats.sock level admin
+
+defaults
+    timeout connect 5000ms
+
+listen scalr:listen:tcp:80
+    mode tcp
+    bind *:80
+    default_backend scalr:backend:tcp:80
+
+backend scalr:backend:tcp:80
+    mode tcp
+    server 10-0-0-1:80 10.0.0.1:80 check
+    server 10-0-0-2:80 10.0.0.2:80 check disabled
+'''
+
+
+class FakeStatsHandler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        server = self.server
+        command = self.rfile.readline().strip()
+        server.commands.append(command)
+        args = command.split()
+        if command == 'show stat':
+            lines = ['# pxname,svname,status,weight,']
+            for (backend, name), (status, weight) in sorted(server.servers.items()):
+                lines.append('%s,%s,%s,%s,' % (backend, name, status, weight))
+            reply = '\n'.join(lines) + '\n\n'
+        elif args[0] in ('enable', 'disable', 'set') and not server.admin:
+            reply = 'Permission denied\n\n'
+        elif args[0] in ('enable', 'disable', 'set'):
+            key = tuple(args[2].split('/', 1))
+            if key not in server.servers:
+                reply = 'No such server.\n\n'
+            else:
+                status, weight = server.servers[key]
+                if args[0] == 'enable':
+                    status = 'UP'
+                elif args[0] == 'disable':
+                    status = 'MAINT'
+                else:
+                    weight = int(args[3])
+                server.servers[key] = (status, weight)
+                reply = '\n'
+        else:
+            reply = 'Unknown command.\n\n'
+        self.wfile.write(reply)
+
+
+class FakeHAProxy(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    '''
+    haproxy stats socket stand-in, knows servers from HAPROXY_CFG
+    '''
+    daemon_threads = True
+
+    def __init__(self, address):
+        SocketServer.UnixStreamServer.__init__(self, address, FakeStatsHandler)
+        self.commands = []
+        self.admin = True
+        self.servers = {
+            (BACKEND, '10-0-0-1:80'): ('UP', 1),
+            (BACKEND, '10-0-0-2:80'): ('MAINT', 1)
+        }
+        self.thread = threading.Thread(target=self.serve_forever, args=(0.05, ))
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class TestStatSocket(object):
+
+    def setup(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.fake = FakeHAProxy(os.path.join(self.tmp_dir, 'stats.sock'))
+        self.stats = haproxy.StatSocket(os.path.join(self.tmp_dir, 'stats.sock'))
+
+    def teardown(self):
+        self.fake.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_show_stat(self):
+        stat = self.stats.show_stat()
+        eq_([(row['svname'], row['status']) for row in stat],
+            [('10-0-0-1:80', 'UP'), ('10-0-0-2:80', 'MAINT')])
+
+    def test_server_state(self):
+        self.stats.disable_server(BACKEND, '10-0-0-1:80')
+        self.stats.enable_server(BACKEND, '10-0-0-2:80')
+        self.stats.drain_server(BACKEND, '10-0-0-2:80')
+        eq_(self.fake.servers, {
+            (BACKEND, '10-0-0-1:80'): ('MAINT', 1),
+            (BACKEND, '10-0-0-2:80'): ('UP', 0)
+        })
+        eq_(self.fake.commands[-1], 'set weight %s/10-0-0-2:80 0' % BACKEND)
+
+    def test_errors(self):
+        assert_raises(haproxy.HAProxyError, self.stats.enable_server, BACKEND, '10-0-0-3:80')
+        self.fake.admin = False
+        assert_raises(haproxy.HAProxyError, self.stats.disable_server, BACKEND, '10-0-0-1:80')
+        stats = haproxy.StatSocket(os.path.join(self.tmp_dir, 'nosuch.sock'))
+        assert_raises(haproxy.HAProxyError, stats.show_stat)
+
+
+class TestHAProxyAPIRuntime(object):
+
+    def setup(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'haproxy.cfg')
+        with open(self.path, 'w') as fp:
+            fp.write(HAPROXY_CFG)
+        self.fake = FakeHAProxy(os.path.join(self.tmp_dir, 'stats.sock'))
+        # bypass Singleton
+        self.api = haproxy_api.HAProxyAPI.__new__(haproxy_api.HAProxyAPI)
+        self.api.__init__(self.path)
+        self.api.stats = haproxy.StatSocket(os.path.join(self.tmp_dir, 'stats.sock'))
+        self.api.svc = mock.Mock(**{'status.return_value': 0})
+        self.api._commits.window = 60
+
+    def teardown(self):
+        self.fake.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def _servers(self):
+        servers = haproxy.HAProxyCfg(self.path).backends[BACKEND]['server']
+        return dict((name, servers[name]) for name in servers)
+
+    def test_remove_and_add_in_place(self):
+        self.api.remove_server('10.0.0.1', backend='tcp:80')
+        eq_(self.fake.servers[(BACKEND, '10-0-0-1:80')], ('MAINT', 1))
+        assert '10-0-0-1:80' not in self._servers()
+
+        self.api.add_server({'host': '10.0.0.1', 'port': 80}, backend='tcp:80')
+        eq_(self.fake.servers[(BACKEND, '10-0-0-1:80')], ('UP', 1))
+        # server disabled in config
+        self.api.add_server({'host': '10.0.0.2', 'port': 80}, backend='tcp:80')
+        eq_(self.fake.servers[(BACKEND, '10-0-0-2:80')], ('UP', 1))
+
+        self.api._commits.flush()
+        eq_(self.api.svc.reload.call_count, 0)
+        eq_(sorted(self._servers()), ['10-0-0-1:80', '10-0-0-2:80'])
+        assert not self._servers()['10-0-0-2:80'].get('disabled')
+
+    def test_new_servers_coalesced(self):
+        for n in range(3, 10):
+            self.api.add_server({'host': '10.0.0.%d' % n, 'port': 80}, backend='tcp:80')
+        self.api.remove_server('10.0.0.1', backend='tcp:80')
+        # the first one is committed at once, the rest wait for the window
+        eq_(self.api.svc.reload.call_count, 1)
+        eq_(len(self._servers()), 3)
+
+        self.api._commits.flush()
+        eq_(self.api.svc.reload.call_count, 2)
+        eq_(len(self._servers()), 8)
+
+    def test_same_server_no_reload(self):
+        self.api.add_server({'host': '10.0.0.1', 'port': 80}, backend='tcp:80')
+        self.api._commits.flush()
+        eq_(self.api.svc.reload.call_count, 0)
+
+    def test_fallback_to_reload(self):
+        self.fake.admin = False
+        self.api.remove_server('10.0.0.1', backend='tcp:80')
+        eq_(self.api.svc.reload.call_count, 1)
+        eq_(self.fake.servers[(BACKEND, '10-0-0-1:80')], ('UP', 1))
+
+    def test_list_servers_sees_pending(self):
+        self.api.add_server({'host': '10.0.0.3', 'port': 80}, backend='tcp:80')
+        self.api.add_server({'host': '10.0.0.4', 'port': 80}, backend='tcp:80')
+        assert self.api._commits.pending
+        eq_(len(self.api.list_listeners()), 1)
+        assert not self.api._commits.pending
+        eq_(len(self._servers()), 4)
+
+    def test_healthcheck_commits_pending(self):
+        self.api.add_server({'host': '10.0.0.3', 'port': 80}, backend='tcp:80')
+        self.api.remove_server('10.0.0.1', backend='tcp:80')
+        assert self.api._commits.pending
+        assert self.api._disabled
+
+        self.api.configure_healthcheck('tcp:80', '5s', '3s', 3, 2)
+        assert not self.api._commits.pending
+        assert not self.api._disabled
+        eq_(self.api.svc.reload.call_count, 2)
+        eq_(sorted(self._servers()), ['10-0-0-2:80', '10-0-0-3:80'])
@@ -0,0 +1,139 @@
+from __future__ import with_statement
+
+import os
+import sys
+import tempfile
+
+import mock
+from nose.tools import eq_, assert_raises
+
+from scalarizr.util import PopenError
+from scalarizr.services import postgresql
+
+
+FAKE_PSQL = os.path.join(os.path.dirname(__file__),
+                         '../../fixtures/services/postgresql/fake_psql.py')
+
+
+class TestPSQL(object):
+
+    def setup(self):
+        fd, self.log = tempfile.mkstemp()
+        os.close(fd)
+        self.patcher = mock.patch.object(postgresql.PSQLSession, '_args',
+                                         lambda session: [sys.executable, FAKE_PSQL, self.log])
+        self.patcher.start()
+        self.psql = postgresql.PSQL()
+
+    def teardown(self):
+        postgresql.PSQL.close_sessions()
+        self.patcher.stop()
+        os.remove(self.log)
+
+    def _starts(self):
+        with open(self.log) as fp:
+            return fp.read().count('start')
+
+    def test_one_session(self):
+        eq_(self.psql.list_pg_roles(), ['postgres', 'scalr'])
+        eq_(postgresql.PSQL().list_pg_roles(), ['postgres', 'scalr'])
+        eq_(self.psql.query('SELECT 1'), [('SELECT 1;', 'multi\nline')])
+        eq_(self.psql.query('ALTER ROLE scalr NOSUPERUSER;'), [])
+        eq_(self._starts(), 1)
+
+    def test_params(self):
+        rows = self.psql.query('SELECT :\'value\' FROM :"table";',
+                               value="it's a \\ back\nslash", table='pg_roles')
+        eq_(rows[0][0], 'SELECT \'it\'\'s a \\ back\nslash\' FROM "pg_roles";')
+
+    def test_error(self):
+        assert_raises(PopenError, self.psql.query, 'SELECT BOGUS;', silent=True)
+        # session is still usable
+        eq_(self.psql.execute('SELECT 2;'), 'SELECT 2;|multi\nline')
+        eq_(self._starts(), 1)
+
+    def test_session_restart(self):
+        self.psql.query('SELECT 1;')
+        try:
+            self.psql.query('SELECT CRASH;', silent=True)
+            assert False, 'PopenError expected'
+        except PopenError, e:
+            assert 'server closed the connection' in str(e)
+        eq_(self.psql.list_pg_roles(), ['postgres', 'scalr'])
+        eq_(self._starts(), 3)
+
+    def test_connection_failure(self):
+        with mock.patch.object(postgresql.PSQLSession, '_args',
+                               lambda session: ['/bin/sh', '-c',
+                                    'echo "psql: could not connect to server: No such file"']):
+            assert not self.psql.test_connection()
+
+
+PG_HBA = '''# TYPE  DATABASE  USER  ADDRESS  METHOD
+local   all   postgres   trust
+host    all   all   10.0.0.1/32   md5
+'''
+
+
+class TestPgHbaConf(object):
+
+    def setup(self):
+        fd, self.path = tempfile.mkstemp()
+        os.write(fd, PG_HBA)
+        os.close(fd)
+        os.chmod(self.path, 0640)
+        self.conf = postgresql.PgHbaConf(self.path)
+
+    def teardown(self):
+        os.remove(self.path)
+
+    def _read(self):
+        with open(self.path) as fp:
+            return fp.read()
+
+    def test_add_client(self):
+        assert self.conf.add_client('10.0.0.2')
+        assert not self.conf.add_client('10.0.0.1')
+        eq_(self._read(), PG_HBA + 'host\tall\tall\t10.0.0.2/32\tmd5\n')
+
+    def test_batch(self):
+        with mock.patch.object(postgresql.PgHbaRecord, 'from_string',
+                               side_effect=postgresql.PgHbaRecord.from_string) as from_string:
+            with self.conf.batch():
+                for n in range(2, 10):
+                    self.conf.add_client('10.0.0.%d' % n)
+                self.conf.delete_client('10.0.0.1')
+                self.conf.delete_client('10.0.0.5')
+                # written on batch exit
+                eq_(self._read(), PG_HBA)
+            eq_(from_string.call_count, 2)
+        ips = [r.address for r in postgresql.PgHbaConf(self.path).records if r.host == 'host']
+        eq_(ips, ['10.0.0.%d/32' % n for n in (2, 3, 4, 6, 7, 8, 9)])
+        assert self._read().startswith('# TYPE')
+        eq_(os.stat(self.path).st_mode & 0777, 0640)
+
+    def test_batch_rollback(self):
+        try:
+            with self.conf.batch():
+                self.conf.add_client('10.0.0.2')
+                raise Exception('Rollback')
+        except Exception:
+            pass
+        eq_(self._read(), PG_HBA)
+        eq_(len(self.conf.records), 2)
+
+    def test_access_mode(self):
+        self.conf.set_password_access_mode()
+        records = self.conf.records
+        eq_(records[-1], postgresql.PgHbaConf.password_mode)
+        eq_(len(records), 2)
+        self.conf.allow_local_connections()
+        eq_(len(self.conf.records), 3)
+        assert not self.conf.add_record(records[-1], replace_similar=True)
+
+    def test_external_change(self):
+        eq_(len(self.conf.records), 2)
+        with open(self.path, 'a') as fp:
+            fp.write('host all all 10.0.0.3/32 md5\n')
+        eq_(len(self.conf.records), 3)
+        assert not self.conf.add_client('10.0.0.3')
@@ -0,0 +1,152 @@
+from __future__ import with_statement
+
+import socket
+import threading
+import SocketServer
+
+from nose.tools import eq_, assert_raises
+
+from scalarizr.util import PopenError
+from scalarizr.services import redis
+
+
+INFO = '\r\n'.join([
+    '# Replication',
+    'role:slave',
+    'master_host:10.0.0.1',
+    'master_port:6379',
+    'master_link_status:up',
+    'master_sync_in_progress:0',
+    'aof_enabled:1',
+    'bgsave_in_progress:0',
+    ''
+])
+
+
+class FakeRedisHandler(SocketServer.StreamRequestHandler):
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        assert line.startswith('*')
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def handle(self):
+        server = self.server
+        server.connections += 1
+        authorized = not server.password
+        while True:
+            args = self._read_command()
+            if args is None:
+                break
+            server.commands.append(args)
+            name = args[0].upper()
+            if name == 'AUTH':
+                if not server.password:
+                    reply = '-ERR Client sent AUTH, but no password is set\r\n'
+                elif args[1] == server.password:
+                    authorized = True
+                    reply = '+OK\r\n'
+                else:
+                    reply = '-ERR invalid password\r\n'
+            elif not authorized:
+                reply = '-ERR operation not permitted\r\n'
+            elif name == 'INFO':
+                reply = '$%d\r\n%s\r\n' % (len(INFO), INFO)
+            elif name == 'PING':
+                reply = '+PONG\r\n'
+            elif name == 'DBSIZE':
+                reply = ':42\r\n'
+            elif name == 'KEYS':
+                reply = '*2\r\n$1\r\na\r\n$1\r\nb\r\n'
+            else:
+                reply = "-ERR unknown command '%s'\r\n" % args[0]
+            self.wfile.write(reply)
+            if server.close_after_reply:
+                break
+
+
+class TestRedisCLI(object):
+
+    def setup(self):
+        self.server = SocketServer.ThreadingTCPServer(('127.0.0.1', 0), FakeRedisHandler)
+        self.server.daemon_threads = True
+        self.server.connections = 0
+        self.server.commands = []
+        self.server.password = None
+        self.server.close_after_reply = False
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def teardown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        for pool in redis.RedisConnectionPool._pools.values():
+            pool.clear()
+        redis.RedisConnectionPool._pools.clear()
+
+    def test_info_properties(self):
+        cli = redis.RedisCLI(port=self.port)
+        eq_(cli.role, 'slave')
+        eq_(cli.master_port, 6379)
+        eq_(cli.master_link_status, 'up')
+        assert cli.aof_enabled
+        assert not cli.master_sync_in_progress
+        eq_(self.server.connections, 1)
+        eq_(len(self.server.commands), 5)
+
+    def test_info_snapshot(self):
+        cli = redis.RedisCLI(port=self.port)
+        info = cli.info
+        eq_((info.role, info.master_host, info.bgsave_in_progress),
+            ('slave', '10.0.0.1', False))
+        eq_(info['unknown_key'], None)
+        eq_(self.server.commands, [['info']])
+
+    def test_execute(self):
+        cli = redis.RedisCLI(port=self.port)
+        eq_(cli.execute('dbsize'), '42')
+        eq_(cli.execute('keys "*"'), 'a\nb')
+        eq_(self.server.commands[-1], ['keys', '*'])
+        assert_raises(PopenError, cli.execute, 'unknown', silent=True)
+
+    def test_pipeline(self):
+        cli = redis.RedisCLI(port=self.port)
+        eq_(cli.pipeline(('PING', ), ('DBSIZE', )), ['PONG', 42])
+        assert_raises(redis.RedisError, cli.pipeline, ('PING', ), ('BOGUS', ))
+        # connection stays usable after an error reply
+        eq_(cli.execute('ping'), 'PONG')
+        eq_(self.server.connections, 1)
+
+    def test_auth(self):
+        self.server.password = 'secret'
+        cli = redis.RedisCLI('secret', port=self.port)
+        eq_(cli.role, 'slave')
+        eq_(cli.role, 'slave')
+        eq_(self.server.commands, [['AUTH', 'secret'], ['info'], ['info']])
+        assert_raises(redis.RedisError, redis.RedisCLI('wrong', port=self.port).execute,
+                      'ping', silent=True)
+
+    def test_auth_no_password_set(self):
+        cli = redis.RedisCLI('secret', port=self.port)
+        eq_(cli.execute('ping'), 'PONG')
+
+    def test_reconnect(self):
+        cli = redis.RedisCLI(port=self.port)
+        self.server.close_after_reply = True
+        eq_(cli.execute('ping'), 'PONG')
+        eq_(cli.execute('ping'), 'PONG')
+        eq_(self.server.connections, 2)
+
+    def test_server_down(self):
+        self.server.shutdown()
+        self.server.server_close()
+        cli = redis.RedisCLI(port=self.port)
+        assert_raises(redis.RedisError, cli.execute, 'ping', silent=True)
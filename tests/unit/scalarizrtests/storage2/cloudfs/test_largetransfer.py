@@ -0,0 +1,127 @@
+from __future__ import with_statement
+
+import os
+import hashlib
+import tempfile
+import threading
+
+import mock
+
+from scalarizr.linux import coreutils
+from scalarizr.storage2 import cloudfs
+from scalarizr.storage2.cloudfs import local
+
+
+def _cloudfs(fstype, **driver_kwds):
+    return cloudfs.cloudfs_types[fstype](**driver_kwds)
+
+
+class TestLargeTransferStreaming(object):
+
+    def setup(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp_dir, 'dump.sql')
+        with open(self.src, 'w') as fp:
+            for i in range(5 * 1024):
+                fp.write(os.urandom(512))
+        self.dst = os.path.join(self.tmp_dir, 'bucket')
+        # test_cloudfs replaces module level cloudfs() with a mock
+        self.patcher = mock.patch.object(cloudfs, 'cloudfs', _cloudfs)
+        self.patcher.start()
+
+    def teardown(self):
+        self.patcher.stop()
+        coreutils.remove(self.tmp_dir)
+
+    def test_upload(self):
+        in_use = []
+        put = local.LocalFileSystem.put
+
+        def put_and_count(driver, src, url, report_to=None):
+            in_use.append(transfer._buffers.qsize())
+            return put(driver, src, url, report_to)
+
+        transfer = cloudfs.LargeTransfer(open(self.src), 'file://%s/' % self.dst,
+                        compressor=None, chunk_size=1, streaming=True,
+                        transfer_id='trn', num_workers=2)
+        with mock.patch.object(local.LocalFileSystem, 'put', put_and_count):
+            manifest = transfer.run()
+
+        assert transfer._tranzit_vol.device is None
+        assert not os.path.exists(transfer._tranzit_vol.mpoint)
+        assert max(in_use) <= 2
+        assert transfer._buffers.qsize() == 0
+
+        chunks = manifest['files'][0]['chunks']
+        assert [chunk[0] for chunk in chunks] == \
+                        ['dump.sql.000', 'dump.sql.001', 'dump.sql.002']
+        assert [chunk[2] for chunk in chunks] == [1048576, 1048576, 524288]
+        data = ''
+        for name, md5sum, size in chunks:
+            with open(os.path.join(self.dst, 'trn', name)) as fp:
+                chunk = fp.read()
+            assert hashlib.md5(chunk).hexdigest() == md5sum
+            data += chunk
+        assert data == open(self.src).read()
+        assert os.path.exists(os.path.join(self.dst, 'trn', 'manifest.json'))
+
+
+class TestLargeTransferRestore(object):
+
+    def setup(self):
+        self.transfer = cloudfs.LargeTransfer('file:///backups/manifest.json', '/tmp/restore/')
+        self.transfer.restore_buf_size = 1000
+        self.transfer.restore_read_ahead = 2
+        self.chunks_dir = self.transfer._tranzit_vol.mpoint
+        self.data = os.urandom(10000)
+        self.file_ = {'chunks': cloudfs.OrderedDict()}
+        for n in range(5):
+            chunk = self.data[n * 2000:(n + 1) * 2000]
+            name = 'dump.sql.%03d' % n
+            with open(os.path.join(self.chunks_dir, name), 'w') as fp:
+                fp.write(chunk)
+            self.file_['chunks'][name] = {
+                'md5sum': hashlib.md5(chunk).hexdigest(),
+                'downloaded': cloudfs.InterruptibleEvent(),
+                'processed': cloudfs.InterruptibleEvent()
+            }
+        self.transfer.files = [self.file_]
+
+    def teardown(self):
+        coreutils.remove(self.chunks_dir)
+
+    def download(self):
+        # download workers fire transfer_complete and wait until chunk is processed
+        workers = []
+        for name in self.file_['chunks']:
+            worker = threading.Thread(target=self.transfer._chunk_downloaded,
+                                      args=('file:///backups/' + name, self.chunks_dir, 0, -1))
+            worker.setDaemon(True)
+            worker.start()
+            workers.append(worker)
+        return workers
+
+    def test_restore_chunks(self):
+        out = []
+        stream = mock.Mock(write=out.append)
+        workers = self.download()
+        self.transfer._restore_chunks(self.file_, stream, None)
+        for worker in workers:
+            worker.join(5)
+        assert ''.join(out) == self.data
+        assert all(info['processed'].isSet() for info in self.file_['chunks'].values())
+        assert not os.listdir(self.chunks_dir)
+
+    def test_md5_mismatch(self):
+        self.file_['chunks']['dump.sql.002']['md5sum'] = hashlib.md5('').hexdigest()
+        out = []
+        stream = mock.Mock(write=out.append)
+        self.download()
+        try:
+            self.transfer._restore_chunks(self.file_, stream, None)
+            assert False, 'Exception expected'
+        except Exception, e:
+            assert 'dump.sql.002' in str(e)
+        assert not self.file_['chunks']['dump.sql.002']['processed'].isSet()
+        # corrupted chunk is never written to the restore pipe
+        assert ''.join(out) == self.data[:4000]
@@ -0,0 +1,77 @@
+import time
+import threading
+
+import mock
+from nose.tools import raises
+
+from scalarizr import storage2
+from scalarizr.storage2.volumes import loop
+
+
+@mock.patch.multiple('scalarizr.linux.coreutils',
+                                        dd=mock.DEFAULT,
+                                        losetup=mock.DEFAULT,
+                                        losetup_all=mock.DEFAULT)
+class TestConcurrentEnsure(object):
+
+    def setup(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+        self.failing_file = None
+
+    def _slow_losetup(self, file, **kwds):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.2)
+        with self.lock:
+            self.running -= 1
+        if file == self.failing_file:
+            raise storage2.StorageError('losetup failed for %s' % file)
+
+    def _volumes(self, losetup, losetup_all, count):
+        losetup.side_effect = self._slow_losetup
+        losetup_all.return_value.__getitem__.side_effect = lambda file: '/dev/loop-%s' % file
+        return [storage2.volume(type='loop', size=1, file='/mnt/loopdev%d' % num)
+                for num in range(count)]
+
+    def test_ensure(self, dd, losetup, losetup_all):
+        vols = self._volumes(losetup, losetup_all, 6)
+        start = time.time()
+        assert storage2.concurrent_ensure(vols, max_workers=3) == vols
+        elapsed = time.time() - start
+
+        assert self.max_running == 3
+        assert elapsed < 0.6, elapsed
+        assert [vol.device for vol in vols] == \
+                        ['/dev/loop-/mnt/loopdev%d' % num for num in range(6)]
+        assert all(vol.id for vol in vols)
+
+    def test_rollback(self, dd, losetup, losetup_all):
+        vols = self._volumes(losetup, losetup_all, 4)
+        vols[0].id = 'loop-existed'
+        self.failing_file = vols[2].file
+        destroyed = []
+
+        with mock.patch.object(loop.LoopVolume, 'destroy',
+                                lambda vol, force=False: destroyed.append(vol)):
+            try:
+                storage2.concurrent_ensure(vols)
+                assert False, 'StorageError expected'
+            except storage2.StorageError, e:
+                assert 'losetup failed for /mnt/loopdev2' in str(e)
+
+        assert destroyed == [vols[1], vols[3]]
+
+    @raises(storage2.StorageError)
+    def test_error_stops_pending(self, dd, losetup, losetup_all):
+        vols = self._volumes(losetup, losetup_all, 4)
+        vols[0].size = None
+        vols[0].file = None
+        with mock.patch.object(loop.LoopVolume, 'destroy') as destroy:
+            try:
+                storage2.concurrent_ensure(vols, max_workers=1)
+            finally:
+                assert not losetup.called
+                assert not destroy.called
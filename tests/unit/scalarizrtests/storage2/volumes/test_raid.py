@@ -4,6 +4,7 @@ import sys
 import mock
 import unittest
 
+from scalarizr.storage2 import concurrent_ensure
 from scalarizr.storage2.volumes import raid
 from scalarizr.linux import mount
 
@@ -21,6 +22,7 @@ class RaidVolumeTest(unittest.TestCase):
                                             b64, op):
         disks = [mock.MagicMock(type='loop', device='/dev/loop%s' % x) for x in range(2)]*2
         storage2.volume.side_effect = disks
+        storage2.concurrent_ensure.side_effect = concurrent_ensure
         disks_devices = [d.device for d in disks[:2]]
         mdadm.findname.return_value = '/dev/md1'
 
@@ -64,6 +66,7 @@ class RaidVolumeTest(unittest.TestCase):
         disks =  [mock.MagicMock(), mock.MagicMock()]
         storage2.snapshot.side_effect = disks
         storage2.volume.side_effect = disks
+        storage2.concurrent_ensure.side_effect = concurrent_ensure
         mdadm.mdfind.return_value = '/dev/md2'
         lv_info = mock.MagicMock()
         lvm2.lvs.return_value = {'test': lv_info}
@@ -106,6 +109,7 @@ class RaidVolumeTest(unittest.TestCase):
             disks =  [mock.MagicMock(), mock.MagicMock()]
             storage2.snapshot.side_effect = disks
             storage2.volume.side_effect = disks
+            storage2.concurrent_ensure.side_effect = concurrent_ensure
             storage2.StorageError = Exception
             mdadm.mdfind.side_effect = Exception()
 
@@ -142,6 +146,7 @@ class RaidVolumeTest(unittest.TestCase):
             disks = [mock.MagicMock(), mock.MagicMock()]
             storage2.snapshot.side_effect = disks
             storage2.volume.side_effect = disks
+            storage2.concurrent_ensure.side_effect = concurrent_ensure
             storage2.StorageError = Exception
             mdadm.mdfind.side_effect = Exception()
 
@@ -216,6 +221,7 @@ class RaidVolumeTest(unittest.TestCase):
                                                     storage2, exists, rm, tfile, b64, op):
         disks = [mock.MagicMock() for _ in xrange(4)]
         storage2.volume.side_effect = disks
+        storage2.concurrent_ensure.side_effect = concurrent_ensure
         raid_vol = raid.RaidVolume(type='raid',
                                                 vg='test', level=1,
                                                 disks=disks, pv_uuid='pvuuid',
@@ -1,9 +1,13 @@
+from __future__ import with_statement
+
 import os
+import shutil
+import tempfile
 
 import mock
 
 from scalarizr import node
-from nose.tools import raises, eq_
+from nose.tools import raises, eq_, assert_raises
 from nose.plugins.attrib import attr
 
 
@@ -146,3 +150,67 @@ class TestIni(object):
         finally:
             if os.path.exists(filename):
                 os.remove(filename)
+
+
+class TestCachedStores(object):
+    def setup(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmp_dir, 'config.ini')
+        with open(self.filename, 'w') as fp:
+            fp.write('[general]\nserver_id = 14593\n')
+
+    def teardown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _touch(self, filename, content):
+        mtime = os.stat(filename).st_mtime
+        with open(filename, 'w') as fp:
+            fp.write(content)
+        os.utime(filename, (mtime + 1, mtime + 1))
+
+    def test_ini_parsed_once(self):
+        store = node.Ini(self.filename, 'general')
+        with mock.patch.object(store, '_reload', wraps=store._reload) as reload:
+            for _ in range(3):
+                eq_(store['server_id'], '14593')
+            eq_(reload.call_count, 1)
+
+    def test_ini_external_change(self):
+        store = node.Ini(self.filename, 'general')
+        eq_(store['server_id'], '14593')
+        self._touch(self.filename, '[general]\nserver_id = 777\n')
+        eq_(store['server_id'], '777')
+        os.remove(self.filename)
+        with assert_raises(KeyError):
+            store['server_id']
+
+    def test_ini_write_through(self):
+        store = node.Ini(self.filename, 'general')
+        store['farm_id'] = 12
+        with mock.patch.object(store, '_reload') as reload:
+            eq_(store['farm_id'], '12')
+            eq_(store['server_id'], '14593')
+            assert not reload.called
+        other = node.Ini(self.filename, 'general')
+        eq_(other['farm_id'], '12')
+
+    def test_file(self):
+        filename = os.path.join(self.tmp_dir, '.state')
+        store = node.StateFile(filename)
+        eq_(store['state'], 'unknown')
+        store['state'] = 'running'
+        with mock.patch('__builtin__.open') as open_:
+            eq_(store['state'], 'running')
+            assert not open_.called
+        self._touch(filename, 'terminated')
+        eq_(store['state'], 'terminated')
+        os.remove(filename)
+        eq_(store['state'], 'unknown')
+
+    def test_json_reloaded_on_change(self):
+        filename = os.path.join(self.tmp_dir, 'volume.json')
+        store = node.Json(filename, dict)
+        store['volume'] = {'type': 'lvm'}
+        eq_(store['volume'], {'type': 'lvm'})
+        self._touch(filename, '{"type": "ebs"}')
+        eq_(store['volume'], {'type': 'ebs'})
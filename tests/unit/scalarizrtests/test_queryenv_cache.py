@@ -0,0 +1,156 @@
+from __future__ import with_statement
+
+import os
+import time
+import shutil
+import tempfile
+import threading
+import BaseHTTPServer
+
+import mock
+from nose.tools import eq_, raises
+
+from scalarizr.queryenv import QueryEnvService, QueryEnvError
+from scalarizr.util import cryptotool
+
+
+LIST_ROLES = '''<?xml version="1.0" encoding="UTF-8"?>
+<response>
+    <roles>
+        <role id="1" behaviour="app" name="app64">
+            <hosts>
+                <host index="1" internal-ip="10.0.0.1" external-ip="54.0.0.1" cloud-location="us-east-1" />
+            </hosts>
+        </role>
+    </roles>
+</response>'''
+
+
+class TestQueryEnvCache(object):
+
+    def setup(self):
+        self.qe = QueryEnvService('http://localhost/query-env', '1', '/dev/null')
+        self.calls = []
+        self.qe._fetch = mock.Mock(side_effect=self._fetch)
+
+    def _fetch(self, command, params=None, log_response=True):
+        self.calls.append((command, params))
+        return LIST_ROLES
+
+    def test_ttl(self):
+        roles = self.qe.list_roles(with_init=True)
+        eq_(roles[0].hosts[0].internal_ip, '10.0.0.1')
+        self.qe.list_roles(with_init=True)
+        self.qe.list_roles()
+        eq_(len(self.calls), 2)
+        eq_(self.qe.stats, dict(hits=1, misses=2, coalesced=0))
+
+        with mock.patch('time.time', return_value=time.time() + 11):
+            self.qe.list_roles(with_init=True)
+        eq_(len(self.calls), 3)
+
+    def test_not_cached(self):
+        self.qe.fetch('list-scripts')
+        self.qe.fetch('list-scripts')
+        eq_(len(self.calls), 2)
+        eq_(self.qe.stats, dict(hits=0, misses=0, coalesced=0))
+
+    def test_invalidate_for(self):
+        self.qe.fetch('list-roles')
+        self.qe.fetch('get-scaling-metrics')
+
+        self.qe.invalidate_for('HostUp')
+        self.qe.fetch('list-roles')
+        self.qe.fetch('get-scaling-metrics')
+        eq_([c[0] for c in self.calls], ['list-roles', 'get-scaling-metrics', 'list-roles'])
+
+        self.qe.invalidate_for('UpdateServiceConfiguration')
+        self.qe.fetch('list-roles')
+        self.qe.fetch('get-scaling-metrics')
+        eq_(len(self.calls), 5)
+
+    def test_coalesce(self):
+        release = threading.Event()
+
+        def fetch(command, params=None, log_response=True):
+            release.wait()
+            return self._fetch(command, params, log_response)
+        self.qe._fetch.side_effect = fetch
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.qe.fetch('list-roles')))
+                   for _ in range(5)]
+        for t in threads:
+            t.start()
+        while self.qe.stats['coalesced'] < 4:
+            time.sleep(0.01)
+        release.set()
+        for t in threads:
+            t.join()
+
+        eq_(results, [LIST_ROLES] * 5)
+        eq_(len(self.calls), 1)
+        eq_(self.qe.stats, dict(hits=0, misses=1, coalesced=4))
+
+    def test_invalidate_in_flight(self):
+        def fetch(command, params=None, log_response=True):
+            self.qe.invalidate('list-roles')
+            return self._fetch(command, params, log_response)
+        self.qe._fetch.side_effect = fetch
+
+        self.qe.fetch('list-roles')
+        self.qe._fetch.side_effect = self._fetch
+        self.qe.fetch('list-roles')
+        eq_(len(self.calls), 2)
+
+    def test_error_not_cached(self):
+        self.qe._fetch.side_effect = QueryEnvError('QueryEnv failed')
+        raises(QueryEnvError)(self.qe.fetch)('list-roles')
+
+        self.qe._fetch.side_effect = self._fetch
+        eq_(self.qe.fetch('list-roles'), LIST_ROLES)
+        eq_(self.qe.stats['misses'], 2)
+
+
+class ProxyHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    paths = []
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.paths.append(self.path)
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(LIST_ROLES)))
+        self.end_headers()
+        self.wfile.write(LIST_ROLES)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestQueryEnvProxy(object):
+
+    def setup(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        key_path = os.path.join(self.tmp_dir, 'default')
+        with open(key_path, 'w') as fp:
+            fp.write(cryptotool.keygen())
+        self.proxy = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), ProxyHandler)
+        t = threading.Thread(target=self.proxy.serve_forever)
+        t.setDaemon(True)
+        t.start()
+        del ProxyHandler.paths[:]
+        self.qe = QueryEnvService('http://scalr.test/query-env', '1', key_path)
+
+    def teardown(self):
+        self.qe.transport.close()
+        self.proxy.shutdown()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_request_through_proxy(self):
+        proxy = 'http://127.0.0.1:%d' % self.proxy.server_port
+        with mock.patch.dict(os.environ, {'http_proxy': proxy}):
+            roles = self.qe.list_roles()
+        eq_(roles[0].hosts[0].internal_ip, '10.0.0.1')
+        eq_(ProxyHandler.paths, ['http://scalr.test/query-env/2012-04-17/list-roles'])
+
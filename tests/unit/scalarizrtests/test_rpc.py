@@ -0,0 +1,93 @@
+from __future__ import with_statement
+
+import json
+import time
+import threading
+
+from nose.tools import eq_
+
+from scalarizr import rpc
+
+
+class MyService(object):
+
+    def __init__(self):
+        self.threads = set()
+
+    @rpc.query_method
+    def echo(self, value=None):
+        return value
+
+    @rpc.query_method
+    def slow(self):
+        self.threads.add(threading.current_thread().name)
+        time.sleep(0.05)
+        return 'done'
+
+    @rpc.command_method
+    def unserializable(self):
+        return object()
+
+    @rpc.query_method
+    def fail(self):
+        return {}['key']
+
+
+class TestRequestHandler(object):
+
+    def setup(self):
+        self.service = MyService()
+        self.handler = rpc.RequestHandler({None: self.service})
+
+    def call(self, req):
+        return json.loads(self.handler.handle_request(json.dumps(req)))
+
+    def test_result(self):
+        eq_(self.call({'id': 1, 'method': 'echo', 'params': {'value': [1, 2]}}),
+            {'id': 1, 'result': [1, 2]})
+
+    def test_unserializable_result(self):
+        resp = self.call({'id': 2, 'method': 'unserializable', 'params': {}})
+        eq_(resp['id'], 2)
+        eq_(resp['error']['code'], rpc.ServiceError.INTERNAL)
+        assert resp['error']['message'].startswith('TypeError')
+        assert 'result' not in resp
+
+    def test_errors(self):
+        resp = self.call({'id': 3, 'method': 'fail', 'params': {}})
+        assert resp['error']['message'].startswith('KeyError')
+
+        resp = self.call({'id': 4, 'method': 'missing', 'params': {}})
+        eq_(resp['error']['code'], rpc.ServiceError.METHOD_NOT_FOUND)
+
+        resp = json.loads(self.handler.handle_request('{not json'))
+        eq_(resp, {'id': '', 'error': {'code': rpc.ServiceError.PARSE,
+                   'message': 'Parse error', 'data': resp['error']['data']}})
+
+    def test_batch(self):
+        resp = self.call([
+            {'id': 1, 'method': 'echo', 'params': {'value': 'a'}},
+            {'id': 2, 'method': 'missing', 'params': {}},
+            {'id': 3, 'method': 'unserializable', 'params': {}},
+            {'id': 4, 'method': 'echo', 'params': {'value': 'b'}}
+        ])
+        eq_([r['id'] for r in resp], [1, 2, 3, 4])
+        eq_(resp[0]['result'], 'a')
+        eq_(resp[1]['error']['code'], rpc.ServiceError.METHOD_NOT_FOUND)
+        eq_(resp[2]['error']['code'], rpc.ServiceError.INTERNAL)
+        eq_(resp[3]['result'], 'b')
+
+    def test_empty_batch(self):
+        resp = self.call([])
+        eq_(resp['error']['code'], rpc.ServiceError.INVALID_REQUEST)
+
+    def test_batch_workers(self):
+        self.handler.batch_workers = 4
+        reqs = [{'id': i, 'method': 'slow', 'params': {}} for i in range(4)]
+
+        start = time.time()
+        resp = self.call(reqs)
+
+        assert time.time() - start < 0.15
+        eq_([r['result'] for r in resp], ['done'] * 4)
+        eq_(len(self.service.threads), 4)
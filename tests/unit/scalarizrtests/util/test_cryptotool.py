@@ -1,12 +1,15 @@
+from __future__ import with_statement
 '''
 Created on Apr 7, 2010
 
 @author: marat
 '''
 
-from scalarizr.util import cryptotool, init_tests
+from scalarizr.util import cryptotool
 import unittest
 import binascii
+import tempfile
+import os
 
 class Test(unittest.TestCase):
 
@@ -25,7 +28,36 @@ class Test(unittest.TestCase):
 
         print so
 
+    def test_crypto_reuses_cipher(self):
+        key = binascii.a2b_base64(cryptotool.keygen(40))
+        messages = ["", "1234567", "x" * 1000]
+        encrypted = [cryptotool.encrypt(m, key) for m in messages]
+        for m, e in zip(messages, encrypted):
+            self.assertEqual(cryptotool.decrypt(e, key), m)
+            self.assertEqual(cryptotool.encrypt(m, key), e)
+
+    def test_hmac_sha1(self):
+        import hmac, hashlib
+        key = os.urandom(40)
+        for msg in ("a", "b" * 100):
+            self.assertEqual(cryptotool.hmac_sha1(key, msg),
+                                            hmac.new(key, msg, hashlib.sha1).digest())
+
+    def test_read_key(self):
+        fd, filename = tempfile.mkstemp()
+        try:
+            os.write(fd, binascii.b2a_base64("key1"))
+            os.close(fd)
+            self.assertEqual(cryptotool.read_key(filename), "key1")
+            self.assertTrue(cryptotool.read_key(filename) is cryptotool.read_key(filename))
+
+            with open(filename, "w") as fp:
+                fp.write(binascii.b2a_base64("new key2"))
+            self.assertEqual(cryptotool.read_key(filename), "new key2")
+        finally:
+            cryptotool.invalidate_key(filename)
+            os.remove(filename)
+
 
 if __name__ == "__main__":
-    init_tests()
     unittest.main()
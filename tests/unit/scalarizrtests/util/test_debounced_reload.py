@@ -0,0 +1,52 @@
+import time
+import mock
+
+from nose.tools import eq_, assert_raises
+
+from scalarizr import util
+
+
+class TestDebouncedReload(object):
+
+    def setup(self):
+        self.commits = []
+        self.reloads = util.DebouncedReload(self.commits.append, window=0.2)
+
+    def test_burst(self):
+        self.reloads.request(reload=False)
+        # first request is committed at once
+        eq_(self.commits, [False])
+        for reload in (False, True, False):
+            self.reloads.request(reload=reload)
+        eq_(self.commits, [False])
+        assert self.reloads.pending
+        time.sleep(0.4)
+        eq_(self.commits, [False, True])
+        assert not self.reloads.pending
+
+    def test_flush(self):
+        self.reloads.flush()
+        eq_(self.commits, [])
+        self.reloads.request(reload=False)
+        self.reloads.request(reload=False)
+        self.reloads.flush(reload=True)
+        eq_(self.commits, [False, True])
+        time.sleep(0.3)
+        eq_(self.commits, [False, True])
+
+    def test_failed_commit(self):
+        self.reloads.request(reload=False)
+        self.reloads.commit = mock.Mock(side_effect=Exception('commit failed'))
+        self.reloads.request(reload=True)
+        time.sleep(0.5)
+        # deferred commit is retried while failing
+        assert self.reloads.commit.call_count > 1
+        assert self.reloads.failed
+        assert self.reloads.pending
+
+        assert_raises(Exception, self.reloads.flush)
+        self.reloads.commit = self.commits.append
+        self.reloads.flush()
+        eq_(self.commits, [False, True])
+        assert not self.reloads.failed
+        assert not self.reloads.pending
@@ -0,0 +1,81 @@
+import time
+import threading
+
+from nose.tools import eq_, assert_raises
+
+from scalarizr import util
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+class TestPeriodicalExecutor(object):
+
+    def setup(self):
+        self.ex = util.PeriodicalExecutor(workers=2, jitter=0)
+        self.ex.start()
+        self.release = threading.Event()
+
+    def teardown(self):
+        self.release.set()
+        self.ex.shutdown()
+
+    def test_add_task_runs_immediately(self):
+        ran = threading.Event()
+        start = time.time()
+        self.ex.add_task(ran.set, 3600, 'once')
+        ran.wait(5)
+        assert ran.isSet()
+        assert time.time() - start < 1
+
+    def test_add_task_twice(self):
+        fn = lambda: None
+        self.ex.add_task(fn, 10)
+        assert_raises(BaseException, self.ex.add_task, fn, 10)
+        assert_raises(ValueError, self.ex.add_task, lambda: None, 0)
+
+    def test_slow_task_doesnt_delay_others(self):
+        fast = []
+        self.ex.add_task(lambda: self.release.wait(), 0.05, 'slow')
+        self.ex.add_task(lambda: fast.append(time.time()), 0.05, 'fast')
+        assert _wait_for(lambda: len(fast) >= 5)
+        stats = self.ex.stats()
+        eq_(stats['slow']['runs'], 0)
+        assert stats['slow']['skipped'] > 0
+        assert stats['fast']['runs'] >= 5
+
+    def test_remove_task(self):
+        runs = []
+        fn = lambda: runs.append(1)
+        self.ex.add_task(fn, 0.05)
+        assert _wait_for(lambda: len(runs) >= 2)
+        self.ex.remove_task(fn)
+        time.sleep(0.1)
+        count = len(runs)
+        time.sleep(0.2)
+        eq_(len(runs), count)
+        eq_(self.ex.stats(), {})
+
+    def test_missed_deadline(self):
+        self.ex.tolerance = 0.05
+        self.ex.add_task(lambda: self.release.wait(), 0.05, 'slow1')
+        self.ex.add_task(lambda: self.release.wait(), 0.05, 'slow2')
+        self.ex.add_task(lambda: None, 3600, 'blocked')
+        time.sleep(0.2)
+        self.release.set()
+        assert _wait_for(lambda: self.ex.stats()['blocked']['runs'] == 1)
+        stats = self.ex.stats()['blocked']
+        eq_(stats['missed'], 1)
+        assert stats['max_delay'] >= 0.15
+
+    def test_task_error(self):
+        runs = []
+        def fail():
+            runs.append(1)
+            raise Exception('task failed')
+        self.ex.add_task(fail, 0.05, 'fail')
+        assert _wait_for(lambda: len(runs) >= 2)
@@ -0,0 +1,74 @@
+from __future__ import with_statement
+
+import os
+import gzip
+import tempfile
+import cStringIO
+
+from nose.tools import assert_raises
+
+from scalarizr.util import pgzip
+
+
+DATA = ''.join('INSERT INTO t VALUES (%d, "%s");\n' % (i, os.urandom(8).encode('hex'))
+               for i in range(20000))
+
+
+def _gzip(data):
+    buf = cStringIO.StringIO()
+    fp = gzip.GzipFile(fileobj=buf, mode='wb')
+    fp.write(data)
+    fp.close()
+    return buf.getvalue()
+
+
+class TestParallelGzip(object):
+
+    def setup(self):
+        self.gz = pgzip.ParallelGzip(level=6, block_size=64 * 1024, threads=4)
+
+    def _compress(self, data):
+        return ''.join(self.gz.compress(cStringIO.StringIO(data)))
+
+    def _decompress(self, data):
+        out = []
+        self.gz.decompress(cStringIO.StringIO(data), out.append)
+        return ''.join(out)
+
+    def test_standard_gzip_stream(self):
+        compressed = self._compress(DATA)
+        assert len(compressed) < len(DATA) / 2
+        assert gzip.GzipFile(fileobj=cStringIO.StringIO(compressed)).read() == DATA
+
+    def test_roundtrip(self):
+        assert self._decompress(self._compress(DATA)) == DATA
+        assert self._decompress(self._compress('')) == ''
+
+    def test_decompress_foreign_stream(self):
+        assert self._decompress(_gzip(DATA)) == DATA
+        # our members followed by multi-member gzip stream
+        data = self._compress(DATA) + _gzip('one') + _gzip('two')
+        assert self._decompress(data) == DATA + 'onetwo'
+
+    def test_crc_check(self):
+        member = bytearray(pgzip.compress_block('some data'))
+        member[-5] ^= 0xff
+        assert_raises(pgzip.GzipError, self._decompress, str(member))
+
+    def test_popen(self):
+        compress = self.gz.popen(stdin=cStringIO.StringIO(DATA))
+        out = tempfile.TemporaryFile()
+        decompress = self.gz.popen(stdout=out, decompress=True)
+        decompress.stdin.write(compress.stdout.read())
+        decompress.stdin.close()
+        assert compress.wait() == 0
+        assert decompress.wait() == 0
+        out.seek(0)
+        assert out.read() == DATA
+
+    def test_popen_error(self):
+        proc = self.gz.popen(stdin=cStringIO.StringIO('not a gzip stream' * 10),
+                             stdout=open(os.devnull, 'w'), decompress=True)
+        assert proc.wait() == 1
+        assert proc.communicate()[1]
+        assert proc.stderr.read()
@@ -67,6 +67,26 @@ INSERT INTO test_execute_script VALUES (1, '/usr/bin/python', -9);
         assert type(cur) == sqlite_server.CursorProxy
 
 
+    def test_executebatch(self):
+        CONN.executescript('''
+DROP TABLE IF EXISTS test_execute_batch;
+CREATE TABLE test_execute_batch ("id" INTEGER PRIMARY KEY, "name" TEXT);
+''')
+        rowcounts = CONN.executebatch([
+            ('INSERT INTO test_execute_batch VALUES (?, ?)', [1, 'one']),
+            ('INSERT INTO test_execute_batch VALUES (?, ?)', [2, 'two']),
+            ('UPDATE test_execute_batch SET name = ?', ['all'])
+        ])
+        assert rowcounts == [1, 1, 2]
+        assert_raises(sqlite3.IntegrityError, CONN.executebatch, [
+            ('INSERT INTO test_execute_batch VALUES (?, ?)', [3, 'three']),
+            ('INSERT INTO test_execute_batch VALUES (?, ?)', [1, 'duplicate'])
+        ])
+        cur = CONN.cursor()
+        cur.execute('SELECT COUNT(*) FROM test_execute_batch')
+        assert cur.fetchone() == (2, )
+
+
 class TestCursorProxy(object):
     @classmethod
     def setup_class(cls):
@@ -178,3 +198,89 @@ class TestSQLiteServer(object):
         cur = CONN.cursor()
         cur.execute('select 1')
         assert cur.fetchone() == (1, )
+
+
+class TestSQLitePool(object):
+
+    @classmethod
+    def setup_class(cls):
+        cls.database = DATABASE + '.pool'
+
+        def creator(**kwds):
+            conn = sqlite3.Connection(database=cls.database, **kwds)
+            conn.row_factory = sqlite3.Row
+            return conn
+        cls.pool = sqlite_server.SQLitePool(creator)
+        cls.pool.executescript('''
+DROP TABLE IF EXISTS test_pool;
+CREATE TABLE test_pool (
+"id" INTEGER PRIMARY KEY,
+"name" TEXT
+);
+INSERT INTO test_pool VALUES (1, 'Mr. First');
+''')
+
+    @classmethod
+    def teardown_class(cls):
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(cls.database + suffix):
+                os.remove(cls.database + suffix)
+
+    def test_wal(self):
+        if sqlite_server.wal_supported():
+            assert self.pool.journal_mode.lower() == 'wal'
+
+    def test_durable_commits(self):
+        # FULL: WAL is fsynced on every commit
+        assert self.pool._writer.execute('PRAGMA synchronous').fetchone()[0] == 2
+
+    def test_read(self):
+        cur = self.pool.cursor()
+        cur.execute('SELECT * FROM test_pool WHERE id = ?', (1, ))
+        row = cur.fetchone()
+        assert row['name'] == 'Mr. First'
+        assert cur.fetchone() is None
+
+    def test_write_then_read_from_other_thread(self):
+        cur = self.pool.cursor()
+        cur.execute('INSERT INTO test_pool VALUES (NULL, ?)', ['Mister'])
+        assert cur.rowcount == 1
+        result = []
+
+        def read():
+            cur = self.pool.cursor()
+            cur.execute('SELECT name FROM test_pool WHERE name = ?', ['Mister'])
+            result.extend(cur.fetchall())
+        t = threading.Thread(target=read)
+        t.start()
+        t.join()
+        assert [tuple(row) for row in result] == [('Mister', )]
+
+    def test_fetchall(self):
+        cur = self.pool.cursor()
+        cur.execute('SELECT id FROM test_pool WHERE id = 1')
+        assert [tuple(row) for row in cur.fetchall()] == [(1, )]
+        assert cur.fetchall() is None
+
+    def test_invalid_query(self):
+        cur = self.pool.cursor()
+        assert_raises(sqlite3.OperationalError, cur.execute, 'U KNOW SQL!')
+        assert_raises(sqlite3.OperationalError, cur.execute, 'SELECT * FROM unknown_table')
+
+    def test_executebatch(self):
+        self.pool.executebatch([
+            ('INSERT INTO test_pool VALUES (?, ?)', [100, 'Batch']),
+            ('UPDATE test_pool SET name = ? WHERE id = ?', ['Batch updated', 100])
+        ])
+        cur = self.pool.cursor()
+        cur.execute('SELECT name FROM test_pool WHERE id = 100')
+        assert cur.fetchone()[0] == 'Batch updated'
+
+    def test_executebatch_rollback(self):
+        assert_raises(sqlite3.OperationalError, self.pool.executebatch, [
+            ('INSERT INTO test_pool VALUES (?, ?)', [200, 'Rolled back']),
+            ('U KNOW SQL!', None)
+        ])
+        cur = self.pool.cursor()
+        cur.execute('SELECT * FROM test_pool WHERE id = 200')
+        assert cur.fetchone() is None
@@ -0,0 +1,125 @@
+import os
+import time
+import socket
+import threading
+import urllib2
+import BaseHTTPServer
+
+import mock
+
+from nose.tools import assert_raises
+
+from scalarizr.util import urltool
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    requests = []
+    proxy_auth = []
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.requests.append(('POST', self.path, body))
+        self.proxy_auth.append(self.headers.get('Proxy-Authorization'))
+        if self.path == '/redirect':
+            self._respond(302, location='/target')
+        elif self.path == '/error':
+            self._respond(400)
+        elif self.path == '/slow':
+            time.sleep(0.5)
+            self._respond(201)
+        else:
+            self._respond(201)
+
+    def do_GET(self):
+        self.requests.append(('GET', self.path, None))
+        self._respond(200)
+
+    def _respond(self, code, location=None):
+        self.send_response(code)
+        if location:
+            self.send_header('Location', location)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write('ok')
+
+    def log_message(self, *args):
+        pass
+
+
+class TestHTTPConnectionPool(object):
+
+    @classmethod
+    def setup_class(cls):
+        cls.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), Handler)
+        cls.url = 'http://127.0.0.1:%d' % cls.server.server_port
+        t = threading.Thread(target=cls.server.serve_forever)
+        t.setDaemon(True)
+        t.start()
+
+    @classmethod
+    def teardown_class(cls):
+        cls.server.shutdown()
+
+    def setup(self):
+        del Handler.requests[:]
+        del Handler.proxy_auth[:]
+        self.pool = urltool.HTTPConnectionPool()
+
+    def teardown(self):
+        self.pool.close()
+
+    def test_reuse(self):
+        for i in range(3):
+            resp = self.pool.request('POST', self.url + '/control', 'msg%d' % i)
+            assert resp.status == 201
+            assert resp.data == 'ok'
+        assert self.pool.stats['requests'] == 3
+        assert self.pool.stats['connections'] == 1
+        assert self.pool.stats['reused'] == 2
+        assert [r[2] for r in Handler.requests] == ['msg0', 'msg1', 'msg2']
+
+    def test_reconnect_after_server_closed_connection(self):
+        self.pool.request('POST', self.url + '/control', 'msg')
+        for conns in self.pool._idle.values():
+            for conn in conns:
+                conn.sock.shutdown(socket.SHUT_RDWR)
+        resp = self.pool.request('POST', self.url + '/control', 'msg')
+        assert resp.status == 201
+        assert self.pool.stats['connections'] == 2
+
+    def test_redirect(self):
+        resp = self.pool.request('POST', self.url + '/redirect', 'msg',
+                                 {'Content-Type': 'application/json'})
+        assert resp.status == 200
+        assert Handler.requests == [('POST', '/redirect', 'msg'), ('GET', '/target', None)]
+
+    def test_http_error(self):
+        assert_raises(urllib2.HTTPError, self.pool.request, 'POST', self.url + '/error', 'msg')
+
+    def test_connection_refused(self):
+        assert_raises(urllib2.URLError, self.pool.request, 'POST', 'http://127.0.0.1:1/control', 'msg')
+
+    def test_no_retry_on_timeout_after_send(self):
+        pool = urltool.HTTPConnectionPool(timeout=0.2)
+        try:
+            pool.request('POST', self.url + '/control', 'msg')
+            assert_raises(urllib2.URLError, pool.request, 'POST', self.url + '/slow', 'msg')
+        finally:
+            pool.close()
+        time.sleep(0.5)
+        assert [r[1] for r in Handler.requests] == ['/control', '/slow']
+        assert pool.stats['connections'] == 1
+
+    def test_proxy(self):
+        env = {'http_proxy': self.url.replace('//', '//user:secret@'), 'no_proxy': 'bypass.test'}
+        with mock.patch.dict(os.environ, env):
+            for i in range(2):
+                resp = self.pool.request('POST', 'http://scalr.test:8013/control', 'msg')
+                assert resp.status == 201
+            assert_raises(urllib2.URLError, self.pool.request,
+                          'POST', 'http://bypass.test:1/control', 'msg')
+        assert [r[1] for r in Handler.requests] == ['http://scalr.test:8013/control'] * 2
+        assert Handler.proxy_auth == ['Basic dXNlcjpzZWNyZXQ='] * 2
+        assert self.pool.stats['connections'] == 1
+